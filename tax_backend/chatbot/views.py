@@ -18,6 +18,7 @@ import logging
 import PyPDF2 # type: ignore
 import io
 from .models import TaxConversation, TaxMessage  # Add this at the top with other imports
+from tax_report.services.llm_client import LLMClient
 
 logger = logging.getLogger(__name__)
 
@@ -710,7 +711,7 @@ def test_chat(request):
         # Test Gemini API
         try:
             genai.configure(api_key=GOOGLE_API_KEY)
-            model = genai.GenerativeModel('gemini-pro')
+            model = LLMClient(genai.GenerativeModel('gemini-pro'))
             test_prompt = f"Test query: {query}"
             gemini_response = model.generate_content(test_prompt)
             gemini_working = bool(gemini_response.text)
@@ -747,9 +748,15 @@ import logging
 logger = logging.getLogger(__name__)
 load_dotenv()
 
+_gemini_client = None
+
 def configure_gemini():
-    """Configure Gemini API with safety settings"""
+    """Configure Gemini API and return the shared client (deadlines, retries, circuit breaker)"""
+    global _gemini_client
     try:
+        if _gemini_client is not None:
+            return _gemini_client
+
         api_key = os.getenv('GEMINI_API_KEY')
         if not api_key:
             raise ValueError("Gemini API key not found")
@@ -768,14 +775,11 @@ def configure_gemini():
             model_name="gemini-1.5-flash",  # Updated to use 1.5 Flash
             generation_config=generation_config
         )
-        
-        # Test the model
-        test_response = model.generate_content("Test")
-        if not test_response:
-            raise ValueError("Model test failed")
-            
+
+        # No test request here: the client's circuit breaker tracks API health
+        _gemini_client = LLMClient(model)
         logger.info("Gemini 1.5 Flash model configured successfully")
-        return model
+        return _gemini_client
 
     except Exception as e:
         logger.error(f"Gemini configuration error: {e}")
@@ -14,3 +14,11 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tax_backend.settings')
 
 application = get_asgi_application()
+
+# Build the shared document processor (Gemini client, OCR engine) at worker
+# start instead of on the first upload, and start the upload sweeper if scheduled
+from tax_report.services.document_processor import warm_document_processor  # noqa: E402
+from tax_report.services.upload_sweeper import start_sweeper  # noqa: E402
+
+warm_document_processor()
+start_sweeper()
@@ -195,6 +195,75 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 # Ensure media directory exists
 os.makedirs(os.path.join(MEDIA_ROOT, 'tax_documents'), exist_ok=True)
 
+# Content-addressable storage for uploaded tax documents (tax_report/storage.py).
+# Identical uploads are stored once under MEDIA_ROOT/blobs; zstd compression is optional.
+UPLOAD_STORAGE = {
+    'blob_prefix': 'blobs',
+    'compress': False,
+    'compression_level': 10,
+    'min_compression_ratio': 0.9,
+}
+
+# Saved tax reports (DownloadedReports.document) share the blob store with
+# uploads; identical reports are stored once, zstd-compressed
+REPORT_STORAGE = {
+    'blob_prefix': 'blobs',
+    'compress': True,
+    'compression_level': 10,
+    'min_compression_ratio': 0.9,
+}
+
+# view-document serving (tax_report/services/file_serving.py). Set 'offload' to
+# 'x-accel-redirect' (nginx: an internal location at accel_prefix aliased to
+# MEDIA_ROOT) or 'x-sendfile' (Apache mod_xsendfile) to let the web server send files.
+FILE_SERVING = {
+    'offload': None,
+    'accel_prefix': '/protected-media/',
+    'cache_control': 'private, no-cache',
+}
+
+# Page thumbnails (tax_report/services/previews.py), stored next to each upload's blob.
+# Pages rasterized for OCR are saved as previews on the way through.
+PREVIEWS = {
+    'sizes': {'small': 160, 'medium': 320, 'large': 640},
+    'default_size': 'small',
+    'quality': 80,
+    'render_on_upload': False,
+}
+
+# Resumable chunked uploads (tax_report/services/chunked_upload.py)
+CHUNKED_UPLOAD = {
+    'chunk_size': 5 * 1024 * 1024,
+    'max_size': 200 * 1024 * 1024,
+    'max_pages': 500,
+}
+
+# Sweeper for expired session uploads, temp files and orphaned blobs
+# (tax_report/services/upload_sweeper.py). Run `manage.py sweep_uploads` from cron,
+# or set 'interval' (seconds) to sweep from inside the worker processes.
+UPLOAD_SWEEPER = {
+    'temp_max_age': 60 * 60,
+    'stalled_upload_max_age': 24 * 60 * 60,
+    'session_grace': 60 * 60,
+    'batch_size': 200,
+    'batch_pause': 0.05,
+    'interval': 0,
+}
+
+# Server-side tax computation (tax_report.services.tax_engine)
+TAX_ENGINE = {
+    'rate_cache_ttl': 60 * 60,
+    'default_tax_year': '2024/2025',
+}
+
+# Server-side PDF reports (tax_report.services.report_renderer)
+REPORT_RENDERER = {
+    'page_size': (595, 842),  # A4 in points
+    'margin': 50,
+    'font_size': 10,
+    'compress': True,
+}
+
 # Session and File Upload Settings
 SESSION_ENGINE = 'django.contrib.sessions.backends.db'
 SESSION_COOKIE_AGE = 86400  # 24 hours
@@ -264,6 +333,75 @@ TESSERACT_PATH = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
 if TESSERACT_INSTALLED and os.name == 'nt' and os.path.exists(TESSERACT_PATH):
     pytesseract.pytesseract.tesseract_cmd = TESSERACT_PATH
 
+# Skip OCR for pages already seen in the session (perceptual hash + thumbnail check)
+PAGE_DEDUPE = {
+    'enabled': True,
+    'max_distance': 8,
+}
+
+# OCR backend: 'tesserocr' keeps a pool of loaded Tesseract API handles per worker
+# process (pip install tesserocr, needs the Tesseract libraries); 'pytesseract'
+# runs the CLI per page. 'auto' uses the pool when available.
+OCR_ENGINE = {
+    'backend': 'auto',
+    'lang': 'eng',
+    'pool_size': 2,
+    'tessdata_path': None,
+}
+
+# Layout OCR: pages are read as word boxes and rebuilt into (label, amount)
+# rows, so two-column payslips and tables reach the rule engine intact.
+# Documents read confidently and mostly classified by the rules skip Gemini.
+LAYOUT_OCR = {
+    'enabled': True,
+    'row_tolerance': 0.5,
+    'column_gap': 1.5,
+    'rules_min_confidence': 85.0,
+    'rules_min_coverage': 0.6,
+}
+
+# OpenCV preprocessing applied to page images before Tesseract; each step can be switched off
+OCR_PREPROCESSING = {
+    'enabled': True,
+    'target_dpi': 300,
+    'downscale': True,
+    'grayscale': True,
+    'binarize': True,
+    'binarize_method': 'adaptive',
+    'deskew': True,
+    'crop_margins': True,
+}
+
+# Gemini response cache (keyed by model name + prompt hash)
+GEMINI_RESPONSE_CACHE_ENABLED = True
+GEMINI_RESPONSE_CACHE_PATH = os.path.join(BASE_DIR, 'cache', 'gemini_responses.sqlite3')
+GEMINI_RESPONSE_CACHE_TTL = 7 * 24 * 60 * 60  # 1 week
+GEMINI_RESPONSE_CACHE_MAX_BYTES = 64 * 1024 * 1024  # 64MB
+
+# Gemini analysis prompts (tax_report/services/prompt_builder.py): only lines with
+# amounts are sent; documents over the budget are split into parallel requests
+GEMINI_PROMPT = {
+    'max_prompt_tokens': 6000,
+    'context_lines': 1,
+    'max_chunks': 12,
+    'max_workers': 4,
+}
+
+# Guarded LLM client used for every Gemini call (tax_report/services/llm_client.py):
+# per-call deadlines, a per-process concurrency cap, jittered retries and a circuit
+# breaker that sends document analysis straight to the rule-based path while open
+LLM_CLIENT = {
+    'timeout': 30,
+    'deadline': 60,
+    'max_concurrency': 4,
+    'acquire_timeout': 5,
+    'max_retries': 2,
+    'backoff_base': 0.5,
+    'backoff_max': 8,
+    'failure_threshold': 5,
+    'reset_timeout': 30,
+}
+
 # Add this to your existing settings.py
 LOGGING = {
     'version': 1,
@@ -0,0 +1,240 @@
+import os
+import json
+import random
+import logging
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+from PIL import Image, ImageDraw, ImageFilter, ImageFont # type: ignore
+
+try:
+    import numpy as np # type: ignore
+    NUMPY_INSTALLED = True
+except ImportError:
+    NUMPY_INSTALLED = False
+
+try:
+    import openpyxl # type: ignore
+    OPENPYXL_INSTALLED = True
+except ImportError:
+    OPENPYXL_INSTALLED = False
+    print("Warning: openpyxl not installed. XLSX ledgers will be left out of the benchmark corpus.")
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = 'manifest.json'
+CORPUS_VERSION = 1
+
+KINDS = ('payslip', 'apit_certificate', 'interest_statement', 'xlsx_ledger', 'scanned_image')
+DEFAULT_PAGE_COUNTS = (1, 5, 20)
+DEFAULT_DPIS = (150, 300)
+
+PAGE_INCHES = (8.27, 11.69)  # A4
+ROWS_PER_PAGE = 30
+LEDGER_ROWS_PER_PAGE = 40
+
+# (label, amount range, classified by the rule engine)
+PAYSLIP_EARNINGS = [('Primary Salary', (80000, 400000)), ('Fuel Allowance', (5000, 30000)),
+                    ('Overtime', (2000, 40000)), ('Secondary Salary', (10000, 90000))]
+PAYSLIP_DEDUCTIONS = [('APIT', (2000, 60000)), ('EPF Employee 8%', (6000, 32000)),
+                      ('Welfare Society', (200, 1500)), ('Salary Advance', (5000, 50000))]
+MONTHS = ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September',
+          'October', 'November', 'December']
+INTEREST_LINES = ['Interest credit FD', 'Savings interest', 'WHT on interest', 'Dividend received',
+                  'ATM withdrawal', 'Card payment', 'Transfer to savings']
+
+
+def _font(size: int):
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        # Pillow < 10.1 only has the fixed bitmap font
+        return ImageFont.load_default()
+
+
+def _amount(rng: random.Random, bounds: Tuple[int, int]) -> float:
+    return round(rng.uniform(*bounds), 2)
+
+
+def _format(amount: float) -> str:
+    return f"{amount:,.2f}"
+
+
+class CorpusGenerator:
+    """
+    Synthetic tax documents for the pipeline benchmark.
+
+    Every document is rendered from rows of (label, amount) cells, and the
+    manifest keeps those rows as ground truth next to the source text, so
+    the harness can report how many amounts each extraction recovered.
+    Output is deterministic for a given seed.
+    """
+
+    def __init__(self, seed: int = 42):
+        self.seed = seed
+
+    def parameters(self, kinds: Iterable[str], page_counts: Iterable[int], dpis: Iterable[int]) -> Dict[str, Any]:
+        """What a corpus was generated from; a corpus is reused only for identical parameters"""
+        return {'kinds': list(kinds), 'pages': list(page_counts), 'dpi': list(dpis), 'seed': self.seed}
+
+    # Row layouts: every row is a list of (label, amount or None) cells
+
+    def _payslip_rows(self, rng: random.Random, pages: int) -> List[List[List[Tuple[str, Optional[float]]]]]:
+        document = []
+        for page in range(pages):
+            rows = [[('PAYSLIP', None)], [(f'Month {page + 1:02d} / 2024', None)], [('Earnings', None), ('Deductions', None)]]
+            for index in range(ROWS_PER_PAGE - len(rows)):
+                earning = PAYSLIP_EARNINGS[index % len(PAYSLIP_EARNINGS)]
+                deduction = PAYSLIP_DEDUCTIONS[index % len(PAYSLIP_DEDUCTIONS)]
+                # Two columns per printed line: the layout that defeats "last token is the amount"
+                rows.append([(earning[0], _amount(rng, earning[1])), (deduction[0], _amount(rng, deduction[1]))])
+            document.append(rows)
+        return document
+
+    def _apit_rows(self, rng: random.Random, pages: int):
+        document = []
+        for page in range(pages):
+            rows = [[('APIT CERTIFICATE - Year of Assessment 2024/2025', None)],
+                    [(f'Employee TIN {rng.randint(100000000, 999999999)}', None)]]
+            for month in range(ROWS_PER_PAGE - len(rows)):
+                gross = _amount(rng, (80000, 400000))
+                rows.append([(f'Primary Salary {MONTHS[month % 12]}', gross),
+                             ('APIT deducted', round(gross * 0.08, 2))])
+            document.append(rows)
+        return document
+
+    def _interest_rows(self, rng: random.Random, pages: int):
+        document = []
+        for page in range(pages):
+            rows = [[('BANK STATEMENT', None)], [('Description', None), ('Amount', None)]]
+            for _ in range(ROWS_PER_PAGE - len(rows)):
+                rows.append([(rng.choice(INTEREST_LINES), _amount(rng, (100, 250000)))])
+            document.append(rows)
+        return document
+
+    def _ledger_rows(self, rng: random.Random, pages: int):
+        labels = [label for label, _ in PAYSLIP_EARNINGS] + INTEREST_LINES + ['Rental income', 'Service fees']
+        return [[[(rng.choice(labels), _amount(rng, (100, 500000)))] for _ in range(LEDGER_ROWS_PER_PAGE)]
+                for _ in range(pages)]
+
+    # Rendering
+
+    def _render_page(self, rows, dpi: int) -> Image.Image:
+        width, height = (int(inches * dpi) for inches in PAGE_INCHES)
+        image = Image.new('L', (width, height), 255)
+        draw = ImageDraw.Draw(image)
+        font = _font(max(8, int(dpi * 0.14)))
+        line_height = int(dpi * 0.3)
+        # Label and amount columns for up to two cells per line
+        columns = [(0.06, 0.44), (0.52, 0.94)]
+
+        top = int(dpi * 0.6)
+        for row in rows:
+            for (label_x, amount_x), (label, amount) in zip(columns, row):
+                draw.text((int(width * label_x), top), label, fill=0, font=font)
+                if amount is not None:
+                    text = _format(amount)
+                    text_width = draw.textlength(text, font=font)
+                    # Right-aligned amounts, like a printed table
+                    draw.text((int(width * amount_x - text_width), top), text, fill=0, font=font)
+            top += line_height
+        return image
+
+    @staticmethod
+    def _scan(image: Image.Image, rng: random.Random) -> Image.Image:
+        """Make a clean page look scanned: slight rotation, blur and sensor noise"""
+        scanned = image.rotate(rng.uniform(-1.2, 1.2), resample=Image.BICUBIC, expand=False, fillcolor=255)
+        scanned = scanned.filter(ImageFilter.GaussianBlur(radius=0.6))
+        if NUMPY_INSTALLED:
+            pixels = np.asarray(scanned, dtype=np.int16)
+            noise = np.random.default_rng(rng.randint(0, 2 ** 31)).normal(0, 12, pixels.shape)
+            scanned = Image.fromarray(np.clip(pixels + noise, 0, 255).astype(np.uint8))
+        return scanned
+
+    @staticmethod
+    def _save_pdf(images: List[Image.Image], path: str, dpi: int) -> None:
+        images[0].save(path, 'PDF', resolution=dpi, save_all=True, append_images=images[1:])
+
+    @staticmethod
+    def _save_xlsx(document, path: str) -> None:
+        workbook = openpyxl.Workbook()
+        sheet = workbook.active
+        sheet.title = 'Ledger'
+        sheet.append(['Description', 'Amount'])
+        for rows in document:
+            for row in rows:
+                for label, amount in row:
+                    sheet.append([label, amount])
+        workbook.save(path)
+
+    @staticmethod
+    def _ground_truth(document) -> Tuple[List[Dict[str, Any]], str]:
+        expected = []
+        lines = []
+        for rows in document:
+            for row in rows:
+                for label, amount in row:
+                    if amount is not None:
+                        expected.append({'label': label, 'amount': amount})
+                        lines.append(f'{label} {_format(amount)}')
+                    else:
+                        lines.append(label)
+        return expected, '\n'.join(lines) + '\n'
+
+    def generate(self, directory: str, kinds: Iterable[str] = KINDS, page_counts: Iterable[int] = DEFAULT_PAGE_COUNTS,
+                 dpis: Iterable[int] = DEFAULT_DPIS) -> Dict[str, Any]:
+        """Write the corpus and its manifest into directory and return the manifest"""
+        kinds, page_counts, dpis = list(kinds), list(page_counts), list(dpis)
+        os.makedirs(directory, exist_ok=True)
+        layouts = {
+            'payslip': self._payslip_rows,
+            'apit_certificate': self._apit_rows,
+            'interest_statement': self._interest_rows,
+            'scanned_image': self._payslip_rows,
+            'xlsx_ledger': self._ledger_rows,
+        }
+        documents = []
+        for kind in kinds:
+            if kind not in layouts:
+                raise ValueError(f"Unknown document kind: {kind}")
+            if kind == 'xlsx_ledger' and not OPENPYXL_INSTALLED:
+                continue
+            for pages in page_counts:
+                # Spreadsheets have no resolution; generate them once per page count
+                for dpi in (dpis if kind != 'xlsx_ledger' else [None]):
+                    rng = random.Random(f'{self.seed}-{kind}-{pages}-{dpi}')
+                    document = layouts[kind](rng, pages)
+                    name = f'{kind}-{pages}p' + (f'-{dpi}dpi' if dpi else '')
+
+                    if kind == 'xlsx_ledger':
+                        filename = name + '.xlsx'
+                        self._save_xlsx(document, os.path.join(directory, filename))
+                    else:
+                        images = [self._render_page(rows, dpi) for rows in document]
+                        if kind == 'scanned_image':
+                            images = [self._scan(image, rng) for image in images]
+                        if kind == 'scanned_image' and pages == 1:
+                            filename = name + '.jpg'
+                            images[0].save(os.path.join(directory, filename), 'JPEG', quality=70, dpi=(dpi, dpi))
+                        else:
+                            filename = name + '.pdf'
+                            self._save_pdf(images, os.path.join(directory, filename), dpi)
+
+                    expected, text = self._ground_truth(document)
+                    documents.append({'file': filename, 'kind': kind, 'pages': pages, 'dpi': dpi,
+                                      'expected': expected, 'text': text})
+                    logger.info(f"Generated benchmark document {filename}")
+
+        manifest = {'version': CORPUS_VERSION, 'parameters': self.parameters(kinds, page_counts, dpis),
+                    'documents': documents}
+        with open(os.path.join(directory, MANIFEST_NAME), 'w') as f:
+            json.dump(manifest, f)
+        return manifest
+
+
+def load_manifest(directory: str) -> Optional[Dict[str, Any]]:
+    """The manifest of a generated corpus, or None if the directory holds none (or an outdated one)"""
+    try:
+        with open(os.path.join(directory, MANIFEST_NAME)) as f:
+            manifest = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+    return manifest if manifest.get('version') == CORPUS_VERSION else None
@@ -0,0 +1,322 @@
+import os
+import json
+import time
+import logging
+import platform
+import threading
+from collections import Counter, defaultdict
+from types import SimpleNamespace
+from typing import Dict, Any, List, Optional
+from PIL import Image # type: ignore
+from ..services.image_preprocessing import ImagePreprocessor
+from ..services.layout_extraction import LayoutExtractor
+from ..services.prompt_builder import PromptBuilder
+from ..services.response_cache import GeminiResponseCache
+from ..services.llm_client import LLMClient, CircuitBreaker, ConcurrencyLimiter, LLMMetrics, DEFAULT_LLM_CLIENT
+
+try:
+    import pdf2image # type: ignore
+    PDF2IMAGE_INSTALLED = True
+except ImportError:
+    PDF2IMAGE_INSTALLED = False
+
+logger = logging.getLogger(__name__)
+
+STAGES = ('rasterize', 'preprocess', 'ocr', 'extract', 'classify', 'llm')
+# 2: stages are timed inside DocumentProcessor
+BASELINE_VERSION = 2
+# Stage timings below this many ms per page are too small to call a regression
+MIN_REGRESSION_MS = 1.0
+MAX_RECALL_DROP = 0.02
+
+
+class StubModel:
+    """Stands in for the Gemini model: fixed latency and an empty analysis"""
+
+    def __init__(self, latency_ms: float):
+        self.latency = latency_ms / 1000
+
+    def generate_content(self, prompt, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        return SimpleNamespace(text=json.dumps({'document_type': 'tax_document', 'confidence_score': 0.9,
+                                                'income_items': [], 'deductions': []}))
+
+
+def _label_key(label: str) -> str:
+    return ' '.join(label.lower().split())
+
+
+def row_recall(expected: List[Dict[str, Any]], rows: List[Dict[str, Any]]) -> float:
+    """Share of the ground-truth (label, amount) pairs found among the extracted rows"""
+    if not expected:
+        return 1.0
+    found = Counter((_label_key(row['label']), round(row['amount'], 2)) for row in rows)
+    hits = 0
+    for item in expected:
+        key = (_label_key(item['label']), round(item['amount'], 2))
+        if found[key] > 0:
+            found[key] -= 1
+            hits += 1
+    return hits / len(expected)
+
+
+class TimedEngine:
+    """Wraps an OCR engine and adds the time of every call to a stage"""
+
+    def __init__(self, engine, timed):
+        self.engine = engine
+        self.name = engine.name
+        self.image_to_string = timed('ocr', engine.image_to_string)
+        self.image_to_data = timed('ocr', engine.image_to_data)
+
+
+class PipelineBenchmark:
+    """
+    Runs DocumentProcessor over a generated corpus and times its stages.
+
+    The processor's own methods are wrapped with timers, so the measured
+    code is the code an upload runs: rasterize (pdf2image), preprocess
+    (OpenCV), OCR (the engine calls and layout row extraction), extract
+    (spreadsheets), classify (keyword rules) and the LLM calls, made through
+    LLMClient against a stub model with a fixed latency and without the
+    response cache. Stages that can't run here (no Tesseract or Poppler)
+    are reported as unavailable and the manifest's source text is analyzed
+    in their place (as layout rows when layout OCR is on), so the remaining
+    stages are still measured.
+
+    ``options`` may carry 'preprocessing', 'layout', 'prompt' and
+    'llm_client' dicts; missing keys use the project settings.
+    """
+
+    def __init__(self, options: Optional[Dict[str, Any]] = None, llm_latency_ms: float = 800,
+                 ocr: bool = True, layout: Optional[bool] = None, engine=None):
+        from ..services.document_processor import DocumentProcessor
+
+        options = options or {}
+        self._timings = {stage: 0.0 for stage in STAGES}
+        self._llm_calls = 0
+        self._rules = None
+        self._lock = threading.Lock()
+
+        processor = DocumentProcessor(model=StubModel(llm_latency_ms))
+        processor.preprocessor = ImagePreprocessor(options.get('preprocessing'))
+        layout_options = dict(LayoutExtractor(options.get('layout')).options)
+        if layout is not None:
+            layout_options['enabled'] = layout
+        processor.layout = LayoutExtractor(layout_options)
+        self.use_layout = processor.layout.enabled
+        processor.prompt_builder = PromptBuilder(options.get('prompt'))
+        processor.response_cache = GeminiResponseCache(enabled=False)
+
+        llm_options = dict(DEFAULT_LLM_CLIENT)
+        llm_options.update(options.get('llm_client') or {})
+        # Private breaker, metrics and limiter: the benchmark never touches the live Gemini state
+        self.llm_metrics = LLMMetrics()
+        processor.llm = self.llm = LLMClient(
+            processor.model, service='benchmark', options=llm_options,
+            breaker=CircuitBreaker(llm_options['failure_threshold'], llm_options['reset_timeout']),
+            metrics=self.llm_metrics, limiter=ConcurrencyLimiter(llm_options['max_concurrency']),
+        )
+
+        self.unavailable: Dict[str, str] = {}
+        self.engine = None
+        if not ocr:
+            self.unavailable['ocr'] = 'disabled'
+        else:
+            self.engine = engine
+            self._probe_ocr()
+        if not PDF2IMAGE_INSTALLED:
+            self.unavailable['rasterize'] = 'pdf2image is not installed'
+
+        self.processor = self._instrument(processor)
+
+    def _probe_ocr(self) -> None:
+        try:
+            if self.engine is None:
+                from ..services.ocr_engines import get_ocr_engine
+                self.engine = get_ocr_engine()
+            self.engine.image_to_string(Image.new('L', (64, 32), 255))
+        except Exception as e:
+            self.engine = None
+            self.unavailable['ocr'] = str(e) or e.__class__.__name__
+
+    def _timed(self, stage: str, fn):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                elapsed = (time.perf_counter() - start) * 1000
+                with self._lock:
+                    self._timings[stage] += elapsed
+        return timed
+
+    def _instrument(self, processor):
+        """Put timers around the processor methods each stage runs in"""
+        rasterize = self._timed('rasterize', processor._rasterize_pdf)
+
+        def rasterize_pdf(file_path):
+            try:
+                return rasterize(file_path)
+            except Exception as e:
+                # The processor turns this into an error text; the run falls back to the manifest
+                self.unavailable['rasterize'] = str(e) or e.__class__.__name__
+                raise
+
+        analyze_prompt = processor._analyze_prompt
+
+        def counted_prompt(*args, **kwargs):
+            with self._lock:
+                self._llm_calls += 1
+            return analyze_prompt(*args, **kwargs)
+
+        processor._rasterize_pdf = rasterize_pdf
+        processor.preprocessor.process = self._timed('preprocess', processor.preprocessor.process)
+        if self.engine is not None:
+            engine = TimedEngine(self.engine, self._timed)
+            processor._ocr_engine = lambda: engine
+        processor.layout.extract = self._timed('ocr', processor.layout.extract)
+        classify = self._timed('classify', processor.analyze_document)
+
+        def analyze_document(text, rows=None):
+            self._rules = classify(text, rows)
+            return self._rules
+
+        processor.analyze_document = analyze_document
+        processor._analyze_prompt = counted_prompt
+        # Includes the rule-based pass, which is taken out again in run_document
+        processor.analyze_document_with_gemini = self._timed('llm', processor.analyze_document_with_gemini)
+        return processor
+
+    def run_document(self, directory: str, entry: Dict[str, Any]) -> Dict[str, Any]:
+        """Time every stage for one corpus document"""
+        path = os.path.join(directory, entry['file'])
+        self._timings = {stage: 0.0 for stage in STAGES}
+        self._llm_calls = 0
+        self._rules = None
+        processor = self.processor
+
+        text, rows, source = '', [], 'pipeline'
+        if entry['kind'] == 'xlsx_ledger':
+            text, _ = self._timed('extract', processor.extract_text_with_stats)(path, rows=rows)
+        elif 'ocr' in self.unavailable or (path.lower().endswith('.pdf') and 'rasterize' in self.unavailable):
+            source = 'manifest'
+        else:
+            text, _ = processor.extract_text_with_stats(path, rows=rows)
+            if 'rasterize' in self.unavailable and path.lower().endswith('.pdf'):
+                text, rows, source = '', [], 'manifest'
+
+        if source == 'manifest':
+            text = entry['text']
+            if self.use_layout:
+                rows = LayoutExtractor.rows_from_text(text)
+
+        processor.analyze_document_with_gemini(text, rows=rows)
+        # The rule-based pass inside it was timed as classify already
+        self._timings['llm'] = max(0.0, self._timings['llm'] - self._timings['classify'])
+
+        analysis = json.loads(self._rules)
+        classified = len(analysis['income_items']) + len(analysis['deductions'])
+        extracted = rows or LayoutExtractor.rows_from_text(text)
+        return {
+            'file': entry['file'], 'kind': entry['kind'], 'pages': entry['pages'], 'dpi': entry['dpi'],
+            'source': source, 'stages': {stage: round(ms, 2) for stage, ms in self._timings.items()},
+            'recall': round(row_recall(entry['expected'], extracted), 4),
+            'classified': classified, 'llm_calls': self._llm_calls, 'llm_skipped': self._llm_calls == 0,
+        }
+
+    def warm_up(self, directory: str, manifest: Dict[str, Any]) -> None:
+        """
+        Run the smallest document of every kind once, untimed, so lazy imports
+        and first-open costs don't land on whichever document happens to go first
+        """
+        smallest = {}
+        for entry in manifest['documents']:
+            if entry['kind'] not in smallest or entry['pages'] < smallest[entry['kind']]['pages']:
+                smallest[entry['kind']] = entry
+        for entry in smallest.values():
+            self.run_document(directory, entry)
+        self.llm_metrics = self.llm.metrics = LLMMetrics()
+
+    def run(self, directory: str, manifest: Dict[str, Any], warm_up: bool = True) -> Dict[str, Any]:
+        if warm_up:
+            self.warm_up(directory, manifest)
+        results = [self.run_document(directory, entry) for entry in manifest['documents']]
+        return {'documents': results, 'summary': summarize(results), 'unavailable': dict(self.unavailable),
+                'llm': self.llm_metrics.snapshot()}
+
+
+def summarize(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Per-stage ms per page, pages per second and recall, overall and per document kind"""
+    def aggregate(documents: List[Dict[str, Any]]) -> Dict[str, Any]:
+        pages = sum(document['pages'] for document in documents)
+        stage_ms = {stage: sum(document['stages'][stage] for document in documents) for stage in STAGES}
+        total_ms = sum(stage_ms.values())
+        return {
+            'documents': len(documents),
+            'pages': pages,
+            'ms_per_page': {stage: round(ms / pages, 2) if pages else 0.0 for stage, ms in stage_ms.items()},
+            'pages_per_second': round(pages / (total_ms / 1000), 2) if total_ms else 0.0,
+            'recall': round(sum(document['recall'] for document in documents) / len(documents), 4) if documents else 0.0,
+            'llm_skipped': sum(1 for document in documents if document['llm_skipped']),
+        }
+
+    by_kind = defaultdict(list)
+    for result in results:
+        by_kind[result['kind']].append(result)
+    summary = aggregate(results)
+    summary['by_kind'] = {kind: aggregate(documents) for kind, documents in sorted(by_kind.items())}
+    return summary
+
+
+def compare(summary: Dict[str, Any], baseline: Dict[str, Any], tolerance: float = 0.15) -> List[str]:
+    """Regressions of a summary against a baseline summary (an empty list if there are none)"""
+    regressions = []
+    scopes = [('overall', summary, baseline)]
+    scopes += [(kind, summary['by_kind'][kind], baseline.get('by_kind', {})[kind])
+               for kind in summary.get('by_kind', {}) if kind in baseline.get('by_kind', {})]
+
+    for scope, current, previous in scopes:
+        for stage in STAGES:
+            now = current['ms_per_page'].get(stage, 0.0)
+            before = previous.get('ms_per_page', {}).get(stage, 0.0)
+            if now > before * (1 + tolerance) and now - before >= MIN_REGRESSION_MS:
+                regressions.append(f"{scope}: {stage} {before:.1f} -> {now:.1f} ms/page")
+        if previous.get('pages_per_second') and current['pages_per_second'] < previous['pages_per_second'] * (1 - tolerance):
+            regressions.append(
+                f"{scope}: {previous['pages_per_second']:.2f} -> {current['pages_per_second']:.2f} pages/s"
+            )
+        if current['recall'] < previous.get('recall', 0.0) - MAX_RECALL_DROP:
+            regressions.append(f"{scope}: recall {previous['recall']:.3f} -> {current['recall']:.3f}")
+    return regressions
+
+
+def environment() -> Dict[str, Any]:
+    return {'python': platform.python_version(), 'platform': platform.platform(), 'machine': platform.machine()}
+
+
+def load_baseline(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path) as f:
+            baseline = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+    return baseline if baseline.get('version') == BASELINE_VERSION else None
+
+
+def save_baseline(path: str, report: Dict[str, Any], parameters: Dict[str, Any]) -> None:
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    baseline = {
+        'version': BASELINE_VERSION,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'environment': environment(),
+        'parameters': parameters,
+        'unavailable': report['unavailable'],
+        'summary': report['summary'],
+    }
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(baseline, f, indent=2)
+    os.replace(temp_path, path)
@@ -0,0 +1,132 @@
+from django.core.management.base import BaseCommand # type: ignore
+from tax_report.services.autofill_mapping import (
+    AutoFillMapper, INCOME_MAPPING, DEDUCTION_MAPPING, WHT_SOURCES, DEFAULT_WHT_SOURCE,
+)
+import random
+import time
+
+SAMPLE_INCOME = [
+    ('Employment Income', ['Primary Employment', 'Secondary Employment', ''],
+     ['Monthly salary', 'Part-time tutoring', 'Bonus', 'Primary employer allowance']),
+    ('Business Income', ['Sole Proprietorship', 'Partnership', ''],
+     ['Self-employed consulting', 'Partnership share', 'Trust distribution', 'Casino winnings', 'Shop profit']),
+    ('Investment Income', ['Interest Income', 'Dividend Income', 'Capital Gains', ''],
+     ['Fixed deposit interest', 'Dividend from shares', 'Rental of house', 'Gain on sale', 'Unit trust income']),
+    ('Other Income', ['Service Income (WHT)', 'Royalty (WHT)', ''],
+     ['Consulting service fee', 'Book royalty', 'Natural resource payment', 'Gem auction', 'Management fee']),
+    ('Terminal Benefits', ['Commuted Pension', 'ETF Payment', ''],
+     ['Lump sum pension', 'Gratuity payment', 'Compensation for job loss', 'Employees trust fund', 'Leave encashment']),
+    ('Qualifying Payments', ['Donations', 'Solar Panel Installation', ''],
+     ['Charity donation', 'Samurthy shop setup', 'Solar panels', 'Housing project', 'Film production', 'Medical bill']),
+    ('Unknown Category', [''], ['Unclassified receipt']),
+]
+
+SAMPLE_DEDUCTIONS = [
+    ('APIT Deduction', 'APIT on salary'), ('WHT Deduction', 'WHT on interest'),
+    ('', 'Withholding tax on service fee'), ('', 'WHT on gem auction'), ('', 'Natural resource WHT'),
+    ('BUSINESS_DEDUCTION', 'Office rent'), ('', 'Business travel'), ('INVESTMENT_DEDUCTION', 'Broker fee'),
+    ('', 'Investment advisory fee'), ('', 'Bank charges'),
+]
+
+
+def _sequential_match(rules, item_type, description):
+    for rule in rules:
+        if item_type == rule.get('type') or any(keyword in description for keyword in rule['keywords']):
+            return rule
+    return None
+
+
+def sequential_map(analysis_data):
+    """Reference implementation: the rule tables scanned in order, as the old if/elif cascade did"""
+    mappings = AutoFillMapper.empty_mappings()
+    categories = {category['category']: category for category in INCOME_MAPPING}
+    for item in analysis_data.get('income_items', []):
+        category = categories.get(item.get('category', ''))
+        if category is None:
+            continue
+        rule = _sequential_match(category['rules'], item.get('type', ''), item.get('description', '').lower())
+        if rule is not None:
+            entries, name = rule['entries'], rule['name']
+        else:
+            default = category['default']
+            entries = default['entries']
+            name = default['name'] if 'name' in default else item.get('description', default['default_name'])
+        mappings[category['section']][entries].append({'name': name, 'amount': str(item.get('amount', 0))})
+
+    for deduction in analysis_data.get('deductions', []):
+        description = deduction.get('description', '').lower()
+        rule = _sequential_match(DEDUCTION_MAPPING, deduction.get('type', ''), description)
+        if rule is None:
+            continue
+        amount = str(deduction.get('amount', 0))
+        if rule['entry'] == 'apit':
+            entry = {'source': deduction.get('source', 'Primary Employment'), 'name': 'APIT Deduction', 'amount': amount}
+        elif rule['entry'] == 'wht':
+            source = DEFAULT_WHT_SOURCE
+            for keywords, wht_source in WHT_SOURCES:
+                if any(keyword in description for keyword in keywords):
+                    source = wht_source
+                    break
+            entry = {'source': source, 'amount': amount}
+        else:
+            entry = {'name': deduction.get('description', rule['default_name']), 'amount': amount}
+        mappings[rule['section']][rule['entries']].append(entry)
+    return mappings
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the compiled auto-fill mapper against a sequential scan of the mapping tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=5000, help='Income items per synthetic analysis')
+        parser.add_argument('--deductions', type=int, default=1000, help='Deductions per synthetic analysis')
+        parser.add_argument('--analyses', type=int, default=20, help='Number of analyses to map')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed for the synthetic corpus')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        analyses = []
+        for _ in range(options['analyses']):
+            income_items = []
+            for _ in range(options['items']):
+                category, types, descriptions = rng.choice(SAMPLE_INCOME)
+                income_items.append({
+                    'category': category,
+                    'type': rng.choice(types),
+                    'description': rng.choice(descriptions),
+                    'amount': round(rng.uniform(100, 5000000), 2),
+                })
+            deductions = []
+            for _ in range(options['deductions']):
+                deduction_type, description = rng.choice(SAMPLE_DEDUCTIONS)
+                deductions.append({
+                    'type': deduction_type,
+                    'description': description,
+                    'amount': round(rng.uniform(100, 500000), 2),
+                })
+            analyses.append({'income_items': income_items, 'deductions': deductions})
+        total = (options['items'] + options['deductions']) * options['analyses']
+
+        start = time.perf_counter()
+        mapper = AutoFillMapper()
+        compile_elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        compiled_results = [mapper.map_analysis(analysis) for analysis in analyses]
+        compiled_elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        sequential_results = [sequential_map(analysis) for analysis in analyses]
+        sequential_elapsed = time.perf_counter() - start
+
+        mismatches = sum(1 for compiled, sequential in zip(compiled_results, sequential_results)
+                         if compiled != sequential)
+
+        self.stdout.write(f'Mapped {total:,} items across {options["analyses"]} analyses '
+                          f'(tables compiled in {compile_elapsed * 1000:.2f}ms)')
+        self.stdout.write(f'  compiled mapper:   {compiled_elapsed:.3f}s ({total / compiled_elapsed:,.0f} items/s)')
+        self.stdout.write(f'  sequential tables: {sequential_elapsed:.3f}s ({total / sequential_elapsed:,.0f} items/s)')
+        if mismatches:
+            self.stdout.write(self.style.ERROR(f'  {mismatches} analyses mapped differently'))
+        else:
+            self.stdout.write(self.style.SUCCESS('  mappings identical'))
@@ -0,0 +1,79 @@
+from django.core.management.base import BaseCommand # type: ignore
+from tax_report.services.keyword_classifier import CLASSIFICATION_RULES, KeywordClassifier
+import random
+import time
+
+SAMPLE_DESCRIPTIONS = [
+    'Primary Salary', 'Secondary Salary', 'APIT Deduction', 'WHT on Interest',
+    'Interest Income from Bank', 'Dividend Income', 'Rental Income', 'Service Income',
+    'Royalty Payment', 'Capital Gain on Shares', 'Sole Proprietorship Profit',
+    'Partnership Share', 'Trust Beneficiary Income', 'Samurdhi Beneficiary Shop Setup',
+    'Commuted Pension', 'Retiring Gratuity', 'Compensation for Job Loss', 'ETF Payment',
+    'Donation to Charity', 'Solar Panel Installation', 'Housing Construction',
+    'Opening Balance', 'Transfer to Savings', 'ATM Withdrawal', 'Card Payment Supermarket',
+]
+
+
+def sequential_classify(rules, description):
+    """Reference implementation: test every rule's keywords in order"""
+    description_lower = description.lower()
+    for rule in rules:
+        if any(keyword in description_lower for keyword in rule['keywords']):
+            for override in rule.get('overrides', ()):
+                if any(keyword in description_lower for keyword in override['keywords']):
+                    return override
+            return rule
+    return None
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the compiled keyword classifier against a sequential rule scan'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lines', type=int, default=5000, help='Lines per synthetic statement')
+        parser.add_argument('--statements', type=int, default=20, help='Number of statements to classify')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed for the synthetic corpus')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        statements = []
+        for _ in range(options['statements']):
+            lines = [
+                f"{rng.choice(SAMPLE_DESCRIPTIONS)} {rng.randint(100, 5000000):,}.{rng.randint(0, 99):02d}"
+                for _ in range(options['lines'])
+            ]
+            statements.append(lines)
+        total_lines = options['lines'] * options['statements']
+
+        classifier = KeywordClassifier(CLASSIFICATION_RULES)
+
+        start = time.perf_counter()
+        compiled_results = [classifier.classify_lines(lines) for lines in statements]
+        compiled_elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        sequential_results = []
+        for lines in statements:
+            results = []
+            for line in lines:
+                parts = line.split()
+                rule = sequential_classify(CLASSIFICATION_RULES, ' '.join(parts[:-1]))
+                if rule is not None:
+                    results.append(rule)
+            sequential_results.append(results)
+        sequential_elapsed = time.perf_counter() - start
+
+        mismatches = sum(
+            1
+            for compiled, sequential in zip(compiled_results, sequential_results)
+            for entry, rule in zip(compiled, sequential)
+            if entry['rule'] is not rule
+        ) + sum(abs(len(c) - len(s)) for c, s in zip(compiled_results, sequential_results))
+
+        self.stdout.write(f'Classified {total_lines:,} lines across {options["statements"]} statements')
+        self.stdout.write(f'  compiled matcher:  {compiled_elapsed:.3f}s ({total_lines / compiled_elapsed:,.0f} lines/s)')
+        self.stdout.write(f'  sequential rules:  {sequential_elapsed:.3f}s ({total_lines / sequential_elapsed:,.0f} lines/s)')
+        if mismatches:
+            self.stdout.write(self.style.ERROR(f'  {mismatches} lines categorized differently'))
+        else:
+            self.stdout.write(self.style.SUCCESS('  categorization identical'))
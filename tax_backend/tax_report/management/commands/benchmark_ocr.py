@@ -0,0 +1,80 @@
+from django.conf import settings # type: ignore
+from django.core.management.base import BaseCommand # type: ignore
+from tax_report.services.ocr_engines import create_ocr_engine, TESSEROCR_INSTALLED
+from tax_report.services.image_preprocessing import ImagePreprocessor
+from concurrent.futures import ThreadPoolExecutor
+from pdf2image import convert_from_path # type: ignore
+from PIL import Image, ImageOps # type: ignore
+import os
+import time
+
+class Command(BaseCommand):
+    help = 'Compare OCR pages per second between the pytesseract CLI and the pooled tesserocr engine'
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='+', type=str, help='Images or PDFs to OCR')
+        parser.add_argument('--repeat', type=int, default=3, help='Times to OCR the page set per backend')
+        parser.add_argument('--threads', type=int, default=1, help='Pages OCR\'d concurrently')
+        parser.add_argument('--no-preprocess', action='store_true', help='Skip the OpenCV preprocessing stage')
+
+    def load_pages(self, paths, preprocess):
+        preprocessor = ImagePreprocessor()
+        pages = []
+        for path in paths:
+            if not os.path.exists(path):
+                self.stderr.write(self.style.ERROR(f'File not found: {path}'))
+                continue
+            if path.lower().endswith('.pdf'):
+                images = convert_from_path(path)
+            else:
+                with Image.open(path) as opened:
+                    image = ImageOps.exif_transpose(opened)
+                    image.load()
+                images = [image]
+            for image in images:
+                pages.append(preprocessor.process(image)[0] if preprocess else image)
+        return pages
+
+    def handle(self, *args, **options):
+        pages = self.load_pages(options['files'], not options['no_preprocess'])
+        if not pages:
+            return
+
+        backends = ['pytesseract']
+        if TESSEROCR_INSTALLED:
+            backends.append('tesserocr')
+        else:
+            self.stderr.write(self.style.WARNING('tesserocr is not installed; only pytesseract is measured'))
+
+        workload = pages * options['repeat']
+        results = {}
+        for backend in backends:
+            # Same language and tessdata as the app, with one API handle per thread
+            engine_options = dict(getattr(settings, 'OCR_ENGINE', {}), pool_size=options['threads'])
+            engine = create_ocr_engine(backend, options=engine_options)
+            if engine.name != backend:
+                self.stderr.write(self.style.WARNING(f'{backend} could not start; skipped'))
+                continue
+            try:
+                # Warm-up page so one-off model loading is reported separately
+                start = time.perf_counter()
+                engine.image_to_string(pages[0])
+                warmup_ms = (time.perf_counter() - start) * 1000
+
+                start = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=options['threads']) as executor:
+                    list(executor.map(engine.image_to_string, workload))
+                elapsed = time.perf_counter() - start
+            finally:
+                engine.close()
+
+            results[backend] = len(workload) / elapsed
+            self.stdout.write(
+                f'{backend:<12} {len(workload)} pages in {elapsed:.2f}s: '
+                f'{results[backend]:.2f} pages/s (first page {warmup_ms:.0f}ms)'
+            )
+
+        if len(results) == 2:
+            self.stdout.write(self.style.SUCCESS(
+                f"Pooled engine speed-up: {results['tesserocr'] / results['pytesseract']:.2f}x"
+            ))
@@ -0,0 +1,95 @@
+from django.core.management.base import BaseCommand, CommandError # type: ignore
+from tax_report.benchmarks.corpus import CorpusGenerator, load_manifest, KINDS, DEFAULT_PAGE_COUNTS, DEFAULT_DPIS
+from tax_report.benchmarks.harness import (
+    PipelineBenchmark, STAGES, compare, load_baseline, save_baseline,
+)
+import os
+import json
+import tempfile
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                                'benchmarks', 'pipeline_baseline.json')
+
+
+def _int_list(value):
+    return [int(part) for part in value.split(',') if part.strip()]
+
+
+class Command(BaseCommand):
+    help = 'Measure per-stage latency and pages per second of the document pipeline on a synthetic corpus'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--corpus', default=os.path.join(tempfile.gettempdir(), 'tax_pipeline_corpus'),
+                            help='Directory of the generated corpus (created if missing)')
+        parser.add_argument('--regenerate', action='store_true', help='Rebuild the corpus even if it exists')
+        parser.add_argument('--kinds', default=','.join(KINDS), help='Comma-separated document kinds')
+        parser.add_argument('--pages', type=_int_list, default=list(DEFAULT_PAGE_COUNTS), help='Page counts, e.g. 1,5,20')
+        parser.add_argument('--dpi', type=_int_list, default=list(DEFAULT_DPIS), help='Render resolutions, e.g. 150,300')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed for the corpus')
+        parser.add_argument('--llm-latency', type=float, default=800, help='Latency of the stub LLM per prompt (ms)')
+        parser.add_argument('--text-ocr', action='store_true', help='Plain text OCR instead of layout OCR')
+        parser.add_argument('--no-ocr', action='store_true', help='Skip rasterize/preprocess/OCR; use the source text')
+        parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='Baseline JSON to compare against')
+        parser.add_argument('--save-baseline', action='store_true', help='Store this run as the new baseline')
+        parser.add_argument('--tolerance', type=float, default=0.15, help='Allowed slowdown before reporting a regression')
+        parser.add_argument('--fail-on-regression', action='store_true', help='Exit with an error on regressions')
+        parser.add_argument('--json', dest='json_path', help='Also write the full per-document report here')
+
+    def handle(self, *args, **options):
+        kinds = [kind.strip() for kind in options['kinds'].split(',') if kind.strip()]
+        parameters = {'kinds': kinds, 'pages': options['pages'], 'dpi': options['dpi'], 'seed': options['seed'],
+                      'llm_latency_ms': options['llm_latency'], 'layout': not options['text_ocr'],
+                      'ocr': not options['no_ocr']}
+
+        generator = CorpusGenerator(options['seed'])
+        manifest = None if options['regenerate'] else load_manifest(options['corpus'])
+        if manifest is None or manifest['parameters'] != generator.parameters(kinds, options['pages'], options['dpi']):
+            self.stdout.write(f"Generating corpus in {options['corpus']}...")
+            try:
+                manifest = generator.generate(options['corpus'], kinds, options['pages'], options['dpi'])
+            except ValueError as e:
+                raise CommandError(str(e))
+
+        benchmark = PipelineBenchmark(llm_latency_ms=options['llm_latency'], ocr=not options['no_ocr'],
+                                      layout=False if options['text_ocr'] else None)
+        report = benchmark.run(options['corpus'], manifest)
+        summary = report['summary']
+
+        for stage, reason in report['unavailable'].items():
+            self.stderr.write(self.style.WARNING(f'{stage} unavailable ({reason}); source text used instead'))
+
+        header = f"{'':<20}{'docs':>5}{'pages':>7}" + ''.join(f'{stage:>11}' for stage in STAGES) + f"{'pages/s':>10}{'recall':>8}{'no LLM':>8}"
+        self.stdout.write(header)
+        self.stdout.write(f"{'':<32}" + ''.join(f"{'ms/page':>11}" for _ in STAGES))
+        for name, scope in list(summary['by_kind'].items()) + [('overall', summary)]:
+            self.stdout.write(
+                f"{name:<20}{scope['documents']:>5}{scope['pages']:>7}"
+                + ''.join(f"{scope['ms_per_page'][stage]:>11.1f}" for stage in STAGES)
+                + f"{scope['pages_per_second']:>10.2f}{scope['recall']:>8.3f}{scope['llm_skipped']:>8}"
+            )
+        llm = report['llm']
+        self.stdout.write(f"LLM stub: {llm['calls']} calls, p95 {llm['latency_ms']['p95']}ms")
+
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump(dict(report, parameters=parameters), f, indent=2)
+
+        baseline = load_baseline(options['baseline'])
+        if baseline is None:
+            self.stdout.write(f"No baseline at {options['baseline']}")
+        elif baseline.get('parameters') != parameters:
+            self.stdout.write(self.style.WARNING('Baseline was recorded with different parameters; not compared'))
+        else:
+            regressions = compare(summary, baseline['summary'], options['tolerance'])
+            if regressions:
+                self.stdout.write(self.style.ERROR(f'{len(regressions)} regression(s) against {options["baseline"]}:'))
+                for regression in regressions:
+                    self.stdout.write(self.style.ERROR(f'  {regression}'))
+                if options['fail_on_regression']:
+                    raise CommandError('Pipeline benchmark regressed')
+            else:
+                self.stdout.write(self.style.SUCCESS(f'No regressions against baseline from {baseline["created"]}'))
+
+        if options['save_baseline']:
+            save_baseline(options['baseline'], report, parameters)
+            self.stdout.write(self.style.SUCCESS(f"Baseline saved to {options['baseline']}"))
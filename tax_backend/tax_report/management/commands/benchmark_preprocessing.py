@@ -0,0 +1,63 @@
+from django.core.management.base import BaseCommand # type: ignore
+from tax_report.services.image_preprocessing import ImagePreprocessor, STEP_ORDER
+from PIL import Image, ImageOps # type: ignore
+import pytesseract # type: ignore
+import os
+import time
+
+class Command(BaseCommand):
+    help = 'Compare Tesseract time on raw images against the OpenCV preprocessing stage'
+
+    def add_arguments(self, parser):
+        parser.add_argument('images', nargs='+', type=str, help='Image files to OCR')
+        parser.add_argument('--disable', action='append', default=[], choices=STEP_ORDER,
+                            help='Preprocessing step to switch off (repeatable)')
+        parser.add_argument('--target-dpi', type=int, default=None, help='Override the target DPI')
+
+    def handle(self, *args, **options):
+        overrides = {step: False for step in options['disable']}
+        if options['target_dpi']:
+            overrides['target_dpi'] = options['target_dpi']
+        preprocessor = ImagePreprocessor()
+        preprocessor.options.update(overrides)
+
+        if not preprocessor.enabled:
+            self.stderr.write(self.style.ERROR('Preprocessing is disabled or OpenCV is not installed'))
+            return
+
+        raw_total = 0.0
+        processed_total = 0.0
+        for path in options['images']:
+            if not os.path.exists(path):
+                self.stderr.write(self.style.ERROR(f'File not found: {path}'))
+                continue
+
+            with Image.open(path) as opened:
+                image = ImageOps.exif_transpose(opened)
+                image.load()
+
+            start = time.perf_counter()
+            pytesseract.image_to_string(image)
+            raw_ms = (time.perf_counter() - start) * 1000
+
+            prepared, report = preprocessor.process(image)
+            start = time.perf_counter()
+            pytesseract.image_to_string(prepared)
+            ocr_ms = (time.perf_counter() - start) * 1000
+
+            raw_total += raw_ms
+            processed_total += report['total_ms'] + ocr_ms
+
+            self.stdout.write(f'{os.path.basename(path)} {report["original_size"]} -> {report["final_size"]}')
+            for step in report['steps']:
+                self.stdout.write(
+                    f'  {step["step"]:<13} {step["ms"]:>9.1f}ms  {step["size_before"]} -> {step["size_after"]}'
+                )
+            self.stdout.write(f'  tesseract raw          {raw_ms:>9.1f}ms')
+            self.stdout.write(f'  tesseract preprocessed {ocr_ms:>9.1f}ms (+{report["total_ms"]:.1f}ms preprocessing)')
+
+        if raw_total:
+            self.stdout.write(self.style.SUCCESS(
+                f'Total: raw {raw_total:.0f}ms, preprocessed {processed_total:.0f}ms '
+                f'({(1 - processed_total / raw_total) * 100:.1f}% saved)'
+            ))
@@ -0,0 +1,66 @@
+import os
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from django.core.management.base import BaseCommand, CommandError # type: ignore
+from tax_report.models import TaxReport
+from tax_report.services.report_renderer import report_context, render_batch, warm_report_renderer
+from tax_report.management.commands.storage_usage import format_bytes
+
+class Command(BaseCommand):
+    help = 'Render saved tax reports as PDFs in parallel and write them into a zip archive'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='Path of the zip archive to write')
+        parser.add_argument('--user', type=int, action='append', dest='users',
+                            help='Only reports of this user id (repeatable)')
+        parser.add_argument('--tax-year', help='Only reports for this year of assessment, e.g. 2024/2025')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Render processes')
+        parser.add_argument('--batch-size', type=int, default=50, help='Reports sent to a worker at a time')
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--workers and --batch-size must be at least 1')
+
+        reports = TaxReport.objects.select_related('user').prefetch_related('categories__entries', 'deductions')
+        if options['users']:
+            reports = reports.filter(user_id__in=options['users'])
+        if options['tax_year']:
+            reports = reports.filter(tax_year=options['tax_year'])
+        reports = reports.order_by('id')
+
+        started = time.perf_counter()
+        rendered = total_bytes = 0
+        # Workers only render; the database is read here, batch by batch, so at
+        # most a few batches of reports are in memory at any time. Page content
+        # is already Flate-compressed, so the archive stores the PDFs as they are.
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=warm_report_renderer) as executor, \
+                zipfile.ZipFile(options['output'], 'w', zipfile.ZIP_STORED) as archive:
+            def write(futures):
+                nonlocal rendered, total_bytes
+                for future in futures:
+                    for name, pdf in future.result():
+                        archive.writestr(name, pdf)
+                        rendered += 1
+                        total_bytes += len(pdf)
+
+            pending = set()
+            batch = []
+            for report in reports.iterator(chunk_size=options['batch_size']):
+                batch.append(report_context(report))
+                if len(batch) < options['batch_size']:
+                    continue
+                pending.add(executor.submit(render_batch, batch))
+                batch = []
+                if len(pending) >= options['workers'] * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    write(done)
+            if batch:
+                pending.add(executor.submit(render_batch, batch))
+            write(pending)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Rendered {rendered} reports ({format_bytes(total_bytes)}) into {options['output']} "
+            f"in {elapsed:.1f}s ({rendered / elapsed if elapsed else 0:.0f} reports/s)"
+        ))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand # type: ignore
+from tax_report.storage import upload_storage
+import json
+
+def format_bytes(size):
+    for unit in ('B', 'KB', 'MB'):
+        if abs(size) < 1024:
+            return f'{size:.1f} {unit}'
+        size /= 1024
+    return f'{size:.1f} GB'
+
+class Command(BaseCommand):
+    help = 'Report how much disk space the deduplicating upload storage saves'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--json', action='store_true', help='Print the raw report as JSON')
+
+    def handle(self, *args, **options):
+        report = upload_storage.usage()
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+
+        self.stdout.write(f"Stored files:         {report['files']} ({report['blobs']} unique blobs)")
+        self.stdout.write(f"Logical size:         {format_bytes(report['logical_bytes'])}")
+        self.stdout.write(f"On disk:              {format_bytes(report['stored_bytes'])}")
+        self.stdout.write(f"Saved by dedupe:      {format_bytes(report['deduplication_saved_bytes'])}")
+        self.stdout.write(f"Saved by compression: {format_bytes(report['compression_saved_bytes'])}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Total saved:          {format_bytes(report['saved_bytes'])} ({report['saved_ratio']:.1%})"
+        ))
@@ -0,0 +1,49 @@
+import os
+from django.core.management.base import BaseCommand # type: ignore
+from tax_report.models import DownloadedReports, StoredFile
+from tax_report.storage import report_storage
+from tax_report.management.commands.storage_usage import format_bytes
+
+class Command(BaseCommand):
+    help = 'Move reports saved as plain files in downloaded_docs/ into the deduplicating report storage'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be moved')
+
+    def handle(self, *args, **options):
+        stored = set(StoredFile.objects.filter(name__startswith='downloaded_docs/').values_list('name', flat=True))
+        reports = DownloadedReports.objects.exclude(document='').exclude(document__isnull=True).order_by('id')
+
+        moved = {}  # legacy name -> name in the blob store
+        count = reclaimed = missing = 0
+        for report in reports.iterator():
+            name = report.document.name
+            if name in stored:
+                continue
+
+            if name in moved:
+                new_name = report_storage.link(moved[name], name) if not options['dry_run'] else name
+            else:
+                path = report_storage.path(name)
+                if not os.path.exists(path):
+                    missing += 1
+                    self.stdout.write(self.style.WARNING(f"Missing file for report {report.id}: {name}"))
+                    continue
+                reclaimed += os.path.getsize(path)
+                if options['dry_run']:
+                    new_name = name
+                else:
+                    new_name = report_storage.adopt(name, path)
+                moved[name] = new_name
+
+            if not options['dry_run']:
+                DownloadedReports.objects.filter(pk=report.pk).update(document=new_name)
+            count += 1
+
+        # What the plain copies used; the blob store keeps each unique report once, compressed
+        verb = 'Would move' if options['dry_run'] else 'Moved'
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {count} reports ({len(moved)} files, {format_bytes(reclaimed)}) into the report storage"
+        ))
+        if missing:
+            self.stdout.write(self.style.WARNING(f"{missing} reports reference missing files"))
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand # type: ignore
+from tax_report.services.upload_sweeper import UploadSweeper
+from tax_report.management.commands.storage_usage import format_bytes
+import json
+
+class Command(BaseCommand):
+    help = 'Delete uploads of expired sessions, stale temp and part files, and orphaned blobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report what would be deleted without deleting')
+        parser.add_argument('--session-grace', type=int, help='Seconds a session stays after expiry and last activity')
+        parser.add_argument('--temp-max-age', type=int, help='Seconds before temp and part files count as stale')
+        parser.add_argument('--batch-size', type=int, help='Deletions between pauses')
+        parser.add_argument('--batch-pause', type=float, help='Seconds to pause after every batch')
+        parser.add_argument('--json', action='store_true', help='Print the raw report as JSON')
+
+    def handle(self, *args, **options):
+        sweeper = UploadSweeper()
+        overrides = {key: options[key] for key in ('session_grace', 'temp_max_age', 'batch_size', 'batch_pause')
+                     if options[key] is not None}
+        if overrides:
+            sweeper = UploadSweeper(dict(sweeper.options, **overrides))
+
+        report = sweeper.sweep_locked(dry_run=options['dry_run'])
+        if report is None:
+            self.stdout.write(self.style.WARNING('Another process is sweeping; nothing done'))
+            return
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+
+        for category, counts in sorted(report['categories'].items()):
+            self.stdout.write(f"{category:<18}{counts['files']:>7} files  {format_bytes(counts['bytes']):>10}")
+        self.stdout.write(f"Expired sessions:  {len(report['sessions'])}")
+        verb = 'Would reclaim' if report['dry_run'] else 'Reclaimed'
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {format_bytes(report['bytes'])} in {report['files']} files ({report['duration_ms']:.0f}ms)"
+        ))
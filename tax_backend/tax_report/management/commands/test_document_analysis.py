@@ -1,5 +1,5 @@
 from django.core.management.base import BaseCommand # type: ignore
-from tax_report.services.document_processor import DocumentProcessor
+from tax_report.services.document_processor import get_document_processor
 import asyncio
 import os
 import json
@@ -17,7 +17,7 @@ class Command(BaseCommand):
             self.stderr.write(self.style.ERROR(f'File not found: {file_path}'))
             return
 
-        processor = DocumentProcessor()
+        processor = get_document_processor()
         
         try:
             # Extract text
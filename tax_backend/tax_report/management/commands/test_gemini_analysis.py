@@ -1,5 +1,5 @@
 from django.core.management.base import BaseCommand
-from tax_report.services.document_processor import DocumentProcessor
+from tax_report.services.document_processor import get_document_processor
 import json
 
 class Command(BaseCommand):
@@ -10,7 +10,7 @@ class Command(BaseCommand):
         parser.add_argument('--file', type=str, help='Test file to analyze')
 
     def handle(self, *args, **options):
-        processor = DocumentProcessor()
+        processor = get_document_processor()
         
         # Test text
         test_text = options.get('text') or """
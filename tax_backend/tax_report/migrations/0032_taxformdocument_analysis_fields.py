@@ -0,0 +1,27 @@
+# Generated by Django 4.2.18 on 2026-10-19 13:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tax_report', '0031_remove_downloadedreports_full_name_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='taxformdocument',
+            name='analyzed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='taxformdocument',
+            name='file_type',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddIndex(
+            model_name='taxformdocument',
+            index=models.Index(fields=['session_id', 'is_processed', 'analyzed_at'], name='tax_doc_session_analyzed_idx'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.18 on 2026-10-19 13:57
+
+from django.db import migrations, models
+import django.db.models.deletion
+import tax_report.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tax_report', '0032_taxformdocument_analysis_fields'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=64, unique=True)),
+                ('path', models.CharField(max_length=255)),
+                ('size', models.BigIntegerField()),
+                ('stored_size', models.BigIntegerField()),
+                ('compressed', models.BooleanField(default=False)),
+                ('ref_count', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'tax_report_stored_blobs',
+            },
+        ),
+        migrations.AlterField(
+            model_name='taxformdocument',
+            name='file',
+            field=models.FileField(storage=tax_report.storage.get_upload_storage, upload_to='tax_form_docs/'),
+        ),
+        migrations.CreateModel(
+            name='StoredFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('blob', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='files', to='tax_report.storedblob')),
+            ],
+            options={
+                'db_table': 'tax_report_stored_files',
+            },
+        ),
+    ]
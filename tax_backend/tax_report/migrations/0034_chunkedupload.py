@@ -0,0 +1,38 @@
+# Generated by Django 4.2.18 on 2026-10-19 14:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tax_report', '0033_upload_storage_blobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChunkedUpload',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('session_id', models.CharField(db_index=True, max_length=100)),
+                ('filename', models.CharField(max_length=255)),
+                ('file_type', models.CharField(blank=True, default='', max_length=100)),
+                ('total_size', models.BigIntegerField()),
+                ('chunk_size', models.IntegerField()),
+                ('received_chunks', models.JSONField(default=list)),
+                ('hashed_offset', models.BigIntegerField(default=0)),
+                ('page_count', models.IntegerField(blank=True, null=True)),
+                ('sha256', models.CharField(blank=True, default='', max_length=64)),
+                ('status', models.CharField(choices=[('uploading', 'Uploading'), ('complete', 'Complete'), ('failed', 'Failed')], default='uploading', max_length=20)),
+                ('error', models.CharField(blank=True, default='', max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('document', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='tax_report.taxformdocument')),
+            ],
+            options={
+                'db_table': 'tax_report_chunked_uploads',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.18 on 2026-10-19 14:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tax_report', '0034_chunkedupload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='taxformdocument',
+            name='extraction_stats',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
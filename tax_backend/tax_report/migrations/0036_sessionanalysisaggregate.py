@@ -0,0 +1,28 @@
+# Generated by Django 4.2.18 on 2026-10-19 14:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tax_report', '0035_taxformdocument_extraction_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SessionAnalysisAggregate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_id', models.CharField(max_length=100, unique=True)),
+                ('entries', models.JSONField(default=dict)),
+                ('documents', models.JSONField(default=dict)),
+                ('totals', models.JSONField(default=dict)),
+                ('next_sequence', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'tax_report_session_aggregates',
+            },
+        ),
+    ]
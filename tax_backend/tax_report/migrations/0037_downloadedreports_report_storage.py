@@ -0,0 +1,19 @@
+# Generated by Django 4.2.18 on 2026-10-19 14:36
+
+from django.db import migrations, models
+import tax_report.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tax_report', '0036_sessionanalysisaggregate'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='downloadedreports',
+            name='document',
+            field=models.FileField(blank=True, null=True, storage=tax_report.storage.get_report_storage, upload_to='downloaded_docs/'),
+        ),
+    ]
@@ -2,6 +2,7 @@ from django.db import models # type: ignore
 from django.contrib.auth.models import User # type: ignore
 import uuid
 from django.utils import timezone # type: ignore
+from .storage import get_upload_storage, get_report_storage
 
 class TaxReport(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -30,17 +31,129 @@ class TaxDeduction(models.Model):
 class TaxFormDocument(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     session_id = models.CharField(max_length=100, db_index=True)
-    file = models.FileField(upload_to='tax_form_docs/')
+    file = models.FileField(upload_to='tax_form_docs/', storage=get_upload_storage)
     original_filename = models.CharField(max_length=255)
     content_text = models.TextField(null=True, blank=True)
     extracted_data = models.JSONField(null=True, blank=True)
+    extraction_stats = models.JSONField(null=True, blank=True)  # pages OCRed / duplicate pages skipped
+    file_type = models.CharField(max_length=100, blank=True, default='')
     uploaded_at = models.DateTimeField(auto_now_add=True)
     is_processed = models.BooleanField(default=False)
+    analyzed_at = models.DateTimeField(null=True, blank=True)
     form_progress = models.CharField(max_length=50, default='uploaded')  # track progress state
 
     class Meta:
         db_table = 'tax_report_documents'
         ordering = ['-uploaded_at']
+        indexes = [
+            models.Index(fields=['session_id', 'is_processed', 'analyzed_at'], name='tax_doc_session_analyzed_idx'),
+        ]
+
+    def as_document_data(self):
+        """Serialize in the shape the frontend used to receive from the session"""
+        from .services.previews import PreviewService
+        data = {
+            'doc_id': str(self.id),
+            'filename': self.original_filename,
+            'stored_filename': self.file.name,
+            'file_type': self.file_type,
+            'upload_date': self.uploaded_at.isoformat() if self.uploaded_at else None,
+            'analyzed': self.is_processed,
+            'has_preview': bool(self.file.name) and PreviewService.supports(self.file.name),
+        }
+        if self.is_processed:
+            data['analysis'] = self.extracted_data
+        return data
+
+class SessionAnalysisAggregate(models.Model):
+    """
+    Income items and deductions of every analyzed document in a session,
+    merged incrementally (see services/session_aggregate.py)
+    """
+    session_id = models.CharField(max_length=100, unique=True)
+    entries = models.JSONField(default=dict)  # fingerprint -> entry and the documents it came from
+    documents = models.JSONField(default=dict)  # document id -> fingerprints of its entries
+    totals = models.JSONField(default=dict)  # running amount and entry count per kind and category
+    next_sequence = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'tax_report_session_aggregates'
+
+class StoredBlob(models.Model):
+    """A unique piece of uploaded content, stored once under its sha256 digest"""
+    digest = models.CharField(max_length=64, unique=True)
+    path = models.CharField(max_length=255)  # relative to MEDIA_ROOT
+    size = models.BigIntegerField()  # original size in bytes
+    stored_size = models.BigIntegerField()  # size on disk (after compression)
+    compressed = models.BooleanField(default=False)
+    ref_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'tax_report_stored_blobs'
+
+class StoredFile(models.Model):
+    """A logical file name handed out by the upload storage, pointing at its blob"""
+    name = models.CharField(max_length=255, unique=True)
+    blob = models.ForeignKey(StoredBlob, on_delete=models.PROTECT, related_name='files')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'tax_report_stored_files'
+
+class ChunkedUpload(models.Model):
+    """A resumable upload assembled from fixed-size chunks"""
+    STATUS_CHOICES = [
+        ('uploading', 'Uploading'),
+        ('complete', 'Complete'),
+        ('failed', 'Failed'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    session_id = models.CharField(max_length=100, db_index=True)
+    filename = models.CharField(max_length=255)
+    file_type = models.CharField(max_length=100, blank=True, default='')
+    total_size = models.BigIntegerField()
+    chunk_size = models.IntegerField()
+    received_chunks = models.JSONField(default=list)
+    hashed_offset = models.BigIntegerField(default=0)  # bytes of the contiguous prefix already hashed
+    page_count = models.IntegerField(null=True, blank=True)
+    sha256 = models.CharField(max_length=64, blank=True, default='')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='uploading')
+    error = models.CharField(max_length=255, blank=True, default='')
+    document = models.ForeignKey(TaxFormDocument, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'tax_report_chunked_uploads'
+
+    @property
+    def total_chunks(self):
+        return max(1, -(-self.total_size // self.chunk_size))
+
+    def chunk_length(self, index):
+        """Expected byte length of a chunk (the last one may be short)"""
+        return min(self.chunk_size, self.total_size - index * self.chunk_size)
+
+    def missing_chunks(self):
+        received = set(self.received_chunks)
+        return [index for index in range(self.total_chunks) if index not in received]
+
+    def as_status(self):
+        return {
+            'upload_id': str(self.id),
+            'filename': self.filename,
+            'status': self.status,
+            'total_size': self.total_size,
+            'chunk_size': self.chunk_size,
+            'total_chunks': self.total_chunks,
+            'received_chunks': sorted(self.received_chunks),
+            'missing_chunks': self.missing_chunks(),
+            'page_count': self.page_count,
+            'error': self.error or None,
+        }
 
 class ExtractedContext(models.Model):
     document = models.ForeignKey(TaxFormDocument, on_delete=models.CASCADE, related_name='contexts')
@@ -62,7 +175,8 @@ class DownloadedReports(models.Model):
     user_id = models.IntegerField(null=True, blank=True)  # Keep existing user_id field
     username = models.CharField(max_length=150, null=True, blank=True)  # Add username field as nullable
     email = models.EmailField(null=True, blank=True)  # Make email nullable
-    document = models.FileField(upload_to='downloaded_docs/', null=True, blank=True)  # stores the document file
+    # stores the document file; identical reports share one compressed blob
+    document = models.FileField(upload_to='downloaded_docs/', storage=get_report_storage, null=True, blank=True)
     downloaded_at = models.DateTimeField(default=timezone.now)  # date and time of download
 
     class Meta:
@@ -0,0 +1,76 @@
+import json
+import asyncio
+import logging
+import threading
+from typing import Dict, Any, AsyncIterator, Callable
+from django.db import connections # type: ignore
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_SECONDS = 15  # comment lines keep proxies from closing an idle stream
+
+_FINISHED = object()
+
+
+def sse_event(event: str, data: Dict[str, Any], event_id: int = None) -> str:
+    """Format one Server-Sent Event"""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    for line in json.dumps(data, separators=(',', ':'), default=str).split('\n'):
+        lines.append(f"data: {line}")
+    return '\n'.join(lines) + '\n\n'
+
+
+async def stream_events(run: Callable[[Callable[[str, Dict[str, Any]], None]], None],
+                        heartbeat: float = HEARTBEAT_SECONDS) -> AsyncIterator[str]:
+    """
+    Run a blocking pipeline on its own thread and yield its events as SSE.
+
+    ``run`` receives an ``emit(event, data)`` callable. Events are handed to
+    the event loop as they happen, so under ASGI each one reaches the client
+    immediately. The stream ends with a ``done`` event, or ``error`` if the
+    pipeline raised. If the client goes away the pipeline still finishes (its
+    results are stored as usual); only the remaining events are dropped.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+
+    def emit(event: str, data: Dict[str, Any]) -> None:
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, (event, data))
+        except RuntimeError:
+            pass  # the loop is gone: the client disconnected
+
+    def worker() -> None:
+        try:
+            run(emit)
+            emit('done', {'success': True})
+        except Exception as e:
+            logger.error(f"Error in streamed analysis: {str(e)}")
+            emit('error', {'success': False, 'error': str(e)})
+        finally:
+            try:
+                # This thread's connections would otherwise stay open until the process exits
+                connections.close_all()
+            except Exception as e:
+                logger.error(f"Error closing database connections: {str(e)}")
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, _FINISHED)
+            except RuntimeError:
+                pass
+
+    threading.Thread(target=worker, name='analysis-stream', daemon=True).start()
+
+    event_id = 0
+    while True:
+        try:
+            item = await asyncio.wait_for(queue.get(), timeout=heartbeat)
+        except asyncio.TimeoutError:
+            yield ': keep-alive\n\n'
+            continue
+        if item is _FINISHED:
+            break
+        event_id += 1
+        yield sse_event(item[0], item[1], event_id)
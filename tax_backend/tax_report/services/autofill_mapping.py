@@ -0,0 +1,224 @@
+import logging
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+from .keyword_classifier import KeywordMatcher
+
+logger = logging.getLogger(__name__)
+
+# Form sections and the entry lists the frontend expects in each
+FORM_SECTIONS = (
+    ('EmploymentIncome', ('primaryEntries', 'secondaryEntries', 'apitEntries')),
+    ('BusinessIncome', ('businessEntries', 'deductions')),
+    ('InvestmentIncome', ('investmentEntries', 'deductions')),
+    ('OtherIncome', ('otherEntries', 'whtEntries')),
+    ('TerminalBenefits', ('commutedEntries', 'gratuityEntries', 'compensationEntries', 'etfEntries', 'otherEntries')),
+    ('QualifyingPayments', ('paymentEntries', 'samurdhiEntries', 'donationEntries', 'solarEntries',
+                            'housingEntries', 'otherEntries')),
+)
+
+# Income items, per analysis category. Rules are tried in order: the first
+# rule whose type equals the item's type or one of whose keywords appears in
+# the lower-cased description wins. Without a match the item goes to the
+# default entry list under its own description (or default_name).
+INCOME_MAPPING = (
+    {'category': 'Employment Income', 'section': 'EmploymentIncome', 'rules': (
+        {'type': 'Primary Employment', 'keywords': ('primary', 'salary'),
+         'entries': 'primaryEntries', 'name': 'Primary Salary'},
+        {'type': 'Secondary Employment', 'keywords': ('secondary', 'part-time'),
+         'entries': 'secondaryEntries', 'name': 'Secondary Salary'},
+    ), 'default': {'entries': 'primaryEntries', 'name': 'Primary Salary'}},
+
+    {'category': 'Business Income', 'section': 'BusinessIncome', 'rules': (
+        {'type': 'Sole Proprietorship', 'keywords': ('sole proprietor', 'self-employed'),
+         'entries': 'businessEntries', 'name': 'Sole Proprietorship'},
+        {'type': 'Partnership', 'keywords': ('partnership',),
+         'entries': 'businessEntries', 'name': 'Partnership'},
+        {'type': 'Trust Beneficiary', 'keywords': ('trust',),
+         'entries': 'businessEntries', 'name': 'Trust Beneficiary'},
+        {'type': 'Betting, Gaming, Liquor & Tobacco', 'keywords': ('betting', 'gaming', 'casino', 'lottery'),
+         'entries': 'businessEntries', 'name': 'Betting, Gaming, Liquor & Tobacco'},
+    ), 'default': {'entries': 'businessEntries', 'default_name': 'Business Income'}},
+
+    {'category': 'Investment Income', 'section': 'InvestmentIncome', 'rules': (
+        {'type': 'Interest Income', 'keywords': ('interest',),
+         'entries': 'investmentEntries', 'name': 'Interest Income'},
+        {'type': 'Dividend Income', 'keywords': ('dividend',),
+         'entries': 'investmentEntries', 'name': 'Dividend Income'},
+        {'type': 'Rental Income', 'keywords': ('rent', 'rental'),
+         'entries': 'investmentEntries', 'name': 'Rental Income'},
+        {'type': 'Capital Gains', 'keywords': ('capital', 'gain'),
+         'entries': 'investmentEntries', 'name': 'Capital Gains'},
+    ), 'default': {'entries': 'investmentEntries', 'default_name': 'Investment Income'}},
+
+    {'category': 'Other Income', 'section': 'OtherIncome', 'rules': (
+        {'type': 'Service Income (WHT)', 'keywords': ('service',),
+         'entries': 'otherEntries', 'name': 'Service Income'},
+        {'type': 'Royalty (WHT)', 'keywords': ('royalty',),
+         'entries': 'otherEntries', 'name': 'Royalty'},
+        {'type': 'Natural Resource Payment (WHT)', 'keywords': ('natural resource',),
+         'entries': 'otherEntries', 'name': 'Natural Resource Payment'},
+        {'type': 'Auctioned Gem Sale (WHT)', 'keywords': ('gem', 'auction'),
+         'entries': 'otherEntries', 'name': 'Auctioned Gem Sale'},
+    ), 'default': {'entries': 'otherEntries', 'default_name': 'Other Income'}},
+
+    {'category': 'Terminal Benefits', 'section': 'TerminalBenefits', 'rules': (
+        {'type': 'Commuted Pension', 'keywords': ('commuted', 'lump sum pension'),
+         'entries': 'commutedEntries', 'name': 'Commuted Pension'},
+        {'type': 'Retiring Gratuity', 'keywords': ('gratuity',),
+         'entries': 'gratuityEntries', 'name': 'Retiring Gratuity'},
+        {'type': 'Compensation for Job Loss', 'keywords': ('compensation', 'job loss'),
+         'entries': 'compensationEntries', 'name': 'Compensation for Job Loss'},
+        {'type': 'ETF Payment', 'keywords': ('etf', 'trust fund'),
+         'entries': 'etfEntries', 'name': 'ETF Payment'},
+    ), 'default': {'entries': 'otherEntries', 'default_name': 'Other Terminal Benefit'}},
+
+    {'category': 'Qualifying Payments', 'section': 'QualifyingPayments', 'rules': (
+        {'type': 'Donations', 'keywords': ('donation', 'charity'),
+         'entries': 'donationEntries', 'name': 'Donations'},
+        {'type': 'Shop Setup for Samurdhi Beneficiary', 'keywords': ('samurdhi', 'samurthy'),
+         'entries': 'samurdhiEntries', 'name': 'Shop Setup for Samurdhi Beneficiary'},
+        {'type': 'Solar Panel Installation', 'keywords': ('solar',),
+         'entries': 'solarEntries', 'name': 'Solar Panel Installation'},
+        {'type': 'Low-Income Housing Construction', 'keywords': ('housing',),
+         'entries': 'housingEntries', 'name': 'Low-Income Housing Construction'},
+        {'type': 'Film & Cinema Industry Expenditure', 'keywords': ('cinema', 'film'),
+         'entries': 'otherEntries', 'name': 'Film & Cinema Industry Expenditure'},
+    ), 'default': {'entries': 'otherEntries', 'default_name': 'Other Qualifying Payment'}},
+)
+
+# Deductions are matched the same way regardless of category; unmatched
+# deductions are dropped. 'entry' selects the shape of the form entry.
+DEDUCTION_MAPPING = (
+    {'type': 'APIT Deduction', 'keywords': ('apit',), 'section': 'EmploymentIncome',
+     'entries': 'apitEntries', 'entry': 'apit'},
+    {'type': 'WHT Deduction', 'keywords': ('wht', 'withholding'), 'section': 'OtherIncome',
+     'entries': 'whtEntries', 'entry': 'wht'},
+    {'type': 'BUSINESS_DEDUCTION', 'keywords': ('business',), 'section': 'BusinessIncome',
+     'entries': 'deductions', 'entry': 'named', 'default_name': 'Business Deduction'},
+    {'type': 'INVESTMENT_DEDUCTION', 'keywords': ('investment',), 'section': 'InvestmentIncome',
+     'entries': 'deductions', 'entry': 'named', 'default_name': 'Investment Deduction'},
+)
+
+# WHT entries name the income they were withheld from; first match wins
+WHT_SOURCES = (
+    (('service',), 'Service Income WHT'),
+    (('royalty',), 'Royalty WHT'),
+    (('resource', 'natural'), 'Natural Resource WHT'),
+    (('gem', 'auction'), 'Gem Sale WHT'),
+    (('dividend',), 'Dividend WHT'),
+    (('interest',), 'Interest WHT'),
+)
+DEFAULT_WHT_SOURCE = 'WHT Deduction'
+
+MATCH_CACHE_SIZE = 4096  # distinct (type, description) pairs remembered per rule list
+
+
+class RuleIndex:
+    """
+    Compiled form of an ordered rule list: a dict from type to rule
+    position plus one keyword matcher for all of the rules' keywords. The
+    winning rule is the lowest position hit by either, which is exactly the
+    first rule a sequential "type == ... or any(keyword in ...)" scan accepts.
+    Statements repeat the same descriptions over and over, so results are
+    memoized per (type, description).
+    """
+
+    def __init__(self, rules: Iterable[Dict[str, Any]], type_key: Optional[str] = 'type'):
+        self.rules = tuple(rules)
+        self._cache = {}
+        self._by_type = {}
+        self._by_keyword = {}
+        for position, rule in enumerate(self.rules):
+            if type_key is not None:
+                self._by_type.setdefault(rule[type_key], position)
+            for keyword in rule['keywords']:
+                self._by_keyword.setdefault(keyword, position)
+        self.matcher = KeywordMatcher(self._by_keyword)
+
+    def match(self, item_type: Optional[str], description: str) -> Optional[Dict[str, Any]]:
+        key = (item_type, description)
+        try:
+            position = self._cache[key]
+        except KeyError:
+            position = self._position(item_type, description)
+            if len(self._cache) >= MATCH_CACHE_SIZE:
+                self._cache.clear()
+            self._cache[key] = position
+        except TypeError:
+            # Unhashable type from a malformed analysis: nothing to remember
+            position = self._position(item_type, description)
+        return self.rules[position] if position is not None else None
+
+    def _position(self, item_type, description: str) -> Optional[int]:
+        positions = [self._by_keyword[keyword] for keyword in self.matcher.find(description)]
+        try:
+            if item_type in self._by_type:
+                positions.append(self._by_type[item_type])
+        except TypeError:
+            pass
+        return min(positions) if positions else None
+
+
+class AutoFillMapper:
+    """Turns an analysis into the auto-fill entries of each tax form section"""
+
+    def __init__(self, income_mapping=INCOME_MAPPING, deduction_mapping=DEDUCTION_MAPPING, wht_sources=WHT_SOURCES):
+        self.categories = {
+            category['category']: (category, RuleIndex(category['rules']))
+            for category in income_mapping
+        }
+        self.deductions = RuleIndex(deduction_mapping)
+        self.wht_sources = RuleIndex(
+            [{'keywords': keywords, 'source': source} for keywords, source in wht_sources], type_key=None
+        )
+
+    @staticmethod
+    def empty_mappings() -> Dict[str, Dict[str, List[Dict[str, str]]]]:
+        return {section: {entries: [] for entries in entry_lists} for section, entry_lists in FORM_SECTIONS}
+
+    def _income_entry(self, item: Dict[str, Any]) -> Optional[Tuple[str, str, Dict[str, str]]]:
+        compiled = self.categories.get(item.get('category', ''))
+        if compiled is None:
+            return None
+        category, index = compiled
+
+        rule = index.match(item.get('type', ''), item.get('description', '').lower())
+        if rule is not None:
+            return category['section'], rule['entries'], {'name': rule['name'], 'amount': str(item.get('amount', 0))}
+
+        default = category['default']
+        name = default['name'] if 'name' in default else item.get('description', default['default_name'])
+        return category['section'], default['entries'], {'name': name, 'amount': str(item.get('amount', 0))}
+
+    def _deduction_entry(self, deduction: Dict[str, Any]) -> Optional[Tuple[str, str, Dict[str, str]]]:
+        description = deduction.get('description', '').lower()
+        rule = self.deductions.match(deduction.get('type', ''), description)
+        if rule is None:
+            return None
+
+        amount = str(deduction.get('amount', 0))
+        if rule['entry'] == 'apit':
+            entry = {'source': deduction.get('source', 'Primary Employment'), 'name': 'APIT Deduction', 'amount': amount}
+        elif rule['entry'] == 'wht':
+            source = self.wht_sources.match(None, description)
+            entry = {'source': source['source'] if source else DEFAULT_WHT_SOURCE, 'amount': amount}
+        else:
+            entry = {'name': deduction.get('description', rule['default_name']), 'amount': amount}
+        return rule['section'], rule['entries'], entry
+
+    def map_analysis(self, analysis_data: Dict[str, Any]) -> Dict[str, Dict[str, List[Dict[str, str]]]]:
+        mappings = self.empty_mappings()
+        for item in analysis_data.get('income_items', []):
+            mapped = self._income_entry(item)
+            if mapped is not None:
+                section, entries, entry = mapped
+                mappings[section][entries].append(entry)
+
+        for deduction in analysis_data.get('deductions', []):
+            mapped = self._deduction_entry(deduction)
+            if mapped is not None:
+                section, entries, entry = mapped
+                mappings[section][entries].append(entry)
+        return mappings
+
+# Create a singleton instance
+autofill_mapper = AutoFillMapper()
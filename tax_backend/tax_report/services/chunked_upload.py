@@ -0,0 +1,398 @@
+import os
+import re
+import copy
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+from django.conf import settings # type: ignore
+from django.db import transaction # type: ignore
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNKED_UPLOAD = {
+    'chunk_size': 5 * 1024 * 1024,
+    'min_chunk_size': 256 * 1024,
+    'max_chunk_size': 16 * 1024 * 1024,
+    'max_size': 200 * 1024 * 1024,
+    'max_pages': 500,
+}
+
+SUPPORTED_EXTENSIONS = ('.pdf', '.jpg', '.jpeg', '.png', '.docx', '.doc', '.xls', '.xlsx', '.txt')
+
+# Leading bytes expected for formats we can cheaply sanity-check on the first chunk
+MAGIC_BYTES = {
+    '.pdf': (b'%PDF-',),
+    '.png': (b'\x89PNG',),
+    '.jpg': (b'\xff\xd8\xff',),
+    '.jpeg': (b'\xff\xd8\xff',),
+    '.docx': (b'PK\x03\x04',),
+    '.xlsx': (b'PK\x03\x04',),
+}
+
+READ_BLOCK = 64 * 1024
+MAX_HASH_STATES = 128
+
+
+class ChunkedUploadError(Exception):
+    """Raised for invalid chunked upload requests; carries the HTTP status to return"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class PdfPageCounter:
+    """
+    Counts page objects in a PDF as its bytes stream past.
+
+    Only uncompressed page dictionaries are visible; for PDFs that keep them
+    in object streams the largest /Count of a page tree node is used instead.
+    """
+
+    PAGE = re.compile(rb'/Type\s{0,8}/Page(?![a-zA-Z])')
+    COUNT = re.compile(rb'/Count\s{0,8}(\d{1,7})(?!\d)')
+    OVERLAP = 64
+
+    def __init__(self):
+        self.pages = 0
+        self.max_count = 0
+        self._tail = b''
+        self._tail_start = 0  # absolute offset of _tail
+        self._counted_end = 0  # absolute end of the last match counted
+
+    def _scan(self, buffer: bytes, start: int, final: bool) -> None:
+        # A match that touches the end of the buffer may continue in the next
+        # feed (e.g. "/Page" vs "/Pages"), so it is left for the next scan
+        limit = len(buffer) if final else len(buffer) - 1
+        counted_end = self._counted_end
+        for pattern in (self.PAGE, self.COUNT):
+            for match in pattern.finditer(buffer):
+                end = start + match.end()
+                if match.end() > limit or end <= self._counted_end:
+                    continue
+                if pattern is self.PAGE:
+                    self.pages += 1
+                else:
+                    self.max_count = max(self.max_count, int(match.group(1)))
+                counted_end = max(counted_end, end)
+        self._counted_end = counted_end
+
+    def feed(self, data: bytes) -> None:
+        buffer = self._tail + data
+        self._scan(buffer, self._tail_start, final=False)
+        keep = min(len(buffer), self.OVERLAP)
+        self._tail_start += len(buffer) - keep
+        self._tail = buffer[-keep:] if keep else b''
+
+    def finish(self) -> None:
+        self._scan(self._tail, self._tail_start, final=True)
+        self._tail = b''
+
+    @property
+    def page_count(self) -> int:
+        return self.pages or self.max_count
+
+
+class _HashState:
+    def __init__(self):
+        self.offset = 0
+        self.hasher = hashlib.sha256()
+        self.pages = PdfPageCounter()
+
+    def update(self, block: bytes, is_pdf: bool) -> None:
+        self.hasher.update(block)
+        if is_pdf:
+            self.pages.feed(block)
+        self.offset += len(block)
+
+    def copy(self) -> '_HashState':
+        state = _HashState()
+        state.offset = self.offset
+        state.hasher = self.hasher.copy()
+        state.pages = copy.copy(self.pages)
+        return state
+
+
+def _pwrite(fd: int, data: bytes, offset: int) -> None:
+    if hasattr(os, 'pwrite'):
+        while data:
+            written = os.pwrite(fd, data, offset)
+            data = data[written:]
+            offset += written
+    else:
+        os.lseek(fd, offset, os.SEEK_SET)
+        os.write(fd, data)
+
+
+class ChunkedUploadManager:
+    """
+    Resumable uploads: init, upload chunk N (in any order, retried freely), complete.
+
+    Each chunk is written with an offset write straight into a preallocated
+    part file inside the upload storage's scratch directory, so completing
+    the upload moves the file into the blob store with a rename instead of
+    copying it. The sha256 digest and the PDF page-count preflight advance
+    over the contiguous prefix of received chunks as they arrive: a chunk
+    that extends the prefix is hashed from memory while it is written. The
+    hash state lives in process memory; when another worker handled some
+    chunks, only the bytes this process hasn't hashed yet are read back
+    from the part file.
+    """
+
+    def __init__(self, options: Optional[Dict[str, Any]] = None):
+        self._options = options
+        self._states: 'OrderedDict[str, _HashState]' = OrderedDict()
+        self._states_lock = threading.Lock()
+
+    @property
+    def options(self) -> Dict[str, Any]:
+        config = dict(DEFAULT_CHUNKED_UPLOAD)
+        config.update(self._options if self._options is not None else getattr(settings, 'CHUNKED_UPLOAD', {}))
+        return config
+
+    @property
+    def storage(self):
+        from ..storage import upload_storage
+        return upload_storage
+
+    def part_path(self, upload) -> str:
+        return os.path.join(self.storage.temp_dir(), f'{upload.id}.part')
+
+    def start(self, session_id: str, filename: str, total_size: int, file_type: str = '',
+              chunk_size: Optional[int] = None):
+        """Validate the declared file and create the upload with a preallocated part file"""
+        from ..models import ChunkedUpload
+
+        options = self.options
+        filename = os.path.basename(filename or '')
+        extension = os.path.splitext(filename)[1].lower()
+        if not filename or extension not in SUPPORTED_EXTENSIONS:
+            raise ChunkedUploadError(f'Unsupported file type: {extension or filename}')
+        if total_size <= 0:
+            raise ChunkedUploadError('File size must be positive')
+        if total_size > options['max_size']:
+            raise ChunkedUploadError(f"File exceeds the {options['max_size']} byte limit", status_code=413)
+
+        chunk_size = chunk_size or options['chunk_size']
+        chunk_size = max(options['min_chunk_size'], min(options['max_chunk_size'], chunk_size))
+
+        upload = ChunkedUpload(
+            session_id=session_id, filename=filename, file_type=file_type or '',
+            total_size=total_size, chunk_size=chunk_size
+        )
+        with open(self.part_path(upload), 'wb') as f:
+            f.truncate(total_size)
+        upload.save()
+        logger.info(f"Started chunked upload {upload.id} for {filename}: {total_size} bytes "
+                    f"in {upload.total_chunks} chunks")
+        return upload
+
+    def write_chunk(self, upload, index: int, stream):
+        """Write one chunk at its offset from a readable stream and advance the digest"""
+        from ..models import ChunkedUpload
+
+        if upload.status != 'uploading':
+            raise ChunkedUploadError(f'Upload is {upload.status}', status_code=409)
+        if not 0 <= index < upload.total_chunks:
+            raise ChunkedUploadError(f'Chunk index {index} out of range')
+
+        expected = upload.chunk_length(index)
+        offset = index * upload.chunk_size
+        # Hash the chunk on the way to disk when it continues this process's digest
+        prepared = self._prepared_state(upload, offset)
+        is_pdf = self._is_pdf(upload)
+        first_block = b''
+        written = 0
+        fd = os.open(self.part_path(upload), os.O_WRONLY | getattr(os, 'O_BINARY', 0))
+        try:
+            while True:
+                block = stream.read(min(READ_BLOCK, expected - written + 1))
+                if not block:
+                    break
+                if written + len(block) > expected:
+                    raise ChunkedUploadError(f'Chunk {index} is larger than {expected} bytes')
+                if not written:
+                    first_block = block
+                _pwrite(fd, block, offset + written)
+                if prepared is not None:
+                    prepared.update(block, is_pdf)
+                written += len(block)
+        finally:
+            os.close(fd)
+
+        if written != expected:
+            raise ChunkedUploadError(f'Chunk {index} is incomplete: got {written} of {expected} bytes')
+        if index == 0:
+            self._check_magic(upload, first_block)
+
+        with transaction.atomic():
+            upload = ChunkedUpload.objects.select_for_update().get(pk=upload.pk)
+            if index not in upload.received_chunks:
+                upload.received_chunks = upload.received_chunks + [index]
+            self._advance(upload, prepared, offset)
+            upload.save(update_fields=['received_chunks', 'hashed_offset', 'page_count', 'updated_at'])
+        self._check_pages(upload)
+        return upload
+
+    def complete(self, upload, expected_sha256: Optional[str] = None):
+        """Verify the upload, move it into the blob store and register the document"""
+        from ..models import ChunkedUpload
+
+        with transaction.atomic():
+            upload = ChunkedUpload.objects.select_for_update().get(pk=upload.pk)
+            if upload.status == 'complete' and upload.document_id:
+                return upload.document
+            if upload.status != 'uploading':
+                raise ChunkedUploadError(f'Upload is {upload.status}', status_code=409)
+            missing = upload.missing_chunks()
+            if missing:
+                raise ChunkedUploadError(f'Missing chunks: {missing[:20]}', status_code=409)
+
+            state = self._advance(upload)
+            state.pages.finish()
+            upload.page_count = state.pages.page_count if self._is_pdf(upload) else None
+            digest = state.hasher.hexdigest()
+            failure = self._pages_error(upload)
+            if not failure and expected_sha256 and expected_sha256.lower() != digest:
+                failure = ('Checksum mismatch: the file was corrupted in transit', 400)
+            if not failure:
+                document = self._register_document(upload, digest)
+
+        if failure:
+            # Recorded outside the transaction so the failed state is kept
+            self._fail(upload, failure[0])
+            raise ChunkedUploadError(*failure)
+
+        self._drop_state(upload)
+        logger.info(f"Completed chunked upload {upload.id} as document {document.id} ({digest[:12]})")
+        return document
+
+    def _register_document(self, upload, digest: str):
+        """Move the part file into the blob store and create its TaxFormDocument"""
+        from ..models import TaxFormDocument
+
+        document = TaxFormDocument(
+            session_id=upload.session_id,
+            original_filename=upload.filename,
+            file_type=upload.file_type
+        )
+        name = os.path.join('tax_documents', upload.session_id, f'{document.id}_{upload.filename}')
+        document.file.name = self.storage.adopt(name, self.part_path(upload), digest=digest)
+        document.save()
+
+        upload.sha256 = digest
+        upload.status = 'complete'
+        upload.document = document
+        upload.save()
+        return document
+
+    def abort(self, upload) -> None:
+        self._fail(upload, 'Aborted by client')
+
+    def _fail(self, upload, error: str) -> None:
+        upload.status = 'failed'
+        upload.error = error[:255]
+        upload.save(update_fields=['status', 'error', 'page_count', 'updated_at'])
+        try:
+            os.remove(self.part_path(upload))
+        except FileNotFoundError:
+            pass
+        self._drop_state(upload)
+
+    def _is_pdf(self, upload) -> bool:
+        return upload.filename.lower().endswith('.pdf')
+
+    def _check_magic(self, upload, data: bytes) -> None:
+        signatures = MAGIC_BYTES.get(os.path.splitext(upload.filename)[1].lower())
+        if signatures and not any(data.startswith(signature) for signature in signatures):
+            self._fail(upload, 'File content does not match its extension')
+            raise ChunkedUploadError('File content does not match its extension')
+
+    def _pages_error(self, upload):
+        max_pages = self.options['max_pages']
+        if max_pages and upload.page_count and upload.page_count > max_pages:
+            return (f'Document has more than {max_pages} pages', 413)
+        return None
+
+    def _check_pages(self, upload) -> None:
+        failure = self._pages_error(upload)
+        if failure:
+            self._fail(upload, failure[0])
+            raise ChunkedUploadError(*failure)
+
+    def _prepared_state(self, upload, offset: int) -> Optional[_HashState]:
+        """
+        A copy of this process's hash state if it ends exactly where a chunk
+        starts, for hashing the chunk while it is written; None otherwise
+        """
+        with self._states_lock:
+            state = self._states.get(str(upload.id))
+        if state is None:
+            return _HashState() if offset == 0 else None
+        return state.copy() if state.offset == offset else None
+
+    def _state(self, upload) -> _HashState:
+        """
+        Return this process's hash state for the upload, caught up with the
+        hashed prefix. Bytes other workers hashed since are read from disk,
+        starting where this process's state ends.
+        """
+        key = str(upload.id)
+        with self._states_lock:
+            state = self._states.pop(key, None)
+        if state is None or state.offset > upload.hashed_offset:
+            # No state here (or one ahead of an update that was rolled back)
+            state = _HashState()
+        self._feed(upload, state, upload.hashed_offset)
+        self._store_state(key, state)
+        return state
+
+    def _store_state(self, key: str, state: _HashState) -> None:
+        with self._states_lock:
+            self._states[key] = state
+            self._states.move_to_end(key)
+            while len(self._states) > MAX_HASH_STATES:
+                self._states.popitem(last=False)
+
+    def _drop_state(self, upload) -> None:
+        with self._states_lock:
+            self._states.pop(str(upload.id), None)
+
+    def _feed(self, upload, state: _HashState, until: int) -> None:
+        """Hash the part file from state.offset up to ``until``"""
+        if until <= state.offset:
+            return
+        is_pdf = self._is_pdf(upload)
+        with open(self.part_path(upload), 'rb') as f:
+            f.seek(state.offset)
+            while state.offset < until:
+                block = f.read(min(READ_BLOCK * 16, until - state.offset))
+                if not block:
+                    break
+                state.update(block, is_pdf)
+
+    def _advance(self, upload, prepared: Optional[_HashState] = None, prepared_from: int = 0) -> _HashState:
+        """
+        Extend the digest over every newly contiguous chunk (row lock must be
+        held). ``prepared`` is a state that already hashed the chunk starting
+        at ``prepared_from``; it is used when that chunk is the next one.
+        """
+        state = self._state(upload)
+        if prepared is not None and state.offset == prepared_from and prepared.offset > state.offset:
+            state = prepared
+            self._store_state(str(upload.id), state)
+        received = set(upload.received_chunks)
+        index = upload.hashed_offset // upload.chunk_size
+        while index in received and index < upload.total_chunks:
+            index += 1
+        until = min(upload.total_size, index * upload.chunk_size)
+        self._feed(upload, state, until)
+        upload.hashed_offset = state.offset
+        if self._is_pdf(upload):
+            upload.page_count = state.pages.page_count
+        return state
+
+# Create a singleton instance
+chunked_upload_manager = ChunkedUploadManager()
@@ -1,16 +1,30 @@
 import os
 import google.generativeai as genai # type: ignore
 from django.conf import settings # type: ignore
-import pytesseract # type: ignore
 from pdf2image import convert_from_path # type: ignore
 from django.core.files.storage import default_storage # type: ignore
+from django.db import transaction # type: ignore
 import shutil
 import uuid
 from django.utils import timezone # type: ignore
 import json
+import time
 import logging
-from typing import Dict, Any, List
+import threading
+from typing import Dict, Any, List, Optional, Callable
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from PIL import Image, ImageOps # type: ignore
 from .analysis_service import analyze_document
+from .response_cache import response_cache
+from .prompt_builder import PromptBuilder, merge_analyses
+from .llm_client import LLMClient, LLMError, CircuitBreaker
+from .keyword_classifier import keyword_classifier
+from .image_preprocessing import ImagePreprocessor
+from .ocr_engines import get_ocr_engine
+from .layout_extraction import layout_extractor
+from .page_dedupe import PageDeduplicator
+from .streaming_extractors import iter_docx_lines, iter_excel_lines, can_stream_excel, join_lines
+from .session_index import get_session_index
 
 # Handle optional dependencies with try-except blocks
 try:
@@ -37,31 +51,98 @@ except ImportError:
 
 logger = logging.getLogger(__name__)
 
+# Receives (event name, event data) while a document is being processed
+ProgressCallback = Optional[Callable[[str, Dict[str, Any]], None]]
+# Receives (page number, PIL image) for every page rasterized for OCR
+PageCallback = Optional[Callable[[int, Image.Image], None]]
+
+
+def notify(progress: ProgressCallback, event: str, **data) -> None:
+    """Report a processing stage; a failing listener never breaks processing"""
+    if progress is None:
+        return
+    try:
+        progress(event, data)
+    except Exception as e:
+        logger.error(f"Error reporting progress '{event}': {str(e)}")
+
 class DocumentProcessor:
-    def __init__(self):
-        api_key = os.getenv('GEMINI_API_KEY')
-        if not api_key:
-            raise ValueError("Gemini API key not found")
-        
-        genai.configure(api_key=api_key)
+    def __init__(self, model=None):
+        """model replaces the Gemini model (e.g. a stub in the pipeline benchmark)"""
         # Update to use gemini-1.5-flash model
-        self.model = genai.GenerativeModel('gemini-1.5-flash')
+        self.model_name = 'gemini-1.5-flash'
+        if model is None:
+            api_key = os.getenv('GEMINI_API_KEY')
+            if not api_key:
+                raise ValueError("Gemini API key not found")
+
+            genai.configure(api_key=api_key)
+            model = genai.GenerativeModel(self.model_name)
+        self.model = model
+        self.llm = LLMClient(self.model)
+        self.response_cache = response_cache
+        self.prompt_builder = PromptBuilder()
+        self.classifier = keyword_classifier
+        self.preprocessor = ImagePreprocessor()
+        self.layout = layout_extractor
         self.upload_dir = os.path.join(settings.MEDIA_ROOT, 'tax_documents')
         os.makedirs(self.upload_dir, exist_ok=True)
 
-    def extract_text_from_document(self, file_path: str) -> str:
-        """Extract text from document using appropriate method based on file type"""
+    def warm_up(self) -> None:
+        """
+        Pay the one-off costs before the first request does: build the OCR
+        engine (Tesseract language data, tesserocr API pool) and run a blank
+        page through OpenCV preprocessing and the OCR call a real page gets
+        (word boxes and row extraction with layout OCR, plain text
+        otherwise). Failures are logged; OCR is retried on first use anyway.
+        """
+        start = time.perf_counter()
+        try:
+            blank = Image.new('L', (200, 60), 255)
+            if self.layout.enabled:
+                self._ocr_image_layout(blank)
+            else:
+                self._ocr_image(blank)
+        except Exception as e:
+            logger.warning(f"OCR warm-up failed: {str(e)}")
+        logger.info(f"Document processor warmed up in {round((time.perf_counter() - start) * 1000, 2)}ms")
+
+    def extract_text_with_stats(self, file_path: str, session_id: str = None, progress: ProgressCallback = None,
+                                on_page: PageCallback = None, rows: List[Dict[str, Any]] = None):
+        """
+        Extract text and return it with extraction statistics. Pages already
+        OCRed earlier in the session are not OCRed again.
+        """
+        stats = {'pages': 0, 'duplicate_pages_skipped': 0}
+        text = self.extract_text_from_document(file_path, session_id=session_id, stats=stats, progress=progress,
+                                               on_page=on_page, rows=rows)
+        if rows is not None:
+            stats['layout_rows'] = len(rows)
+        return text, stats
+
+    def extract_text_from_document(self, file_path: str, session_id: str = None, stats: Dict[str, int] = None,
+                                   progress: ProgressCallback = None, on_page: PageCallback = None,
+                                   rows: List[Dict[str, Any]] = None) -> str:
+        """
+        Extract text from document using appropriate method based on file type.
+        progress, if given, is called with ('page', {...}) after every OCRed page;
+        on_page receives (page number, image) for every rasterized page, so other
+        consumers (previews) can reuse the rasterization. With layout OCR enabled,
+        the (label, amount, confidence) rows of every OCRed page are appended
+        to rows; it stays untouched for documents that aren't OCRed.
+        """
         try:
             file_extension = os.path.splitext(file_path)[1].lower()
             
             if file_extension == '.pdf':
                 try:
                     # Convert PDF to images
-                    images = convert_from_path(file_path)
+                    images = self._rasterize_pdf(file_path)
+                    dedupe = self._page_deduplicator(session_id)
                     text = ""
-                    for image in images:
+                    for number, image in enumerate(images, start=1):
                         # Extract text from each page
-                        text += pytesseract.image_to_string(image)
+                        text += self._ocr_page(image, dedupe, stats, progress, number, len(images), on_page, rows)
                     return text if text.strip() else "No text could be extracted from PDF"
                 except Exception as e:
                     logger.error(f"Error processing PDF: {str(e)}")
@@ -69,14 +150,26 @@ class DocumentProcessor:
                 
             elif file_extension in ['.jpg', '.jpeg', '.png']:
                 try:
-                    # Extract text from image
-                    text = pytesseract.image_to_string(file_path)
+                    # Extract text from image, honouring phone camera EXIF rotation
+                    with Image.open(file_path) as image:
+                        text = self._ocr_page(ImageOps.exif_transpose(image),
+                                              self._page_deduplicator(session_id), stats, progress, on_page=on_page,
+                                              rows=rows)
                     return text if text.strip() else "No text could be extracted from image"
                 except Exception as e:
                     logger.error(f"Error processing image: {str(e)}")
                     return "Error processing image document"
                 
-            elif file_extension in ['.doc', '.docx'] and DOCX_INSTALLED:
+            elif file_extension == '.docx':
+                try:
+                    # Stream paragraphs and table rows from the Word document
+                    text = join_lines(iter_docx_lines(file_path))
+                    return text if text.strip() else "No text could be extracted from Word document"
+                except Exception as e:
+                    logger.error(f"Error processing Word document: {str(e)}")
+                    return "Error processing Word document"
+
+            elif file_extension == '.doc' and DOCX_INSTALLED:
                 try:
                     # Extract text from Word document
                     doc = Document(file_path)
@@ -86,6 +179,15 @@ class DocumentProcessor:
                     logger.error(f"Error processing Word document: {str(e)}")
                     return "Error processing Word document"
                 
+            elif file_extension in ['.xls', '.xlsx'] and can_stream_excel(file_path):
+                try:
+                    # Stream rows from every sheet as compact tab-delimited lines
+                    text = join_lines(iter_excel_lines(file_path))
+                    return text if text.strip() else "No data found in Excel file"
+                except Exception as e:
+                    logger.error(f"Error processing Excel file: {str(e)}")
+                    return "Error processing Excel file"
+
             elif file_extension in ['.xls', '.xlsx'] and PANDAS_INSTALLED:
                 try:
                     # Extract text from Excel file
@@ -113,282 +215,111 @@ class DocumentProcessor:
             logger.error(f"Error extracting text: {str(e)}")
             return "Error extracting text from document"
 
-    def analyze_document(self, text: str) -> str:
-        """Analyze document text and return structured data"""
+    def _rasterize_pdf(self, file_path: str) -> List[Image.Image]:
+        return convert_from_path(file_path)
+
+    def _ocr_engine(self):
+        return get_ocr_engine()
+
+    def _page_deduplicator(self, session_id: str = None) -> PageDeduplicator:
+        """Dedupe against the whole session when known, otherwise within the document"""
+        return PageDeduplicator(os.path.join(self.upload_dir, session_id) if session_id else None)
+
+    def _ocr_page(self, image, dedupe: PageDeduplicator = None, stats: Dict[str, int] = None,
+                  progress: ProgressCallback = None, number: int = 1, pages: int = 1,
+                  on_page: PageCallback = None, rows: List[Dict[str, Any]] = None) -> str:
+        """OCR one rasterized page, reusing the text of an earlier duplicate page"""
+        if on_page is not None:
+            on_page(number, image)
+        text, duplicate = self._ocr_or_reuse_page(image, dedupe, stats, rows)
+        notify(progress, 'page', page=number, pages=pages, duplicate=duplicate)
+        return text
+
+    def _ocr_or_reuse_page(self, image, dedupe: PageDeduplicator = None, stats: Dict[str, int] = None,
+                           rows: List[Dict[str, Any]] = None):
+        if stats is not None:
+            stats['pages'] += 1
+
+        fingerprint = None
+        if dedupe is not None and dedupe.enabled:
+            try:
+                fingerprint = dedupe.fingerprint(image)
+                duplicate_text = dedupe.find(fingerprint)
+            except Exception as e:
+                logger.error(f"Error checking for duplicate page: {str(e)}")
+                fingerprint, duplicate_text = None, None
+            if duplicate_text is not None:
+                if stats is not None:
+                    stats['duplicate_pages_skipped'] += 1
+                if rows is not None and self.layout.enabled:
+                    rows.extend(self.layout.rows_from_text(duplicate_text))
+                return duplicate_text, True
+
+        if self.layout.enabled:
+            text, page_rows = self._ocr_image_layout(image)
+            if rows is not None:
+                # A page read as plain text still contributes its amounts
+                rows.extend(page_rows if page_rows is not None else self.layout.rows_from_text(text))
+        else:
+            text = self._ocr_image(image)
+        if fingerprint is not None:
+            dedupe.add(fingerprint, text)
+        return text, False
+
+    def _ocr_image(self, image) -> str:
+        """Run the OpenCV preprocessing stage on a page image, then Tesseract"""
+        prepared, report = self.preprocessor.process(image)
+
+        engine = self._ocr_engine()
+        ocr_start = time.perf_counter()
+        text = engine.image_to_string(prepared)
+        ocr_ms = round((time.perf_counter() - ocr_start) * 1000, 2)
+
+        stages = ', '.join(f"{step['step']}={step['ms']}ms" for step in report['steps'])
+        logger.info(
+            f"OCR page {report['original_size']} -> {report.get('final_size', report['original_size'])}: "
+            f"preprocessing {report['total_ms']}ms [{stages}], {engine.name} {ocr_ms}ms"
+        )
+        return text
+
+    def _ocr_image_layout(self, image):
+        """
+        OCR a page into word boxes and rebuild its rows (one Tesseract pass).
+        Falls back to plain text OCR if the engine can't report word boxes;
+        the rows are None then.
+        """
+        prepared, report = self.preprocessor.process(image)
+
+        engine = self._ocr_engine()
+        ocr_start = time.perf_counter()
         try:
-            # Process the text line by line
-            lines = text.split('\n')
-            income_items = []
-            deductions = []
-            total_income = 0
-
-            for line in lines:
-                line = line.strip()
-                if not line:
-                    continue
-
-                # Split the line into description and amount
-                parts = line.split()
-                if len(parts) < 2:
-                    continue
-
-                # Extract amount (last part of the line)
-                amount_str = parts[-1].replace(',', '')
-                try:
-                    amount = float(amount_str)
-                except ValueError:
-                    continue
-
-                # Get description (everything except the amount)
-                description = ' '.join(parts[:-1]).strip()
-                description_lower = description.lower()
-
-                # Handle capital gains first to ensure they're always categorized as Investment Income
-                if 'capital' in description_lower or 'gain' in description_lower:
-                    income_items.append({
-                        'category': 'Investment Income',
-                        'type': 'Capital Gains',
-                        'description': description,
-                        'amount': amount
-                    })
-                    total_income += amount
-                    continue
-
-                # Handle APIT deductions
-                if 'apit' in description_lower:
-                    deductions.append({
-                        'category': 'Employment Income',
-                        'type': 'APIT Deduction',
-                        'description': description,
-                        'amount': amount
-                    })
-                    continue
-
-                # Handle WHT deductions
-                if 'wht' in description_lower:
-                    deductions.append({
-                        'category': 'Other Income',
-                        'type': 'WHT Deduction',
-                        'description': description,
-                        'amount': amount
-                    })
-                    continue
-
-                # Process other income items
-                if 'primary income' in description_lower or 'primary salary' in description_lower:
-                    income_items.append({
-                        'category': 'Employment Income',
-                        'type': 'Primary Employment',
-                        'description': description,
-                        'amount': amount
-                    })
-                    total_income += amount
-                elif 'secondary income' in description_lower or 'secondary salary' in description_lower:
-                    income_items.append({
-                        'category': 'Employment Income',
-                        'type': 'Secondary Employment',
-                        'description': description,
-                        'amount': amount
-                    })
-                    total_income += amount
-                elif 'sole proprietorship' in description_lower:
-                    income_items.append({
-                        'category': 'Business Income',
-                        'type': 'Sole Proprietorship',
-                        'description': description,
-                        'amount': amount
-                    })
-                    total_income += amount
-                elif 'partnership' in description_lower:
-                    income_items.append({
-                        'category': 'Business Income',
-                        'type': 'Partnership',
-                        'description': description,
-                        'amount': amount
-                    })
-                    total_income += amount
-                elif 'trust' in description_lower or 'beneficiary' in description_lower:
-                    # Check if it's Samurdhi beneficiary (qualifying payment) vs regular trust beneficiary (business income)
-                    if 'samurdhi' in description_lower or 'samurthy' in description_lower:
-                        income_items.append({
-                            'category': 'Qualifying Payments',
-                            'type': 'Shop Setup for Samurdhi Beneficiary',
-                            'description': description,
-                            'amount': amount
-                        })
-                    else:
-                        # Regular trust beneficiary income
-                        income_items.append({
-                            'category': 'Business Income',
-                            'type': 'Trust Beneficiary',
-                            'description': description,
-                            'amount': amount
-                        })
-                        total_income += amount
-                elif 'betting' in description_lower or 'gaming' in description_lower:
-                    income_items.append({
-                        'category': 'Business Income',
-                        'type': 'Betting, Gaming, Liquor & Tobacco',
-                        'description': description,
-                        'amount': amount
-                    })
-                    total_income += amount
-                elif 'interest' in description_lower:
-                    income_items.append({
-                        'category': 'Investment Income',
-                        'type': 'Interest Income',
-                        'description': description,
-                        'amount': amount
-                    })
-                    total_income += amount
-                elif 'dividend' in description_lower:
-                    income_items.append({
-                        'category': 'Investment Income',
-                        'type': 'Dividend Income',
-                        'description': description,
-                        'amount': amount
-                    })
-                    total_income += amount
-                elif 'rent' in description_lower or 'rental' in description_lower:
-                    income_items.append({
-                        'category': 'Investment Income',
-                        'type': 'Rental Income',
-                        'description': description,
-                        'amount': amount
-                    })
-                    total_income += amount
-                elif 'service' in description_lower:
-                    income_items.append({
-                        'category': 'Other Income',
-                        'type': 'Service Income (WHT)',
-                        'description': description,
-                        'amount': amount
-                    })
-                    total_income += amount
-                elif 'royalty' in description_lower:
-                    income_items.append({
-                        'category': 'Other Income',
-                        'type': 'Royalty (WHT)',
-                        'description': description,
-                        'amount': amount
-                    })
-                    total_income += amount
-                elif 'natural resource' in description_lower:
-                    income_items.append({
-                        'category': 'Other Income',
-                        'type': 'Natural Resource Payment (WHT)',
-                        'description': description,
-                        'amount': amount
-                    })
-                    total_income += amount
-                elif 'gem' in description_lower or 'auction' in description_lower:
-                    income_items.append({
-                        'category': 'Other Income',
-                        'type': 'Auctioned Gem Sale (WHT)',
-                        'description': description,
-                        'amount': amount
-                    })
-                    total_income += amount
-                elif 'pension' in description_lower:
-                    # Check for commuted pension specifically
-                    if 'commuted' in description_lower or 'lump sum' in description_lower:
-                        income_items.append({
-                            'category': 'Terminal Benefits',
-                            'type': 'Commuted Pension',
-                            'description': description,
-                            'amount': amount
-                        })
-                    else:
-                        # Default to commuted pension for general pension terms
-                        income_items.append({
-                            'category': 'Terminal Benefits',
-                            'type': 'Commuted Pension',
-                            'description': description,
-                            'amount': amount
-                        })
-                    total_income += amount
-                elif 'gratuity' in description_lower or 'retiring' in description_lower:
-                    income_items.append({
-                        'category': 'Terminal Benefits',
-                        'type': 'Retiring Gratuity',
-                        'description': description,
-                        'amount': amount
-                    })
-                    total_income += amount
-                elif 'compensation' in description_lower or 'job loss' in description_lower or 'redundancy' in description_lower or 'severance' in description_lower:
-                    income_items.append({
-                        'category': 'Terminal Benefits',
-                        'type': 'Compensation for Job Loss',
-                        'description': description,
-                        'amount': amount
-                    })
-                    total_income += amount
-                elif 'etf' in description_lower or 'trust fund' in description_lower or 'employees trust' in description_lower:
-                    income_items.append({
-                        'category': 'Terminal Benefits',
-                        'type': 'ETF Payment',
-                        'description': description,
-                        'amount': amount
-                    })
-                    total_income += amount
-                elif 'terminal' in description_lower or 'end of service' in description_lower or 'retirement benefit' in description_lower:
-                    # Categorize as other terminal benefits
-                    income_items.append({
-                        'category': 'Terminal Benefits',
-                        'type': 'Other Terminal Benefits',
-                        'description': description,
-                        'amount': amount
-                    })
-                    total_income += amount
-                elif 'donation' in description_lower:
-                    income_items.append({
-                        'category': 'Qualifying Payments',
-                        'type': 'Donations',
-                        'description': description,
-                        'amount': amount
-                    })
-                elif 'solar' in description_lower:
-                    income_items.append({
-                        'category': 'Qualifying Payments',
-                        'type': 'Solar Panel Installation',
-                        'description': description,
-                        'amount': amount
-                    })
-                elif 'housing' in description_lower:
-                    income_items.append({
-                        'category': 'Qualifying Payments',
-                        'type': 'Low-Income Housing Construction',
-                        'description': description,
-                        'amount': amount
-                    })
-                else:
-                    # For any other income items, categorize based on context
-                    if 'income' in description_lower:
-                        income_items.append({
-                            'category': 'Other Income',
-                            'type': 'Other Income',
-                            'description': description,
-                            'amount': amount
-                        })
-                        total_income += amount
-
-            # Sort income items to ensure capital gains are properly categorized
-            sorted_income_items = []
-            capital_gains = [item for item in income_items if item['type'] == 'Capital Gains']
-            other_items = [item for item in income_items if item['type'] != 'Capital Gains']
-            sorted_income_items.extend(capital_gains)
-            sorted_income_items.extend(other_items)
-
-            # Create the analysis result
-            analysis = {
-                "document_type": "tax_document",
-                "confidence_score": 0.95,
-                "processing_time": 0,
-                "income_items": sorted_income_items,
-                "deductions": deductions,
-                "total_assessable_income": total_income - sum(d['amount'] for d in deductions)
-            }
-
+            words = engine.image_to_data(prepared)
+        except NotImplementedError:
+            return engine.image_to_string(prepared), None
+        except Exception as e:
+            logger.error(f"Error reading word boxes, using plain OCR: {str(e)}")
+            return engine.image_to_string(prepared), None
+        text, page_rows = self.layout.extract(words)
+        ocr_ms = round((time.perf_counter() - ocr_start) * 1000, 2)
+
+        logger.info(
+            f"Layout OCR page {report['original_size']}: preprocessing {report['total_ms']}ms, "
+            f"{engine.name} {ocr_ms}ms, {len(words)} words, {len(page_rows)} amount rows"
+        )
+        return text, page_rows
+
+    def analyze_document(self, text: str, rows: List[Dict[str, Any]] = None) -> str:
+        """
+        Analyze document text and return structured data. Rows from layout
+        OCR are classified directly instead of re-parsing the text.
+        """
+        try:
+            if rows:
+                entries = self.classifier.classify_rows(rows)
+            else:
+                # Categorize every "<description> <amount>" line in a single keyword scan
+                entries = self.classifier.classify_lines(text.split('\n'))
+            analysis = self.classifier.build_analysis(entries)
             return json.dumps(analysis)
 
         except Exception as e:
@@ -404,147 +335,132 @@ class DocumentProcessor:
             }
             return json.dumps(empty_analysis)
 
-    def analyze_document_with_gemini(self, text: str) -> str:
-        """Analyze document text using Gemini API for improved categorization"""
+    def analyze_document_with_gemini(self, text: str, force_refresh: bool = False,
+                                     progress: ProgressCallback = None, rows: List[Dict[str, Any]] = None) -> str:
+        """
+        Analyze document text using Gemini API for improved categorization.
+        The prompt carries only the lines with amounts (see PromptBuilder);
+        documents over the token budget are sent as several prompts in parallel
+        and the results merged in document order. Each prompt is served from
+        the response cache unless force_refresh is set. progress, if given,
+        receives the rule-based analysis ('rules') and every part's items as
+        soon as it arrives ('llm_partial'). When layout OCR rows were read
+        confidently and mostly classified, the rule-based result is returned
+        without calling Gemini.
+        """
         try:
             # First, extract basic information using the existing method
-            basic_analysis = self.analyze_document(text)
-            basic_data = json.loads(basic_analysis)
-            
-            # Prepare text for Gemini analysis
-            analysis_prompt = f"""
-            You are an expert tax consultant for Sri Lanka. Analyze the following document text and categorize income items and deductions accurately.
-
-            Document Text:
-            {text}
-
-            Current Analysis (to improve upon):
-            {json.dumps(basic_data, indent=2)}
-
-            Instructions:
-            1. Review the current categorization and improve it
-            2. Categorize income items into these categories:
-               - Employment Income (Primary Employment, Secondary Employment)
-               - Business Income (Sole Proprietorship, Partnership, Trust Beneficiary, Betting/Gaming)
-               - Investment Income (Interest Income, Dividend Income, Rental Income, Capital Gains)
-               - Other Income (Service Income, Royalty, Natural Resource Payment, Gem Sale)
-               - Terminal Benefits with specific subcategories:
-                 * Commuted Pension (lump sum received instead of regular pension)
-                 * Retiring Gratuity (one-time payment upon retirement)
-                 * Compensation for Job Loss (payment for loss of employment under uniform scheme)
-                 * ETF Payment (amount from Employees' Trust Fund at/after retirement)
-                 * Other Terminal Benefits (any other terminal benefits not listed above)
-               - Qualifying Payments (Donations, Solar Panel, Housing Construction)
-
-            3. For Terminal Benefits, use these specific keywords to categorize:
-               - "commuted", "pension", "lump sum pension" → Commuted Pension
-               - "gratuity", "retiring gratuity", "retirement gratuity" → Retiring Gratuity
-               - "compensation", "job loss", "redundancy", "severance" → Compensation for Job Loss
-               - "etf", "trust fund", "employees trust fund" → ETF Payment
-               - Any other terminal benefit terms → Other Terminal Benefits
-
-            4. For Qualifying Payments, use these specific keywords:
-               - "donation", "charity", "contribution" → Donations
-               - "samurdhi", "samurthy", "shop setup" → Shop Setup for Samurdhi Beneficiary
-               - "solar", "solar panel", "solar installation" → Solar Panel Installation
-               - "cinema", "film", "movie" → Film & Cinema Industry Expenditure
-               - "housing", "low income housing" → Low-Income Housing Construction
-               - Any other qualifying payment terms → Other Qualifying Payments
-
-            5. For Business Income, distinguish between:
-               - Regular trust beneficiary income (not Samurdhi) → Trust Beneficiary
-               - Samurdhi beneficiary items should be categorized as Qualifying Payments, not Business Income
-
-            6. Categorize deductions into:
-               - APIT (Advanced Personal Income Tax) - for Employment Income
-               - WHT (Withholding Tax) - for Other Income
-               - Other deductions
-
-            7. Return a JSON response with this exact structure:
-            {{
-                "document_type": "tax_document",
-                "confidence_score": 0.95,
-                "processing_time": 0,
-                "income_items": [
-                    {{
-                        "category": "category_name",
-                        "type": "specific_type",
-                        "description": "original_description",
-                        "amount": amount_value
-                    }}
-                ],
-                "deductions": [
-                    {{
-                        "category": "category_name",
-                        "type": "deduction_type",
-                        "description": "original_description",
-                        "amount": amount_value
-                    }}
-                ],
-                "total_assessable_income": total_value
-            }}
-
-            8. Ensure all amounts are numeric values
-            9. Maintain the original description text
-            10. Be more accurate than the current analysis
-            11. If unsure about categorization, use the most likely category based on Sri Lankan tax law
-            12. IMPORTANT: Return ONLY the JSON response, no additional text or explanations
-            """
-
-            try:
-                logger.info("Starting Gemini API analysis...")
-                # Use Gemini API for improved categorization
-                response = self.model.generate_content(analysis_prompt)
-                
-                if response and response.text:
-                    logger.info(f"Gemini API response received: {len(response.text)} characters")
-                    
-                    # Try to parse the JSON response
-                    try:
-                        # Clean the response text to extract only JSON
-                        response_text = response.text.strip()
-                        
-                        # Remove any markdown formatting if present
-                        if response_text.startswith('```json'):
-                            response_text = response_text[7:]
-                        if response_text.endswith('```'):
-                            response_text = response_text[:-3]
-                        response_text = response_text.strip()
-                        
-                        gemini_analysis = json.loads(response_text)
-                        
-                        # Validate the structure
-                        if (isinstance(gemini_analysis, dict) and 
-                            'income_items' in gemini_analysis and 
-                            'deductions' in gemini_analysis):
-                            
-                            # Calculate total assessable income
-                            total_income = sum(item.get('amount', 0) for item in gemini_analysis.get('income_items', []))
-                            total_deductions = sum(ded.get('amount', 0) for ded in gemini_analysis.get('deductions', []))
-                            gemini_analysis['total_assessable_income'] = total_income - total_deductions
-                            
-                            logger.info(f"Gemini analysis successful: {len(gemini_analysis.get('income_items', []))} income items, {len(gemini_analysis.get('deductions', []))} deductions")
-                            return json.dumps(gemini_analysis)
-                        else:
-                            logger.warning("Gemini response structure invalid, falling back to basic analysis")
-                            return basic_analysis
-                            
-                    except json.JSONDecodeError as e:
-                        logger.warning(f"Failed to parse Gemini JSON response: {e}, falling back to basic analysis")
-                        logger.debug(f"Raw Gemini response: {response.text}")
-                        return basic_analysis
-                else:
-                    logger.warning("No response from Gemini API, falling back to basic analysis")
+            basic_analysis = self.analyze_document(text, rows)
+            if progress is not None or rows:
+                parsed = json.loads(basic_analysis)
+                notify(progress, 'rules', analysis=parsed)
+                classified = len(parsed.get('income_items', [])) + len(parsed.get('deductions', []))
+                if rows and not force_refresh and self.layout.rules_suffice(rows, classified):
+                    logger.info(f"Rule engine classified {classified} of {len(rows)} layout rows, skipping Gemini")
                     return basic_analysis
-                    
-            except Exception as gemini_error:
-                logger.error(f"Gemini API error: {gemini_error}, falling back to basic analysis")
+
+            # Fail fast to the rule-based result while the API is known to be down
+            if self.llm.breaker.state == CircuitBreaker.OPEN:
+                logger.warning("Gemini circuit is open, using basic analysis")
+                return basic_analysis
+
+            prompts = self.prompt_builder.build(text)
+            options = self.prompt_builder.options
+            if len(prompts) > options['max_chunks']:
+                logger.warning(f"Document needs {len(prompts)} Gemini requests (limit {options['max_chunks']}), using basic analysis")
+                return basic_analysis
+
+            logger.info(f"Starting Gemini API analysis ({len(prompts)} prompt(s))...")
+            results: List[Optional[Dict[str, Any]]] = [None] * len(prompts)
+
+            def report(index: int) -> None:
+                result = results[index]
+                if result is not None:
+                    notify(progress, 'llm_partial', part=index + 1, parts=len(prompts),
+                           income_items=result.get('income_items', []), deductions=result.get('deductions', []))
+
+            if len(prompts) == 1:
+                results[0] = self._analyze_prompt(prompts[0], force_refresh)
+                report(0)
+            else:
+                with ThreadPoolExecutor(max_workers=min(options['max_workers'], len(prompts))) as executor:
+                    futures = {executor.submit(self._analyze_prompt, prompt, force_refresh): index
+                               for index, prompt in enumerate(prompts)}
+                    # Parts are reported as they finish; the merge below still uses document order
+                    for future in as_completed(futures):
+                        results[futures[future]] = future.result()
+                        report(futures[future])
+
+            if any(result is None for result in results):
+                logger.warning("Gemini analysis incomplete, falling back to basic analysis")
                 return basic_analysis
 
+            gemini_analysis = merge_analyses(results)
+            logger.info(f"Gemini analysis successful: {len(gemini_analysis['income_items'])} income items, {len(gemini_analysis['deductions'])} deductions")
+            return json.dumps(gemini_analysis)
+
         except Exception as e:
             logger.error(f"Error in Gemini-enhanced analysis: {str(e)}")
             # Fall back to basic analysis
-            return self.analyze_document(text)
+            return self.analyze_document(text, rows)
+
+    def _analyze_prompt(self, prompt: str, force_refresh: bool = False) -> Optional[Dict[str, Any]]:
+        """Run one analysis prompt (or serve it from the cache); None if the response is unusable"""
+        if not force_refresh:
+            cached_analysis = self.response_cache.get(self.model_name, prompt)
+            if cached_analysis is not None:
+                try:
+                    return json.loads(cached_analysis)
+                except json.JSONDecodeError:
+                    self.response_cache.invalidate(self.model_name, prompt)
+
+        try:
+            # Use Gemini API for improved categorization (deadline, retries, circuit breaker)
+            response = self.llm.generate_content(prompt)
+            if not (response and response.text):
+                logger.warning("No response from Gemini API")
+                return None
+
+            logger.info(f"Gemini API response received: {len(response.text)} characters")
+            try:
+                # Clean the response text to extract only JSON
+                response_text = response.text.strip()
+
+                # Remove any markdown formatting if present
+                if response_text.startswith('```json'):
+                    response_text = response_text[7:]
+                if response_text.endswith('```'):
+                    response_text = response_text[:-3]
+                response_text = response_text.strip()
+
+                gemini_analysis = json.loads(response_text)
+            except json.JSONDecodeError as e:
+                logger.warning(f"Failed to parse Gemini JSON response: {e}")
+                logger.debug(f"Raw Gemini response: {response.text}")
+                return None
+
+            # Validate the structure
+            if not (isinstance(gemini_analysis, dict) and
+                    'income_items' in gemini_analysis and
+                    'deductions' in gemini_analysis):
+                logger.warning("Gemini response structure invalid")
+                return None
+
+            usage = getattr(response, 'usage_metadata', None)
+            self.response_cache.set(
+                self.model_name,
+                prompt,
+                json.dumps(gemini_analysis),
+                tokens=getattr(usage, 'total_token_count', None)
+            )
+            return gemini_analysis
+
+        except LLMError as llm_error:
+            logger.warning(f"Gemini API unavailable: {llm_error}")
+            return None
+        except Exception as gemini_error:
+            logger.error(f"Gemini API error: {gemini_error}")
+            return None
 
     def cleanup_session_documents(self, session_id: str):
         """Clean up documents associated with a session"""
@@ -558,6 +474,31 @@ class DocumentProcessor:
             logger.error(f"Error cleaning up session documents: {str(e)}")
             raise
 
+    def _map_income_item(self, item):
+        """Return the EmploymentIncome field mapping for one income item, or None"""
+        if item.get('category') == 'Employment Income':
+            field_type = 'SALARY'
+        elif item.get('category') == 'Secondary Employment':
+            field_type = 'SECONDARY_SALARY'
+        else:
+            return None
+        return {
+            'type': field_type,
+            'amount': float(item.get('amount', 0)),
+            'description': item.get('description', '')
+        }
+
+    def _map_deduction(self, deduction):
+        """Return the EmploymentIncome field mapping for one deduction, or None"""
+        if deduction.get('type') != 'APIT':
+            return None
+        return {
+            'type': 'APIT',
+            'amount': float(deduction.get('amount', 0)),
+            'description': deduction.get('description', ''),
+            'source': deduction.get('source', 'Primary Employment')
+        }
+
     def map_context_to_form_fields(self, context_data):
         """Map extracted context to form fields"""
         try:
@@ -572,31 +513,16 @@ class DocumentProcessor:
             }
 
             # Process income items
-            if 'income_items' in context_data:
-                for item in context_data['income_items']:
-                    if item.get('category') == 'Employment Income':
-                        mappings['EmploymentIncome']['income_items'].append({
-                            'type': 'SALARY',
-                            'amount': float(item.get('amount', 0)),
-                            'description': item.get('description', '')
-                        })
-                    elif item.get('category') == 'Secondary Employment':
-                        mappings['EmploymentIncome']['income_items'].append({
-                            'type': 'SECONDARY_SALARY',
-                            'amount': float(item.get('amount', 0)),
-                            'description': item.get('description', '')
-                        })
+            for item in context_data.get('income_items', []):
+                mapping = self._map_income_item(item)
+                if mapping:
+                    mappings['EmploymentIncome']['income_items'].append(mapping)
 
             # Process deductions
-            if 'deductions' in context_data:
-                for deduction in context_data['deductions']:
-                    if deduction.get('type') == 'APIT':
-                        mappings['EmploymentIncome']['deductions'].append({
-                            'type': 'APIT',
-                            'amount': float(deduction.get('amount', 0)),
-                            'description': deduction.get('description', ''),
-                            'source': deduction.get('source', 'Primary Employment')
-                        })
+            for deduction in context_data.get('deductions', []):
+                mapping = self._map_deduction(deduction)
+                if mapping:
+                    mappings['EmploymentIncome']['deductions'].append(mapping)
 
             logger.info(f"Generated mappings: {mappings}")
             return mappings
@@ -611,52 +537,64 @@ class DocumentProcessor:
             }
 
     def process_and_store_context(self, document_id, extracted_data):
-        """Process extracted data and store context with form mappings"""
+        """
+        Process extracted data and store context with form mappings.
+
+        Contexts and mappings are built in memory and written with bulk_create
+        in a single transaction, so the number of queries does not grow with
+        the number of line items. Each mapping points at the context of the
+        item it was derived from. Re-processing a document replaces its
+        previous contexts.
+        """
+        from ..models import ExtractedContext, FormFieldMapping
+
         try:
-            # Store extracted contexts
             contexts = []
-            for item in extracted_data.get('income_items', []):
-                context = ExtractedContext.objects.create(
-                    document_id=document_id,
-                    context_type='income',
-                    original_text=item.get('original_text', ''),
-                    extracted_value=item.get('amount', 0),
-                    confidence_score=0.9
-                )
-                contexts.append(context)
-
-            for item in extracted_data.get('deductions', []):
-                context = ExtractedContext.objects.create(
-                    document_id=document_id,
-                    context_type='deduction',
-                    original_text=item.get('original_text', ''),
-                    extracted_value=item.get('amount', 0),
-                    confidence_score=0.9
-                )
-                contexts.append(context)
-
-            # Map contexts to form fields
-            mappings = self.map_context_to_form_fields(extracted_data)
-            
-            # Store form field mappings
-            for mapping in mappings.get('EmploymentIncome', {}).get('income_items', []):
-                FormFieldMapping.objects.create(
-                    context=contexts[0],
-                    form_type='EmploymentIncome',
-                    field_name=mapping['type'],
-                    field_path=f"EmploymentIncome.{mapping['type']}",
-                    confidence_score=0.9
-                )
-
-            for mapping in mappings.get('EmploymentIncome', {}).get('deductions', []):
-                FormFieldMapping.objects.create(
-                    context=contexts[1],
-                    form_type='EmploymentIncome',
-                    field_name=mapping['type'],
-                    field_path=f"EmploymentIncome.{mapping['type']}",
-                    confidence_score=0.9
-                )
-
+            pending_mappings = []  # (index into contexts, mapping)
+            sources = [
+                ('income', extracted_data.get('income_items', []), self._map_income_item),
+                ('deduction', extracted_data.get('deductions', []), self._map_deduction),
+            ]
+            for context_type, items, map_item in sources:
+                for item in items:
+                    contexts.append(ExtractedContext(
+                        document_id=document_id,
+                        context_type=context_type,
+                        original_text=item.get('original_text', ''),
+                        extracted_value=item.get('amount', 0),
+                        confidence_score=0.9
+                    ))
+                    mapping = map_item(item)
+                    if mapping:
+                        pending_mappings.append((len(contexts) - 1, mapping))
+
+            with transaction.atomic():
+                ExtractedContext.objects.filter(document_id=document_id).delete()
+                ExtractedContext.objects.bulk_create(contexts)
+
+                if contexts and contexts[0].pk is None:
+                    # Backends such as MySQL don't return primary keys from
+                    # bulk inserts; the document has no other contexts, so
+                    # the new rows come back in insertion order
+                    ids = ExtractedContext.objects.filter(
+                        document_id=document_id
+                    ).order_by('id').values_list('id', flat=True)
+                    for context, pk in zip(contexts, ids):
+                        context.pk = pk
+
+                FormFieldMapping.objects.bulk_create([
+                    FormFieldMapping(
+                        context=contexts[index],
+                        form_type='EmploymentIncome',
+                        field_name=mapping['type'],
+                        field_path=f"EmploymentIncome.{mapping['type']}",
+                        confidence_score=0.9
+                    )
+                    for index, mapping in pending_mappings
+                ])
+
+            logger.info(f"Stored {len(contexts)} contexts and {len(pending_mappings)} form field mappings "
+                        f"for document {document_id}")
             return True
             
         except Exception as e:
@@ -685,28 +623,11 @@ class DocumentProcessor:
             return None
 
     def maintain_session_documents(self, session_id, document_info):
-        """Store document info in session file for persistence"""
+        """Store document info in the session's append-only index for persistence"""
         try:
-            # Create session metadata file
-            session_meta_path = os.path.join(self.upload_dir, session_id, 'session_meta.json')
-            
-            # Read existing metadata
-            existing_docs = []
-            if os.path.exists(session_meta_path):
-                with open(session_meta_path, 'r') as f:
-                    try:
-                        existing_docs = json.load(f)
-                    except json.JSONDecodeError:
-                        existing_docs = []
-            
-            # Add new document
-            if document_info not in existing_docs:
-                existing_docs.append(document_info)
-                
-            # Write updated metadata
-            with open(session_meta_path, 'w') as f:
-                json.dump(existing_docs, f)
-                
+            session_dir = os.path.join(self.upload_dir, session_id)
+            index = get_session_index(session_dir, legacy_files=[os.path.join(session_dir, 'session_meta.json')])
+            index.add(document_info, replace=False)
             return True
         except Exception as e:
             logger.error(f"Error maintaining session documents: {str(e)}") # type: ignore
@@ -754,38 +675,22 @@ class TaxFormDocumentProcessor:
             logger.error(f"Error processing document: {str(e)}")
             return None
 
+    def _session_index(self, session_id):
+        session_dir = os.path.join(self.storage_path, session_id)
+        return get_session_index(session_dir, legacy_files=[os.path.join(session_dir, 'metadata.json')])
+
     def _store_session_metadata(self, session_id, doc_info):
-        """Store document metadata in session-specific file"""
+        """Store document metadata in the session's append-only index"""
         try:
-            metadata_file = os.path.join(self.storage_path, session_id, 'metadata.json')
-            
-            # Load existing metadata
-            existing_docs = []
-            if os.path.exists(metadata_file):
-                with open(metadata_file, 'r') as f:
-                    existing_docs = json.load(f)
-            
             # Add new document if not exists
-            if not any(d.get('doc_id') == doc_info['doc_id'] for d in existing_docs):
-                existing_docs.append(doc_info)
-            
-            # Write updated metadata
-            with open(metadata_file, 'w') as f:
-                json.dump(existing_docs, f, indent=2)
-                
+            self._session_index(session_id).add(doc_info, replace=False)
         except Exception as e:
             logger.error(f"Metadata storage error: {str(e)}") # type: ignore
 
     def get_session_documents(self, session_id):
         """Retrieve all documents for a session"""
         try:
-            metadata_file = os.path.join(self.storage_path, session_id, 'metadata.json')
-            if not os.path.exists(metadata_file):
-                return []
-            
-            # Read metadata file
-            with open(metadata_file, 'r') as f:
-                documents = json.load(f)
+            documents = self._session_index(session_id).all()
             
             # Verify files still exist
             valid_docs = []
@@ -799,16 +704,67 @@ class TaxFormDocumentProcessor:
             logger.error(f"Error retrieving session documents: {str(e)}") # type: ignore
             return []
 
+    def get_session_document(self, session_id, doc_id):
+        """Retrieve a single session document by id without scanning the session"""
+        try:
+            doc = self._session_index(session_id).get(doc_id)
+            if doc and os.path.exists(doc.get('path', '')):
+                return doc
+            return None
+        except Exception as e:
+            logger.error(f"Error retrieving session document: {str(e)}") # type: ignore
+            return None
+
+    def remove_session_document(self, session_id, doc_id):
+        """Drop a document from the session index"""
+        try:
+            self._session_index(session_id).remove(doc_id)
+            return True
+        except Exception as e:
+            logger.error(f"Error removing session document: {str(e)}") # type: ignore
+            return False
+
     def verify_document(self, doc_info):
         """Verify document exists and is accessible"""
         if not doc_info or 'absolute_path' not in doc_info:
             return False
         return os.path.exists(doc_info['absolute_path'])
 
+_processor = None
+_processor_pid = None
+_processor_lock = threading.Lock()
+
+
+def get_document_processor() -> DocumentProcessor:
+    """
+    Process-wide DocumentProcessor shared by all request threads. It holds no
+    per-request state, so building it once saves every request the Gemini
+    client setup and upload directory checks. Like the OCR engine, a worker
+    forked from a parent that already built one gets its own.
+    """
+    global _processor, _processor_pid
+    pid = os.getpid()
+    if _processor is None or _processor_pid != pid:
+        with _processor_lock:
+            if _processor is None or _processor_pid != pid:
+                _processor = DocumentProcessor()
+                _processor_pid = pid
+                logger.info(f"Document processor for process {pid} ready")
+    return _processor
+
+
+def warm_document_processor() -> None:
+    """Build and warm the shared processor at worker start; a failure is logged, not raised"""
+    try:
+        get_document_processor().warm_up()
+    except Exception as e:
+        logger.error(f"Error warming up document processor: {str(e)}")
+
+
 def process_document(file_path: str) -> Dict[str, Any]:
     """Process a document and return structured data"""
     try:
-        processor = DocumentProcessor()
+        processor = get_document_processor()
         extracted_text = processor.extract_text_from_document(file_path)
         analysis_result = processor.analyze_document_with_gemini(extracted_text)
         return json.loads(analysis_result)
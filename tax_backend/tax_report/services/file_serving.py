@@ -0,0 +1,195 @@
+import os
+import re
+import logging
+from typing import Dict, Any, Callable, Optional, Tuple
+from urllib.parse import quote
+from django.conf import settings # type: ignore
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse # type: ignore
+from django.utils.cache import get_conditional_response # type: ignore
+from django.utils.http import http_date, parse_http_date_safe, parse_etags # type: ignore
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+DEFAULT_FILE_SERVING = {
+    # None streams through Django; 'x-accel-redirect' (nginx) or 'x-sendfile'
+    # (Apache mod_xsendfile, lighttpd) hand the bytes to the web server
+    'offload': None,
+    # nginx "internal" location aliased to MEDIA_ROOT, used with x-accel-redirect
+    'accel_prefix': '/protected-media/',
+    'cache_control': 'private, no-cache',  # always revalidate; revalidation is a cheap 304
+}
+
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def file_info(storage, name: str) -> Dict[str, Any]:
+    """Digest, size, modification time and compression of a stored file in one lookup"""
+    if hasattr(storage, 'stat'):
+        return storage.stat(name)
+    return {'digest': None, 'size': storage.size(name), 'modified_time': storage.get_modified_time(name),
+            'compressed': False}
+
+
+def file_validators(storage, name: str, info: Optional[Dict[str, Any]] = None) -> Tuple[Optional[str], int, Any]:
+    """ETag, size and modification time of a stored file"""
+    info = info or file_info(storage, name)
+
+    modified = info['modified_time']
+    if info['digest']:
+        # The content hash identifies the bytes exactly: a strong validator
+        etag = f'"{info["digest"]}"'
+    else:
+        etag = f'W/"{info["size"]:x}-{int(modified.timestamp()):x}"'
+    return etag, info['size'], modified
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Inclusive (start, end) for a single "bytes=" range. Returns None when the
+    header should be ignored (missing, malformed or several ranges, which are
+    answered with the whole file) and (-1, -1) when it can't be satisfied.
+    """
+    match = RANGE_PATTERN.match(header.strip()) if header else None
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            return (-1, -1)
+        return (max(0, size - length), size - 1)
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or (last and int(last) < start):
+        return (-1, -1)
+    return (start, end)
+
+
+def _if_range_matches(request, etag: str, modified) -> bool:
+    """An If-Range that no longer matches means the client must get the whole new file"""
+    value = request.META.get('HTTP_IF_RANGE')
+    if not value:
+        return True
+    if value.startswith('"') or value.startswith('W/'):
+        # Only a strong, identical ETag may be combined with a partial response
+        return not etag.startswith('W/') and etag in parse_etags(value)
+    timestamp = parse_http_date_safe(value)
+    return timestamp is not None and int(modified.timestamp()) <= timestamp
+
+
+def _iter_range(path: str, start: int, length: int):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def _iter_stream(stream):
+    try:
+        for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+            yield chunk
+    finally:
+        stream.close()
+
+
+def serve_stored_file(request, field_file, content_type: str, filename: str,
+                      options: Optional[Dict[str, Any]] = None, attachment: bool = False,
+                      decompress: bool = False) -> HttpResponse:
+    """
+    Serve a FieldFile inline with conditional request and byte range support.
+
+    Responses carry an ETag (the content sha256 for blob-store files) and
+    Last-Modified, so If-None-Match / If-Modified-Since revalidation returns
+    304 without touching the file. A single "Range: bytes=" request is
+    answered with 206 (honouring If-Range); a PDF viewer fetching pages only
+    reads what it asks for. With ``offload`` configured the response only
+    names the file and the web server sends the bytes.
+
+    With ``decompress`` a compressed blob is decompressed while it is
+    streamed (no Range support) instead of being expanded to disk first.
+    """
+    storage, name = field_file.storage, field_file.name
+    info = file_info(storage, name)
+    etag, size, modified = file_validators(storage, name, info)
+    stream = None
+    if decompress and info.get('compressed'):
+        stream = lambda: storage.open_stream(name)
+    return serve_file(request, lambda: storage.path(name), content_type, filename,
+                      etag, size, modified, storage.location, options, stream=stream, attachment=attachment)
+
+
+def serve_file(request, resolve_path: Callable[[], str], content_type: str, filename: str,
+               etag: str, size: int, modified, root: str,
+               options: Optional[Dict[str, Any]] = None, cache_control: Optional[str] = None,
+               stream: Optional[Callable[[], Any]] = None, attachment: bool = False) -> HttpResponse:
+    """
+    Serve a local file under ``root`` given its validators. resolve_path is
+    only called once the request isn't answered by a 304. ``stream`` opens a
+    reader of the content for files that have no servable path (compressed
+    blobs); those are always sent whole, by Django.
+    """
+    config = dict(DEFAULT_FILE_SERVING)
+    config.update(options if options is not None else getattr(settings, 'FILE_SERVING', {}))
+    last_modified = int(modified.timestamp())
+
+    def decorate(response: HttpResponse) -> HttpResponse:
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        response['Cache-Control'] = cache_control or config['cache_control']
+        response['Accept-Ranges'] = 'bytes'
+        return response
+
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        return decorate(not_modified)
+
+    disposition = f'{"attachment" if attachment else "inline"}; filename="{filename}"'
+    if stream is not None:
+        response = StreamingHttpResponse(_iter_stream(stream()), content_type=content_type)
+        response['Content-Length'] = str(size)
+        response['Content-Disposition'] = disposition
+        decorate(response)
+        response['Accept-Ranges'] = 'none'
+        return response
+
+    path = resolve_path()
+
+    if config['offload']:
+        response = HttpResponse(content_type=content_type)
+        if config['offload'] == 'x-accel-redirect':
+            relative = os.path.relpath(path, root).replace(os.sep, '/')
+            response['X-Accel-Redirect'] = quote(config['accel_prefix'].rstrip('/') + '/' + relative)
+        else:
+            response['X-Sendfile'] = path
+        response['Content-Disposition'] = disposition
+        # The web server handles Range itself for the file it sends
+        return decorate(response)
+
+    byte_range = parse_range(request.META.get('HTTP_RANGE', ''), size)
+    if byte_range is not None and _if_range_matches(request, etag, modified):
+        start, end = byte_range
+        if start < 0:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return decorate(response)
+
+        response = StreamingHttpResponse(_iter_range(path, start, end - start + 1),
+                                         status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = str(end - start + 1)
+        response['Content-Disposition'] = disposition
+        return decorate(response)
+
+    response = FileResponse(open(path, 'rb'), content_type=content_type)
+    response['Content-Length'] = str(size)
+    response['Content-Disposition'] = disposition
+    return decorate(response)
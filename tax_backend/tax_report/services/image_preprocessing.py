@@ -0,0 +1,150 @@
+import time
+import logging
+from typing import Dict, Any, Optional, Tuple
+from django.conf import settings # type: ignore
+from PIL import Image # type: ignore
+
+try:
+    import cv2 # type: ignore
+    import numpy as np # type: ignore
+    CV2_INSTALLED = True
+except ImportError:
+    CV2_INSTALLED = False
+    print("Warning: opencv-python not installed. OCR preprocessing will be disabled.")
+
+logger = logging.getLogger(__name__)
+
+# A4 long side in inches, used to infer the effective DPI of camera photos
+PAGE_LONG_SIDE_INCHES = 11.69
+
+DEFAULT_PREPROCESSING = {
+    'enabled': True,
+    'target_dpi': 300,
+    'downscale': True,
+    'grayscale': True,
+    'binarize': True,
+    'binarize_method': 'adaptive',  # 'adaptive' copes with uneven phone lighting, 'otsu' is faster
+    'deskew': True,
+    'max_skew_angle': 15.0,
+    'crop_margins': True,
+    'margin_padding': 10,
+}
+
+STEP_ORDER = ('downscale', 'grayscale', 'binarize', 'deskew', 'crop_margins')
+
+
+class ImagePreprocessor:
+    """
+    OpenCV pipeline that prepares page images for Tesseract.
+
+    Steps run in a fixed order and can each be switched off through the
+    OCR_PREPROCESSING setting. ``process`` returns the prepared image together
+    with a report holding the duration and image size before/after each step.
+    """
+
+    def __init__(self, options: Optional[Dict[str, Any]] = None):
+        config = dict(DEFAULT_PREPROCESSING)
+        config.update(options if options is not None else getattr(settings, 'OCR_PREPROCESSING', {}))
+        self.options = config
+
+    @property
+    def enabled(self) -> bool:
+        return CV2_INSTALLED and self.options['enabled']
+
+    @property
+    def target_dpi(self) -> int:
+        return self.options['target_dpi']
+
+    def process(self, image: Image.Image) -> Tuple[Image.Image, Dict[str, Any]]:
+        """Run the enabled steps on a PIL image and return (image, report)"""
+        report = {'steps': [], 'total_ms': 0.0, 'original_size': image.size}
+        if not self.enabled:
+            report['skipped'] = True
+            return image, report
+
+        start = time.perf_counter()
+        array = np.array(image.convert('RGB'))
+        for step in STEP_ORDER:
+            if not self.options.get(step):
+                continue
+            step_start = time.perf_counter()
+            size_before = (array.shape[1], array.shape[0])
+            array = getattr(self, f'_{step}')(array)
+            report['steps'].append({
+                'step': step,
+                'ms': round((time.perf_counter() - step_start) * 1000, 2),
+                'size_before': size_before,
+                'size_after': (array.shape[1], array.shape[0]),
+            })
+
+        report['total_ms'] = round((time.perf_counter() - start) * 1000, 2)
+        report['final_size'] = (array.shape[1], array.shape[0])
+        return Image.fromarray(array), report
+
+    def _gray(self, array):
+        if array.ndim == 3:
+            return cv2.cvtColor(array, cv2.COLOR_RGB2GRAY)
+        return array
+
+    def _downscale(self, array):
+        """Shrink oversize photos so the long side matches target_dpi on an A4 page"""
+        height, width = array.shape[:2]
+        max_side = int(self.target_dpi * PAGE_LONG_SIDE_INCHES)
+        long_side = max(height, width)
+        if long_side <= max_side:
+            return array
+        scale = max_side / long_side
+        return cv2.resize(array, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+
+    def _grayscale(self, array):
+        return self._gray(array)
+
+    def _binarize(self, array):
+        gray = self._gray(array)
+        if self.options['binarize_method'] == 'otsu':
+            blurred = cv2.GaussianBlur(gray, (5, 5), 0)
+            _, binary = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+            return binary
+        return cv2.adaptiveThreshold(
+            gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 31, 15
+        )
+
+    def _deskew(self, array):
+        """Rotate the page so text lines are horizontal"""
+        gray = self._gray(array)
+        # Text pixels are dark; invert so they become the foreground
+        _, inverted = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+        coords = cv2.findNonZero(inverted)
+        if coords is None:
+            return array
+
+        angle = cv2.minAreaRect(coords)[-1]
+        # minAreaRect reports angles in [0, 90); map to the smallest correction
+        if angle > 45:
+            angle -= 90
+        if abs(angle) < 0.1 or abs(angle) > self.options['max_skew_angle']:
+            return array
+
+        height, width = array.shape[:2]
+        matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+        return cv2.warpAffine(
+            array, matrix, (width, height),
+            flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE
+        )
+
+    def _crop_margins(self, array):
+        """Crop blank borders around the printed area"""
+        gray = self._gray(array)
+        _, inverted = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+        coords = cv2.findNonZero(inverted)
+        if coords is None:
+            return array
+
+        x, y, w, h = cv2.boundingRect(coords)
+        padding = self.options['margin_padding']
+        height, width = array.shape[:2]
+        top, bottom = max(0, y - padding), min(height, y + h + padding)
+        left, right = max(0, x - padding), min(width, x + w + padding)
+        if (bottom - top) < 16 or (right - left) < 16:
+            return array
+        return array[top:bottom, left:right]
@@ -0,0 +1,208 @@
+import re
+import logging
+from typing import Dict, Any, Iterable, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# Rules are evaluated in order: the first rule with a keyword found in the
+# description wins, exactly like the original if/elif chain. Keywords are
+# plain lower-case substrings. "overrides" are checked only once their parent
+# rule has matched (e.g. Samurdhi beneficiaries inside the trust rule).
+CLASSIFICATION_RULES = (
+    # Capital gains first so they are always categorized as Investment Income
+    {'keywords': ('capital', 'gain'), 'kind': 'income',
+     'category': 'Investment Income', 'type': 'Capital Gains', 'assessable': True},
+    {'keywords': ('apit',), 'kind': 'deduction',
+     'category': 'Employment Income', 'type': 'APIT Deduction', 'assessable': False},
+    {'keywords': ('wht',), 'kind': 'deduction',
+     'category': 'Other Income', 'type': 'WHT Deduction', 'assessable': False},
+    {'keywords': ('primary income', 'primary salary'), 'kind': 'income',
+     'category': 'Employment Income', 'type': 'Primary Employment', 'assessable': True},
+    {'keywords': ('secondary income', 'secondary salary'), 'kind': 'income',
+     'category': 'Employment Income', 'type': 'Secondary Employment', 'assessable': True},
+    {'keywords': ('sole proprietorship',), 'kind': 'income',
+     'category': 'Business Income', 'type': 'Sole Proprietorship', 'assessable': True},
+    {'keywords': ('partnership',), 'kind': 'income',
+     'category': 'Business Income', 'type': 'Partnership', 'assessable': True},
+    # Samurdhi beneficiary (qualifying payment) vs regular trust beneficiary (business income)
+    {'keywords': ('trust', 'beneficiary'), 'kind': 'income',
+     'category': 'Business Income', 'type': 'Trust Beneficiary', 'assessable': True,
+     'overrides': (
+         {'keywords': ('samurdhi', 'samurthy'), 'kind': 'income',
+          'category': 'Qualifying Payments', 'type': 'Shop Setup for Samurdhi Beneficiary',
+          'assessable': False},
+     )},
+    {'keywords': ('betting', 'gaming'), 'kind': 'income',
+     'category': 'Business Income', 'type': 'Betting, Gaming, Liquor & Tobacco', 'assessable': True},
+    {'keywords': ('interest',), 'kind': 'income',
+     'category': 'Investment Income', 'type': 'Interest Income', 'assessable': True},
+    {'keywords': ('dividend',), 'kind': 'income',
+     'category': 'Investment Income', 'type': 'Dividend Income', 'assessable': True},
+    {'keywords': ('rent', 'rental'), 'kind': 'income',
+     'category': 'Investment Income', 'type': 'Rental Income', 'assessable': True},
+    {'keywords': ('service',), 'kind': 'income',
+     'category': 'Other Income', 'type': 'Service Income (WHT)', 'assessable': True},
+    {'keywords': ('royalty',), 'kind': 'income',
+     'category': 'Other Income', 'type': 'Royalty (WHT)', 'assessable': True},
+    {'keywords': ('natural resource',), 'kind': 'income',
+     'category': 'Other Income', 'type': 'Natural Resource Payment (WHT)', 'assessable': True},
+    {'keywords': ('gem', 'auction'), 'kind': 'income',
+     'category': 'Other Income', 'type': 'Auctioned Gem Sale (WHT)', 'assessable': True},
+    # General pension terms default to commuted pension as well
+    {'keywords': ('pension',), 'kind': 'income',
+     'category': 'Terminal Benefits', 'type': 'Commuted Pension', 'assessable': True},
+    {'keywords': ('gratuity', 'retiring'), 'kind': 'income',
+     'category': 'Terminal Benefits', 'type': 'Retiring Gratuity', 'assessable': True},
+    {'keywords': ('compensation', 'job loss', 'redundancy', 'severance'), 'kind': 'income',
+     'category': 'Terminal Benefits', 'type': 'Compensation for Job Loss', 'assessable': True},
+    {'keywords': ('etf', 'trust fund', 'employees trust'), 'kind': 'income',
+     'category': 'Terminal Benefits', 'type': 'ETF Payment', 'assessable': True},
+    {'keywords': ('terminal', 'end of service', 'retirement benefit'), 'kind': 'income',
+     'category': 'Terminal Benefits', 'type': 'Other Terminal Benefits', 'assessable': True},
+    {'keywords': ('donation',), 'kind': 'income',
+     'category': 'Qualifying Payments', 'type': 'Donations', 'assessable': False},
+    {'keywords': ('solar',), 'kind': 'income',
+     'category': 'Qualifying Payments', 'type': 'Solar Panel Installation', 'assessable': False},
+    {'keywords': ('housing',), 'kind': 'income',
+     'category': 'Qualifying Payments', 'type': 'Low-Income Housing Construction', 'assessable': False},
+    # For any other income items, categorize based on context
+    {'keywords': ('income',), 'kind': 'income',
+     'category': 'Other Income', 'type': 'Other Income', 'assessable': True},
+)
+
+
+class KeywordMatcher:
+    """
+    Finds every keyword occurring in a text with one regex scan.
+
+    The pattern is a zero-width lookahead alternation (longest keyword first),
+    so it reports the longest keyword starting at each position. Each keyword
+    is expanded to all keywords contained in it, which yields exactly the set
+    of keywords that ``keyword in text`` would report, overlaps included.
+    """
+
+    def __init__(self, keywords: Iterable[str]):
+        self.keywords = sorted(set(keywords), key=lambda k: (-len(k), k))
+        self._pattern = re.compile(
+            '(?=(' + '|'.join(re.escape(keyword) for keyword in self.keywords) + '))'
+        ) if self.keywords else None
+        self._contained = {
+            keyword: frozenset(other for other in self.keywords if other in keyword)
+            for keyword in self.keywords
+        }
+
+    def find(self, text: str) -> Set[str]:
+        """Return the set of keywords found in the (already lower-cased) text"""
+        found = set()
+        if self._pattern is None:
+            return found
+        for match in self._pattern.finditer(text):
+            keyword = match.group(1)
+            if keyword not in found:
+                found.update(self._contained[keyword])
+        return found
+
+
+class KeywordClassifier:
+    """Categorizes statement lines against a rule table in a single scan per line"""
+
+    def __init__(self, rules=CLASSIFICATION_RULES):
+        self.rules = rules
+        keywords = set()
+        self._first_rule = {}
+        for index, rule in enumerate(rules):
+            for keyword in rule['keywords']:
+                keywords.add(keyword)
+                self._first_rule.setdefault(keyword, index)
+            for override in rule.get('overrides', ()):
+                keywords.update(override['keywords'])
+        self.matcher = KeywordMatcher(keywords)
+
+    def classify(self, description: str) -> Optional[Dict[str, Any]]:
+        """Return the winning rule for a line description, or None if nothing matches"""
+        found = self.matcher.find(description.lower())
+        if not found:
+            return None
+
+        rule_indexes = [self._first_rule[keyword] for keyword in found if keyword in self._first_rule]
+        if not rule_indexes:
+            return None
+
+        rule = self.rules[min(rule_indexes)]
+        for override in rule.get('overrides', ()):
+            if found.intersection(override['keywords']):
+                return override
+        return rule
+
+    def classify_lines(self, lines: Iterable[str]) -> List[Dict[str, Any]]:
+        """
+        Parse "<description> <amount>" lines and return classified entries.
+        Each entry carries the matched rule and the parsed description/amount.
+        """
+        entries = []
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+
+            # Split the line into description and amount (last part of the line)
+            parts = line.split()
+            if len(parts) < 2:
+                continue
+            try:
+                amount = float(parts[-1].replace(',', ''))
+            except ValueError:
+                continue
+
+            description = ' '.join(parts[:-1]).strip()
+            rule = self.classify(description)
+            if rule is not None:
+                entries.append({'rule': rule, 'description': description, 'amount': amount})
+        return entries
+
+    def classify_rows(self, rows: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Classify (label, amount, confidence) rows from layout OCR; no line parsing needed"""
+        entries = []
+        for row in rows:
+            rule = self.classify(row['label'])
+            if rule is not None:
+                entries.append({'rule': rule, 'description': row['label'], 'amount': row['amount'],
+                                'confidence': row.get('confidence')})
+        return entries
+
+    def build_analysis(self, entries: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+        """Turn classified entries into the analysis structure used by the views"""
+        income_items = []
+        deductions = []
+        total_income = 0
+
+        for entry in entries:
+            rule = entry['rule']
+            item = {
+                'category': rule['category'],
+                'type': rule['type'],
+                'description': entry['description'],
+                'amount': entry['amount']
+            }
+            if rule['kind'] == 'deduction':
+                deductions.append(item)
+                continue
+            income_items.append(item)
+            if rule['assessable']:
+                total_income += entry['amount']
+
+        # Sort income items to ensure capital gains are listed first
+        sorted_income_items = [item for item in income_items if item['type'] == 'Capital Gains']
+        sorted_income_items.extend(item for item in income_items if item['type'] != 'Capital Gains')
+
+        return {
+            "document_type": "tax_document",
+            "confidence_score": 0.95,
+            "processing_time": 0,
+            "income_items": sorted_income_items,
+            "deductions": deductions,
+            "total_assessable_income": total_income - sum(d['amount'] for d in deductions)
+        }
+
+# Create a singleton instance
+keyword_classifier = KeywordClassifier()
@@ -0,0 +1,165 @@
+import re
+import logging
+from statistics import median
+from typing import Dict, Any, List, Optional, Tuple
+from django.conf import settings # type: ignore
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LAYOUT_OCR = {
+    'enabled': True,  # OCR pages into word boxes and rebuild rows; False uses plain text OCR
+    'row_tolerance': 0.5,  # words whose centres are within this many word heights share a row
+    'column_gap': 1.5,  # a gap wider than this many word heights starts a new column
+    # A document is left to the rule engine (no Gemini call) when its rows
+    # were OCRed at least this confidently and this share of them was classified
+    'rules_min_confidence': 85.0,
+    'rules_min_coverage': 0.6,
+}
+
+# 1,234.56  1234  1,000/-  Rs.1,500.00  LKR 2,000
+AMOUNT_PATTERN = re.compile(r'^(?:rs\.?|lkr)?(\d{1,3}(?:,\d{3})+|\d+)(\.\d{1,2})?(?:/-)?$', re.IGNORECASE)
+
+
+def parse_amount(token: str) -> Optional[str]:
+    """The plain number in an amount token ("Rs.1,500.00" -> "1500.00"), or None"""
+    match = AMOUNT_PATTERN.match(token.strip())
+    if not match:
+        return None
+    return match.group(1).replace(',', '') + (match.group(2) or '')
+
+
+class LayoutExtractor:
+    """
+    Rebuilds table rows from OCR word boxes.
+
+    Words are grouped into rows by their vertical centre in one pass over
+    the page sorted top to bottom, so the two halves of a two-column payslip
+    that sit on the same line form one row. Within a row, wide horizontal
+    gaps separate columns. Every run of label words followed by amounts in
+    their own column becomes a (label, amount, confidence) row, using the
+    last amount of the run like the plain text parser did. Numbers inside a
+    label ("Salary for 12 months") stay part of the label.
+    """
+
+    def __init__(self, options: Optional[Dict[str, Any]] = None):
+        self._options = options
+
+    @property
+    def options(self) -> Dict[str, Any]:
+        config = dict(DEFAULT_LAYOUT_OCR)
+        config.update(self._options if self._options is not None else getattr(settings, 'LAYOUT_OCR', {}))
+        return config
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.options['enabled'])
+
+    @staticmethod
+    def _center(word: Dict[str, Any]) -> float:
+        return word['top'] + word['height'] / 2
+
+    def group_rows(self, words: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        """Words grouped into rows (top to bottom), each row ordered left to right"""
+        if not words:
+            return []
+        tolerance = self.options['row_tolerance'] * median(word['height'] for word in words)
+
+        rows: List[List[Dict[str, Any]]] = []
+        center = 0.0
+        for word in sorted(words, key=self._center):
+            word_center = self._center(word)
+            if rows and abs(word_center - center) <= tolerance:
+                rows[-1].append(word)
+                # Running mean, so a slightly skewed line still stays together
+                center += (word_center - center) / len(rows[-1])
+            else:
+                rows.append([word])
+                center = word_center
+        return [sorted(row, key=lambda word: word['left']) for row in rows]
+
+    def _column_break(self, previous: Dict[str, Any], word: Dict[str, Any]) -> bool:
+        gap = word['left'] - (previous['left'] + previous['width'])
+        return gap > self.options['column_gap'] * max(previous['height'], word['height'], 1)
+
+    def split_row(self, row: List[Dict[str, Any]]) -> Tuple[List[str], List[Dict[str, Any]]]:
+        """Text lines and (label, amount, confidence) rows for one layout row"""
+        lines: List[str] = []
+        entries: List[Dict[str, Any]] = []
+        label: List[Dict[str, Any]] = []
+        amounts: List[Tuple[Dict[str, Any], str]] = []
+
+        def flush() -> None:
+            if label and amounts:
+                last_word, amount = amounts[-1]
+                used = label + [last_word]
+                entries.append({
+                    'label': ' '.join(word['text'] for word in label),
+                    'amount': float(amount),
+                    'confidence': round(sum(word['conf'] for word in used) / len(used), 1),
+                })
+                lines.append(' '.join([entries[-1]['label']] + [value for _, value in amounts]))
+            elif label or amounts:
+                lines.append(' '.join([word['text'] for word in label] + [word['text'] for word, _ in amounts]))
+            label.clear()
+            amounts.clear()
+
+        for word in row:
+            amount = parse_amount(word['text'])
+            if amount is not None:
+                amounts.append((word, amount))
+                continue
+            if amounts:
+                if self._column_break(amounts[-1][0], word):
+                    flush()
+                else:
+                    # Numbers followed by more words in the same column belong to the label
+                    label.extend(amount_word for amount_word, _ in amounts)
+                    amounts.clear()
+            label.append(word)
+        flush()
+        return lines, entries
+
+    def extract(self, words: List[Dict[str, Any]]) -> Tuple[str, List[Dict[str, Any]]]:
+        """Page text rebuilt row by row, and the amount rows found on the page"""
+        lines: List[str] = []
+        entries: List[Dict[str, Any]] = []
+        for row in self.group_rows(words):
+            row_lines, row_entries = self.split_row(row)
+            lines.extend(row_lines)
+            entries.extend(row_entries)
+        return '\n'.join(lines) + '\n' if lines else '', entries
+
+    @staticmethod
+    def rows_from_text(text: str) -> List[Dict[str, Any]]:
+        """
+        Amount rows of text rendered by extract() (e.g. a page whose text was
+        reused from a duplicate), without a known confidence
+        """
+        entries = []
+        for line in text.split('\n'):
+            parts = line.split()
+            if len(parts) < 2 or parse_amount(parts[-1]) is None:
+                continue
+            # The label ends where the trailing run of amounts starts
+            end = len(parts) - 1
+            while end > 0 and parse_amount(parts[end - 1]) is not None:
+                end -= 1
+            if end == 0:
+                continue
+            entries.append({'label': ' '.join(parts[:end]), 'amount': float(parse_amount(parts[-1])),
+                            'confidence': None})
+        return entries
+
+    def rules_suffice(self, rows: List[Dict[str, Any]], classified: int) -> bool:
+        """Whether the rule engine's result is trustworthy enough to skip the LLM"""
+        if not rows or classified == 0:
+            return False
+        confidences = [row['confidence'] for row in rows]
+        if any(confidence is None for confidence in confidences):
+            return False
+        options = self.options
+        return (sum(confidences) / len(confidences) >= options['rules_min_confidence']
+                and classified / len(rows) >= options['rules_min_coverage'])
+
+# Create a singleton instance
+layout_extractor = LayoutExtractor()
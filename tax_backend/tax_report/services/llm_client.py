@@ -0,0 +1,326 @@
+import time
+import random
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Dict, Any, Optional, Callable
+from django.conf import settings # type: ignore
+
+try:
+    from google.api_core import exceptions as google_exceptions # type: ignore
+    RETRYABLE_GOOGLE_ERRORS = (
+        google_exceptions.TooManyRequests,
+        google_exceptions.ResourceExhausted,
+        google_exceptions.InternalServerError,
+        google_exceptions.ServiceUnavailable,
+        google_exceptions.DeadlineExceeded,
+    )
+except ImportError:
+    RETRYABLE_GOOGLE_ERRORS = ()
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LLM_CLIENT = {
+    'timeout': 30,  # seconds allowed for one attempt
+    'deadline': 60,  # seconds for the whole call, retries and backoff included
+    'max_concurrency': 4,  # in-flight requests per worker process, all models together
+    'acquire_timeout': 5,  # seconds to wait for a free slot before giving up
+    'max_retries': 2,
+    'backoff_base': 0.5,  # seconds; the n-th retry waits up to base * 2**n
+    'backoff_max': 8,
+    'failure_threshold': 5,  # consecutive failed calls that open the circuit
+    'reset_timeout': 30,  # seconds the circuit stays open before a trial call
+}
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class LLMError(Exception):
+    """A model call that did not produce a response"""
+
+
+class CircuitOpenError(LLMError):
+    """The circuit breaker is open; the call was not attempted"""
+
+
+class LLMTimeoutError(LLMError):
+    """An attempt or the overall deadline ran out"""
+
+
+class LLMBusyError(LLMError):
+    """No concurrency slot became free in time"""
+
+
+def is_retryable(error: Exception) -> bool:
+    """Rate limits, server errors, timeouts and dropped connections are worth retrying"""
+    if isinstance(error, (LLMTimeoutError, ConnectionError, TimeoutError)):
+        return True
+    if RETRYABLE_GOOGLE_ERRORS and isinstance(error, RETRYABLE_GOOGLE_ERRORS):
+        return True
+    code = getattr(error, 'code', None)
+    return isinstance(code, int) and code in RETRYABLE_STATUS_CODES
+
+
+class CircuitBreaker:
+    """
+    Opens after ``failure_threshold`` consecutive failures. While open every
+    call fails fast; after ``reset_timeout`` one trial call is let through
+    (half-open) and its outcome closes or re-opens the circuit.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30,
+                 clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and self.clock() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN and self.clock() - self._opened_at >= self.reset_timeout:
+                self._state = self.HALF_OPEN
+            if self._state == self.HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def release(self) -> None:
+        """Give up a trial call without an outcome"""
+        with self._lock:
+            self._trial_running = False
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info("LLM circuit closed")
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_running = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    logger.warning(f"LLM circuit opened after {self._failures} consecutive failures")
+                self._state = self.OPEN
+                self._opened_at = self.clock()
+
+
+class LLMMetrics:
+    """Call counters and a window of recent latencies"""
+
+    def __init__(self, window: int = 512):
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=window)
+        self.counters = {
+            'calls': 0, 'successes': 0, 'failures': 0, 'retries': 0,
+            'timeouts': 0, 'circuit_rejections': 0, 'busy_rejections': 0,
+        }
+
+    def increment(self, name: str) -> None:
+        with self._lock:
+            self.counters[name] += 1
+
+    def observe(self, seconds: float) -> None:
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            latencies = sorted(self._latencies)
+            counters = dict(self.counters)
+
+        def percentile(fraction: float) -> Optional[float]:
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(fraction * len(latencies)))] * 1000, 1)
+
+        counters['error_rate'] = round(counters['failures'] / counters['calls'], 3) if counters['calls'] else 0.0
+        counters['latency_ms'] = {
+            'samples': len(latencies),
+            'avg': round(sum(latencies) / len(latencies) * 1000, 1) if latencies else None,
+            'p50': percentile(0.5),
+            'p95': percentile(0.95),
+            'max': round(latencies[-1] * 1000, 1) if latencies else None,
+        }
+        return counters
+
+
+class ConcurrencyLimiter:
+    """
+    Process-wide cap on in-flight model requests. Attempts run on a small
+    thread pool so the caller can stop waiting at its deadline; the slot is
+    only released when the request really finishes, so abandoned requests
+    still count against the cap.
+    """
+
+    def __init__(self, max_concurrency: int):
+        self.max_concurrency = max(1, max_concurrency)
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix='llm')
+
+    def submit(self, fn: Callable, acquire_timeout: float):
+        if not self._slots.acquire(timeout=max(0.0, acquire_timeout)):
+            raise LLMBusyError(f"All {self.max_concurrency} LLM slots are busy")
+        try:
+            future = self._executor.submit(fn)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+
+class LLMClient:
+    """
+    Guarded wrapper around a model exposing ``generate_content``.
+
+    Every call gets a deadline, waits for a process-wide concurrency slot,
+    retries retryable errors with jittered exponential backoff and goes
+    through the circuit breaker of its service. Any model object with a
+    ``generate_content(prompt, **kwargs)`` method works, so tests can pass a
+    local fake in place of the Gemini model.
+    """
+
+    def __init__(self, model, service: str = 'gemini', options: Optional[Dict[str, Any]] = None,
+                 breaker: Optional[CircuitBreaker] = None, metrics: Optional[LLMMetrics] = None,
+                 limiter: Optional[ConcurrencyLimiter] = None,
+                 sleep: Callable[[float], None] = time.sleep, clock: Callable[[], float] = time.monotonic):
+        config = dict(DEFAULT_LLM_CLIENT)
+        config.update(options if options is not None else getattr(settings, 'LLM_CLIENT', {}))
+        self.options = config
+        self.model = model
+        self.service = service
+        self.breaker = breaker or get_circuit_breaker(service, config)
+        self.metrics = metrics or get_metrics(service)
+        self.limiter = limiter or get_limiter(config)
+        self.sleep = sleep
+        self.clock = clock
+
+    def _request_kwargs(self, kwargs: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+        # Let the Gemini SDK cancel the HTTP request itself at the attempt timeout
+        if hasattr(self.model, 'model_name') and 'request_options' not in kwargs:
+            return dict(kwargs, request_options={'timeout': timeout})
+        return kwargs
+
+    def _attempt(self, prompt, kwargs: Dict[str, Any], timeout: float):
+        future = self.limiter.submit(
+            lambda: self.model.generate_content(prompt, **self._request_kwargs(kwargs, timeout)),
+            min(self.options['acquire_timeout'], timeout)
+        )
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise LLMTimeoutError(f"{self.service} call exceeded {timeout:.1f}s")
+
+    def generate_content(self, prompt, **kwargs):
+        """Call the model; raises LLMError subclasses or the last model error"""
+        if not self.breaker.allow():
+            self.metrics.increment('circuit_rejections')
+            raise CircuitOpenError(f"{self.service} circuit is open")
+
+        self.metrics.increment('calls')
+        start = self.clock()
+        deadline = start + self.options['deadline']
+        attempt = 0
+        while True:
+            remaining = deadline - self.clock()
+            try:
+                if remaining <= 0:
+                    raise LLMTimeoutError(f"{self.service} deadline of {self.options['deadline']}s exceeded")
+                response = self._attempt(prompt, kwargs, min(self.options['timeout'], remaining))
+            except LLMBusyError:
+                # Local back-pressure says nothing about the service's health
+                self.breaker.release()
+                self.metrics.increment('busy_rejections')
+                self.metrics.increment('failures')
+                raise
+            except Exception as e:
+                retryable = is_retryable(e)
+                if isinstance(e, LLMTimeoutError):
+                    self.metrics.increment('timeouts')
+                backoff = random.uniform(0, min(self.options['backoff_max'],
+                                                self.options['backoff_base'] * 2 ** attempt))
+                if retryable and attempt < self.options['max_retries'] and self.clock() + backoff < deadline:
+                    attempt += 1
+                    self.metrics.increment('retries')
+                    logger.warning(f"{self.service} call failed ({str(e)}), retry {attempt} in {backoff:.2f}s")
+                    self.sleep(backoff)
+                    continue
+
+                self.metrics.increment('failures')
+                self.metrics.observe(self.clock() - start)
+                if retryable:
+                    self.breaker.record_failure()
+                else:
+                    # The service answered (bad request, blocked prompt): it is up
+                    self.breaker.record_success()
+                raise
+
+            self.breaker.record_success()
+            self.metrics.increment('successes')
+            self.metrics.observe(self.clock() - start)
+            return response
+
+
+_registry_lock = threading.Lock()
+_breakers: Dict[str, CircuitBreaker] = {}
+_metrics: Dict[str, LLMMetrics] = {}
+_limiter: Optional[ConcurrencyLimiter] = None
+
+
+def get_circuit_breaker(service: str, options: Dict[str, Any]) -> CircuitBreaker:
+    """One breaker per upstream service, shared by every client in the process"""
+    with _registry_lock:
+        if service not in _breakers:
+            _breakers[service] = CircuitBreaker(options['failure_threshold'], options['reset_timeout'])
+        return _breakers[service]
+
+
+def get_metrics(service: str) -> LLMMetrics:
+    with _registry_lock:
+        if service not in _metrics:
+            _metrics[service] = LLMMetrics()
+        return _metrics[service]
+
+
+def get_limiter(options: Dict[str, Any]) -> ConcurrencyLimiter:
+    """The process-wide concurrency limiter"""
+    global _limiter
+    with _registry_lock:
+        if _limiter is None:
+            _limiter = ConcurrencyLimiter(options['max_concurrency'])
+        return _limiter
+
+
+def llm_metrics() -> Dict[str, Any]:
+    """Metrics and circuit state for every service used by this process"""
+    with _registry_lock:
+        services = sorted(set(_metrics) | set(_breakers))
+    report = {}
+    for service in services:
+        snapshot = get_metrics(service).snapshot()
+        breaker = _breakers.get(service)
+        snapshot['circuit'] = breaker.state if breaker else CircuitBreaker.CLOSED
+        report[service] = snapshot
+    return report
@@ -0,0 +1,199 @@
+import os
+import queue
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional
+from django.conf import settings # type: ignore
+
+try:
+    import pytesseract # type: ignore
+    PYTESSERACT_INSTALLED = True
+except ImportError:
+    PYTESSERACT_INSTALLED = False
+
+# tesserocr binds the Tesseract C++ API directly, so one handle keeps the
+# language data loaded across pages instead of spawning a process per page
+try:
+    import tesserocr # type: ignore
+    TESSEROCR_INSTALLED = True
+except ImportError:
+    TESSEROCR_INSTALLED = False
+
+logger = logging.getLogger(__name__)
+
+TSV_COLUMNS = ('level', 'page_num', 'block_num', 'par_num', 'line_num', 'word_num',
+               'left', 'top', 'width', 'height', 'conf', 'text')
+WORD_LEVEL = 5
+
+DEFAULT_OCR_ENGINE = {
+    'backend': 'auto',  # 'auto' prefers the pooled engine when tesserocr is installed
+    'lang': 'eng',
+    'pool_size': 2,  # API handles per worker process (concurrent pages)
+    'tessdata_path': None,
+}
+
+
+def parse_tsv(tsv: str) -> List[Dict[str, Any]]:
+    """
+    Words (with their boxes and confidence) from Tesseract's TSV output,
+    with or without the header line
+    """
+    words = []
+    for line in tsv.splitlines():
+        fields = line.split('\t')
+        if len(fields) < len(TSV_COLUMNS) or fields[0] == 'level':
+            continue
+        try:
+            if int(fields[0]) != WORD_LEVEL:
+                continue
+            text = '\t'.join(fields[len(TSV_COLUMNS) - 1:]).strip()
+            conf = float(fields[10])
+        except ValueError:
+            continue
+        if not text or conf < 0:
+            continue
+        words.append({
+            'text': text,
+            'conf': conf,
+            'left': int(fields[6]),
+            'top': int(fields[7]),
+            'width': int(fields[8]),
+            'height': int(fields[9]),
+            'block': int(fields[2]),
+            'line': int(fields[4]),
+        })
+    return words
+
+
+class OCREngine:
+    """Interface shared by the OCR backends"""
+    name = 'base'
+
+    def image_to_string(self, image) -> str:
+        raise NotImplementedError
+
+    def image_to_data(self, image) -> List[Dict[str, Any]]:
+        """Recognized words with their bounding boxes and confidence (see parse_tsv)"""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class PytesseractEngine(OCREngine):
+    """Runs the tesseract CLI through pytesseract (one subprocess per page)"""
+    name = 'pytesseract'
+
+    def __init__(self, lang: str = 'eng'):
+        if not PYTESSERACT_INSTALLED:
+            raise RuntimeError("pytesseract is not installed")
+        self.lang = lang
+
+    def image_to_string(self, image) -> str:
+        return pytesseract.image_to_string(image, lang=self.lang)
+
+    def image_to_data(self, image) -> List[Dict[str, Any]]:
+        return parse_tsv(pytesseract.image_to_data(image, lang=self.lang))
+
+
+class TesserocrPoolEngine(OCREngine):
+    """
+    Pool of long-lived tesserocr API handles.
+
+    Handles are created lazily up to ``pool_size`` and reused for every page,
+    so the language model is loaded once per handle rather than once per page.
+    Threads borrow a handle for the duration of one page.
+    """
+    name = 'tesserocr'
+
+    def __init__(self, lang: str = 'eng', pool_size: int = 2, tessdata_path: Optional[str] = None):
+        if not TESSEROCR_INSTALLED:
+            raise RuntimeError("tesserocr is not installed")
+        self.lang = lang
+        self.pool_size = max(1, pool_size)
+        self.tessdata_path = tessdata_path
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._handles = []
+        # Fail fast (and let the caller fall back) if the language data can't be loaded
+        self._idle.put(self._create_handle())
+
+    def _create_handle(self):
+        kwargs = {'lang': self.lang}
+        if self.tessdata_path:
+            kwargs['path'] = self.tessdata_path
+        handle = tesserocr.PyTessBaseAPI(**kwargs)
+        self._handles.append(handle)
+        self._created += 1
+        return handle
+
+    @contextmanager
+    def _borrow(self):
+        try:
+            handle = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_create = self._created < self.pool_size
+                handle = self._create_handle() if can_create else None
+            if handle is None:
+                handle = self._idle.get()
+        try:
+            yield handle
+        finally:
+            handle.Clear()
+            self._idle.put(handle)
+
+    def image_to_string(self, image) -> str:
+        with self._borrow() as handle:
+            handle.SetImage(image)
+            return handle.GetUTF8Text()
+
+    def image_to_data(self, image) -> List[Dict[str, Any]]:
+        with self._borrow() as handle:
+            handle.SetImage(image)
+            return parse_tsv(handle.GetTSVText(0))
+
+    def close(self) -> None:
+        for handle in self._handles:
+            handle.End()
+        self._handles = []
+
+
+def create_ocr_engine(backend: Optional[str] = None, options: Optional[Dict[str, Any]] = None) -> OCREngine:
+    """Build an engine for a backend name, falling back to pytesseract if the pool can't start"""
+    config = dict(DEFAULT_OCR_ENGINE)
+    config.update(options if options is not None else getattr(settings, 'OCR_ENGINE', {}))
+    backend = backend or config['backend']
+
+    if backend in ('auto', 'tesserocr') and TESSEROCR_INSTALLED:
+        try:
+            return TesserocrPoolEngine(config['lang'], config['pool_size'], config['tessdata_path'])
+        except Exception as e:
+            logger.error(f"Could not start the tesserocr engine, using pytesseract: {str(e)}")
+    elif backend == 'tesserocr':
+        logger.warning("tesserocr is not installed, using pytesseract")
+
+    return PytesseractEngine(config['lang'])
+
+
+_engine = None
+_engine_pid = None
+_engine_lock = threading.Lock()
+
+
+def get_ocr_engine() -> OCREngine:
+    """
+    Process-wide OCR engine. API handles can't be shared across a fork, so
+    a worker forked from a parent that already built one gets its own.
+    """
+    global _engine, _engine_pid
+    pid = os.getpid()
+    if _engine is None or _engine_pid != pid:
+        with _engine_lock:
+            if _engine is None or _engine_pid != pid:
+                _engine = create_ocr_engine()
+                _engine_pid = pid
+                logger.info(f"OCR engine for process {pid}: {_engine.name}")
+    return _engine
@@ -0,0 +1,145 @@
+import os
+import hashlib
+import logging
+from typing import Dict, Any, List, Optional, Tuple
+from django.conf import settings # type: ignore
+from PIL import Image # type: ignore
+from .session_index import get_session_index
+
+try:
+    import imagehash # type: ignore
+    import numpy as np # type: ignore
+    IMAGEHASH_INSTALLED = True
+except ImportError:
+    IMAGEHASH_INSTALLED = False
+    print("Warning: ImageHash not installed. Duplicate page detection will be disabled.")
+
+logger = logging.getLogger(__name__)
+
+PAGES_INDEX_NAME = 'pages'
+
+DEFAULT_PAGE_DEDUPE = {
+    'enabled': True,
+    'hash_size': 16,  # 256-bit pHash
+    'max_distance': 8,  # Hamming distance for a candidate match
+    # Candidates are confirmed on binarized thumbnails: ink further than one
+    # pixel from any ink on the other page counts as a difference, and no tile
+    # may hold more than max_tile_mismatch of those. Re-renders, JPEG noise and
+    # DPI changes leave no such pixels, a changed digit does, so two payslips
+    # from the same template that differ only in their figures never match.
+    'verify_width': 1200,
+    'tile_size': 8,
+    'max_tile_mismatch': 0.02,  # at most one unexplained pixel per 8x8 tile
+}
+
+
+class PageFingerprint:
+    """Perceptual hash plus the thumbnail used to confirm a match"""
+
+    def __init__(self, phash: int, thumbnail):
+        self.phash = phash
+        self.thumbnail = thumbnail
+        self.key = f"{phash:x}-{hashlib.sha1(np.packbits(thumbnail).tobytes()).hexdigest()[:12]}"
+
+
+class PageDeduplicator:
+    """
+    Skips OCR for pages already seen in the same session.
+
+    Every rasterized page gets a perceptual hash. Earlier pages within
+    ``max_distance`` are candidates; a candidate is accepted only if its
+    binarized thumbnail matches the new page in every tile, and then its OCR
+    text is reused. With a session directory the fingerprints and text are
+    kept in the session's append-only index (thumbnails as small PNGs next to
+    it), so duplicates are found across documents; without one, only within
+    the current document.
+    """
+
+    def __init__(self, directory: Optional[str] = None, options: Optional[Dict[str, Any]] = None):
+        config = dict(DEFAULT_PAGE_DEDUPE)
+        config.update(options if options is not None else getattr(settings, 'PAGE_DEDUPE', {}))
+        self.options = config
+        self.directory = directory
+        self.index = get_session_index(directory, name=PAGES_INDEX_NAME) if directory else None
+        self._pages: Dict[str, Dict[str, Any]] = {}
+        self._thumbnails: Dict[str, Any] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return IMAGEHASH_INSTALLED and self.options['enabled']
+
+    def fingerprint(self, image: Image.Image) -> PageFingerprint:
+        phash = imagehash.phash(image, hash_size=self.options['hash_size'])
+        value = int(str(phash), 16)
+
+        width = self.options['verify_width']
+        gray = image.convert('L')
+        height = max(1, round(gray.height * width / gray.width))
+        small = np.asarray(gray.resize((width, height), Image.LANCZOS))
+        return PageFingerprint(value, small < min(200, small.mean()))
+
+    def _known_pages(self) -> List[Dict[str, Any]]:
+        if self.index is not None:
+            return self.index.all()
+        return list(self._pages.values())
+
+    def _thumbnail(self, key: str):
+        thumbnail = self._thumbnails.get(key)
+        if thumbnail is None and self.directory:
+            path = os.path.join(self.directory, f'page-{key}.png')
+            if os.path.exists(path):
+                with Image.open(path) as stored:
+                    thumbnail = np.asarray(stored.convert('L')) > 127
+                self._thumbnails[key] = thumbnail
+        return thumbnail
+
+    @staticmethod
+    def _dilate(mask):
+        """Grow ink by one pixel in each direction (3x3 neighbourhood)"""
+        grown = mask.copy()
+        grown[1:] |= mask[:-1]
+        grown[:-1] |= mask[1:]
+        wide = grown.copy()
+        wide[:, 1:] |= grown[:, :-1]
+        wide[:, :-1] |= grown[:, 1:]
+        return wide
+
+    def _same_page(self, a, b) -> bool:
+        if a is None or b is None or a.shape[1] != b.shape[1] or abs(a.shape[0] - b.shape[0]) > 1:
+            return False
+        rows = min(a.shape[0], b.shape[0])
+        a, b = a[:rows], b[:rows]
+        diff = (a & ~self._dilate(b)) | (b & ~self._dilate(a))
+        tile = self.options['tile_size']
+        rows, cols = (rows // tile) * tile, (diff.shape[1] // tile) * tile
+        tiles = diff[:rows, :cols].reshape(rows // tile, tile, cols // tile, tile).mean(axis=(1, 3))
+        return bool(tiles.max(initial=0.0) <= self.options['max_tile_mismatch'])
+
+    def find(self, fingerprint: PageFingerprint) -> Optional[str]:
+        """Return the OCR text of a matching earlier page, or None"""
+        candidates: List[Tuple[int, Dict[str, Any]]] = []
+        for page in self._known_pages():
+            distance = bin(int(page['phash'], 16) ^ fingerprint.phash).count('1')
+            if distance <= self.options['max_distance']:
+                candidates.append((distance, page))
+
+        for distance, page in sorted(candidates, key=lambda item: item[0]):
+            if page['id'] == fingerprint.key or self._same_page(self._thumbnail(page['id']), fingerprint.thumbnail):
+                logger.info(f"Page {fingerprint.key} duplicates {page['id']} (pHash distance {distance})")
+                return page['text']
+        return None
+
+    def add(self, fingerprint: PageFingerprint, text: str) -> None:
+        """Remember a page that was OCRed"""
+        record = {'id': fingerprint.key, 'phash': f'{fingerprint.phash:x}', 'text': text}
+        self._thumbnails[fingerprint.key] = fingerprint.thumbnail
+        if self.index is None:
+            self._pages[fingerprint.key] = record
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f'page-{fingerprint.key}.png')
+            Image.fromarray(np.where(fingerprint.thumbnail, 255, 0).astype('uint8')).convert('1').save(path)
+            self.index.add(record, replace=False)
+        except Exception as e:
+            logger.error(f"Error storing page fingerprint: {str(e)}")
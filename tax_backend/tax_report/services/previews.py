@@ -0,0 +1,138 @@
+import os
+import logging
+import tempfile
+from typing import Dict, Any, Callable, Optional
+from django.conf import settings # type: ignore
+from PIL import Image, ImageOps # type: ignore
+
+try:
+    from pdf2image import convert_from_path # type: ignore
+    PDF2IMAGE_INSTALLED = True
+except ImportError:
+    PDF2IMAGE_INSTALLED = False
+    print("Warning: pdf2image not installed. PDF previews will be disabled.")
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PREVIEWS = {
+    'sizes': {'small': 160, 'medium': 320, 'large': 640},  # width in pixels
+    'default_size': 'small',
+    'quality': 80,  # JPEG quality
+    'max_pages': 500,
+    'max_age': 365 * 24 * 60 * 60,  # previews of an upload never change
+    'render_on_upload': False,  # render the first page when a document is uploaded
+}
+
+PDF_EXTENSIONS = ('.pdf',)
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+PageWriter = Callable[[int, Image.Image], None]
+
+
+class PreviewService:
+    """
+    Page thumbnails for uploaded documents.
+
+    Every page is stored as ``p<page>-<size>.jpg`` in the storage's preview
+    directory for the upload, which sits next to its content-addressed blob,
+    so identical uploads share one set of previews. Pages are rendered when
+    first requested (PDFs straight at thumbnail resolution), and every page
+    rasterized for OCR is written at all sizes on the way through, so
+    analyzed documents never need a second rasterization.
+    """
+
+    def __init__(self, options: Optional[Dict[str, Any]] = None):
+        self._options = options
+
+    @property
+    def options(self) -> Dict[str, Any]:
+        config = dict(DEFAULT_PREVIEWS)
+        config.update(self._options if self._options is not None else getattr(settings, 'PREVIEWS', {}))
+        return config
+
+    @property
+    def sizes(self) -> Dict[str, int]:
+        return self.options['sizes']
+
+    @staticmethod
+    def supports(name: str) -> bool:
+        extension = os.path.splitext(name)[1].lower()
+        return extension in IMAGE_EXTENSIONS or (extension in PDF_EXTENSIONS and PDF2IMAGE_INSTALLED)
+
+    @staticmethod
+    def _filename(page: int, size: str) -> str:
+        return f'p{page}-{size}.jpg'
+
+    def save_page(self, directory: str, page: int, image: Image.Image) -> None:
+        """Write every missing size of a page from an already rasterized image"""
+        missing = [size for size in self.sizes
+                   if not os.path.exists(os.path.join(directory, self._filename(page, size)))]
+        if not missing:
+            return
+
+        os.makedirs(directory, exist_ok=True)
+        source = image.convert('RGB') if image.mode != 'RGB' else image
+        # Largest first, each size shrunk from the previous one
+        for size in sorted(missing, key=lambda size: -self.sizes[size]):
+            width = self.sizes[size]
+            if source.width > width:
+                source = source.resize((width, max(1, round(source.height * width / source.width))), Image.LANCZOS)
+            fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as out:
+                    source.save(out, 'JPEG', quality=self.options['quality'], optimize=True)
+                # Atomic, so a concurrent request never reads a half-written preview
+                os.replace(temp_path, os.path.join(directory, self._filename(page, size)))
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+
+    def page_writer(self, field_file) -> Optional[PageWriter]:
+        """Callback that stores previews of pages rasterized elsewhere (the OCR pass)"""
+        if not field_file or not field_file.name or not self.supports(field_file.name):
+            return None
+        directory = field_file.storage.preview_dir(field_file.name)
+
+        def write(page: int, image: Image.Image) -> None:
+            try:
+                self.save_page(directory, page, image)
+            except Exception as e:
+                logger.error(f"Error storing preview of page {page}: {str(e)}")
+        return write
+
+    def _rasterize(self, path: str, page: int) -> Optional[Image.Image]:
+        extension = os.path.splitext(path)[1].lower()
+        if extension in PDF_EXTENSIONS:
+            width = max(self.sizes.values())
+            images = convert_from_path(path, first_page=page, last_page=page, size=(width, None))
+            return images[0] if images else None
+        if page != 1:
+            return None
+        with Image.open(path) as image:
+            transposed = ImageOps.exif_transpose(image)
+            transposed.load()
+            return transposed
+
+    def get(self, field_file, page: int = 1, size: Optional[str] = None) -> Optional[str]:
+        """
+        Path of a page preview, rendering it on first use. None if the file
+        type has no previews or the page doesn't exist.
+        """
+        size = size or self.options['default_size']
+        if size not in self.sizes or not 1 <= page <= self.options['max_pages'] or not self.supports(field_file.name):
+            return None
+
+        directory = field_file.storage.preview_dir(field_file.name)
+        path = os.path.join(directory, self._filename(page, size))
+        if os.path.exists(path):
+            return path
+
+        image = self._rasterize(field_file.storage.path(field_file.name), page)
+        if image is None:
+            return None
+        self.save_page(directory, page, image)
+        logger.info(f"Rendered preview of {field_file.name} page {page}")
+        return path
+
+# Create a singleton instance
+preview_service = PreviewService()
@@ -0,0 +1,212 @@
+import re
+import json
+import logging
+from typing import Dict, Any, Iterable, List, Optional
+from django.conf import settings # type: ignore
+from .keyword_classifier import keyword_classifier
+from .response_cache import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_GEMINI_PROMPT = {
+    'max_prompt_tokens': 6000,  # estimated tokens per request, instructions included
+    'context_lines': 1,  # lines kept before and after every line with an amount
+    'max_chunks': 12,  # larger documents keep the rule-based analysis
+    'max_workers': 4,  # chunks sent to Gemini concurrently
+}
+
+# 1,234,567.89 or 1234.50; bare integers only count on lines the classifier recognises
+AMOUNT_PATTERN = re.compile(r'\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+\.\d{1,2}\b')
+DIGITS = re.compile(r'\d+')
+WHITESPACE = re.compile(r'\s+')
+
+PROMPT_TEMPLATE = """You are an expert tax consultant for Sri Lanka. Analyze the following document text and categorize income items and deductions accurately.
+{part}
+Document Text (only lines with amounts and their neighbours):
+{document}
+
+Current Analysis (to improve upon):
+{analysis}
+
+Instructions:
+1. Review the current categorization and improve it
+2. Categorize income items into these categories:
+   - Employment Income (Primary Employment, Secondary Employment)
+   - Business Income (Sole Proprietorship, Partnership, Trust Beneficiary, Betting/Gaming)
+   - Investment Income (Interest Income, Dividend Income, Rental Income, Capital Gains)
+   - Other Income (Service Income, Royalty, Natural Resource Payment, Gem Sale)
+   - Terminal Benefits with specific subcategories:
+     * Commuted Pension (lump sum received instead of regular pension)
+     * Retiring Gratuity (one-time payment upon retirement)
+     * Compensation for Job Loss (payment for loss of employment under uniform scheme)
+     * ETF Payment (amount from Employees' Trust Fund at/after retirement)
+     * Other Terminal Benefits (any other terminal benefits not listed above)
+   - Qualifying Payments (Donations, Solar Panel, Housing Construction)
+3. For Terminal Benefits, use these specific keywords to categorize:
+   - "commuted", "pension", "lump sum pension" → Commuted Pension
+   - "gratuity", "retiring gratuity", "retirement gratuity" → Retiring Gratuity
+   - "compensation", "job loss", "redundancy", "severance" → Compensation for Job Loss
+   - "etf", "trust fund", "employees trust fund" → ETF Payment
+   - Any other terminal benefit terms → Other Terminal Benefits
+4. For Qualifying Payments, use these specific keywords:
+   - "donation", "charity", "contribution" → Donations
+   - "samurdhi", "samurthy", "shop setup" → Shop Setup for Samurdhi Beneficiary
+   - "solar", "solar panel", "solar installation" → Solar Panel Installation
+   - "cinema", "film", "movie" → Film & Cinema Industry Expenditure
+   - "housing", "low income housing" → Low-Income Housing Construction
+   - Any other qualifying payment terms → Other Qualifying Payments
+5. For Business Income, distinguish between:
+   - Regular trust beneficiary income (not Samurdhi) → Trust Beneficiary
+   - Samurdhi beneficiary items should be categorized as Qualifying Payments, not Business Income
+6. Categorize deductions into:
+   - APIT (Advanced Personal Income Tax) - for Employment Income
+   - WHT (Withholding Tax) - for Other Income
+   - Other deductions
+7. Return a JSON response with this exact structure:
+{{"document_type":"tax_document","confidence_score":0.95,"processing_time":0,"income_items":[{{"category":"category_name","type":"specific_type","description":"original_description","amount":amount_value}}],"deductions":[{{"category":"category_name","type":"deduction_type","description":"original_description","amount":amount_value}}],"total_assessable_income":total_value}}
+8. Ensure all amounts are numeric values
+9. Maintain the original description text
+10. Be more accurate than the current analysis
+11. If unsure about categorization, use the most likely category based on Sri Lankan tax law
+12. IMPORTANT: Return ONLY the JSON response, no additional text or explanations
+"""
+
+PART_NOTE = "\nThis is part {index} of {count} of a longer document. Report only the items in this part.\n"
+
+
+def compact_json(data: Any) -> str:
+    """JSON without indentation or spaces after separators"""
+    return json.dumps(data, separators=(',', ':'), ensure_ascii=False)
+
+
+class PromptBuilder:
+    """
+    Builds token-budgeted Gemini prompts for a document.
+
+    Only lines carrying an amount are sent, with ``context_lines`` of their
+    neighbours for labels printed above or below the figure. Lines without an
+    amount that repeat (page headers and footers, ignoring digits such as page
+    numbers) are sent once. The rule-based analysis is attached as compact
+    JSON, restricted to the lines in each prompt. Documents that don't fit in
+    ``max_prompt_tokens`` are split on line boundaries into several prompts,
+    each carrying only its own part of the analysis.
+    """
+
+    def __init__(self, options: Optional[Dict[str, Any]] = None, classifier=None):
+        config = dict(DEFAULT_GEMINI_PROMPT)
+        config.update(options if options is not None else getattr(settings, 'GEMINI_PROMPT', {}))
+        self.options = config
+        self.classifier = classifier or keyword_classifier
+
+    def is_candidate(self, line: str) -> bool:
+        """Whether a line carries an amount worth sending"""
+        if AMOUNT_PATTERN.search(line):
+            return True
+        # "Gratuity 500000": the lines the rule-based analysis picks up
+        return bool(self.classifier.classify_lines([line]))
+
+    def select_lines(self, text: str) -> List[str]:
+        """Lines with amounts plus their context, in document order, headers deduplicated"""
+        lines = [WHITESPACE.sub(' ', line).strip() for line in text.split('\n')]
+        lines = [line for line in lines if line]
+        context = self.options['context_lines']
+
+        candidates = [self.is_candidate(line) for line in lines]
+        keep = [False] * len(lines)
+        for index, candidate in enumerate(candidates):
+            if candidate:
+                for neighbour in range(max(0, index - context), min(len(lines), index + context + 1)):
+                    keep[neighbour] = True
+
+        selected = []
+        seen = set()
+        for index, line in enumerate(lines):
+            if not keep[index]:
+                continue
+            if not candidates[index]:
+                signature = DIGITS.sub('#', line.lower())
+                if signature in seen:
+                    continue
+                seen.add(signature)
+            selected.append(line)
+        return selected
+
+    def analysis_for(self, lines: Iterable[str]) -> Dict[str, Any]:
+        """Rule-based items for the given lines, as sent to the model"""
+        analysis = self.classifier.build_analysis(self.classifier.classify_lines(lines))
+        return {'income_items': analysis['income_items'], 'deductions': analysis['deductions']}
+
+    def render(self, lines: List[str], index: int = 1, count: int = 1) -> str:
+        part = PART_NOTE.format(index=index, count=count) if count > 1 else ''
+        return PROMPT_TEMPLATE.format(
+            part=part,
+            document='\n'.join(lines),
+            analysis=compact_json(self.analysis_for(lines))
+        )
+
+    def _line_cost(self, line: str) -> int:
+        # The line itself plus the analysis items it contributes
+        items = self.analysis_for([line])
+        cost = estimate_tokens(line) + 1
+        for item in items['income_items'] + items['deductions']:
+            cost += estimate_tokens(compact_json(item)) + 1
+        return cost
+
+    def split(self, lines: List[str]) -> List[List[str]]:
+        """Pack lines greedily, in order, into chunks that each fit the budget"""
+        overhead = estimate_tokens(self.render([], 99, 99))
+        budget = max(1, self.options['max_prompt_tokens'] - overhead)
+
+        chunks: List[List[str]] = []
+        current: List[str] = []
+        used = 0
+        for line in lines:
+            cost = self._line_cost(line)
+            if cost > budget:
+                # A single runaway line (a flattened table) is cut to fit
+                line = line[:budget * 4]
+                cost = budget
+            if current and used + cost > budget:
+                chunks.append(current)
+                current, used = [], 0
+            current.append(line)
+            used += cost
+        if current:
+            chunks.append(current)
+        return chunks
+
+    def build(self, text: str) -> List[str]:
+        """Prompts for a document: one when it fits the budget, otherwise one per chunk"""
+        lines = self.select_lines(text)
+        chunks = self.split(lines) or [[]]
+        prompts = [self.render(chunk, index, len(chunks)) for index, chunk in enumerate(chunks, start=1)]
+        logger.info(
+            f"Prompt builder kept {len(lines)} of {text.count(chr(10)) + 1} lines: "
+            f"{len(prompts)} prompt(s), ~{sum(estimate_tokens(prompt) for prompt in prompts)} tokens"
+        )
+        return prompts
+
+
+def merge_analyses(analyses: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Combine per-chunk results in chunk order. Items keep their order within
+    each chunk and the total is recomputed from the merged items, so the same
+    chunk results always merge to the same analysis.
+    """
+    income_items: List[Dict[str, Any]] = []
+    deductions: List[Dict[str, Any]] = []
+    for analysis in analyses:
+        income_items.extend(analysis.get('income_items', []))
+        deductions.extend(analysis.get('deductions', []))
+
+    total_income = sum(item.get('amount', 0) for item in income_items)
+    total_deductions = sum(ded.get('amount', 0) for ded in deductions)
+    first = analyses[0] if analyses else {}
+    return {
+        "document_type": first.get('document_type', 'tax_document'),
+        "confidence_score": min((a.get('confidence_score', 0.95) for a in analyses), default=0.95),
+        "processing_time": first.get('processing_time', 0),
+        "income_items": income_items,
+        "deductions": deductions,
+        "total_assessable_income": total_income - total_deductions
+    }
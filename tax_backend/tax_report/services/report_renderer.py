@@ -0,0 +1,327 @@
+import re
+import zlib
+import logging
+import threading
+from typing import Dict, Any, List, Optional, Tuple
+from django.conf import settings # type: ignore
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REPORT_RENDERER = {
+    'page_size': (595, 842),  # A4 in points
+    'margin': 50,
+    'font_size': 10,
+    'title': 'Income Tax Report',
+    'footer': 'Computed from the submitted tax forms. Please verify all figures before filing.',
+    'compress': True,  # Flate-compress page content
+}
+
+# Widths (1/1000 em) of ASCII 32-126 in the standard Helvetica fonts (WinAnsiEncoding).
+# The base-14 fonts need no embedding, so these are all the font data a report needs.
+HELVETICA_WIDTHS = [
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+    1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+    333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+    556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584,
+]
+HELVETICA_BOLD_WIDTHS = [
+    278, 333, 474, 556, 556, 889, 722, 238, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 333, 333, 584, 584, 584, 611,
+    975, 722, 722, 722, 722, 667, 611, 778, 722, 278, 556, 722, 611, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 333, 278, 333, 584, 556,
+    333, 556, 611, 556, 611, 556, 333, 611, 611, 278, 278, 556, 278, 889, 611, 611,
+    611, 611, 389, 556, 333, 611, 556, 778, 556, 556, 500, 389, 280, 389, 584,
+]
+FONTS = {'F1': ('Helvetica', HELVETICA_WIDTHS), 'F2': ('Helvetica-Bold', HELVETICA_BOLD_WIDTHS)}
+
+# Fixed object numbers of the resources every report shares
+CATALOG, PAGES, TEMPLATE = 1, 2, 3
+FONT_OBJECTS = {'F1': 4, 'F2': 5}
+FIRST_PAGE_OBJECT = 6
+
+DEDUCTION_LABELS = {
+    'PERSONAL_RELIEF': 'Personal relief',
+    'QUALIFYING_PAYMENT': 'Qualifying payments',
+    'APIT': 'APIT deducted',
+    'WHT': 'WHT deducted',
+}
+
+
+def escape(text: str) -> bytes:
+    """A PDF string literal body in WinAnsi (cp1252)"""
+    encoded = str(text).encode('cp1252', errors='replace')
+    return encoded.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+
+
+def format_amount(amount) -> str:
+    return f"{float(amount or 0):,.2f}"
+
+
+def category_title(category_type: str) -> str:
+    """'EmploymentIncome' -> 'Employment Income'"""
+    return re.sub(r'(?<=[a-z])(?=[A-Z])', ' ', category_type).replace('_', ' ')
+
+
+def report_context(report) -> Dict[str, Any]:
+    """
+    Plain data for rendering a TaxReport (with its user, categories, entries
+    and deductions), picklable so it can be sent to worker processes
+    """
+    user = report.user
+    return {
+        'report_id': report.pk,
+        'taxpayer': user.get_full_name() or user.username,
+        'username': user.username,
+        'tax_year': report.tax_year,
+        'created_at': report.created_at.strftime('%Y-%m-%d') if report.created_at else '',
+        'categories': [
+            {
+                'title': category_title(category.category_type),
+                'total': float(category.total_amount),
+                'entries': [(entry.name, float(entry.amount)) for entry in category.entries.all()],
+            }
+            for category in report.categories.all()
+        ],
+        'deductions': [
+            (DEDUCTION_LABELS.get(deduction.deduction_type, deduction.deduction_type.replace('_', ' ').capitalize()),
+             float(deduction.amount))
+            for deduction in report.deductions.all()
+        ],
+        'summary': [
+            ('Assessable income', float(report.assessable_income)),
+            ('Taxable income', float(report.taxable_income)),
+            ('Total tax payable', float(report.total_tax_payable)),
+        ],
+    }
+
+
+class CompiledLayout:
+    """
+    Everything about a report that doesn't depend on the report: page
+    geometry, the serialized font and catalog objects and the page template
+    (title, rules, column headings, footer) as a form XObject that every
+    page draws. Built once per process and reused by every render.
+    """
+
+    def __init__(self, options: Dict[str, Any]):
+        self.width, self.height = options['page_size']
+        self.margin = options['margin']
+        self.font_size = options['font_size']
+        self.line_height = self.font_size * 1.6
+        self.compress = options['compress']
+        self.left = self.margin
+        self.right = self.width - self.margin
+        self.top = self.height - self.margin - 70  # below the template's header
+        self.bottom = self.margin + 40  # above the template's footer
+
+        self.fonts = {name: font for name, (font, _) in FONTS.items()}
+        self.widths = {name: widths for name, (_, widths) in FONTS.items()}
+        self.resources = (
+            b'<< /Font << ' + b' '.join(f'/{name} {number} 0 R'.encode() for name, number in FONT_OBJECTS.items())
+            + b' >> >>'
+        )
+        self.shared_objects = self._shared_objects(options)
+
+    def char_widths(self, text: str, font: str) -> List[int]:
+        widths = self.widths[font]
+        return [widths[ord(char) - 32] if 32 <= ord(char) <= 126 else 556 for char in text]
+
+    def text_width(self, text: str, font: str, size: float) -> float:
+        return sum(self.char_widths(text, font)) * size / 1000
+
+    def fit(self, text: str, font: str, size: float, width: float) -> str:
+        """Shorten text with an ellipsis to fit a column"""
+        text = str(text)
+        limit = width * 1000 / size
+        widths = self.char_widths(text, font)
+        if sum(widths) <= limit:
+            return text
+        limit -= sum(self.char_widths('...', font))
+        used = 0
+        for end, char_width in enumerate(widths):
+            used += char_width
+            if used > limit:
+                return text[:end].rstrip() + '...'
+        return text
+
+    def text(self, x: float, y: float, text: str, font: str = 'F1', size: Optional[float] = None,
+             align: str = 'left') -> bytes:
+        size = size or self.font_size
+        if align == 'right':
+            x -= self.text_width(text, font, size)
+        return b'BT /%s %.1f Tf %.2f %.2f Td (%s) Tj ET\n' % (font.encode(), size, x, y, escape(text))
+
+    def rule(self, y: float, weight: float = 0.5) -> bytes:
+        return b'%.2f w %.2f %.2f m %.2f %.2f l S\n' % (weight, self.left, y, self.right, y)
+
+    def stream(self, content: bytes, dictionary: bytes = b'') -> bytes:
+        if self.compress:
+            content = zlib.compress(content)
+            dictionary += b' /Filter /FlateDecode'
+        return b'<<%s /Length %d >>\nstream\n%s\nendstream' % (dictionary, len(content), content)
+
+    def _shared_objects(self, options: Dict[str, Any]) -> Dict[int, bytes]:
+        header = self.height - self.margin
+        template = b''.join([
+            self.text(self.left, header - 18, options['title'], 'F2', 18),
+            self.rule(header - 30, 1.0),
+            self.text(self.left, self.top + 18, 'Description', 'F2'),
+            self.text(self.right, self.top + 18, 'Amount (LKR)', 'F2', align='right'),
+            self.rule(self.top + 12),
+            self.rule(self.bottom - 12),
+            self.text(self.left, self.bottom - 26, self.fit(options['footer'], 'F1', 8, self.right - self.left - 80),
+                      'F1', 8),
+        ])
+        objects = {
+            CATALOG: b'<< /Type /Catalog /Pages %d 0 R >>' % PAGES,
+            TEMPLATE: self.stream(template, b' /Type /XObject /Subtype /Form /BBox [0 0 %d %d] /Resources %s'
+                                  % (self.width, self.height, self.resources)),
+        }
+        for name, number in FONT_OBJECTS.items():
+            objects[number] = (b'<< /Type /Font /Subtype /Type1 /BaseFont /%s /Encoding /WinAnsiEncoding >>'
+                               % self.fonts[name].encode())
+        return objects
+
+
+class ReportRenderer:
+    """
+    Renders tax reports as PDFs on the server from report_context() data.
+
+    Reports only use the standard Helvetica fonts, which PDF viewers carry,
+    so the PDF is written directly: the layout is compiled once per process
+    (see CompiledLayout) and a render only lays out the report's rows,
+    paginates them and writes the per-page content and cross-reference table.
+    """
+
+    def __init__(self, options: Optional[Dict[str, Any]] = None):
+        self._options = options
+        self._layout = None
+        self._layout_lock = threading.Lock()
+
+    @property
+    def options(self) -> Dict[str, Any]:
+        config = dict(DEFAULT_REPORT_RENDERER)
+        config.update(self._options if self._options is not None else getattr(settings, 'REPORT_RENDERER', {}))
+        return config
+
+    @property
+    def layout(self) -> CompiledLayout:
+        if self._layout is None:
+            with self._layout_lock:
+                if self._layout is None:
+                    self._layout = CompiledLayout(self.options)
+        return self._layout
+
+    def rows(self, context: Dict[str, Any]) -> List[Tuple]:
+        """Report content as (kind, label, amount) rows in reading order"""
+        rows = [('info', f"Taxpayer: {context['taxpayer']}", None),
+                ('info', f"Year of assessment: {context['tax_year']}", None)]
+        if context.get('created_at'):
+            rows.append(('info', f"Computed on: {context['created_at']}", None))
+
+        for category in context['categories']:
+            rows.append(('gap', '', None))
+            rows.append(('heading', category['title'], None))
+            rows.extend(('row', name, amount) for name, amount in category['entries'])
+            rows.append(('total', f"Assessable {category['title'].lower()}", category['total']))
+
+        if context['deductions']:
+            rows.append(('gap', '', None))
+            rows.append(('heading', 'Reliefs and tax credits', None))
+            rows.extend(('row', label, amount) for label, amount in context['deductions'])
+
+        rows.append(('gap', '', None))
+        rows.append(('heading', 'Summary', None))
+        rows.extend(('total', label, amount) for label, amount in context['summary'])
+        return rows
+
+    def paginate(self, rows: List[Tuple]) -> List[List[Tuple[float, Tuple]]]:
+        """Rows with their baseline, split into pages; headings never end a page"""
+        layout = self.layout
+        pages, page, y = [], [], layout.top
+        for row in rows:
+            needed = layout.line_height * (2 if row[0] == 'heading' else 1)
+            if y - needed < layout.bottom and page:
+                pages.append(page)
+                page, y = [], layout.top
+            if row[0] == 'gap' and not page:
+                continue
+            y -= layout.line_height
+            page.append((y, row))
+        pages.append(page)
+        return pages
+
+    def page_content(self, page: List[Tuple[float, Tuple]], number: int, count: int) -> bytes:
+        layout = self.layout
+        label_width = layout.right - layout.left - 120
+        parts = [b'q /Template Do Q\n']
+        for y, (kind, label, amount) in page:
+            if kind == 'gap':
+                continue
+            font = 'F2' if kind in ('heading', 'total') else 'F1'
+            indent = 12 if kind == 'row' else 0
+            parts.append(layout.text(layout.left + indent, y, layout.fit(label, font, layout.font_size,
+                                                                          label_width - indent), font))
+            if amount is not None:
+                parts.append(layout.text(layout.right, y, format_amount(amount), font, align='right'))
+            if kind == 'total':
+                parts.append(b'0.3 w %.2f %.2f m %.2f %.2f l S\n' % (layout.right - 100, y + layout.font_size + 1,
+                                                                     layout.right, y + layout.font_size + 1))
+        parts.append(layout.text(layout.right, layout.bottom - 26, f"Page {number} of {count}", 'F1', 8,
+                                 align='right'))
+        return b''.join(parts)
+
+    def render(self, context: Dict[str, Any]) -> bytes:
+        """PDF bytes of one report"""
+        layout = self.layout
+        pages = self.paginate(self.rows(context))
+
+        objects = dict(layout.shared_objects)
+        page_refs = []
+        page_resources = layout.resources[:-2] + b'/XObject << /Template %d 0 R >> >>' % TEMPLATE
+        for index, page in enumerate(pages):
+            page_number = FIRST_PAGE_OBJECT + 2 * index
+            objects[page_number] = (b'<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %d %d] /Resources %s '
+                                    b'/Contents %d 0 R >>' % (PAGES, layout.width, layout.height,
+                                                              page_resources, page_number + 1))
+            objects[page_number + 1] = layout.stream(self.page_content(page, index + 1, len(pages)))
+            page_refs.append(b'%d 0 R' % page_number)
+        objects[PAGES] = b'<< /Type /Pages /Kids [%s] /Count %d >>' % (b' '.join(page_refs), len(pages))
+        info = len(objects) + 1
+        # Dated by the report, not the render, so the same report always gives
+        # the same bytes and is stored once by the report storage
+        creation_date = context.get('created_at', '').replace('-', '')
+        objects[info] = b'<< /Title (%s) /Producer (tax_report)%s >>' % (
+            escape(f"Tax report {context['tax_year']} - {context['taxpayer']}"),
+            b' /CreationDate (D:%s)' % creation_date.encode() if creation_date else b'')
+
+        out = bytearray(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        offsets = []
+        for number in range(1, len(objects) + 1):
+            offsets.append(len(out))
+            out += b'%d 0 obj\n%s\nendobj\n' % (number, objects[number])
+        xref = len(out)
+        out += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+        out += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+        out += b'trailer\n<< /Size %d /Root %d 0 R /Info %d 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (
+            len(objects) + 1, CATALOG, info, xref)
+        return bytes(out)
+
+    def filename(self, context: Dict[str, Any]) -> str:
+        return f"tax_report_{context['tax_year'].replace('/', '-')}_{context['report_id']}.pdf"
+
+
+def render_batch(contexts: List[Dict[str, Any]]) -> List[Tuple[str, bytes]]:
+    """Render several reports in a worker process: (archive name, PDF) pairs for render_tax_reports"""
+    return [(f"{context['username']}/{report_renderer.filename(context)}", report_renderer.render(context))
+            for context in contexts]
+
+
+def warm_report_renderer() -> None:
+    """Compile the layout up front, e.g. as a process pool initializer"""
+    report_renderer.layout
+
+# Create a singleton instance
+report_renderer = ReportRenderer()
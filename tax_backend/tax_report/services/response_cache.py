@@ -0,0 +1,246 @@
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from typing import Dict, Any, Optional
+from django.conf import settings # type: ignore
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL_SECONDS = 7 * 24 * 60 * 60  # one week
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024  # 64MB of cached responses
+
+
+def hash_prompt(prompt: str) -> str:
+    """Return the stable digest used to key a prompt"""
+    return hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token estimate (~4 characters per token) used when the API gives no usage data"""
+    return max(1, len(text) // 4) if text else 0
+
+
+class GeminiResponseCache:
+    """
+    Persistent cache for Gemini responses keyed by (model name, prompt hash).
+
+    Entries live in a small SQLite file so every worker process shares them.
+    Expired entries are dropped lazily and the least recently used entries are
+    evicted once the stored responses exceed ``max_bytes``.
+    """
+
+    def __init__(self, path: Optional[str] = None, ttl_seconds: Optional[int] = None,
+                 max_bytes: Optional[int] = None, enabled: Optional[bool] = None):
+        self._path = path
+        self._ttl_seconds = ttl_seconds
+        self._max_bytes = max_bytes
+        self._enabled = enabled
+        self._schema_ready = False
+        self._lock = threading.Lock()
+
+    @property
+    def path(self) -> str:
+        if self._path is None:
+            self._path = getattr(settings, 'GEMINI_RESPONSE_CACHE_PATH',
+                                 os.path.join(settings.BASE_DIR, 'cache', 'gemini_responses.sqlite3'))
+        return self._path
+
+    @property
+    def ttl_seconds(self) -> int:
+        if self._ttl_seconds is None:
+            self._ttl_seconds = getattr(settings, 'GEMINI_RESPONSE_CACHE_TTL', DEFAULT_TTL_SECONDS)
+        return self._ttl_seconds
+
+    @property
+    def max_bytes(self) -> int:
+        if self._max_bytes is None:
+            self._max_bytes = getattr(settings, 'GEMINI_RESPONSE_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)
+        return self._max_bytes
+
+    @property
+    def enabled(self) -> bool:
+        if self._enabled is None:
+            self._enabled = getattr(settings, 'GEMINI_RESPONSE_CACHE_ENABLED', True)
+        return self._enabled
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._schema_ready:
+            with self._lock:
+                if not self._schema_ready:
+                    os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                    conn = sqlite3.connect(self.path, timeout=10)
+                    try:
+                        conn.execute("PRAGMA journal_mode=WAL")
+                        conn.execute("""
+                            CREATE TABLE IF NOT EXISTS responses (
+                                model_name TEXT NOT NULL,
+                                prompt_hash TEXT NOT NULL,
+                                response TEXT NOT NULL,
+                                size INTEGER NOT NULL,
+                                tokens INTEGER NOT NULL DEFAULT 0,
+                                created_at REAL NOT NULL,
+                                expires_at REAL NOT NULL,
+                                last_accessed REAL NOT NULL,
+                                PRIMARY KEY (model_name, prompt_hash)
+                            )
+                        """)
+                        conn.execute("CREATE INDEX IF NOT EXISTS responses_last_accessed ON responses (last_accessed)")
+                        conn.execute("""
+                            CREATE TABLE IF NOT EXISTS counters (
+                                name TEXT PRIMARY KEY,
+                                value INTEGER NOT NULL DEFAULT 0
+                            )
+                        """)
+                        conn.commit()
+                    finally:
+                        conn.close()
+                    self._schema_ready = True
+        return sqlite3.connect(self.path, timeout=10)
+
+    def _bump(self, conn: sqlite3.Connection, name: str, amount: int = 1) -> None:
+        conn.execute(
+            "INSERT INTO counters (name, value) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            (name, amount)
+        )
+
+    def get(self, model_name: str, prompt: str) -> Optional[str]:
+        """Return the cached response for a prompt, or None on a miss"""
+        if not self.enabled:
+            return None
+        try:
+            prompt_hash = hash_prompt(prompt)
+            now = time.time()
+            conn = self._connect()
+            try:
+                row = conn.execute(
+                    "SELECT response, tokens, expires_at FROM responses WHERE model_name = ? AND prompt_hash = ?",
+                    (model_name, prompt_hash)
+                ).fetchone()
+                if row is None or row[2] <= now:
+                    if row is not None:
+                        conn.execute("DELETE FROM responses WHERE model_name = ? AND prompt_hash = ?",
+                                     (model_name, prompt_hash))
+                    self._bump(conn, 'misses')
+                    conn.commit()
+                    return None
+
+                conn.execute(
+                    "UPDATE responses SET last_accessed = ? WHERE model_name = ? AND prompt_hash = ?",
+                    (now, model_name, prompt_hash)
+                )
+                self._bump(conn, 'hits')
+                self._bump(conn, 'tokens_saved', row[1])
+                conn.commit()
+                logger.info(f"Gemini response cache hit for {model_name}:{prompt_hash[:12]}")
+                return row[0]
+            finally:
+                conn.close()
+        except Exception as e:
+            logger.error(f"Error reading Gemini response cache: {str(e)}")
+            return None
+
+    def set(self, model_name: str, prompt: str, response: str, tokens: Optional[int] = None) -> None:
+        """Store a response and evict expired or least recently used entries"""
+        if not self.enabled:
+            return
+        try:
+            prompt_hash = hash_prompt(prompt)
+            now = time.time()
+            size = len(response.encode('utf-8'))
+            if tokens is None:
+                tokens = estimate_tokens(prompt) + estimate_tokens(response)
+
+            conn = self._connect()
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO responses "
+                    "(model_name, prompt_hash, response, size, tokens, created_at, expires_at, last_accessed) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (model_name, prompt_hash, response, size, tokens, now, now + self.ttl_seconds, now)
+                )
+                self._evict(conn, now)
+                conn.commit()
+            finally:
+                conn.close()
+        except Exception as e:
+            logger.error(f"Error writing Gemini response cache: {str(e)}")
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        expired = conn.execute("DELETE FROM responses WHERE expires_at <= ?", (now,)).rowcount
+        evicted = 0
+
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total > self.max_bytes:
+            rows = conn.execute(
+                "SELECT model_name, prompt_hash, size FROM responses ORDER BY last_accessed ASC"
+            ).fetchall()
+            for model_name, prompt_hash, size in rows:
+                if total <= self.max_bytes:
+                    break
+                conn.execute("DELETE FROM responses WHERE model_name = ? AND prompt_hash = ?",
+                             (model_name, prompt_hash))
+                total -= size
+                evicted += 1
+
+        if expired or evicted:
+            self._bump(conn, 'evictions', expired + evicted)
+            logger.info(f"Gemini response cache evicted {expired} expired and {evicted} LRU entries")
+
+    def invalidate(self, model_name: str, prompt: str) -> None:
+        """Drop a single cached response"""
+        try:
+            conn = self._connect()
+            try:
+                conn.execute("DELETE FROM responses WHERE model_name = ? AND prompt_hash = ?",
+                             (model_name, hash_prompt(prompt)))
+                conn.commit()
+            finally:
+                conn.close()
+        except Exception as e:
+            logger.error(f"Error invalidating Gemini response cache: {str(e)}")
+
+    def clear(self) -> None:
+        """Remove every cached response and reset the counters"""
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM responses")
+            conn.execute("DELETE FROM counters")
+            conn.commit()
+        finally:
+            conn.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters, tokens saved and current cache size"""
+        try:
+            conn = self._connect()
+            try:
+                counters = dict(conn.execute("SELECT name, value FROM counters").fetchall())
+                entries, size = conn.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+                ).fetchone()
+            finally:
+                conn.close()
+        except Exception as e:
+            logger.error(f"Error reading Gemini response cache stats: {str(e)}")
+            counters, entries, size = {}, 0, 0
+
+        hits = counters.get('hits', 0)
+        misses = counters.get('misses', 0)
+        lookups = hits + misses
+        return {
+            'enabled': self.enabled,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / lookups, 4) if lookups else 0.0,
+            'tokens_saved': counters.get('tokens_saved', 0),
+            'evictions': counters.get('evictions', 0),
+            'entries': entries,
+            'size_bytes': size,
+        }
+
+# Create a singleton instance
+response_cache = GeminiResponseCache()
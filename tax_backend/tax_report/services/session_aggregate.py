@@ -0,0 +1,233 @@
+import hashlib
+import logging
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+from django.db import transaction # type: ignore
+
+logger = logging.getLogger(__name__)
+
+INCOME = 'income'
+DEDUCTION = 'deduction'
+
+
+def _amount(value: Any) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def entry_fingerprint(kind: str, item: Dict[str, Any], occurrence: int = 0, source: str = '') -> str:
+    """
+    Identity of an entry. ``source`` identifies the document's content (its
+    blob digest), so only a re-upload of the same file yields the same
+    fingerprints: two payslips of the same salary are two entries.
+    ``occurrence`` numbers identical entries within one document, so twelve
+    equal monthly salary lines stay twelve entries.
+    """
+    description = ' '.join(str(item.get('description', '')).lower().split())
+    key = '\x1f'.join((
+        source,
+        kind,
+        str(item.get('category', '')),
+        str(item.get('type', '')),
+        description,
+        f"{_amount(item.get('amount', 0)):.2f}",
+        str(occurrence),
+    ))
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+class SessionAggregate:
+    """
+    Running merge of the analyses of a session's documents.
+
+    Each distinct entry is stored once under its fingerprint together with
+    the documents it was found in (several only when the same file was
+    uploaded more than once), and every document keeps the list of its
+    fingerprints. Adding a document with k entries and removing it again are
+    both O(k): totals per category are adjusted only when an entry appears
+    for the first time or loses its last document.
+    """
+
+    def __init__(self, entries: Optional[Dict[str, Any]] = None, documents: Optional[Dict[str, Any]] = None,
+                 totals: Optional[Dict[str, Any]] = None, next_sequence: int = 0):
+        self.entries = entries if entries is not None else {}
+        self.documents = documents if documents is not None else {}
+        self.totals = totals if totals is not None else {}
+        self.next_sequence = next_sequence
+
+    @staticmethod
+    def _fingerprints(analysis: Dict[str, Any], source: str) -> Iterable[Tuple[str, str, Dict[str, Any]]]:
+        for kind, key in ((INCOME, 'income_items'), (DEDUCTION, 'deductions')):
+            seen: Dict[str, int] = {}
+            for item in analysis.get(key) or []:
+                if not isinstance(item, dict):
+                    continue
+                first = entry_fingerprint(kind, item, source=source)
+                occurrence = seen.get(first, 0)
+                seen[first] = occurrence + 1
+                if occurrence:
+                    yield entry_fingerprint(kind, item, occurrence, source), kind, item
+                else:
+                    yield first, kind, item
+
+    def _adjust_total(self, kind: str, item: Dict[str, Any], sign: int) -> None:
+        category = str(item.get('category') or 'Uncategorized')
+        totals = self.totals.setdefault(kind, {})
+        total = totals.setdefault(category, {'amount': 0.0, 'count': 0})
+        total['count'] += sign
+        if total['count'] <= 0:
+            # Dropping empty categories also drops accumulated rounding error
+            del totals[category]
+            return
+        total['amount'] = round(total['amount'] + sign * _amount(item.get('amount', 0)), 2)
+
+    def add_document(self, document_id: str, analysis: Dict[str, Any], source: Optional[str] = None) -> Dict[str, int]:
+        """
+        Merge a document's analysis, replacing its previous one if any.
+        Documents with the same ``source`` (content digest) share their
+        entries; without one a document only shares with itself.
+        """
+        document_id = str(document_id)
+        if document_id in self.documents:
+            self.remove_document(document_id)
+
+        fingerprints: List[str] = []
+        added = shared = 0
+        for fingerprint, kind, item in self._fingerprints(analysis, source or document_id):
+            fingerprints.append(fingerprint)
+            entry = self.entries.get(fingerprint)
+            if entry is None:
+                self.entries[fingerprint] = {
+                    'kind': kind, 'item': item, 'sequence': self.next_sequence, 'documents': [document_id],
+                }
+                self.next_sequence += 1
+                self._adjust_total(kind, item, 1)
+                added += 1
+            else:
+                entry['documents'].append(document_id)
+                shared += 1
+        self.documents[document_id] = fingerprints
+        return {'added': added, 'duplicates': shared}
+
+    def remove_document(self, document_id: str) -> bool:
+        """Drop a document's entries; entries also found in other documents stay"""
+        fingerprints = self.documents.pop(str(document_id), None)
+        if fingerprints is None:
+            return False
+        for fingerprint in fingerprints:
+            entry = self.entries.get(fingerprint)
+            if entry is None:
+                continue
+            if str(document_id) in entry['documents']:
+                entry['documents'].remove(str(document_id))
+            if not entry['documents']:
+                del self.entries[fingerprint]
+                self._adjust_total(entry['kind'], entry['item'], -1)
+        return True
+
+    def category_totals(self, kind: str) -> Dict[str, float]:
+        return {category: total['amount'] for category, total in self.totals.get(kind, {}).items()}
+
+    def as_analysis(self) -> Dict[str, Any]:
+        """The merged analysis, in the shape of a single document's analysis"""
+        ordered = sorted(self.entries.values(), key=lambda entry: entry['sequence'])
+        income_totals = self.category_totals(INCOME)
+        deduction_totals = self.category_totals(DEDUCTION)
+        return {
+            'document_type': 'session_aggregate',
+            'document_count': len(self.documents),
+            'income_items': [entry['item'] for entry in ordered if entry['kind'] == INCOME],
+            'deductions': [entry['item'] for entry in ordered if entry['kind'] == DEDUCTION],
+            'income_totals': income_totals,
+            'deduction_totals': deduction_totals,
+            'total_assessable_income': round(sum(income_totals.values()) - sum(deduction_totals.values()), 2),
+        }
+
+
+class SessionAggregateService:
+    """Keeps the SessionAnalysisAggregate row of a session in step with its documents"""
+
+    @staticmethod
+    def _source(document) -> Optional[str]:
+        """Content digest of a document's file, shared by re-uploads of the same file"""
+        storage = document.file.storage
+        if not document.file.name or not hasattr(storage, 'digest'):
+            return None
+        return storage.digest(document.file.name)
+
+    def _locked(self, session_id: str):
+        """The session's aggregate row, locked; created from the session's analyzed documents if missing"""
+        from ..models import SessionAnalysisAggregate, StoredFile, TaxFormDocument
+        try:
+            return SessionAnalysisAggregate.objects.select_for_update().get(session_id=session_id)
+        except SessionAnalysisAggregate.DoesNotExist:
+            pass
+
+        aggregate = SessionAggregate()
+        analyzed = list(TaxFormDocument.objects
+                        .filter(session_id=session_id, is_processed=True)
+                        .exclude(extracted_data=None)
+                        .order_by('analyzed_at')
+                        .values_list('id', 'extracted_data', 'file'))
+        digests = dict(StoredFile.objects.filter(name__in=[name for _, _, name in analyzed])
+                       .values_list('name', 'blob__digest'))
+        for document_id, analysis, name in analyzed:
+            aggregate.add_document(document_id, analysis or {}, digests.get(name))
+        row, created = SessionAnalysisAggregate.objects.get_or_create(
+            session_id=session_id,
+            defaults={'entries': aggregate.entries, 'documents': aggregate.documents,
+                      'totals': aggregate.totals, 'next_sequence': aggregate.next_sequence},
+        )
+        if created:
+            logger.info(f"Built analysis aggregate for session {session_id} from {len(aggregate.documents)} documents")
+        return SessionAnalysisAggregate.objects.select_for_update().get(pk=row.pk)
+
+    @staticmethod
+    def _save(row, aggregate: SessionAggregate) -> None:
+        row.entries = aggregate.entries
+        row.documents = aggregate.documents
+        row.totals = aggregate.totals
+        row.next_sequence = aggregate.next_sequence
+        row.save(update_fields=['entries', 'documents', 'totals', 'next_sequence', 'updated_at'])
+
+    @staticmethod
+    def _load(row) -> SessionAggregate:
+        return SessionAggregate(row.entries, row.documents, row.totals, row.next_sequence)
+
+    def add_document(self, document) -> Dict[str, int]:
+        """Merge (or re-merge) a processed document's analysis"""
+        with transaction.atomic():
+            row = self._locked(document.session_id)
+            aggregate = self._load(row)
+            stats = aggregate.add_document(document.id, document.extracted_data or {}, self._source(document))
+            self._save(row, aggregate)
+        logger.info(f"Aggregated document {document.id}: {stats['added']} new entries, {stats['duplicates']} duplicates")
+        return stats
+
+    def remove_document(self, document) -> None:
+        from ..models import SessionAnalysisAggregate
+        with transaction.atomic():
+            row = SessionAnalysisAggregate.objects.select_for_update().filter(session_id=document.session_id).first()
+            if row is None:
+                return
+            aggregate = self._load(row)
+            if aggregate.remove_document(document.id):
+                self._save(row, aggregate)
+
+    def analysis(self, session_id: str) -> Dict[str, Any]:
+        """Merged analysis of every analyzed document in the session ({} if there are none)"""
+        from ..models import SessionAnalysisAggregate
+        row = SessionAnalysisAggregate.objects.filter(session_id=session_id).first()
+        if row is None:
+            with transaction.atomic():
+                row = self._locked(session_id)
+        aggregate = self._load(row)
+        return aggregate.as_analysis() if aggregate.documents else {}
+
+    def clear(self, session_id: str) -> None:
+        from ..models import SessionAnalysisAggregate
+        SessionAnalysisAggregate.objects.filter(session_id=session_id).delete()
+
+# Create a singleton instance
+session_aggregates = SessionAggregateService()
@@ -0,0 +1,222 @@
+import os
+import json
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Any, Iterator, List, Optional
+
+# File locking is platform specific: fcntl on POSIX, msvcrt on Windows
+try:
+    import fcntl # type: ignore
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
+    import msvcrt # type: ignore
+
+logger = logging.getLogger(__name__)
+
+INDEX_NAME = 'index'
+INDEX_FILENAME = INDEX_NAME + '.jsonl'
+
+# Compact once the log holds this many records and at least twice as many
+# records as live documents (i.e. half of it is overwritten or deleted entries)
+COMPACT_MIN_RECORDS = 64
+COMPACT_RATIO = 2
+
+MAX_OPEN_INDEXES = 256
+
+
+def document_key(document: Dict[str, Any]) -> str:
+    """Key used to index a document record"""
+    key = document.get('doc_id') or document.get('id')
+    if key:
+        return str(key)
+    # Records without an id are keyed by their content so re-adding is a no-op
+    return json.dumps(document, sort_keys=True, default=str)
+
+
+class SessionDocumentIndex:
+    """
+    Append-only JSON-lines index of the documents uploaded in one session.
+
+    Every change is a single appended line ({"op": "put"|"delete", ...}) written
+    under an exclusive file lock, so concurrent uploads never lose each other's
+    entries and an append costs O(1) regardless of how many documents exist.
+    Readers keep an in-memory dict built from the log and only parse the bytes
+    appended since their last read. When enough records are stale the log is
+    compacted into a fresh file that is atomically swapped in.
+    """
+
+    def __init__(self, directory: str, legacy_files=(), name: str = INDEX_NAME):
+        self.directory = directory
+        self.path = os.path.join(directory, name + '.jsonl')
+        self.lock_path = os.path.join(directory, name + '.lock')
+        self.legacy_files = tuple(legacy_files)
+        self._thread_lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self._documents: Dict[str, Dict[str, Any]] = OrderedDict()
+        self._offset = 0
+        self._records = 0
+        self._inode = None
+
+    @contextmanager
+    def _locked(self, exclusive: bool = True) -> Iterator[None]:
+        """Hold the cross-process lock file (and the in-process lock)"""
+        with self._thread_lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.lock_path, 'a+b') as lock_file:
+                if FCNTL_AVAILABLE:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+                else:
+                    lock_file.seek(0)
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                try:
+                    yield
+                finally:
+                    if FCNTL_AVAILABLE:
+                        fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+                    else:
+                        lock_file.seek(0)
+                        msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def _apply(self, record: Dict[str, Any]) -> None:
+        self._records += 1
+        key = record.get('key')
+        if record.get('op') == 'delete':
+            self._documents.pop(key, None)
+        elif key is not None:
+            # Replacing keeps the document's original position
+            self._documents[key] = record.get('document', {})
+
+    def _refresh(self) -> None:
+        """Apply any records appended since the last read"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self._reset()
+            return
+
+        if self._inode != stat.st_ino or stat.st_size < self._offset:
+            # The log was compacted or recreated: rebuild from the start
+            self._reset()
+            self._inode = stat.st_ino
+        if stat.st_size == self._offset:
+            return
+
+        with open(self.path, 'rb') as f:
+            f.seek(self._offset)
+            chunk = f.read(stat.st_size - self._offset)
+
+        # Only consume complete lines; a partially written tail is read next time
+        end = chunk.rfind(b'\n') + 1
+        for line in chunk[:end].splitlines():
+            if not line.strip():
+                continue
+            try:
+                self._apply(json.loads(line))
+            except json.JSONDecodeError:
+                logger.error(f"Skipping corrupt session index record in {self.path}")
+        self._offset += end
+
+    def _append(self, records: List[Dict[str, Any]]) -> None:
+        self._refresh()
+        payload = ''.join(json.dumps(record, default=str) + '\n' for record in records)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        self._refresh()
+        if self._records >= COMPACT_MIN_RECORDS and self._records >= COMPACT_RATIO * len(self._documents):
+            self._compact()
+
+    def _compact(self) -> None:
+        """Rewrite the log with one record per live document (lock must be held)"""
+        temp_path = self.path + '.compact'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            for key, document in self._documents.items():
+                f.write(json.dumps({'op': 'put', 'key': key, 'document': document}, default=str) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+        logger.info(f"Compacted session index {self.path}: {self._records} -> {len(self._documents)} records")
+        self._reset()
+        self._refresh()
+
+    def _import_legacy(self) -> None:
+        """Fold documents from the old rewrite-on-every-upload metadata files into the log"""
+        for legacy_path in self.legacy_files:
+            if not os.path.exists(legacy_path):
+                continue
+            try:
+                with open(legacy_path, 'r') as f:
+                    documents = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                documents = []
+            if documents:
+                self._append([{'op': 'put', 'key': document_key(doc), 'document': doc} for doc in documents])
+            os.remove(legacy_path)
+
+    def _read(self) -> None:
+        if self.legacy_files and any(os.path.exists(path) for path in self.legacy_files):
+            with self._locked():
+                self._import_legacy()
+        with self._locked(exclusive=False):
+            self._refresh()
+
+    def add(self, document: Dict[str, Any], replace: bool = True) -> str:
+        """
+        Append a document record and return its key. With replace=False an
+        existing record with the same key is left untouched.
+        """
+        key = document_key(document)
+        with self._locked():
+            self._import_legacy()
+            self._refresh()
+            if replace or key not in self._documents:
+                self._append([{'op': 'put', 'key': key, 'document': document}])
+        return key
+
+    def remove(self, key: str) -> None:
+        """Append a tombstone for a document"""
+        with self._locked():
+            self._import_legacy()
+            self._append([{'op': 'delete', 'key': str(key)}])
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Indexed lookup of a single document"""
+        self._read()
+        return self._documents.get(str(key))
+
+    def all(self) -> List[Dict[str, Any]]:
+        """All live documents in the order they were added"""
+        self._read()
+        return list(self._documents.values())
+
+    def __contains__(self, key) -> bool:
+        return self.get(key) is not None
+
+    def compact(self) -> None:
+        """Force a compaction of the log"""
+        with self._locked():
+            self._refresh()
+            self._compact()
+
+
+_indexes: 'OrderedDict[tuple, SessionDocumentIndex]' = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def get_session_index(directory: str, legacy_files=(), name: str = INDEX_NAME) -> SessionDocumentIndex:
+    """Return the shared index ``name`` for a session directory (kept in a small LRU)"""
+    key = (os.path.abspath(directory), name)
+    with _indexes_lock:
+        index = _indexes.pop(key, None)
+        if index is None:
+            index = SessionDocumentIndex(key[0], legacy_files=legacy_files, name=name)
+        _indexes[key] = index
+        while len(_indexes) > MAX_OPEN_INDEXES:
+            _indexes.popitem(last=False)
+        return index
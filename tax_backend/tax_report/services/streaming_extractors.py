@@ -0,0 +1,164 @@
+import io
+import zipfile
+import logging
+import datetime
+from typing import Iterable, Iterator
+from xml.etree.ElementTree import iterparse
+
+# Handle optional dependencies with try-except blocks
+try:
+    import openpyxl # type: ignore
+    OPENPYXL_INSTALLED = True
+except ImportError:
+    OPENPYXL_INSTALLED = False
+    print("Warning: openpyxl not installed. Streaming .xlsx extraction will be disabled.")
+
+try:
+    import xlrd # type: ignore
+    XLRD_INSTALLED = True
+except ImportError:
+    XLRD_INSTALLED = False
+
+logger = logging.getLogger(__name__)
+
+# Cells are separated by tabs so the "<description> <amount>" line parser
+# still sees the amount as the last whitespace-separated token
+CELL_DELIMITER = '\t'
+
+WORD_NAMESPACE = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+W_BODY = WORD_NAMESPACE + 'body'
+W_PARAGRAPH = WORD_NAMESPACE + 'p'
+W_RUN = WORD_NAMESPACE + 'r'
+W_TEXT = WORD_NAMESPACE + 't'
+W_TAB = WORD_NAMESPACE + 'tab'
+W_BREAK = WORD_NAMESPACE + 'br'
+W_TABLE = WORD_NAMESPACE + 'tbl'
+W_ROW = WORD_NAMESPACE + 'tr'
+W_CELL = WORD_NAMESPACE + 'tc'
+
+
+def can_stream_excel(file_path: str) -> bool:
+    """Whether the streaming reader for this spreadsheet format is installed"""
+    if file_path.lower().endswith('.xlsx'):
+        return OPENPYXL_INSTALLED
+    return XLRD_INSTALLED
+
+
+def _format_cell(value) -> str:
+    if value is None:
+        return ''
+    if isinstance(value, float):
+        return str(int(value)) if value.is_integer() else repr(value)
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return ' '.join(str(value).split())
+
+
+def _row_to_line(values: Iterable) -> str:
+    cells = [_format_cell(value) for value in values]
+    # Drop empty cells so wide, sparse ledgers don't produce padding
+    return CELL_DELIMITER.join(cell for cell in cells if cell)
+
+
+def iter_excel_lines(file_path: str) -> Iterator[str]:
+    """
+    Yield one compact tab-delimited line per non-empty row across all sheets.
+    Sheet names are not emitted: every line is parsed as "<description>
+    <amount>", so a title like "Interest 2024" would become an amount.
+    """
+    if file_path.lower().endswith('.xlsx'):
+        workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            for sheet in workbook.worksheets:
+                for row in sheet.iter_rows(values_only=True):
+                    line = _row_to_line(row)
+                    if line:
+                        yield line
+        finally:
+            workbook.close()
+    else:
+        workbook = xlrd.open_workbook(file_path, on_demand=True)
+        try:
+            for index in range(workbook.nsheets):
+                sheet = workbook.sheet_by_index(index)
+                for row_index in range(sheet.nrows):
+                    line = _row_to_line(sheet.row_values(row_index))
+                    if line:
+                        yield line
+                workbook.unload_sheet(index)
+        finally:
+            workbook.release_resources()
+
+
+def iter_docx_lines(file_path: str) -> Iterator[str]:
+    """
+    Stream paragraphs and table rows from a .docx in document order.
+
+    word/document.xml is parsed incrementally and finished elements are
+    discarded, so memory does not grow with the size of the document.
+    Table rows are emitted as tab-delimited cells.
+    """
+    with zipfile.ZipFile(file_path) as archive:
+        with archive.open('word/document.xml') as stream:
+            body = None
+            run_depth = 0
+            paragraphs = []  # stack of paragraphs being built (text boxes nest them)
+            rows = []   # stack of rows being built (nested tables)
+            cells = []  # stack of cells being built
+
+            for event, elem in iterparse(stream, events=('start', 'end')):
+                tag = elem.tag
+                if event == 'start':
+                    if tag == W_BODY:
+                        body = elem
+                    elif tag == W_RUN:
+                        run_depth += 1
+                    elif tag == W_PARAGRAPH:
+                        paragraphs.append([])
+                    elif tag == W_ROW:
+                        rows.append([])
+                    elif tag == W_CELL:
+                        cells.append([])
+                    continue
+
+                if tag == W_TEXT and paragraphs:
+                    paragraphs[-1].append(elem.text or '')
+                elif tag == W_TAB and run_depth and paragraphs:
+                    paragraphs[-1].append(' ')
+                elif tag == W_BREAK and run_depth and paragraphs:
+                    paragraphs[-1].append('\n')
+                elif tag == W_RUN:
+                    run_depth -= 1
+                elif tag == W_PARAGRAPH:
+                    text = ''.join(paragraphs.pop())
+                    if cells:
+                        cells[-1].append(' '.join(text.split()))
+                    else:
+                        for line in text.split('\n'):
+                            if line.strip():
+                                yield line
+                elif tag == W_CELL:
+                    cell_text = ' '.join(part for part in cells.pop() if part)
+                    if rows:
+                        rows[-1].append(cell_text)
+                elif tag == W_ROW:
+                    line = CELL_DELIMITER.join(cell for cell in rows.pop() if cell)
+                    if line:
+                        if cells:
+                            # Nested table: the row belongs to the enclosing cell
+                            cells[-1].append(line.replace(CELL_DELIMITER, ' '))
+                        else:
+                            yield line
+
+                if tag in (W_PARAGRAPH, W_TABLE) and body is not None and not rows and not paragraphs:
+                    # Top-level block finished: drop it from the tree
+                    body.clear()
+
+
+def join_lines(lines: Iterable[str]) -> str:
+    """Concatenate streamed lines into one newline-separated string"""
+    buffer = io.StringIO()
+    for line in lines:
+        buffer.write(line)
+        buffer.write('\n')
+    return buffer.getvalue()
@@ -0,0 +1,346 @@
+import time
+import logging
+import threading
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from typing import Dict, Any, List, Optional, Tuple
+from django.conf import settings # type: ignore
+from django.db import DatabaseError, connection, transaction # type: ignore
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TAX_ENGINE = {
+    'rate_cache_ttl': 60 * 60,  # seconds before rate schedules are read from the database again
+    'default_tax_year': '2024/2025',
+}
+
+# Year of assessment -> suffix of the rate tables created by tax_calculator's init_tax_tables_<year>
+TAX_YEARS = {'2024/2025': '2024', '2025/2026': '2025'}
+
+# Schedules the engine needs, by the rate table they are read from
+SCHEDULE_TABLES = {'income': 'employment', 'terminal': 'pension'}
+
+UNLIMITED = Decimal('99999999.99')  # the rate tables' "and above" bracket limit
+
+# Annual schedules as initialized by init_tax_tables_2024/2025: (relief, [(bracket width, rate %)]).
+# Used when the rate tables don't exist (e.g. a development database).
+DEFAULT_RATE_SCHEDULES = {
+    ('income', '2024'): ('1200000', [('500000', '6'), ('500000', '12'), ('500000', '18'), ('500000', '24'),
+                                     ('500000', '30'), (UNLIMITED, '36')]),
+    ('income', '2025'): ('1800000', [('1000000', '6'), ('500000', '18'), ('500000', '24'), ('500000', '30'),
+                                     (UNLIMITED, '36')]),
+    ('terminal', '2024'): ('0', [('500000', '6'), ('500000', '12'), ('500000', '18'), ('500000', '24'),
+                                 ('500000', '30'), (UNLIMITED, '36')]),
+    ('terminal', '2025'): ('0', [('10000000', '0'), ('10000000', '6'), (UNLIMITED, '12')]),
+}
+
+# Form sections whose entries are assessable income, and the entry lists
+# that reduce them (business and investment expenses)
+INCOME_SECTIONS = (
+    ('EmploymentIncome', ('primaryEntries', 'secondaryEntries'), ()),
+    ('BusinessIncome', ('businessEntries',), ('deductions',)),
+    ('InvestmentIncome', ('investmentEntries',), ('deductions',)),
+    ('OtherIncome', ('otherEntries',), ()),
+)
+TERMINAL_SECTION = 'TerminalBenefits'
+QUALIFYING_SECTION = 'QualifyingPayments'
+# Tax already paid, credited against the liability: (section, entry list, TaxDeduction type)
+TAX_CREDITS = (
+    ('EmploymentIncome', 'apitEntries', 'APIT'),
+    ('OtherIncome', 'whtEntries', 'WHT'),
+)
+
+CENT = Decimal('0.01')
+
+
+def to_decimal(value) -> Decimal:
+    """Form amounts arrive as strings ('150,000.00'), numbers or blanks"""
+    if value is None or value == '':
+        return Decimal('0')
+    try:
+        amount = Decimal(str(value).replace(',', '').strip())
+    except InvalidOperation:
+        return Decimal('0')
+    return amount if amount.is_finite() else Decimal('0')
+
+
+def money(amount: Decimal) -> float:
+    return float(amount.quantize(CENT, rounding=ROUND_HALF_UP))
+
+
+class RateSchedule:
+    """A relief and progressive brackets of (width, rate %); the last bracket is unbounded"""
+
+    def __init__(self, relief, brackets):
+        self.relief = to_decimal(relief)
+        self.brackets = [(to_decimal(width), to_decimal(rate)) for width, rate in brackets]
+
+    def tax(self, income: Decimal) -> Tuple[Decimal, List[Dict[str, float]]]:
+        """Tax on an amount the relief was already taken from, with the per-bracket breakdown"""
+        remaining = max(Decimal('0'), income)
+        total = Decimal('0')
+        lower = Decimal('0')
+        breakdown = []
+        for position, (width, rate) in enumerate(self.brackets):
+            if remaining <= 0:
+                break
+            last = position == len(self.brackets) - 1 or width >= UNLIMITED
+            taxable = remaining if last else min(remaining, width)
+            tax = taxable * rate / 100
+            breakdown.append({'from': money(lower), 'to': money(lower + taxable), 'rate': float(rate),
+                              'taxable_amount': money(taxable), 'tax_amount': money(tax)})
+            total += tax
+            remaining -= taxable
+            lower += taxable
+        return total, breakdown
+
+
+class RateScheduleCache:
+    """
+    Annual rate schedules read from the tax_calculator rate tables, kept in
+    process memory for rate_cache_ttl seconds. Built-in schedules stand in
+    for tables that don't exist.
+    """
+
+    def __init__(self, ttl: float, clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self._schedules: Dict[Tuple[str, str], Tuple[float, RateSchedule]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, kind: str, tax_year: str) -> RateSchedule:
+        if not isinstance(tax_year, str) or tax_year not in TAX_YEARS:
+            raise ValueError(f"Unsupported tax year: {tax_year}")
+        key = (kind, TAX_YEARS[tax_year])
+        cached = self._schedules.get(key)
+        if cached is not None and self.clock() - cached[0] < self.ttl:
+            return cached[1]
+        with self._lock:
+            cached = self._schedules.get(key)
+            if cached is None or self.clock() - cached[0] >= self.ttl:
+                cached = (self.clock(), self._load(*key))
+                self._schedules[key] = cached
+        return cached[1]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._schedules.clear()
+
+    def _load(self, kind: str, year: str) -> RateSchedule:
+        # Table names come from SCHEDULE_TABLES and TAX_YEARS only, never from input
+        table = f"{SCHEDULE_TABLES[kind]}_tax_rates_{year}"
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"SELECT bracket_limit, rate, relief_amount FROM {table} "
+                    "WHERE period_type = %s AND is_active = TRUE ORDER BY bracket_order",
+                    ['annually']
+                )
+                rows = cursor.fetchall()
+        except DatabaseError as e:
+            logger.info(f"Rate table {table} unavailable, using built-in schedule: {str(e)}")
+            rows = []
+        if not rows:
+            relief, brackets = DEFAULT_RATE_SCHEDULES[(kind, year)]
+            return RateSchedule(relief, brackets)
+        return RateSchedule(rows[0][2] or 0, [(limit, rate) for limit, rate, _ in rows])
+
+
+class TaxEngine:
+    """
+    Computes a tax return from the auto-fill form mappings (the structure
+    auto_fill_forms returns) in one pass:
+
+    - assessable income: employment, business and investment income net of
+      their deductions, and other income
+    - reliefs: the personal relief of the year's schedule plus qualifying
+      payments, limited to the assessable income
+    - income tax on the taxable income by the progressive schedule, shared
+      out over the income categories by their part of the assessable income
+    - terminal benefits taxed separately by their own schedule
+    - APIT and WHT credited against the liability
+    """
+
+    def __init__(self, options: Optional[Dict[str, Any]] = None):
+        self._options = options
+        self._rates = None
+        self._rates_lock = threading.Lock()
+
+    @property
+    def options(self) -> Dict[str, Any]:
+        config = dict(DEFAULT_TAX_ENGINE)
+        config.update(self._options if self._options is not None else getattr(settings, 'TAX_ENGINE', {}))
+        return config
+
+    @property
+    def rates(self) -> RateScheduleCache:
+        if self._rates is None:
+            with self._rates_lock:
+                if self._rates is None:
+                    self._rates = RateScheduleCache(self.options['rate_cache_ttl'])
+        return self._rates
+
+    @staticmethod
+    def _validate(mappings: Any) -> None:
+        """Form mappings are an object of sections, each an object of entry lists"""
+        if not isinstance(mappings, dict):
+            raise ValueError('mappings must be an object of form sections')
+        sections = [section for section, _, _ in INCOME_SECTIONS] + [QUALIFYING_SECTION, TERMINAL_SECTION]
+        for section in sections:
+            if mappings.get(section) is not None and not isinstance(mappings[section], dict):
+                raise ValueError(f"Form section {section} must be an object of entry lists")
+
+    @staticmethod
+    def _entries(mappings: Dict[str, Any], section: str, entry_list: str) -> List[Dict[str, Any]]:
+        entries = (mappings.get(section) or {}).get(entry_list)
+        if not isinstance(entries, list):
+            return []
+        return [entry for entry in entries if isinstance(entry, dict)]
+
+    def _sum(self, mappings, section: str, entry_lists) -> Tuple[Decimal, List[Dict[str, Any]]]:
+        total = Decimal('0')
+        entries = []
+        for entry_list in entry_lists:
+            for entry in self._entries(mappings, section, entry_list):
+                amount = to_decimal(entry.get('amount'))
+                if amount:
+                    total += amount
+                    entries.append({'name': entry.get('name') or entry.get('source') or entry_list,
+                                    'amount': amount, 'entry_list': entry_list})
+        return total, entries
+
+    def compute(self, mappings: Dict[str, Any], tax_year: Optional[str] = None) -> Dict[str, Any]:
+        """Raises ValueError for an unsupported tax year or malformed mappings"""
+        self._validate(mappings)
+        tax_year = tax_year or self.options['default_tax_year']
+        income_schedule = self.rates.get('income', tax_year)
+        terminal_schedule = self.rates.get('terminal', tax_year)
+
+        categories = []
+        assessable = Decimal('0')
+        for section, income_lists, deduction_lists in INCOME_SECTIONS:
+            gross, entries = self._sum(mappings, section, income_lists)
+            deducted, deduction_entries = self._sum(mappings, section, deduction_lists)
+            net = max(Decimal('0'), gross - deducted)
+            assessable += net
+            categories.append({'category': section, 'gross': gross, 'deductions': deducted, 'assessable': net,
+                               'entries': entries, 'deduction_entries': deduction_entries})
+
+        qualifying, qualifying_entries = self._sum(mappings, QUALIFYING_SECTION,
+                                                   self._entry_lists(mappings, QUALIFYING_SECTION))
+        personal_relief = min(income_schedule.relief, assessable)
+        qualifying_relief = min(qualifying, assessable - personal_relief)
+        taxable = assessable - personal_relief - qualifying_relief
+        income_tax, brackets = income_schedule.tax(taxable)
+
+        # Share the tax out by assessable income; the last category takes the rounding remainder
+        allocated = Decimal('0')
+        taxed = [category for category in categories if category['assessable'] > 0]
+        for category in categories:
+            if category['assessable'] <= 0:
+                category['tax'] = Decimal('0')
+            elif category is taxed[-1]:
+                category['tax'] = income_tax - allocated
+            else:
+                category['tax'] = (income_tax * category['assessable'] / assessable).quantize(CENT)
+                allocated += category['tax']
+
+        terminal, terminal_entries = self._sum(mappings, TERMINAL_SECTION, self._entry_lists(mappings, TERMINAL_SECTION))
+        terminal_taxable = max(Decimal('0'), terminal - terminal_schedule.relief)
+        terminal_tax, terminal_brackets = terminal_schedule.tax(terminal_taxable)
+
+        credits = []
+        for section, entry_list, deduction_type in TAX_CREDITS:
+            amount, _ = self._sum(mappings, section, (entry_list,))
+            credits.append({'type': deduction_type, 'amount': amount})
+        credit_total = sum((credit['amount'] for credit in credits), Decimal('0'))
+        total_tax = income_tax + terminal_tax
+
+        return {
+            'tax_year': tax_year,
+            'categories': [self._category_result(category) for category in categories],
+            'assessable_income': money(assessable),
+            'personal_relief': money(personal_relief),
+            'qualifying_payments': money(qualifying),
+            'qualifying_relief': money(qualifying_relief),
+            'qualifying_entries': [{'name': entry['name'], 'amount': money(entry['amount'])}
+                                   for entry in qualifying_entries],
+            'taxable_income': money(taxable),
+            'income_tax': money(income_tax),
+            'brackets': brackets,
+            'terminal_benefits': {
+                'amount': money(terminal),
+                'taxable_amount': money(terminal_taxable),
+                'tax': money(terminal_tax),
+                'brackets': terminal_brackets,
+                'entries': [{'name': entry['name'], 'amount': money(entry['amount'])} for entry in terminal_entries],
+            },
+            'tax_credits': {credit['type']: money(credit['amount']) for credit in credits},
+            'total_tax_credits': money(credit_total),
+            'total_tax_payable': money(total_tax),
+            'balance_tax_payable': money(max(Decimal('0'), total_tax - credit_total)),
+            'refund_due': money(max(Decimal('0'), credit_total - total_tax)),
+        }
+
+    @staticmethod
+    def _entry_lists(mappings: Dict[str, Any], section: str) -> List[str]:
+        return list((mappings.get(section) or {}).keys())
+
+    @staticmethod
+    def _category_result(category: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            'category': category['category'],
+            'gross': money(category['gross']),
+            'deductions': money(category['deductions']),
+            'assessable': money(category['assessable']),
+            'tax': money(category['tax']),
+            'entries': [{'name': entry['name'], 'amount': money(entry['amount'])} for entry in category['entries']],
+        }
+
+    def save(self, result: Dict[str, Any], user):
+        """
+        Persist a computed return as a TaxReport with its categories,
+        entries and deductions: one insert per table.
+        """
+        from ..models import TaxReport, IncomeCategory, IncomeEntry, TaxDeduction
+
+        with transaction.atomic():
+            report = TaxReport.objects.create(
+                user=user,
+                tax_year=result['tax_year'],
+                assessable_income=result['assessable_income'],
+                taxable_income=result['taxable_income'],
+                total_tax_payable=result['total_tax_payable'],
+            )
+
+            sections = [(category['category'], category['assessable'], category['entries'])
+                        for category in result['categories'] if category['entries']]
+            if result['terminal_benefits']['entries']:
+                sections.append((TERMINAL_SECTION, result['terminal_benefits']['amount'],
+                                 result['terminal_benefits']['entries']))
+            categories = IncomeCategory.objects.bulk_create([
+                IncomeCategory(tax_report=report, category_type=section, total_amount=total)
+                for section, total, _ in sections
+            ])
+            if any(category.pk is None for category in categories):
+                # Backends that don't return ids from a bulk insert (MySQL)
+                by_type = {category.category_type: category for category in report.categories.all()}
+                categories = [by_type[section] for section, _, _ in sections]
+
+            IncomeEntry.objects.bulk_create([
+                IncomeEntry(category=category, name=str(entry['name'])[:255], amount=entry['amount'])
+                for category, (_, _, entries) in zip(categories, sections)
+                for entry in entries
+            ])
+
+            deductions = [('PERSONAL_RELIEF', result['personal_relief'])]
+            deductions += [('QUALIFYING_PAYMENT', entry['amount']) for entry in result['qualifying_entries']]
+            deductions += list(result['tax_credits'].items())
+            TaxDeduction.objects.bulk_create([
+                TaxDeduction(tax_report=report, deduction_type=deduction_type, amount=amount)
+                for deduction_type, amount in deductions if amount
+            ])
+        logger.info(f"Saved tax report {report.pk} for {result['tax_year']}: {len(sections)} categories")
+        return report
+
+# Create a singleton instance
+tax_engine = TaxEngine()
@@ -0,0 +1,470 @@
+import os
+import time
+import shutil
+import hashlib
+import logging
+import threading
+from datetime import timedelta
+from typing import Dict, Any, Iterable, Iterator, Optional, Set
+from django.conf import settings # type: ignore
+from django.db.models import Count, Max, Sum # type: ignore
+from django.utils import timezone # type: ignore
+
+try:
+    import fcntl # type: ignore
+    FCNTL_INSTALLED = True
+except ImportError:
+    FCNTL_INSTALLED = False
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_UPLOAD_SWEEPER = {
+    'temp_max_age': 60 * 60,  # files in media/temp and scratch files in the blob store
+    'stalled_upload_max_age': 24 * 60 * 60,  # chunked uploads that received nothing for this long
+    'failed_upload_max_age': 60 * 60,  # failed chunked upload rows are kept this long for status polls
+    'session_grace': 60 * 60,  # files of a session outlive its last activity and expiry by this long
+    'orphan_blob_grace': 60 * 60,  # a blob file is written just before its row is created
+    'expanded_max_age': 24 * 60 * 60,  # decompressed copies of compressed blobs are rebuilt on demand
+    'batch_size': 200,  # deletions between pauses
+    'batch_pause': 0.05,  # seconds to pause after every batch, so a sweep doesn't saturate the disk
+    'interval': 0,  # run in-process every this many seconds; 0 disables the scheduler
+}
+
+TEMP_DIR = 'temp'
+SESSION_ROOT = 'tax_documents'
+LEGACY_PREVIEW_ROOT = 'previews'
+PART_SUFFIX = '.part'
+LOCK_NAME = '.upload_sweeper.lock'
+
+
+def tree_size(path: str) -> int:
+    """Bytes used by a file or by every file below a directory"""
+    try:
+        if not os.path.isdir(path) or os.path.islink(path):
+            return os.lstat(path).st_size
+    except FileNotFoundError:
+        return 0
+    total = 0
+    for entry in scandir(path):
+        try:
+            total += tree_size(entry.path) if entry.is_dir(follow_symlinks=False) else entry.stat(follow_symlinks=False).st_size
+        except FileNotFoundError:
+            continue
+    return total
+
+
+def scandir(path: str) -> Iterator[os.DirEntry]:
+    """Entries of a directory; nothing if it doesn't exist (anymore)"""
+    try:
+        with os.scandir(path) as entries:
+            yield from entries
+    except (FileNotFoundError, NotADirectoryError):
+        return
+
+
+def modified(entry: os.DirEntry) -> float:
+    try:
+        return entry.stat(follow_symlinks=False).st_mtime
+    except FileNotFoundError:
+        return float('inf')
+
+
+class Reclaimer:
+    """
+    Deletes files and directories in rate-limited batches and keeps the
+    per-category tally of what was (or, in a dry run, would be) reclaimed
+    """
+
+    def __init__(self, batch_size: int, batch_pause: float, dry_run: bool = False, sleep=time.sleep):
+        self.batch_size = max(1, batch_size)
+        self.batch_pause = batch_pause
+        self.dry_run = dry_run
+        self.sleep = sleep
+        self.report: Dict[str, Dict[str, int]] = {}
+        self._in_batch = 0
+
+    def _tally(self, category: str, files: int, size: int) -> None:
+        counts = self.report.setdefault(category, {'files': 0, 'bytes': 0})
+        counts['files'] += files
+        counts['bytes'] += size
+
+    def _throttle(self) -> None:
+        self._in_batch += 1
+        if self._in_batch >= self.batch_size:
+            self._in_batch = 0
+            if self.batch_pause and not self.dry_run:
+                self.sleep(self.batch_pause)
+
+    def remove(self, path: str, category: str) -> None:
+        """Delete a file or a directory tree"""
+        size = tree_size(path)
+        if not self.dry_run:
+            try:
+                if os.path.isdir(path) and not os.path.islink(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+            except FileNotFoundError:
+                return
+            except OSError as e:
+                logger.error(f"Error removing {path}: {str(e)}")
+                return
+        self._tally(category, 1, size)
+        self._throttle()
+
+    def count(self, category: str, files: int, size: int) -> None:
+        """Record space released some other way (e.g. blobs dropped by the storage)"""
+        self._tally(category, files, size)
+        self._throttle()
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            'dry_run': self.dry_run,
+            'categories': self.report,
+            'files': sum(counts['files'] for counts in self.report.values()),
+            'bytes': sum(counts['bytes'] for counts in self.report.values()),
+        }
+
+
+def sweep_blob_tree(blob_root: str, blob_paths: Set[str], reclaimer: Reclaimer, now: float,
+                    orphan_grace: float, expanded_max_age: float, scratch_dir: str = 'tmp') -> None:
+    """
+    Walk ``blobs/ab/cd/`` and drop what no StoredBlob row accounts for:
+    blob files without a row, preview directories of removed blobs, and
+    decompressed copies of compressed blobs that weren't used for a while.
+    blob_paths are the blobs' file names (relative to blob_root).
+    """
+    digests = {os.path.basename(path).split('.', 1)[0] for path in blob_paths}
+    for first in scandir(blob_root):
+        if first.name == scratch_dir or not first.is_dir(follow_symlinks=False):
+            continue
+        for second in scandir(first.path):
+            if not second.is_dir(follow_symlinks=False):
+                continue
+            for entry in scandir(second.path):
+                relative = os.path.join(first.name, second.name, entry.name)
+                age = now - modified(entry)
+                if entry.is_dir(follow_symlinks=False):
+                    digest = entry.name.split('.', 1)[0]
+                    if digest not in digests and age > orphan_grace:
+                        reclaimer.remove(entry.path, 'orphan_previews')
+                elif relative in blob_paths:
+                    continue
+                elif relative + '.zst' in blob_paths:
+                    # Access times are often disabled; the newer of both is the last use we can see
+                    try:
+                        stat = entry.stat(follow_symlinks=False)
+                        last_used = max(stat.st_atime, stat.st_mtime)
+                    except FileNotFoundError:
+                        continue
+                    if now - last_used > expanded_max_age:
+                        reclaimer.remove(entry.path, 'expanded_copies')
+                elif age > orphan_grace:
+                    # Also catches compression temp files left by a crashed upload
+                    reclaimer.remove(entry.path, 'orphan_blobs')
+
+
+class UploadSweeper:
+    """
+    Reclaims disk space that no session needs anymore.
+
+    Session uploads are only removed when the frontend calls
+    cleanup_tax_session, and temp files of a failed analysis are never
+    removed. The sweeper walks the upload tree with os.scandir and
+    cross-checks it against live Django sessions and the document,
+    chunked upload and blob tables:
+
+    - sessions without an unexpired Django session and without activity
+      for ``session_grace`` lose their documents, stored names, aggregate
+      and session directory (what cleanup_tax_session does)
+    - stale files in media/temp and the blob store's scratch directory,
+      .part files of finished, failed or stalled chunked uploads, and old
+      failed upload rows
+    - blobs nothing references anymore, blob files without a StoredBlob
+      row, previews of removed blobs and unused decompressed copies
+
+    Deletions run in batches of ``batch_size`` with a pause after each.
+    """
+
+    def __init__(self, options: Optional[Dict[str, Any]] = None, storage=None, clock=time.time, sleep=time.sleep):
+        self._options = options
+        self._storage = storage
+        self.clock = clock
+        self.sleep = sleep
+
+    @property
+    def options(self) -> Dict[str, Any]:
+        config = dict(DEFAULT_UPLOAD_SWEEPER)
+        config.update(self._options if self._options is not None else getattr(settings, 'UPLOAD_SWEEPER', {}))
+        return config
+
+    @property
+    def storage(self):
+        if self._storage is not None:
+            return self._storage
+        from ..storage import upload_storage
+        return upload_storage
+
+    @property
+    def media_root(self) -> str:
+        return self.storage.location
+
+    def sweep(self, dry_run: bool = False) -> Dict[str, Any]:
+        """Run every stage once and return what was reclaimed"""
+        options = self.options
+        reclaimer = Reclaimer(options['batch_size'], options['batch_pause'], dry_run=dry_run, sleep=self.sleep)
+        start = time.perf_counter()
+        now = self.clock()
+
+        sessions = self.sweep_sessions(reclaimer, now)
+        self.sweep_uploads(reclaimer, now)
+        self.sweep_temp(reclaimer, now)
+        self.sweep_blobs(reclaimer, now)
+
+        summary = reclaimer.summary()
+        summary['sessions'] = sessions
+        summary['duration_ms'] = round((time.perf_counter() - start) * 1000, 2)
+        logger.info(
+            f"Upload sweep{' (dry run)' if dry_run else ''}: {summary['files']} files, "
+            f"{summary['bytes']} bytes, {len(sessions)} sessions in {summary['duration_ms']}ms"
+        )
+        return summary
+
+    # Sessions
+
+    def _session_activity(self) -> Dict[str, float]:
+        """Last activity (epoch seconds) of every session that owns files or rows"""
+        from ..models import TaxFormDocument, ChunkedUpload, SessionAnalysisAggregate
+
+        activity: Dict[str, float] = {}
+
+        def seen(session_id: str, when) -> None:
+            if not session_id or when is None:
+                return
+            stamp = when if isinstance(when, float) else when.timestamp()
+            activity[session_id] = max(activity.get(session_id, 0.0), stamp)
+
+        for row in TaxFormDocument.objects.values('session_id').annotate(
+                uploaded=Max('uploaded_at'), analyzed=Max('analyzed_at')):
+            seen(row['session_id'], row['uploaded'])
+            seen(row['session_id'], row['analyzed'])
+        for row in ChunkedUpload.objects.values('session_id').annotate(updated=Max('updated_at')):
+            seen(row['session_id'], row['updated'])
+        for session_id, updated in SessionAnalysisAggregate.objects.values_list('session_id', 'updated_at'):
+            seen(session_id, updated)
+        for entry in scandir(os.path.join(self.media_root, SESSION_ROOT)):
+            if entry.is_dir(follow_symlinks=False):
+                seen(entry.name, modified(entry))
+        return activity
+
+    def _live_sessions(self, session_ids: Iterable[str], cutoff) -> Set[str]:
+        from django.contrib.sessions.models import Session # type: ignore
+        session_ids = list(session_ids)
+        live = set()
+        # Chunked so the IN clause stays within SQLite's variable limit
+        for start in range(0, len(session_ids), 500):
+            live.update(Session.objects.filter(
+                session_key__in=session_ids[start:start + 500], expire_date__gt=cutoff
+            ).values_list('session_key', flat=True))
+        return live
+
+    def _released_bytes(self, names: Iterable[str]) -> Dict[str, int]:
+        """Blob files that releasing these names frees: blobs referenced by nothing else"""
+        from ..models import StoredBlob, StoredFile
+        references = dict(StoredFile.objects.filter(name__in=list(names)).values('blob_id')
+                          .annotate(count=Count('id')).values_list('blob_id', 'count'))
+        freed = {'files': 0, 'bytes': 0}
+        for blob_id, ref_count, stored_size in StoredBlob.objects.filter(pk__in=references.keys()).values_list(
+                'id', 'ref_count', 'stored_size'):
+            if ref_count <= references[blob_id]:
+                freed['files'] += 1
+                freed['bytes'] += stored_size
+        return freed
+
+    def sweep_sessions(self, reclaimer: Reclaimer, now: float) -> list:
+        """Remove everything of sessions that expired and have been idle for session_grace"""
+        from ..models import TaxFormDocument, ChunkedUpload, StoredFile
+        from .session_aggregate import session_aggregates
+
+        grace = self.options['session_grace']
+        activity = self._session_activity()
+        idle = [session_id for session_id, last in activity.items() if now - last > grace]
+        live = self._live_sessions(idle, timezone.now() - timedelta(seconds=grace)) if idle else set()
+        dead = [session_id for session_id in idle if session_id not in live]
+
+        for session_id in dead:
+            prefix = f"{SESSION_ROOT}/{session_id}/"
+            documents = list(TaxFormDocument.objects.filter(session_id=session_id))
+            names = [document.file.name for document in documents if document.file.name]
+            names += list(StoredFile.objects.filter(name__startswith=prefix).values_list('name', flat=True))
+            names = list(dict.fromkeys(names))
+
+            # Count first: once released, blobs and plain files can't be measured anymore
+            freed = self._released_bytes(names)
+            reclaimer.count('session_blobs', freed['files'], freed['bytes'])
+            stored = set(StoredFile.objects.filter(name__in=names).values_list('name', flat=True))
+            for name in names:
+                # Plain files inside the session directory are counted with it below
+                if name not in stored and not name.startswith(prefix):
+                    path = self.storage.path(name)
+                    if os.path.exists(path):
+                        reclaimer.count('session_files', 1, tree_size(path))
+
+            if not reclaimer.dry_run:
+                for name in names:
+                    # Releases stored names (blobs go with their last name) and removes plain files
+                    self.storage.delete(name)
+                TaxFormDocument.objects.filter(session_id=session_id).delete()
+                ChunkedUpload.objects.filter(session_id=session_id).delete()
+                session_aggregates.clear(session_id)
+
+            session_dir = os.path.join(self.media_root, SESSION_ROOT, session_id)
+            if os.path.isdir(session_dir):
+                reclaimer.remove(session_dir, 'session_files')
+            logger.info(f"Swept expired session {session_id}: {len(documents)} documents")
+        return dead
+
+    # Chunked uploads and scratch files
+
+    def sweep_uploads(self, reclaimer: Reclaimer, now: float) -> None:
+        """
+        .part files are kept only for uploads still receiving chunks; stalled
+        uploads are failed first, so a late chunk gets a clear error
+        """
+        from ..models import ChunkedUpload
+        options = self.options
+
+        stalled_before = timezone.now() - timedelta(seconds=options['stalled_upload_max_age'])
+        if not reclaimer.dry_run:
+            stalled = ChunkedUpload.objects.filter(status='uploading', updated_at__lt=stalled_before).update(
+                status='failed', error='Upload expired')
+            if stalled:
+                logger.info(f"Expired {stalled} stalled chunked uploads")
+
+        scratch = self.storage.temp_dir()
+        active = {str(upload_id) for upload_id in ChunkedUpload.objects.filter(
+            status='uploading', updated_at__gte=stalled_before).values_list('id', flat=True)}
+        for entry in scandir(scratch):
+            if not entry.is_file(follow_symlinks=False):
+                continue
+            age = now - modified(entry)
+            if entry.name.endswith(PART_SUFFIX):
+                # Grace for a part file written just before its row commits
+                if entry.name[:-len(PART_SUFFIX)] not in active and age > options['temp_max_age']:
+                    reclaimer.remove(entry.path, 'upload_parts')
+            elif age > options['temp_max_age']:
+                reclaimer.remove(entry.path, 'temp_files')
+
+        failed_before = timezone.now() - timedelta(seconds=options['failed_upload_max_age'])
+        if not reclaimer.dry_run:
+            removed = ChunkedUpload.objects.filter(status='failed', updated_at__lt=failed_before).delete()[0]
+            if removed:
+                logger.info(f"Removed {removed} failed chunked uploads")
+
+    def sweep_temp(self, reclaimer: Reclaimer, now: float) -> None:
+        """Files a request left in media/temp (analyses that raised before cleaning up)"""
+        max_age = self.options['temp_max_age']
+
+        def walk(path: str) -> None:
+            for entry in scandir(path):
+                if entry.is_dir(follow_symlinks=False):
+                    walk(entry.path)
+                elif now - modified(entry) > max_age:
+                    reclaimer.remove(entry.path, 'temp_files')
+
+        walk(os.path.join(self.media_root, TEMP_DIR))
+
+    # Blob store
+
+    def sweep_blobs(self, reclaimer: Reclaimer, now: float) -> None:
+        from ..models import StoredBlob, StoredFile, TaxFormDocument
+        options = self.options
+        prefix = self.storage.options['blob_prefix']
+
+        # Tombstones whose purge never ran (e.g. the process died right after the release committed)
+        tombstones = StoredBlob.objects.filter(ref_count__lte=0).aggregate(count=Count('id'), stored=Sum('stored_size'))
+        if tombstones['count']:
+            reclaimer.count('orphan_blobs', tombstones['count'], tombstones['stored'] or 0)
+            if not reclaimer.dry_run:
+                self.storage.purge_unreferenced()
+
+        blob_root = os.path.join(self.media_root, prefix)
+        blob_paths = {os.path.relpath(path, prefix) for path in StoredBlob.objects.values_list('path', flat=True)}
+        sweep_blob_tree(blob_root, blob_paths, reclaimer, now, options['orphan_blob_grace'],
+                        options['expanded_max_age'], scratch_dir=os.path.basename(self.storage.temp_dir()))
+
+        # Previews of names outside the blob store are keyed by a hash of the name
+        stored_names = set(StoredFile.objects.values_list('name', flat=True))
+        keys = {hashlib.sha256(name.encode('utf-8')).hexdigest()
+                for name in TaxFormDocument.objects.exclude(file='').values_list('file', flat=True)
+                if name not in stored_names}
+        for first in scandir(os.path.join(self.media_root, LEGACY_PREVIEW_ROOT)):
+            for entry in scandir(first.path):
+                if entry.name not in keys and now - modified(entry) > options['orphan_blob_grace']:
+                    reclaimer.remove(entry.path, 'orphan_previews')
+
+    # Scheduling
+
+    def _acquire_lock(self):
+        """Inter-process lock so only one worker sweeps at a time; None if another one is"""
+        os.makedirs(self.media_root, exist_ok=True)
+        handle = open(os.path.join(self.media_root, LOCK_NAME), 'a')
+        if not FCNTL_INSTALLED:
+            return handle
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return None
+        return handle
+
+    def sweep_locked(self, dry_run: bool = False) -> Optional[Dict[str, Any]]:
+        """Sweep unless another process is already sweeping (then None)"""
+        handle = self._acquire_lock()
+        if handle is None:
+            logger.info("Upload sweep skipped: another process is sweeping")
+            return None
+        try:
+            return self.sweep(dry_run=dry_run)
+        finally:
+            handle.close()
+
+
+_scheduler = None
+_scheduler_pid = None
+_scheduler_lock = threading.Lock()
+
+
+def start_sweeper(sweeper: Optional[UploadSweeper] = None) -> Optional[threading.Thread]:
+    """
+    Start the in-process sweep loop if UPLOAD_SWEEPER['interval'] is set.
+    Safe to call from every worker: one loop per process, and the file
+    lock lets only one of them sweep at a time.
+    """
+    global _scheduler, _scheduler_pid
+    sweeper = sweeper or upload_sweeper
+    interval = sweeper.options['interval']
+    if not interval:
+        return None
+
+    pid = os.getpid()
+    with _scheduler_lock:
+        if _scheduler is not None and _scheduler_pid == pid and _scheduler.is_alive():
+            return _scheduler
+
+        def loop() -> None:
+            while True:
+                sweeper.sleep(interval)
+                try:
+                    sweeper.sweep_locked()
+                except Exception as e:
+                    logger.error(f"Error sweeping uploads: {str(e)}")
+
+        _scheduler = threading.Thread(target=loop, name='upload-sweeper', daemon=True)
+        _scheduler_pid = pid
+        _scheduler.start()
+        logger.info(f"Upload sweeper scheduled every {interval}s in process {pid}")
+        return _scheduler
+
+# Create a singleton instance
+upload_sweeper = UploadSweeper()
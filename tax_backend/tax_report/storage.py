@@ -0,0 +1,467 @@
+import os
+import shutil
+import hashlib
+import logging
+import tempfile
+from typing import Dict, Any, Iterable, Optional
+from django.conf import settings # type: ignore
+from django.core.files import File # type: ignore
+from django.core.files.storage import FileSystemStorage # type: ignore
+from django.db import IntegrityError, transaction # type: ignore
+from django.db.models import Count, F, Sum # type: ignore
+from django.utils.deconstruct import deconstructible # type: ignore
+
+try:
+    import zstandard as zstd # type: ignore
+    ZSTD_INSTALLED = True
+except ImportError:
+    ZSTD_INSTALLED = False
+    print("Warning: zstandard not installed. Upload compression will be disabled.")
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+COMPRESSED_SUFFIX = '.zst'
+PREVIEW_SUFFIX = '.previews'
+# Names released per transaction by delete_prefix
+RELEASE_BATCH_SIZE = 500
+
+DEFAULT_UPLOAD_STORAGE = {
+    'blob_prefix': 'blobs',
+    'compress': False,
+    'compression_level': 10,
+    # Keep the compressed copy only if it is at most this fraction of the original
+    'min_compression_ratio': 0.9,
+    # Formats that are already compressed are never worth another pass
+    'skip_compression_extensions': ('.jpg', '.jpeg', '.png', '.gif', '.docx', '.xlsx', '.zip', '.gz'),
+}
+
+# Generated reports share the blob pool with uploads but are compressed by default
+DEFAULT_REPORT_STORAGE = dict(DEFAULT_UPLOAD_STORAGE, compress=True)
+
+
+def file_digest(path: str) -> str:
+    """sha256 of a file on disk, read in chunks"""
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+@deconstructible
+class ContentAddressableStorage(FileSystemStorage):
+    """
+    Deduplicating storage for uploaded tax documents.
+
+    Uploads are hashed while they are streamed to disk and every unique
+    content is kept once as a blob under ``blobs/ab/cd/<sha256><ext>``. The
+    names handed out to models are logical names (e.g.
+    ``tax_documents/<session>/<uuid>_<name>``) recorded in StoredFile rows that
+    point at a StoredBlob; blobs are reference counted and removed from disk
+    only when the last name referencing them is deleted. Blobs can optionally
+    be zstd-compressed.
+
+    Names without a StoredFile row (files saved before this backend was
+    introduced) fall through to the plain FileSystemStorage behaviour.
+    """
+
+    defaults = DEFAULT_UPLOAD_STORAGE
+    settings_key = 'UPLOAD_STORAGE'
+
+    def __init__(self, location=None, base_url=None, options: Optional[Dict[str, Any]] = None, **kwargs):
+        super().__init__(location=location, base_url=base_url, **kwargs)
+        self._options = options
+
+    @property
+    def options(self) -> Dict[str, Any]:
+        config = dict(self.defaults)
+        config.update(self._options if self._options is not None else getattr(settings, self.settings_key, {}))
+        return config
+
+    @property
+    def compression_enabled(self) -> bool:
+        return ZSTD_INSTALLED and self.options['compress']
+
+    # Lookups
+
+    def _stored_file(self, name):
+        from .models import StoredFile
+        return StoredFile.objects.select_related('blob').filter(name=name).first()
+
+    def _blob_path(self, digest: str, extension: str, compressed: bool = False) -> str:
+        relative = os.path.join(self._digest_dir(digest), digest + extension)
+        return relative + COMPRESSED_SUFFIX if compressed else relative
+
+    def _expanded_path(self, blob) -> str:
+        """Absolute path of the decompressed copy of a compressed blob"""
+        return super().path(blob.path[:-len(COMPRESSED_SUFFIX)])
+
+    def _digest_dir(self, digest: str) -> str:
+        return os.path.join(self.options['blob_prefix'], digest[:2], digest[2:4])
+
+    def preview_dir(self, name: str) -> str:
+        """
+        Absolute directory for rendered previews of a name: next to its blob,
+        so identical uploads share previews and they go away with the blob.
+        Names outside the blob store get a directory keyed by the name.
+        """
+        digest = self.digest(name)
+        if digest:
+            return super().path(os.path.join(self._digest_dir(digest), digest + PREVIEW_SUFFIX))
+        key = hashlib.sha256(name.encode('utf-8')).hexdigest()
+        return super().path(os.path.join('previews', key[:2], key))
+
+    def digest(self, name: str) -> Optional[str]:
+        """Content digest for a logical name, or None for names outside the blob store"""
+        stored = self._stored_file(name)
+        return stored.blob.digest if stored else None
+
+    def stat(self, name: str) -> Dict[str, Any]:
+        """Digest (None outside the blob store), size and modification time in one lookup"""
+        stored = self._stored_file(name)
+        if not stored:
+            return {'digest': None, 'size': super().size(name), 'modified_time': super().get_modified_time(name),
+                    'compressed': False}
+        return {
+            'digest': stored.blob.digest,
+            'size': stored.blob.size,
+            'modified_time': super().get_modified_time(stored.blob.path),
+            'compressed': stored.blob.compressed,
+        }
+
+    def exists(self, name):
+        from .models import StoredFile
+        return StoredFile.objects.filter(name=name).exists() or super().exists(name)
+
+    def size(self, name):
+        stored = self._stored_file(name)
+        return stored.blob.size if stored else super().size(name)
+
+    def url(self, name):
+        stored = self._stored_file(name)
+        if stored and not stored.blob.compressed:
+            return super().url(stored.blob.path)
+        return super().url(name)
+
+    def get_modified_time(self, name):
+        stored = self._stored_file(name)
+        return super().get_modified_time(stored.blob.path) if stored else super().get_modified_time(name)
+
+    def path(self, name):
+        """
+        Filesystem path of the content. Compressed blobs are expanded once
+        next to the blob for consumers that need a real file (e.g. OCR).
+        """
+        stored = self._stored_file(name)
+        if not stored:
+            return super().path(name)
+        if not stored.blob.compressed:
+            return super().path(stored.blob.path)
+
+        expanded = self._expanded_path(stored.blob)
+        if not os.path.exists(expanded):
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(expanded))
+            with os.fdopen(fd, 'wb') as out, open(super().path(stored.blob.path), 'rb') as src:
+                zstd.ZstdDecompressor().copy_stream(src, out)
+            os.replace(temp_path, expanded)
+        return expanded
+
+    def _open(self, name, mode='rb'):
+        stored = self._stored_file(name)
+        if not stored:
+            return super()._open(name, mode)
+        if not stored.blob.compressed:
+            return File(open(super().path(stored.blob.path), mode), name=name)
+
+        # Spool the decompressed content so callers get a seekable file
+        spooled = tempfile.SpooledTemporaryFile(max_size=8 * CHUNK_SIZE)
+        with open(super().path(stored.blob.path), 'rb') as src:
+            zstd.ZstdDecompressor().copy_stream(src, spooled)
+        spooled.seek(0)
+        return File(spooled, name=name)
+
+    def open_stream(self, name):
+        """
+        Forward-only reader of a name's original bytes. Compressed blobs are
+        decompressed as they are read, without a copy on disk or in memory.
+        """
+        stored = self._stored_file(name)
+        if not stored:
+            return open(super().path(name), 'rb')
+        source = open(super().path(stored.blob.path), 'rb')
+        if not stored.blob.compressed:
+            return source
+        return zstd.ZstdDecompressor().stream_reader(source, closefd=True)
+
+    # Writes
+
+    def temp_dir(self) -> str:
+        """
+        Scratch directory on the same filesystem as the blobs, so files
+        written there can be moved into the store with a rename
+        """
+        path = super().path(os.path.join(self.options['blob_prefix'], 'tmp'))
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def _save(self, name, content):
+        """Stream the upload to a temp file while hashing it, then commit the blob"""
+        fd, temp_path = tempfile.mkstemp(dir=self.temp_dir())
+
+        hasher = hashlib.sha256()
+        size = 0
+        try:
+            if hasattr(content, 'seek') and content.seekable():
+                content.seek(0)
+            with os.fdopen(fd, 'wb') as out:
+                for chunk in content.chunks(CHUNK_SIZE):
+                    hasher.update(chunk)
+                    size += len(chunk)
+                    out.write(chunk)
+            self._commit(name, temp_path, hasher.hexdigest(), size)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        return name
+
+    def adopt(self, name: str, local_path: str, digest: Optional[str] = None) -> str:
+        """
+        Register an existing local file (e.g. an assembled chunked upload)
+        under a logical name. The file is moved into the blob store, or
+        removed if identical content is already stored.
+        """
+        name = self.get_available_name(name)
+        digest = digest or file_digest(local_path)
+        try:
+            self._commit(name, local_path, digest, os.path.getsize(local_path))
+        finally:
+            if os.path.exists(local_path):
+                os.remove(local_path)
+        return name
+
+    def link(self, source: str, name: str) -> str:
+        """
+        Add a logical name for the content already stored under ``source``
+        without reading or copying it. Returns the name actually used.
+        """
+        from .models import StoredBlob, StoredFile
+
+        name = self.get_available_name(name)
+        with transaction.atomic():
+            stored = StoredFile.objects.select_for_update().filter(name=source).first()
+            if stored is None:
+                raise FileNotFoundError(f"No stored file named {source}")
+            StoredBlob.objects.filter(pk=stored.blob_id).update(ref_count=F('ref_count') + 1)
+            StoredFile.objects.create(name=name, blob_id=stored.blob_id)
+        return name
+
+    def _commit(self, name: str, temp_path: str, digest: str, size: int) -> None:
+        """Point ``name`` at the blob for ``digest``, storing temp_path as that blob if it is new"""
+        from .models import StoredBlob, StoredFile
+
+        extension = os.path.splitext(name)[1].lower()
+        with transaction.atomic():
+            blob = StoredBlob.objects.select_for_update().filter(digest=digest).first()
+            if blob is None:
+                blob = self._create_blob(temp_path, digest, extension, size)
+            else:
+                StoredBlob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1)
+                if not os.path.exists(super().path(blob.path)):
+                    # Heal a blob whose file went missing with the identical content
+                    self._place_blob(temp_path, blob.path, blob.compressed)
+                logger.info(f"Deduplicated upload {name} against blob {digest[:12]} ({size} bytes saved)")
+            StoredFile.objects.create(name=name, blob=blob)
+
+    def _create_blob(self, temp_path: str, digest: str, extension: str, size: int):
+        from .models import StoredBlob
+
+        compressed = self._should_compress(extension)
+        blob_path = self._blob_path(digest, extension, compressed)
+        stored_size = self._place_blob(temp_path, blob_path, compressed, size)
+        if stored_size is None:
+            # Compression did not pay off; keep the original bytes
+            compressed = False
+            blob_path = self._blob_path(digest, extension)
+            stored_size = self._place_blob(temp_path, blob_path, False)
+
+        try:
+            with transaction.atomic():
+                return StoredBlob.objects.create(
+                    digest=digest, path=blob_path, size=size, stored_size=stored_size,
+                    compressed=compressed, ref_count=1
+                )
+        except IntegrityError:
+            # A concurrent upload of the same content created the blob first
+            blob = StoredBlob.objects.select_for_update().get(digest=digest)
+            StoredBlob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1)
+            if blob.path != blob_path:
+                self._remove_blob_files(blob_path)
+            return blob
+
+    def _should_compress(self, extension: str) -> bool:
+        return self.compression_enabled and extension not in self.options['skip_compression_extensions']
+
+    def _place_blob(self, temp_path: str, blob_path: str, compressed: bool, size: int = 0) -> Optional[int]:
+        """
+        Write temp_path's content to blob_path and return the stored size.
+        Returns None when compressing would not save enough space.
+        """
+        full_path = super().path(blob_path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        if not compressed:
+            # shutil.move renames within a filesystem and copies across them
+            shutil.move(temp_path, full_path)
+            self._apply_permissions(full_path)
+            return os.path.getsize(full_path)
+
+        fd, compressed_temp = tempfile.mkstemp(dir=os.path.dirname(full_path))
+        with os.fdopen(fd, 'wb') as out, open(temp_path, 'rb') as src:
+            zstd.ZstdCompressor(level=self.options['compression_level']).copy_stream(src, out, size=size)
+        stored_size = os.path.getsize(compressed_temp)
+        if size and stored_size > size * self.options['min_compression_ratio']:
+            os.remove(compressed_temp)
+            return None
+        os.replace(compressed_temp, full_path)
+        self._apply_permissions(full_path)
+        return stored_size
+
+    def _apply_permissions(self, full_path: str) -> None:
+        if self.file_permissions_mode is not None:
+            os.chmod(full_path, self.file_permissions_mode)
+
+    def _remove_blob_files(self, blob_path: str) -> None:
+        full_path = super().path(blob_path)
+        paths = [full_path]
+        if blob_path.endswith(COMPRESSED_SUFFIX):
+            paths.append(full_path[:-len(COMPRESSED_SUFFIX)])
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        digest = os.path.basename(blob_path).split('.', 1)[0]
+        shutil.rmtree(os.path.join(os.path.dirname(full_path), digest + PREVIEW_SUFFIX), ignore_errors=True)
+
+    # Deletes
+
+    def delete(self, name):
+        if not self._release([name]):
+            shutil.rmtree(self.preview_dir(name), ignore_errors=True)
+            super().delete(name)
+
+    def delete_prefix(self, prefix: str) -> int:
+        """Release every logical name under a prefix (e.g. a session directory)"""
+        from .models import StoredFile
+        names = list(StoredFile.objects.filter(name__startswith=prefix).values_list('name', flat=True))
+        # Chunked so the IN clauses stay within SQLite's variable limit
+        for start in range(0, len(names), RELEASE_BATCH_SIZE):
+            self._release(names[start:start + RELEASE_BATCH_SIZE])
+        return len(names)
+
+    def _release(self, names: Iterable[str]) -> int:
+        """
+        Drop logical names and decrement their blobs' reference counts.
+        Blobs nobody references anymore stay behind as tombstones
+        (ref_count 0) until the transaction commits; purge_unreferenced then
+        removes their files, unless an upload of the same content revived
+        them in between. Returns the number of names released.
+        """
+        from .models import StoredBlob, StoredFile
+
+        names = list(names)
+        if not names:
+            return 0
+        with transaction.atomic():
+            files = StoredFile.objects.filter(name__in=names)
+            references = dict(files.values('blob_id').annotate(count=Count('id')).values_list('blob_id', 'count'))
+            if not references:
+                return 0
+            released = files.delete()[0]
+
+            blobs = list(StoredBlob.objects.select_for_update().filter(pk__in=references.keys()))
+            for blob in blobs:
+                blob.ref_count -= references[blob.pk]
+            StoredBlob.objects.bulk_update(blobs, ['ref_count'])
+            unreferenced = [blob.digest for blob in blobs if blob.ref_count <= 0]
+            if unreferenced:
+                transaction.on_commit(lambda: self.purge_unreferenced(unreferenced))
+        return released
+
+    def purge_unreferenced(self, digests: Optional[Iterable[str]] = None) -> int:
+        """
+        Remove tombstoned blobs (ref_count 0) and their files, all of them
+        or only those with the given digests. Each blob is re-checked under
+        its row lock, so a blob an upload revived in the meantime keeps its
+        files, and an upload of the same content waits until the files and
+        row are gone before storing the content afresh. Returns the number
+        of blobs removed.
+        """
+        from .models import StoredBlob
+
+        candidates = StoredBlob.objects.filter(ref_count__lte=0)
+        if digests is not None:
+            candidates = candidates.filter(digest__in=list(digests))
+        removed = 0
+        for digest in list(candidates.values_list('digest', flat=True)):
+            with transaction.atomic():
+                blob = StoredBlob.objects.select_for_update().filter(digest=digest, ref_count__lte=0).first()
+                if blob is None:
+                    continue
+                self._remove_blob_files(blob.path)
+                blob.delete()
+                removed += 1
+        if removed:
+            logger.info(f"Removed {removed} unreferenced blobs")
+        return removed
+
+    # Reporting
+
+    def usage(self) -> Dict[str, Any]:
+        """Logical vs. stored bytes, and how much deduplication and compression saved"""
+        from .models import StoredBlob, StoredFile
+
+        blobs = StoredBlob.objects.filter(ref_count__gt=0).aggregate(
+            count=Count('id'), size=Sum('size'), stored=Sum('stored_size'))
+        logical = StoredFile.objects.aggregate(count=Count('id'), size=Sum('blob__size'))
+
+        logical_bytes = logical['size'] or 0
+        unique_bytes = blobs['size'] or 0
+        stored_bytes = blobs['stored'] or 0
+        saved_bytes = logical_bytes - stored_bytes
+        return {
+            'files': logical['count'],
+            'blobs': blobs['count'],
+            'logical_bytes': logical_bytes,
+            'unique_bytes': unique_bytes,
+            'stored_bytes': stored_bytes,
+            'deduplication_saved_bytes': logical_bytes - unique_bytes,
+            'compression_saved_bytes': unique_bytes - stored_bytes,
+            'saved_bytes': saved_bytes,
+            'saved_ratio': round(saved_bytes / logical_bytes, 4) if logical_bytes else 0.0,
+        }
+
+
+@deconstructible
+class ReportStorage(ContentAddressableStorage):
+    """
+    Blob store for generated tax reports. Every save of the same report
+    content references one compressed blob, so storage grows with unique
+    reports rather than with downloads.
+    """
+    defaults = DEFAULT_REPORT_STORAGE
+    settings_key = 'REPORT_STORAGE'
+
+
+def get_upload_storage():
+    """Storage used by TaxFormDocument.file"""
+    return upload_storage
+
+
+def get_report_storage():
+    """Storage used by DownloadedReports.document"""
+    return report_storage
+
+# Create singleton instances
+upload_storage = ContentAddressableStorage()
+report_storage = ReportStorage()
@@ -0,0 +1,27 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+from django.conf import settings # type: ignore
+
+BACKEND_DIR = Path(__file__).resolve().parents[2]
+
+
+def pytest_configure():
+    """
+    Project settings with an in-memory SQLite database and a scratch
+    MEDIA_ROOT, so tests marked django_db run without the MySQL server
+    """
+    if settings.configured or os.environ.get('DJANGO_SETTINGS_MODULE'):
+        return
+    sys.path.insert(0, str(BACKEND_DIR))
+    os.environ.setdefault('GEMINI_API_KEY', 'test-key')
+    from tax_backend import settings as project_settings
+
+    values = {name: getattr(project_settings, name) for name in dir(project_settings) if name.isupper()}
+    values.update(
+        DATABASES={'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}},
+        MEDIA_ROOT=tempfile.mkdtemp(prefix='tax_report_tests_'),
+        ROOT_URLCONF='tax_report.urls',
+    )
+    settings.configure(**values)
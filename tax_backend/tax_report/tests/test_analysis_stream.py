@@ -0,0 +1,65 @@
+import asyncio
+import json
+import threading
+
+from tax_report.services.analysis_stream import sse_event, stream_events
+
+
+def collect(run, heartbeat=5):
+    async def consume():
+        return [chunk async for chunk in stream_events(run, heartbeat=heartbeat)]
+    return asyncio.run(consume())
+
+
+def parse(chunk):
+    fields = dict(line.split(': ', 1) for line in chunk.strip().split('\n'))
+    return fields['event'], json.loads(fields['data'])
+
+
+class TestAnalysisStream:
+    def test_event_format(self):
+        assert sse_event('page', {'page': 1, 'pages': 3}, 7) == 'id: 7\nevent: page\ndata: {"page":1,"pages":3}\n\n'
+
+    def test_events_arrive_in_order_and_end_with_done(self):
+        def run(emit):
+            for page in range(1, 4):
+                emit('page', {'page': page, 'pages': 3})
+            emit('result', {'analysis': {'income_items': []}})
+
+        events = [parse(chunk) for chunk in collect(run)]
+        assert [name for name, _ in events] == ['page', 'page', 'page', 'result', 'done']
+        assert events[2][1] == {'page': 3, 'pages': 3}
+
+    def test_events_are_delivered_before_the_pipeline_finishes(self):
+        release = threading.Event()
+
+        def run(emit):
+            emit('rules', {'income_items': [1]})
+            assert release.wait(5)
+
+        async def consume():
+            stream = stream_events(run)
+            first = await stream.__anext__()
+            release.set()
+            rest = [chunk async for chunk in stream]
+            return first, rest
+
+        first, rest = asyncio.run(consume())
+        assert parse(first)[0] == 'rules'
+        assert parse(rest[-1])[0] == 'done'
+
+    def test_errors_become_an_error_event(self):
+        def run(emit):
+            raise ValueError('File not found')
+
+        chunks = collect(run)
+        assert parse(chunks[-1]) == ('error', {'success': False, 'error': 'File not found'})
+
+    def test_heartbeat_while_idle(self):
+        release = threading.Event()
+
+        def run(emit):
+            release.wait(0.3)
+
+        chunks = collect(run, heartbeat=0.05)
+        assert ': keep-alive\n\n' in chunks
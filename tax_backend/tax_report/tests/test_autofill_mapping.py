@@ -0,0 +1,67 @@
+from tax_report.services.autofill_mapping import AutoFillMapper, RuleIndex
+
+class TestAutoFillMapper:
+    def setup_method(self):
+        self.mapper = AutoFillMapper()
+
+    def map_items(self, *items):
+        return self.mapper.map_analysis({'income_items': list(items)})
+
+    def map_deductions(self, *deductions):
+        return self.mapper.map_analysis({'deductions': list(deductions)})
+
+    def test_empty_analysis_has_every_section(self):
+        mappings = self.mapper.map_analysis({})
+        assert mappings['EmploymentIncome'] == {'primaryEntries': [], 'secondaryEntries': [], 'apitEntries': []}
+        assert set(mappings['QualifyingPayments']) == {
+            'paymentEntries', 'samurdhiEntries', 'donationEntries', 'solarEntries', 'housingEntries', 'otherEntries'
+        }
+
+    def test_earlier_keyword_beats_later_type(self):
+        # "interest" belongs to the first investment rule, so it wins over the Capital Gains type
+        mappings = self.map_items({'category': 'Investment Income', 'type': 'Capital Gains',
+                                   'description': 'Interest on bonds', 'amount': 500})
+        assert mappings['InvestmentIncome']['investmentEntries'] == [{'name': 'Interest Income', 'amount': '500'}]
+
+    def test_type_matches_without_keywords(self):
+        mappings = self.map_items({'category': 'Terminal Benefits', 'type': 'ETF Payment', 'description': 'Payout'})
+        assert mappings['TerminalBenefits']['etfEntries'] == [{'name': 'ETF Payment', 'amount': '0'}]
+
+    def test_defaults(self):
+        mappings = self.map_items(
+            {'category': 'Employment Income', 'description': 'Bonus', 'amount': 10},
+            {'category': 'Qualifying Payments', 'description': 'Medical bill', 'amount': 20},
+            {'category': 'Business Income', 'amount': 30},
+            {'category': 'Unknown', 'description': 'Salary', 'amount': 40},
+        )
+        assert mappings['EmploymentIncome']['primaryEntries'] == [{'name': 'Primary Salary', 'amount': '10'}]
+        assert mappings['QualifyingPayments']['otherEntries'] == [{'name': 'Medical bill', 'amount': '20'}]
+        assert mappings['BusinessIncome']['businessEntries'] == [{'name': 'Business Income', 'amount': '30'}]
+
+    def test_deductions(self):
+        mappings = self.map_deductions(
+            {'type': 'APIT Deduction', 'amount': 100},
+            {'description': 'Withholding tax on gem auction', 'amount': 50},
+            {'description': 'Business travel', 'amount': 25},
+            {'description': 'Bank charges', 'amount': 5},
+        )
+        assert mappings['EmploymentIncome']['apitEntries'] == [
+            {'source': 'Primary Employment', 'name': 'APIT Deduction', 'amount': '100'}
+        ]
+        assert mappings['OtherIncome']['whtEntries'] == [{'source': 'Gem Sale WHT', 'amount': '50'}]
+        assert mappings['BusinessIncome']['deductions'] == [{'name': 'Business travel', 'amount': '25'}]
+        assert mappings['InvestmentIncome']['deductions'] == []
+
+    def test_wht_source_order_and_default(self):
+        mappings = self.map_deductions(
+            {'type': 'WHT Deduction', 'description': 'WHT on interest and dividend'},
+            {'type': 'WHT Deduction', 'description': 'WHT'},
+        )
+        assert [entry['source'] for entry in mappings['OtherIncome']['whtEntries']] == ['Dividend WHT', 'WHT Deduction']
+
+    def test_rule_index_memoizes_matches(self):
+        index = RuleIndex([{'type': 'A', 'keywords': ('alpha',)}, {'type': 'B', 'keywords': ('beta',)}])
+        assert index.match('B', 'alpha beta')['type'] == 'A'
+        assert index.match('B', 'alpha beta')['type'] == 'A'
+        assert index.match(['unhashable'], 'beta')['type'] == 'B'
+        assert index.match('C', 'gamma') is None
@@ -0,0 +1,160 @@
+import io
+import os
+import random
+import hashlib
+import pytest
+from tax_report.models import ChunkedUpload, TaxFormDocument
+from tax_report.services.chunked_upload import ChunkedUploadError, ChunkedUploadManager, PdfPageCounter
+
+
+def count_in_pieces(data, piece_size):
+    counter = PdfPageCounter()
+    for start in range(0, len(data), piece_size):
+        counter.feed(data[start:start + piece_size])
+    counter.finish()
+    return counter
+
+
+class TestPdfPageCounter:
+    def test_counts_pages_but_not_page_tree_nodes(self):
+        data = b'%PDF-1.4\n<< /Type /Pages /Count 2 >>\n<< /Type /Page >>\n<</Type/Page>>\n'
+        counter = count_in_pieces(data, len(data))
+        assert counter.pages == 2
+        assert counter.page_count == 2
+
+    def test_matches_split_across_chunks_are_counted_once(self):
+        random.seed(7)
+        parts = [b'%PDF-1.7\n']
+        for _ in range(200):
+            parts.append(random.choice([
+                b'<< /Type /Page /Parent 3 0 R >>',
+                b'<< /Type /Pages /Kids [] /Count 120 >>',
+                b'stream' + bytes(random.randint(1, 40)) + b'endstream',
+            ]))
+        data = b'\n'.join(parts)
+        expected = len(PdfPageCounter.PAGE.findall(data))
+
+        for piece_size in (1, 3, 7, 64, 1000):
+            counter = count_in_pieces(data, piece_size)
+            assert counter.pages == expected
+            assert counter.max_count == 120
+
+    def test_falls_back_to_page_tree_count(self):
+        # Page dictionaries hidden in compressed object streams
+        counter = count_in_pieces(b'%PDF-1.5\n<< /Type /Pages /Count 12 >>\n<< /Count 4 >>', 5)
+        assert counter.page_count == 12
+
+
+OPTIONS = {'chunk_size': 8, 'min_chunk_size': 1, 'max_chunk_size': 1024, 'max_size': 10 * 1024, 'max_pages': 500}
+PDF = b'%PDF-1.4\n<< /Type /Page >>\n<< /Type /Page >>\n%%EOF\n'
+
+
+@pytest.mark.django_db
+class TestChunkedUploadProtocol:
+    @pytest.fixture
+    def manager(self):
+        return ChunkedUploadManager(OPTIONS)
+
+    def send(self, manager, upload, index, data=PDF):
+        start = index * upload.chunk_size
+        return manager.write_chunk(upload, index, io.BytesIO(data[start:start + upload.chunk_size]))
+
+    def test_init_preallocates_the_part_file(self, manager):
+        upload = manager.start('session', 'return.pdf', len(PDF))
+        assert upload.total_chunks == 7
+        assert os.path.getsize(manager.part_path(upload)) == len(PDF)
+
+        with pytest.raises(ChunkedUploadError):
+            manager.start('session', 'script.exe', 10)
+        with pytest.raises(ChunkedUploadError) as error:
+            manager.start('session', 'big.pdf', OPTIONS['max_size'] + 1)
+        assert error.value.status_code == 413
+
+    def test_chunks_in_order_are_hashed_without_reading_them_back(self, manager, monkeypatch):
+        reads = []
+        feed = manager._feed
+        monkeypatch.setattr(manager, '_feed', lambda upload, state, until: (
+            reads.append(until - state.offset) if until > state.offset else None, feed(upload, state, until)))
+        upload = manager.start('session', 'return.pdf', len(PDF))
+        for index in range(upload.total_chunks):
+            upload = self.send(manager, upload, index)
+
+        assert reads == []
+        document = manager.complete(upload, hashlib.sha256(PDF).hexdigest())
+        assert document.file.storage.digest(document.file.name) == hashlib.sha256(PDF).hexdigest()
+        assert ChunkedUpload.objects.get(pk=upload.pk).page_count == 2
+
+    def test_out_of_order_and_retried_chunks(self, manager):
+        upload = manager.start('session', 'return.pdf', len(PDF))
+        for index in (3, 1, 0, 1, 6, 2, 5, 4, 4):
+            upload = self.send(manager, upload, index)
+            if index == 0:
+                # Chunks 0 and 1 are contiguous; 3 waits for 2
+                assert upload.hashed_offset == 2 * upload.chunk_size
+
+        assert sorted(upload.received_chunks) == list(range(7))
+        assert upload.hashed_offset == len(PDF)
+        document = manager.complete(upload)
+        with document.file.open('rb') as f:
+            assert f.read() == PDF
+
+    def test_resume_in_a_fresh_manager(self, manager):
+        upload = manager.start('session', 'return.pdf', len(PDF))
+        for index in (0, 1, 2):
+            upload = self.send(manager, upload, index)
+
+        # Another worker (or a restarted one) has no hash state in memory
+        other = ChunkedUploadManager(OPTIONS)
+        upload = ChunkedUpload.objects.get(pk=upload.pk)
+        assert upload.missing_chunks() == [3, 4, 5, 6]
+        for index in upload.missing_chunks():
+            upload = self.send(other, upload, index)
+        other.complete(upload, hashlib.sha256(PDF).hexdigest())
+
+    def test_alternating_workers_never_rehash_from_the_start(self, monkeypatch):
+        workers = [ChunkedUploadManager(OPTIONS), ChunkedUploadManager(OPTIONS)]
+        read = {0: 0, 1: 0}
+        for number, worker in enumerate(workers):
+            def counting_feed(upload, state, until, feed=worker._feed, number=number):
+                read[number] += max(0, until - state.offset)
+                feed(upload, state, until)
+            monkeypatch.setattr(worker, '_feed', counting_feed)
+
+        upload = workers[0].start('session', 'return.pdf', len(PDF))
+        for index in range(upload.total_chunks):
+            upload = self.send(workers[index % 2], upload, index)
+
+        # Each worker catches up from where its own state ends, never from the start,
+        # so no byte is read back more than once per worker
+        assert read[0] <= len(PDF) and read[1] <= len(PDF)
+        assert upload.hashed_offset == len(PDF)
+        workers[1].complete(upload, hashlib.sha256(PDF).hexdigest())
+
+    def test_checksum_mismatch_fails_the_upload(self, manager):
+        upload = manager.start('session', 'return.pdf', len(PDF))
+        for index in range(upload.total_chunks):
+            upload = self.send(manager, upload, index)
+
+        with pytest.raises(ChunkedUploadError, match='Checksum mismatch'):
+            manager.complete(upload, '0' * 64)
+        upload = ChunkedUpload.objects.get(pk=upload.pk)
+        assert upload.status == 'failed'
+        assert not os.path.exists(manager.part_path(upload))
+        assert not TaxFormDocument.objects.exists()
+
+    def test_content_must_match_the_extension(self, manager):
+        data = b'not really a pdf'
+        upload = manager.start('session', 'return.pdf', len(data))
+        with pytest.raises(ChunkedUploadError, match='does not match'):
+            self.send(manager, upload, 0, data)
+        assert ChunkedUpload.objects.get(pk=upload.pk).status == 'failed'
+
+    def test_abort_discards_the_upload(self, manager):
+        upload = manager.start('session', 'return.pdf', len(PDF))
+        upload = self.send(manager, upload, 0)
+        manager.abort(upload)
+
+        assert not os.path.exists(manager.part_path(upload))
+        with pytest.raises(ChunkedUploadError) as error:
+            self.send(manager, upload, 1)
+        assert error.value.status_code == 409
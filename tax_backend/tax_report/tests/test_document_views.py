@@ -0,0 +1,55 @@
+import json
+import pytest
+from unittest import mock
+from django.core.files.uploadedfile import SimpleUploadedFile # type: ignore
+
+ANALYSIS = {'document_type': 'Payslip', 'income_items': [{'category': 'Employment Income', 'amount': 150000.0}],
+            'deductions': [], 'total_assessable_income': 150000.0}
+
+
+@pytest.mark.django_db
+class TestAnalyzeDocument:
+    @pytest.fixture
+    def client(self):
+        from rest_framework.test import APIClient # type: ignore
+        return APIClient()
+
+    @pytest.fixture
+    def processor(self, monkeypatch):
+        processor = mock.Mock()
+        processor.extract_text_with_stats.return_value = ('Salary 150,000.00\n', {'pages': 1,
+                                                                                 'duplicate_pages_skipped': 0})
+        processor.analyze_document_with_gemini.return_value = json.dumps(ANALYSIS)
+        monkeypatch.setattr('tax_report.views.get_document_processor', lambda: processor)
+        return processor
+
+    def upload(self, client):
+        response = client.post('/upload-document/', {
+            'file': SimpleUploadedFile('payslip.txt', b'Salary 150,000.00\n', content_type='text/plain')
+        })
+        assert response.status_code == 200
+        return response.data['document']['doc_id']
+
+    def test_reopening_reuses_the_stored_analysis(self, client, processor):
+        from tax_report.models import TaxFormDocument
+        doc_id = self.upload(client)
+
+        first = client.post(f'/analyze-document/{doc_id}/')
+        second = client.post(f'/analyze-document/{doc_id}/')
+
+        assert first.data['analysis'] == second.data['analysis'] == ANALYSIS
+        assert processor.extract_text_with_stats.call_count == 1
+        assert processor.analyze_document_with_gemini.call_count == 1
+        document = TaxFormDocument.objects.get(id=doc_id)
+        assert document.is_processed and document.content_text == 'Salary 150,000.00\n'
+
+    def test_force_refresh_reanalyzes_the_stored_text(self, client, processor):
+        doc_id = self.upload(client)
+        client.post(f'/analyze-document/{doc_id}/')
+
+        response = client.post(f'/analyze-document/{doc_id}/', {'force_refresh': True}, format='json')
+
+        assert response.status_code == 200
+        assert processor.extract_text_with_stats.call_count == 1
+        assert processor.analyze_document_with_gemini.call_count == 2
+        assert processor.analyze_document_with_gemini.call_args.args[0] == 'Salary 150,000.00\n'
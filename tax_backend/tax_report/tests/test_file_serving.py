@@ -0,0 +1,180 @@
+import os
+import pytest
+import zstandard as zstd # type: ignore
+from datetime import datetime, timezone
+from django.conf import settings # type: ignore
+from django.test import RequestFactory # type: ignore
+from tax_report.services.file_serving import parse_range, serve_file, serve_stored_file
+
+
+class TestParseRange:
+    def test_explicit_and_open_ranges(self):
+        assert parse_range('bytes=0-99', 1000) == (0, 99)
+        assert parse_range('bytes=500-', 1000) == (500, 999)
+        # The end is clamped to the file
+        assert parse_range('bytes=900-5000', 1000) == (900, 999)
+
+    def test_suffix_range(self):
+        assert parse_range('bytes=-100', 1000) == (900, 999)
+        assert parse_range('bytes=-5000', 1000) == (0, 999)
+
+    def test_unsatisfiable(self):
+        assert parse_range('bytes=1000-', 1000) == (-1, -1)
+        assert parse_range('bytes=50-10', 1000) == (-1, -1)
+        assert parse_range('bytes=-0', 1000) == (-1, -1)
+
+    def test_ignored_headers_serve_the_whole_file(self):
+        assert parse_range('', 1000) is None
+        assert parse_range('bytes=-', 1000) is None
+        assert parse_range('items=0-10', 1000) is None
+        # Multiple ranges are answered with a plain 200
+        assert parse_range('bytes=0-10,20-30', 1000) is None
+
+
+class CompressedStorage:
+    """Stands in for the blob store: one zstd-compressed blob, no database"""
+
+    def __init__(self, root, content):
+        self.location = str(root)
+        self.blob = os.path.join(self.location, 'report.pdf.zst')
+        with open(self.blob, 'wb') as f:
+            f.write(zstd.ZstdCompressor().compress(content))
+        self.size = len(content)
+
+    def stat(self, name):
+        return {'digest': 'ab' * 32, 'size': self.size, 'compressed': True,
+                'modified_time': datetime(2026, 1, 1, tzinfo=timezone.utc)}
+
+    def open_stream(self, name):
+        return zstd.ZstdDecompressor().stream_reader(open(self.blob, 'rb'), closefd=True)
+
+    def path(self, name):
+        raise AssertionError('compressed reports must not be expanded to disk')
+
+
+class FieldFile:
+    def __init__(self, storage, name):
+        self.storage, self.name = storage, name
+
+
+class TestDecompressedStreaming:
+    @pytest.fixture(autouse=True)
+    def configured(self):
+        if not settings.configured:
+            settings.configure()
+
+    def test_compressed_blob_is_streamed_whole(self, tmp_path):
+        content = b'%PDF-1.4 report ' * 10000
+        field_file = FieldFile(CompressedStorage(tmp_path, content), 'downloaded_docs/report.pdf')
+        request = RequestFactory().get('/', HTTP_RANGE='bytes=0-99')
+
+        response = serve_stored_file(request, field_file, 'application/pdf', 'report.pdf',
+                                     options={}, attachment=True, decompress=True)
+
+        assert response.status_code == 200
+        assert b''.join(response.streaming_content) == content
+        assert response['Content-Length'] == str(len(content))
+        assert response['Content-Disposition'] == 'attachment; filename="report.pdf"'
+        assert response['Accept-Ranges'] == 'none'
+
+    def test_revalidation_does_not_open_the_blob(self, tmp_path):
+        field_file = FieldFile(CompressedStorage(tmp_path, b'report'), 'downloaded_docs/report.pdf')
+        request = RequestFactory().get('/', HTTP_IF_NONE_MATCH=f'"{"ab" * 32}"')
+
+        response = serve_stored_file(request, field_file, 'application/pdf', 'report.pdf',
+                                     options={}, decompress=True)
+        assert response.status_code == 304
+
+
+class TestServeFile:
+    ETAG = f'"{"cd" * 32}"'
+    MODIFIED = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    CONTENT = bytes(range(256)) * 4
+
+    @pytest.fixture(autouse=True)
+    def configured(self):
+        if not settings.configured:
+            settings.configure()
+
+    @pytest.fixture
+    def path(self, tmp_path):
+        path = tmp_path / 'blobs' / 'cd' / 'cd' / 'statement.pdf'
+        path.parent.mkdir(parents=True)
+        path.write_bytes(self.CONTENT)
+        return str(path)
+
+    def serve(self, path, options=None, etag=ETAG, **headers):
+        request = RequestFactory().get('/', **headers)
+        root = path.split(os.sep + 'blobs' + os.sep)[0]
+        return serve_file(request, lambda: path, 'application/pdf', 'statement.pdf', etag, len(self.CONTENT),
+                          self.MODIFIED, root, options if options is not None else {})
+
+    def test_whole_file_with_validators(self, path):
+        response = self.serve(path)
+
+        assert response.status_code == 200
+        assert b''.join(response.streaming_content) == self.CONTENT
+        assert response['ETag'] == self.ETAG
+        assert response['Last-Modified'] == 'Thu, 01 Jan 2026 00:00:00 GMT'
+        assert response['Accept-Ranges'] == 'bytes'
+        assert response['Content-Disposition'] == 'inline; filename="statement.pdf"'
+
+    def test_matching_etag_is_not_modified(self, path):
+        resolved = []
+        request = RequestFactory().get('/', HTTP_IF_NONE_MATCH=self.ETAG)
+        response = serve_file(request, lambda: resolved.append(path) or path, 'application/pdf', 'statement.pdf',
+                              self.ETAG, len(self.CONTENT), self.MODIFIED, '/', {})
+
+        assert response.status_code == 304
+        assert response['ETag'] == self.ETAG
+        assert resolved == []
+        assert self.serve(path, HTTP_IF_NONE_MATCH='"stale"').status_code == 200
+
+    def test_single_range(self, path):
+        response = self.serve(path, HTTP_RANGE='bytes=100-199')
+
+        assert response.status_code == 206
+        assert response['Content-Range'] == f'bytes 100-199/{len(self.CONTENT)}'
+        assert response['Content-Length'] == '100'
+        assert b''.join(response.streaming_content) == self.CONTENT[100:200]
+
+    def test_if_range_with_current_etag_gets_the_range(self, path):
+        response = self.serve(path, HTTP_RANGE='bytes=-24', HTTP_IF_RANGE=self.ETAG)
+        assert response.status_code == 206
+        assert b''.join(response.streaming_content) == self.CONTENT[-24:]
+
+    @pytest.mark.parametrize('validator', ['"stale"', 'Wed, 31 Dec 2025 00:00:00 GMT'])
+    def test_stale_if_range_gets_the_whole_file(self, path, validator):
+        response = self.serve(path, HTTP_RANGE='bytes=100-199', HTTP_IF_RANGE=validator)
+
+        assert response.status_code == 200
+        assert b''.join(response.streaming_content) == self.CONTENT
+
+    def test_weak_etag_never_allows_a_range(self, path):
+        weak = 'W/"400-0"'
+        response = self.serve(path, etag=weak, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=weak)
+        assert response.status_code == 200
+
+    def test_unsatisfiable_range(self, path):
+        response = self.serve(path, HTTP_RANGE=f'bytes={len(self.CONTENT)}-')
+
+        assert response.status_code == 416
+        assert response['Content-Range'] == f'bytes */{len(self.CONTENT)}'
+
+    def test_nginx_offload(self, path):
+        response = self.serve(path, {'offload': 'x-accel-redirect', 'accel_prefix': '/protected-media/'},
+                              HTTP_RANGE='bytes=0-9')
+
+        # nginx answers the Range itself
+        assert response.status_code == 200
+        assert response['X-Accel-Redirect'] == '/protected-media/blobs/cd/cd/statement.pdf'
+        assert response['ETag'] == self.ETAG
+        assert response['Content-Disposition'] == 'inline; filename="statement.pdf"'
+        assert response.content == b''
+
+    def test_sendfile_offload(self, path):
+        response = self.serve(path, {'offload': 'x-sendfile'})
+
+        assert response['X-Sendfile'] == path
+        assert 'X-Accel-Redirect' not in response
+        assert response.content == b''
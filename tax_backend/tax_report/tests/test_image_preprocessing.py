@@ -0,0 +1,37 @@
+from PIL import Image, ImageDraw
+from tax_report.services.image_preprocessing import ImagePreprocessor
+
+def make_page(size=(1200, 900)):
+    image = Image.new('RGB', size, 'white')
+    draw = ImageDraw.Draw(image)
+    for row in range(10):
+        draw.rectangle([150, 150 + row * 50, 1000, 165 + row * 50], fill='black')
+    return image
+
+class TestImagePreprocessor:
+    def test_steps_are_timed_and_toggleable(self):
+        preprocessor = ImagePreprocessor({'deskew': False, 'crop_margins': False})
+        _, report = preprocessor.process(make_page())
+
+        assert [step['step'] for step in report['steps']] == ['downscale', 'grayscale', 'binarize']
+        assert all(step['ms'] >= 0 for step in report['steps'])
+
+    def test_downscale_to_target_dpi(self):
+        preprocessor = ImagePreprocessor({'target_dpi': 100, 'binarize': False,
+                                          'deskew': False, 'crop_margins': False})
+        prepared, report = preprocessor.process(make_page((4000, 3000)))
+
+        assert max(prepared.size) == int(100 * 11.69)
+        assert prepared.mode == 'L'
+
+    def test_crop_margins(self):
+        preprocessor = ImagePreprocessor({'binarize': False, 'deskew': False, 'margin_padding': 0})
+        prepared, _ = preprocessor.process(make_page())
+
+        assert prepared.size == (851, 466)
+
+    def test_disabled(self):
+        image = make_page()
+        prepared, report = ImagePreprocessor({'enabled': False}).process(image)
+        assert prepared is image
+        assert report['skipped']
@@ -0,0 +1,47 @@
+from tax_report.services.keyword_classifier import KeywordClassifier, KeywordMatcher
+
+class TestKeywordClassifier:
+    def setup_method(self):
+        self.classifier = KeywordClassifier()
+
+    def classify(self, description):
+        rule = self.classifier.classify(description)
+        return (rule['category'], rule['type']) if rule else None
+
+    def test_matcher_reports_overlapping_keywords(self):
+        matcher = KeywordMatcher(['trust', 'trust fund', 'rent', 'rental'])
+        assert matcher.find('employees trust fund rental') == {'trust', 'trust fund', 'rent', 'rental'}
+
+    def test_precedence_follows_rule_order(self):
+        # Capital gains win over everything else
+        assert self.classify('Capital gain on rental property') == ('Investment Income', 'Capital Gains')
+        # "trust fund" hits the trust rule before the ETF rule
+        assert self.classify('Employees Trust Fund') == ('Business Income', 'Trust Beneficiary')
+        assert self.classify('ETF payment') == ('Terminal Benefits', 'ETF Payment')
+        # Substring semantics are kept ("management" contains "gem")
+        assert self.classify('Management fee') == ('Other Income', 'Auctioned Gem Sale (WHT)')
+
+    def test_samurdhi_override(self):
+        assert self.classify('Samurdhi beneficiary shop') == (
+            'Qualifying Payments', 'Shop Setup for Samurdhi Beneficiary'
+        )
+
+    def test_unmatched_lines(self):
+        assert self.classify('Opening balance') is None
+
+    def test_build_analysis_totals(self):
+        entries = self.classifier.classify_lines([
+            'Primary Salary 150,000.00',
+            'APIT Deduction 15,000.00',
+            'Donation 5,000',
+            'Capital gain 1,000',
+            'no amount here',
+        ])
+        analysis = self.classifier.build_analysis(entries)
+
+        assert [item['type'] for item in analysis['income_items']] == [
+            'Capital Gains', 'Primary Employment', 'Donations'
+        ]
+        assert analysis['deductions'][0]['type'] == 'APIT Deduction'
+        # Donations are not assessable; deductions are subtracted
+        assert analysis['total_assessable_income'] == 151000.0 - 15000.0
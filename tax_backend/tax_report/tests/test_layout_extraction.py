@@ -0,0 +1,89 @@
+from tax_report.services.keyword_classifier import KeywordClassifier
+from tax_report.services.layout_extraction import LayoutExtractor, parse_amount
+from tax_report.services.ocr_engines import parse_tsv
+
+OPTIONS = {'enabled': True, 'row_tolerance': 0.5, 'column_gap': 1.5,
+           'rules_min_confidence': 85.0, 'rules_min_coverage': 0.6}
+
+
+def word(text, left, top, conf=95.0, height=20):
+    return {'text': text, 'conf': conf, 'left': left, 'top': top, 'width': len(text) * 10, 'height': height}
+
+
+def line(top, *cells):
+    """Words of one printed line; each cell is (left, text) with single spaces between its words"""
+    words = []
+    for left, text in cells:
+        for token in text.split():
+            words.append(word(token, left, top))
+            left += len(token) * 10 + 8
+    return words
+
+
+class TestLayoutExtractor:
+    def setup_method(self):
+        self.extractor = LayoutExtractor(OPTIONS)
+
+    def test_parse_amount(self):
+        assert parse_amount('1,250,000.00') == '1250000.00'
+        assert parse_amount('Rs.1,500') == '1500'
+        assert parse_amount('2,000/-') == '2000'
+        assert parse_amount('2024/2025') is None
+        assert parse_amount('Salary') is None
+
+    def test_two_column_payslip_rows(self):
+        words = (line(100, (50, 'Primary Salary'), (300, '150,000.00'), (500, 'APIT'), (700, '12,500.00'))
+                 # Second line printed slightly lower on the right half
+                 + line(140, (50, 'Interest Income'), (300, '4,000.00'))
+                 + line(143, (500, 'WHT on interest'), (700, '200.00')))
+        text, rows = self.extractor.extract(words)
+
+        assert [(row['label'], row['amount']) for row in rows] == [
+            ('Primary Salary', 150000.0), ('APIT', 12500.0),
+            ('Interest Income', 4000.0), ('WHT on interest', 200.0),
+        ]
+        assert text.splitlines()[:2] == ['Primary Salary 150000.00', 'APIT 12500.00']
+
+    def test_numbers_inside_a_label_and_table_columns(self):
+        words = (line(100, (50, 'Salary for 12 months'), (400, '100,000'), (550, '100,000'), (700, '200,000'))
+                 + line(140, (50, 'Employee No 1234 Grade A')))
+        text, rows = self.extractor.extract(words)
+        assert [(row['label'], row['amount']) for row in rows] == [('Salary for 12 months', 200000.0)]
+        assert text.splitlines()[1] == 'Employee No 1234 Grade A'
+        # Text reused for a duplicate page yields the same rows
+        assert [(row['label'], row['amount']) for row in LayoutExtractor.rows_from_text(text)] == [
+            ('Salary for 12 months', 200000.0)
+        ]
+
+    def test_row_confidence_and_rule_shortcut(self):
+        words = line(100, (50, 'Primary Salary'), (300, '150,000.00'))
+        words[-1]['conf'] = 60.0
+        _, rows = self.extractor.extract(words)
+        assert rows[0]['confidence'] == round((95 + 95 + 60) / 3, 1)
+        assert not self.extractor.rules_suffice(rows, classified=1)
+
+        confident = [{'label': 'Primary Salary', 'amount': 1.0, 'confidence': 96.0},
+                     {'label': 'Net pay', 'amount': 1.0, 'confidence': 96.0}]
+        assert not self.extractor.rules_suffice(confident, classified=1)
+        assert self.extractor.rules_suffice(confident[:1], classified=1)
+        assert not self.extractor.rules_suffice([dict(confident[0], confidence=None)], classified=1)
+
+    def test_classifier_takes_rows_directly(self):
+        entries = KeywordClassifier().classify_rows([
+            {'label': 'Primary Salary', 'amount': 150000.0, 'confidence': 95.0},
+            {'label': 'Net Pay', 'amount': 137500.0, 'confidence': 95.0},
+        ])
+        assert [(entry['rule']['type'], entry['amount']) for entry in entries] == [('Primary Employment', 150000.0)]
+
+
+class TestParseTsv:
+    def test_keeps_words_only(self):
+        tsv = '\n'.join([
+            'level\tpage_num\tblock_num\tpar_num\tline_num\tword_num\tleft\ttop\twidth\theight\tconf\ttext',
+            '4\t1\t1\t1\t1\t0\t10\t10\t300\t20\t-1\t',
+            '5\t1\t1\t1\t1\t1\t10\t10\t60\t20\t96.5\tSalary',
+            '5\t1\t1\t1\t1\t2\t80\t10\t40\t20\t-1\t ',
+        ])
+        assert parse_tsv(tsv) == [
+            {'text': 'Salary', 'conf': 96.5, 'left': 10, 'top': 10, 'width': 60, 'height': 20, 'block': 1, 'line': 1}
+        ]
@@ -0,0 +1,135 @@
+import threading
+import time
+
+import pytest
+
+from tax_report.services.llm_client import (
+    LLMClient, CircuitBreaker, ConcurrencyLimiter, LLMMetrics,
+    CircuitOpenError, LLMTimeoutError, LLMBusyError,
+)
+
+
+class ServiceUnavailable(Exception):
+    code = 503
+
+
+class FakeModel:
+    """Local stand-in for a Gemini model: replays a script of results/errors"""
+
+    def __init__(self, script=None, delay=0.0):
+        self.script = list(script or [])
+        self.delay = delay
+        self.calls = 0
+
+    def generate_content(self, prompt, **kwargs):
+        self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        outcome = self.script.pop(0) if self.script else 'ok'
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+OPTIONS = {
+    'timeout': 1, 'deadline': 5, 'max_concurrency': 2, 'acquire_timeout': 0.1,
+    'max_retries': 2, 'backoff_base': 0.01, 'backoff_max': 0.05,
+    'failure_threshold': 2, 'reset_timeout': 30,
+}
+
+
+class TestLLMClient:
+    def make_client(self, model, breaker=None, limiter=None, options=None):
+        sleeps = []
+        client = LLMClient(
+            model, options=dict(OPTIONS, **(options or {})),
+            breaker=breaker or CircuitBreaker(OPTIONS['failure_threshold'], OPTIONS['reset_timeout']),
+            metrics=LLMMetrics(), limiter=limiter or ConcurrencyLimiter(OPTIONS['max_concurrency']),
+            sleep=sleeps.append
+        )
+        return client, sleeps
+
+    def test_retries_retryable_errors_with_bounded_backoff(self):
+        model = FakeModel([ServiceUnavailable('busy'), ServiceUnavailable('busy'), 'done'])
+        client, sleeps = self.make_client(model)
+        assert client.generate_content('prompt') == 'done'
+        assert model.calls == 3
+        assert len(sleeps) == 2
+        assert all(0 <= delay <= OPTIONS['backoff_max'] for delay in sleeps)
+        metrics = client.metrics.snapshot()
+        assert metrics['retries'] == 2 and metrics['successes'] == 1 and metrics['failures'] == 0
+
+    def test_other_errors_are_not_retried_and_keep_circuit_closed(self):
+        model = FakeModel([ValueError('blocked prompt')] * 3)
+        client, sleeps = self.make_client(model)
+        for _ in range(3):
+            with pytest.raises(ValueError):
+                client.generate_content('prompt')
+        assert model.calls == 3 and sleeps == []
+        assert client.breaker.state == CircuitBreaker.CLOSED
+
+    def test_attempt_timeout(self):
+        model = FakeModel(delay=0.5)
+        client, _ = self.make_client(model, options={'timeout': 0.05, 'max_retries': 0})
+        with pytest.raises(LLMTimeoutError):
+            client.generate_content('prompt')
+        assert client.metrics.snapshot()['timeouts'] == 1
+
+    def test_circuit_opens_fails_fast_and_recovers(self):
+        clock = FakeClock()
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30, clock=clock)
+        model = FakeModel([ServiceUnavailable('down')] * 6)
+        client, _ = self.make_client(model, breaker=breaker, options={'max_retries': 0})
+
+        for _ in range(2):
+            with pytest.raises(ServiceUnavailable):
+                client.generate_content('prompt')
+        assert breaker.state == CircuitBreaker.OPEN
+
+        calls = model.calls
+        with pytest.raises(CircuitOpenError):
+            client.generate_content('prompt')
+        assert model.calls == calls
+        assert client.metrics.snapshot()['circuit_rejections'] == 1
+
+        # After the reset timeout one trial call goes through and closes the circuit
+        clock.now = 31
+        model.script = ['recovered']
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        assert client.generate_content('prompt') == 'recovered'
+        assert breaker.state == CircuitBreaker.CLOSED
+
+    def test_failed_trial_reopens_circuit(self):
+        clock = FakeClock()
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10, clock=clock)
+        breaker.record_failure()
+        clock.now = 11
+        assert breaker.allow()
+        assert not breaker.allow()  # only one trial at a time
+        breaker.record_failure()
+        assert breaker.state == CircuitBreaker.OPEN
+
+    def test_concurrency_cap(self):
+        limiter = ConcurrencyLimiter(1)
+        release = threading.Event()
+        slow = FakeModel()
+        slow.generate_content = lambda prompt, **kwargs: release.wait(2) and 'slow'
+        slow_client, _ = self.make_client(slow, limiter=limiter)
+        other_client, _ = self.make_client(FakeModel(), limiter=limiter)
+
+        worker = threading.Thread(target=slow_client.generate_content, args=('prompt',))
+        worker.start()
+        time.sleep(0.05)
+        with pytest.raises(LLMBusyError):
+            other_client.generate_content('prompt')
+        release.set()
+        worker.join()
+        assert other_client.generate_content('prompt') == 'ok'
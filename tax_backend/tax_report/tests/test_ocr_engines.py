@@ -0,0 +1,108 @@
+import threading
+import pytest
+from tax_report.services import ocr_engines
+from tax_report.services.ocr_engines import PytesseractEngine, TesserocrPoolEngine, create_ocr_engine
+
+
+class FakeAPI:
+    """Stands in for tesserocr.PyTessBaseAPI"""
+    created = []
+
+    def __init__(self, lang='eng', path=None):
+        self.lang = lang
+        self.path = path
+        FakeAPI.created.append(self)
+
+    def SetImage(self, image):
+        self.image = image
+
+    def GetUTF8Text(self):
+        return f'text of {self.image}'
+
+    def Clear(self):
+        pass
+
+    def End(self):
+        pass
+
+
+class BrokenAPI(FakeAPI):
+    def __init__(self, lang='eng', path=None):
+        raise RuntimeError('Failed to init API, possibly an invalid tessdata path')
+
+
+@pytest.fixture
+def tesserocr(monkeypatch):
+    FakeAPI.created = []
+    module = type('tesserocr', (), {'PyTessBaseAPI': FakeAPI})
+    monkeypatch.setattr(ocr_engines, 'tesserocr', module, raising=False)
+    monkeypatch.setattr(ocr_engines, 'TESSEROCR_INSTALLED', True)
+    monkeypatch.setattr(ocr_engines, 'PYTESSERACT_INSTALLED', True)
+    return module
+
+
+class TestCreateOCREngine:
+    def test_auto_prefers_the_pool(self, tesserocr):
+        engine = create_ocr_engine(options={'lang': 'eng+sin', 'pool_size': 3, 'tessdata_path': '/opt/tessdata'})
+
+        assert isinstance(engine, TesserocrPoolEngine)
+        assert engine.pool_size == 3
+        assert (FakeAPI.created[0].lang, FakeAPI.created[0].path) == ('eng+sin', '/opt/tessdata')
+
+    def test_backend_can_be_chosen(self, tesserocr):
+        engine = create_ocr_engine('pytesseract', options={'lang': 'sin'})
+
+        assert isinstance(engine, PytesseractEngine)
+        assert engine.lang == 'sin'
+        assert FakeAPI.created == []
+
+    def test_settings_are_used_without_options(self, tesserocr, settings):
+        settings.OCR_ENGINE = {'backend': 'pytesseract'}
+        assert create_ocr_engine().name == 'pytesseract'
+
+    def test_falls_back_when_the_pool_cannot_start(self, tesserocr, monkeypatch):
+        monkeypatch.setattr(tesserocr, 'PyTessBaseAPI', BrokenAPI)
+        assert create_ocr_engine('tesserocr', options={}).name == 'pytesseract'
+
+    def test_falls_back_when_tesserocr_is_missing(self, tesserocr, monkeypatch):
+        monkeypatch.setattr(ocr_engines, 'TESSEROCR_INSTALLED', False)
+        assert create_ocr_engine('tesserocr', options={}).name == 'pytesseract'
+
+
+class TestTesserocrPoolEngine:
+    def test_handles_are_created_lazily_and_reused(self, tesserocr):
+        engine = TesserocrPoolEngine(pool_size=2)
+        assert len(FakeAPI.created) == 1
+
+        for page in range(5):
+            assert engine.image_to_string(page) == f'text of {page}'
+        assert len(FakeAPI.created) == 1
+
+    def test_concurrent_pages_never_exceed_the_pool(self, tesserocr):
+        engine = TesserocrPoolEngine(pool_size=2)
+        in_use = []
+        peak = [0]
+        lock = threading.Lock()
+        # Pages hold their handle until a second page holds one too
+        pair = threading.Barrier(2, timeout=5)
+
+        def ocr():
+            with engine._borrow() as handle:
+                with lock:
+                    in_use.append(handle)
+                    peak[0] = max(peak[0], len(in_use))
+                pair.wait()
+                with lock:
+                    in_use.remove(handle)
+
+        threads = [threading.Thread(target=ocr) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(FakeAPI.created) == 2
+        assert peak[0] == 2
+
+    def test_pool_size_is_at_least_one(self, tesserocr):
+        assert TesserocrPoolEngine(pool_size=0).pool_size == 1
@@ -0,0 +1,52 @@
+import io
+from PIL import Image, ImageDraw, ImageFont
+from tax_report.services.page_dedupe import PageDeduplicator
+
+def load_font():
+    try:
+        return ImageFont.truetype('DejaVuSans.ttf', 36)
+    except OSError:
+        return ImageFont.load_default()
+
+FONT = load_font()
+
+def payslip(basic_salary, month='January'):
+    image = Image.new('RGB', (2480, 3508), 'white')
+    draw = ImageDraw.Draw(image)
+    draw.text((200, 200), 'ACME Holdings (Pvt) Ltd - Payslip', fill='black', font=FONT)
+    draw.text((200, 300), f'Month: {month} 2024', fill='black', font=FONT)
+    rows = [('Basic salary', basic_salary), ('Allowances', '25,000.00'), ('APIT', '12,500.00')]
+    for i, (label, amount) in enumerate(rows):
+        draw.text((200, 500 + i * 80), label, fill='black', font=FONT)
+        draw.text((1800, 500 + i * 80), amount, fill='black', font=FONT)
+    return image
+
+class TestPageDeduplicator:
+    def remember(self, dedupe, image, text):
+        fingerprint = dedupe.fingerprint(image)
+        assert dedupe.find(fingerprint) is None
+        dedupe.add(fingerprint, text)
+
+    def test_rerendered_and_recompressed_pages_reuse_text(self):
+        dedupe = PageDeduplicator(options={})
+        page = payslip('150,000.00')
+        self.remember(dedupe, page, 'payslip text')
+
+        buffer = io.BytesIO()
+        page.save(buffer, 'JPEG', quality=60)
+        assert dedupe.find(dedupe.fingerprint(payslip('150,000.00'))) == 'payslip text'
+        assert dedupe.find(dedupe.fingerprint(Image.open(buffer))) == 'payslip text'
+        assert dedupe.find(dedupe.fingerprint(page.resize((1240, 1754)))) == 'payslip text'
+
+    def test_same_template_with_different_figures_is_not_a_duplicate(self):
+        dedupe = PageDeduplicator(options={})
+        self.remember(dedupe, payslip('150,000.00'), 'january')
+
+        assert dedupe.find(dedupe.fingerprint(payslip('160,000.00'))) is None
+        assert dedupe.find(dedupe.fingerprint(payslip('150,000.00', month='February'))) is None
+
+    def test_session_pages_persist_across_instances(self, tmp_path):
+        self.remember(PageDeduplicator(str(tmp_path), options={}), payslip('150,000.00'), 'stored text')
+
+        later = PageDeduplicator(str(tmp_path), options={})
+        assert later.find(later.fingerprint(payslip('150,000.00'))) == 'stored text'
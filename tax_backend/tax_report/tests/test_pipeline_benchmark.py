@@ -0,0 +1,100 @@
+import os
+from tax_report.benchmarks.corpus import CorpusGenerator, load_manifest
+from tax_report.benchmarks.harness import PipelineBenchmark, STAGES, compare, row_recall
+
+# Explicit options so the harness never reads the project settings
+OPTIONS = {
+    'preprocessing': {},
+    'layout': {'enabled': True, 'row_tolerance': 0.5, 'column_gap': 1.5,
+               'rules_min_confidence': 85.0, 'rules_min_coverage': 0.6},
+    'prompt': {},
+    'llm_client': {},
+}
+
+
+class TestCorpusGenerator:
+    def test_manifest_describes_every_document(self, tmp_path):
+        manifest = CorpusGenerator(seed=7).generate(str(tmp_path), ['payslip', 'scanned_image', 'xlsx_ledger'],
+                                                    page_counts=[1, 2], dpis=[72])
+        files = {document['file'] for document in manifest['documents']}
+        assert files == {'payslip-1p-72dpi.pdf', 'payslip-2p-72dpi.pdf', 'scanned_image-1p-72dpi.jpg',
+                         'scanned_image-2p-72dpi.pdf', 'xlsx_ledger-1p.xlsx', 'xlsx_ledger-2p.xlsx'}
+        for document in manifest['documents']:
+            assert os.path.exists(tmp_path / document['file'])
+            assert document['expected']
+        assert load_manifest(str(tmp_path)) == manifest
+        assert manifest['parameters'] == CorpusGenerator(seed=7).parameters(
+            ['payslip', 'scanned_image', 'xlsx_ledger'], [1, 2], [72])
+
+    def test_same_seed_same_corpus(self, tmp_path):
+        first = CorpusGenerator(seed=3).generate(str(tmp_path / 'a'), ['interest_statement'], [1], [72])
+        second = CorpusGenerator(seed=3).generate(str(tmp_path / 'b'), ['interest_statement'], [1], [72])
+        assert first['documents'] == second['documents']
+
+
+class TestPipelineBenchmark:
+    def test_run_without_ocr_uses_source_text(self, tmp_path):
+        manifest = CorpusGenerator(seed=1).generate(str(tmp_path), ['payslip', 'xlsx_ledger'], [1], [72])
+        report = PipelineBenchmark(OPTIONS, llm_latency_ms=0, ocr=False).run(str(tmp_path), manifest)
+
+        assert report['unavailable']['ocr'] == 'disabled'
+        payslip = next(document for document in report['documents'] if document['kind'] == 'payslip')
+        assert payslip['source'] == 'manifest'
+        assert payslip['recall'] == 1.0
+        assert set(report['summary']['ms_per_page']) == set(STAGES)
+        assert set(report['summary']['by_kind']) == {'payslip', 'xlsx_ledger'}
+
+    class Engine:
+        name = 'fake'
+
+        def __init__(self):
+            self.calls = 0
+
+        def image_to_string(self, image):
+            self.calls += 1
+            return 'Primary Salary 150,000.00\n'
+
+        def image_to_data(self, image):
+            self.calls += 1
+            return [{'text': text, 'conf': 95.0, 'left': left, 'top': 10, 'width': 60, 'height': 20}
+                    for text, left in (('Primary', 10), ('Salary', 78), ('150,000.00', 400))]
+
+    def test_stages_are_timed_inside_the_document_processor(self, tmp_path):
+        manifest = CorpusGenerator(seed=1).generate(str(tmp_path), ['scanned_image'], [1], [72])
+        entry = manifest['documents'][0]
+        engine = self.Engine()
+
+        layout = PipelineBenchmark(OPTIONS, llm_latency_ms=0, engine=engine).run_document(str(tmp_path), entry)
+        # The probe page and the document page both went through the engine
+        assert engine.calls == 2
+        assert layout['source'] == 'pipeline'
+        assert layout['stages']['preprocess'] > 0 and layout['stages']['ocr'] > 0
+        # Confident layout rows the rules classify take the processor's no-LLM path
+        assert (layout['classified'], layout['llm_calls'], layout['llm_skipped']) == (1, 0, True)
+
+        text = PipelineBenchmark(OPTIONS, llm_latency_ms=0, engine=engine, layout=False).run_document(
+            str(tmp_path), entry)
+        assert (text['llm_calls'], text['llm_skipped']) == (1, False)
+        assert text['stages']['llm'] >= 0
+
+    def test_row_recall_counts_each_expected_row_once(self):
+        expected = [{'label': 'APIT', 'amount': 100.0}, {'label': 'APIT', 'amount': 100.0}]
+        assert row_recall(expected, [{'label': 'apit', 'amount': 100.0}]) == 0.5
+        assert row_recall([], []) == 1.0
+
+
+class TestCompare:
+    def summary(self, ocr_ms, pages_per_second, recall=1.0):
+        ms_per_page = {stage: 0.0 for stage in STAGES}
+        ms_per_page['ocr'] = ocr_ms
+        return {'ms_per_page': ms_per_page, 'pages_per_second': pages_per_second, 'recall': recall, 'by_kind': {}}
+
+    def test_reports_slowdowns_beyond_tolerance(self):
+        baseline = self.summary(100.0, 10.0)
+        assert compare(self.summary(110.0, 9.5), baseline, tolerance=0.15) == []
+        regressions = compare(self.summary(150.0, 6.0, recall=0.9), baseline, tolerance=0.15)
+        assert regressions == ['overall: ocr 100.0 -> 150.0 ms/page', 'overall: 10.00 -> 6.00 pages/s',
+                               'overall: recall 1.000 -> 0.900']
+
+    def test_ignores_sub_millisecond_noise(self):
+        assert compare(self.summary(0.5, 10.0), self.summary(0.1, 10.0)) == []
@@ -0,0 +1,58 @@
+import os
+
+from PIL import Image
+
+from tax_report.services.previews import PreviewService
+
+
+class FakeStorage:
+    def __init__(self, root):
+        self.root = root
+
+    def preview_dir(self, name):
+        return os.path.join(self.root, name + '.previews')
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+
+class FakeFieldFile:
+    def __init__(self, storage, name):
+        self.storage = storage
+        self.name = name
+
+
+class TestPreviewService:
+    def setup_method(self):
+        self.service = PreviewService(options={'sizes': {'small': 100, 'large': 300}})
+
+    def make_image_file(self, tmp_path, name='scan.png', size=(1200, 1600)):
+        Image.new('RGB', size, (255, 255, 255)).save(tmp_path / name)
+        return FakeFieldFile(FakeStorage(str(tmp_path)), name)
+
+    def test_renders_every_size_once(self, tmp_path):
+        field_file = self.make_image_file(tmp_path)
+        path = self.service.get(field_file, 1, 'large')
+        with Image.open(path) as preview:
+            assert preview.size == (300, 400)
+        directory = field_file.storage.preview_dir(field_file.name)
+        assert sorted(os.listdir(directory)) == ['p1-large.jpg', 'p1-small.jpg']
+
+        # Later requests never rasterize again
+        self.service._rasterize = lambda *args: (_ for _ in ()).throw(AssertionError('rasterized again'))
+        assert self.service.get(field_file, 1, 'small').endswith('p1-small.jpg')
+
+    def test_page_writer_reuses_ocr_rasters(self, tmp_path):
+        field_file = FakeFieldFile(FakeStorage(str(tmp_path)), 'statement.pdf')
+        write = self.service.page_writer(field_file)
+        if write is None:  # pdf2image missing: PDFs have no previews
+            return
+        write(2, Image.new('L', (1700, 2200), 255))
+        directory = field_file.storage.preview_dir(field_file.name)
+        assert sorted(os.listdir(directory)) == ['p2-large.jpg', 'p2-small.jpg']
+
+    def test_unsupported_requests(self, tmp_path):
+        field_file = self.make_image_file(tmp_path)
+        assert self.service.get(field_file, 1, 'huge') is None
+        assert self.service.get(field_file, 2, 'small') is None
+        assert self.service.page_writer(FakeFieldFile(FakeStorage(str(tmp_path)), 'notes.docx')) is None
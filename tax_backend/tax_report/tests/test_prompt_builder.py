@@ -0,0 +1,58 @@
+from tax_report.services.prompt_builder import PromptBuilder, merge_analyses
+
+
+class TestPromptBuilder:
+    def setup_method(self):
+        self.builder = PromptBuilder(options={'max_prompt_tokens': 6000, 'context_lines': 1})
+
+    def test_keeps_amount_lines_with_context(self):
+        text = "\n".join([
+            "ABC Company (Pvt) Ltd",
+            "Employee handbook reference",
+            "Salary for March",
+            "Primary salary 150,000.00",
+            "Thank you",
+            "Unrelated note",
+            "Another note",
+        ])
+        lines = self.builder.select_lines(text)
+        assert lines == ["Salary for March", "Primary salary 150,000.00", "Thank you"]
+
+    def test_bare_numbers_count_only_on_classified_lines(self):
+        assert self.builder.is_candidate("Retiring gratuity 500000")
+        assert not self.builder.is_candidate("Page 2 of 3")
+
+    def test_repeated_headers_are_sent_once(self):
+        page = "Bank Statement - Page {n}\nInterest income 1,250.00\n"
+        text = page.format(n=1) + page.format(n=2) + page.format(n=3)
+        lines = self.builder.select_lines(text)
+        assert lines.count("Bank Statement - Page 1") == 1
+        assert not any(line.startswith("Bank Statement - Page 2") for line in lines)
+        assert lines.count("Interest income 1,250.00") == 3
+
+    def test_small_document_is_one_prompt_with_compact_analysis(self):
+        prompts = self.builder.build("Primary salary 150,000.00\nAPIT 12,000.00")
+        assert len(prompts) == 1
+        assert '"income_items":[{"category":"Employment Income"' in prompts[0]
+        assert "part 1 of" not in prompts[0]
+
+    def test_large_document_is_split_within_budget(self):
+        builder = PromptBuilder(options={'max_prompt_tokens': 1200, 'context_lines': 0})
+        text = "\n".join(f"Interest income account {n} {n},000.00" for n in range(1, 200))
+        prompts = builder.build(text)
+        assert len(prompts) > 1
+        assert all(len(prompt) // 4 <= 1200 for prompt in prompts)
+        # Every line lands in exactly one prompt, in order
+        sent = [line for prompt in prompts for line in prompt.split("\n") if line.startswith("Interest income account")]
+        assert sent == text.split("\n")
+        assert f"part 1 of {len(prompts)}" in prompts[0]
+
+    def test_merge_is_ordered_and_recomputes_total(self):
+        first = {'income_items': [{'type': 'Interest Income', 'amount': 100}], 'deductions': [], 'confidence_score': 0.9}
+        second = {'income_items': [{'type': 'Dividend Income', 'amount': 50}], 'deductions': [{'amount': 30}],
+                  'total_assessable_income': 999}
+        merged = merge_analyses([first, second])
+        assert [item['type'] for item in merged['income_items']] == ['Interest Income', 'Dividend Income']
+        assert merged['total_assessable_income'] == 120
+        assert merged['confidence_score'] == 0.9
+        assert merge_analyses([first, second]) == merged
@@ -0,0 +1,104 @@
+import re
+import zlib
+import pytest
+from django.conf import settings # type: ignore
+from tax_report.services.report_renderer import ReportRenderer, render_batch, category_title
+
+CONTEXT = {
+    'report_id': 7,
+    'taxpayer': 'Jane (Doe)',
+    'username': 'jane',
+    'tax_year': '2024/2025',
+    'created_at': '2026-10-19',
+    'categories': [{'title': 'Employment Income', 'total': 3000000.0,
+                    'entries': [('Salary', 3000000.0)]}],
+    'deductions': [('Personal relief', 1200000.0), ('APIT deducted', 100000.0)],
+    'summary': [('Assessable income', 3800000.0), ('Taxable income', 2300000.0), ('Total tax payable', 390000.0)],
+}
+
+
+def streams(pdf):
+    """Decompressed content of every stream in the PDF"""
+    return [zlib.decompress(pdf[match.end():match.end() + int(match.group(1))])
+            for match in re.finditer(rb'/FlateDecode /Length (\d+) >>\nstream\n', pdf)]
+
+
+class TestReportRenderer:
+    def test_renders_a_well_formed_pdf(self):
+        pdf = ReportRenderer({}).render(CONTEXT)
+
+        assert pdf.startswith(b'%PDF-1.4') and pdf.rstrip().endswith(b'%%EOF')
+        # Every cross-reference offset points at its object
+        xref = int(re.search(rb'startxref\n(\d+)', pdf).group(1))
+        offsets = re.findall(rb'(\d{10}) 00000 n', pdf[xref:])
+        for number, offset in enumerate(offsets, start=1):
+            assert pdf[int(offset):].startswith(b'%d 0 obj' % number)
+
+        content = b''.join(streams(pdf))
+        assert b'(Jane \\(Doe\\)' not in content  # the name only appears with its label
+        assert b'(Taxpayer: Jane \\(Doe\\)) Tj' in content
+        assert b'(390,000.00) Tj' in content
+
+    def test_same_report_renders_to_the_same_bytes(self):
+        pdf = ReportRenderer({}).render(CONTEXT)
+        assert ReportRenderer({}).render(dict(CONTEXT)) == pdf
+        assert b'/CreationDate (D:20261019)' in pdf
+
+    def test_long_reports_flow_onto_more_pages(self):
+        context = dict(CONTEXT, categories=[{'title': 'Employment Income', 'total': 0.0,
+                                             'entries': [(f'Month {index}', 1.0) for index in range(120)]}])
+        renderer = ReportRenderer({})
+        pages = renderer.paginate(renderer.rows(context))
+
+        assert len(pages) > 2
+        assert b'/Count %d' % len(pages) in renderer.render(context)
+        # A heading is never the last row of a page
+        assert all(page[-1][1][0] != 'heading' for page in pages)
+
+    def test_layout_is_compiled_once(self):
+        renderer = ReportRenderer({})
+        layout = renderer.layout
+        renderer.render(CONTEXT)
+        assert renderer.layout is layout
+        # The page template is the same object in every report
+        template = layout.shared_objects[3]
+        assert template in renderer.render(dict(CONTEXT, taxpayer='Someone else'))
+
+    def test_long_labels_are_shortened_to_the_column(self):
+        layout = ReportRenderer({}).layout
+        label = layout.fit('Interest ' * 40, 'F1', 10, 200)
+        assert label.endswith('...')
+        assert layout.text_width(label, 'F1', 10) <= 200
+
+    def test_batch_names_archive_entries_by_user(self):
+        # Workers use the shared renderer, configured from the settings
+        if not settings.configured:
+            settings.configure()
+        [(name, pdf)] = render_batch([CONTEXT])
+        assert name == 'jane/tax_report_2024-2025_7.pdf'
+        assert pdf.startswith(b'%PDF')
+
+    def test_category_titles(self):
+        assert category_title('EmploymentIncome') == 'Employment Income'
+        assert category_title('TerminalBenefits') == 'Terminal Benefits'
+
+
+@pytest.mark.django_db
+class TestRenderTaxReportView:
+    def test_rendering_twice_stores_one_blob(self):
+        from django.contrib.auth.models import User # type: ignore
+        from rest_framework.test import APIClient # type: ignore
+        from tax_report.models import DownloadedReports, TaxReport
+        from tax_report.storage import report_storage
+
+        user = User.objects.create_user('jane', 'jane@example.com', 'password')
+        report = TaxReport.objects.create(user=user, tax_year='2024/2025', assessable_income=100,
+                                          taxable_income=0, total_tax_payable=0)
+        client = APIClient()
+        client.force_authenticate(user)
+        for _ in range(2):
+            assert client.post(f'/tax-reports/{report.id}/render/').status_code == 201
+
+        digests = {report_storage.digest(row.document.name) for row in DownloadedReports.objects.all()}
+        assert DownloadedReports.objects.count() == 2
+        assert len(digests) == 1 and None not in digests
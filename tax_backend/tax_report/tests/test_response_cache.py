@@ -0,0 +1,41 @@
+import time
+import pytest
+from tax_report.services.response_cache import GeminiResponseCache
+
+class TestGeminiResponseCache:
+    @pytest.fixture
+    def cache(self, tmp_path):
+        return GeminiResponseCache(
+            path=str(tmp_path / 'responses.sqlite3'),
+            ttl_seconds=60,
+            max_bytes=1024,
+            enabled=True
+        )
+
+    def test_hit_after_set(self, cache):
+        assert cache.get('gemini-1.5-flash', 'prompt') is None
+        cache.set('gemini-1.5-flash', 'prompt', '{"income_items": []}', tokens=120)
+
+        assert cache.get('gemini-1.5-flash', 'prompt') == '{"income_items": []}'
+        # Same prompt against another model is a different key
+        assert cache.get('gemini-pro', 'prompt') is None
+
+        stats = cache.stats()
+        assert stats['hits'] == 1
+        assert stats['misses'] == 2
+        assert stats['tokens_saved'] == 120
+
+    def test_expired_entries_are_misses(self, cache):
+        cache._ttl_seconds = 0
+        cache.set('gemini-1.5-flash', 'prompt', 'response')
+        time.sleep(0.01)
+        assert cache.get('gemini-1.5-flash', 'prompt') is None
+
+    def test_lru_eviction_by_size(self, cache):
+        cache.set('gemini-1.5-flash', 'first', 'a' * 600)
+        time.sleep(0.01)
+        cache.set('gemini-1.5-flash', 'second', 'b' * 600)
+
+        assert cache.get('gemini-1.5-flash', 'first') is None
+        assert cache.get('gemini-1.5-flash', 'second') == 'b' * 600
+        assert cache.stats()['evictions'] == 1
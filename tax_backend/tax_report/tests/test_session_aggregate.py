@@ -0,0 +1,112 @@
+import pytest
+from django.core.files.base import ContentFile # type: ignore
+from django.utils import timezone # type: ignore
+from tax_report.models import SessionAnalysisAggregate, TaxFormDocument
+from tax_report.services.session_aggregate import SessionAggregate, session_aggregates
+from tax_report.storage import upload_storage
+
+SALARY = {'category': 'Employment Income', 'type': 'Primary Employment', 'description': 'Salary', 'amount': 100000}
+INTEREST = {'category': 'Investment Income', 'type': 'Interest Income', 'description': 'FD interest', 'amount': 5000}
+APIT = {'category': 'Employment Income', 'type': 'APIT Deduction', 'description': 'APIT', 'amount': 8000}
+
+class TestSessionAggregate:
+    def setup_method(self):
+        self.aggregate = SessionAggregate()
+
+    def test_reuploaded_file_is_counted_once(self):
+        self.aggregate.add_document('a', {'income_items': [SALARY], 'deductions': [APIT]}, source='digest-1')
+        stats = self.aggregate.add_document('b', {'income_items': [dict(SALARY, description=' SALARY '), INTEREST]},
+                                            source='digest-1')
+        assert stats == {'added': 1, 'duplicates': 1}
+
+        analysis = self.aggregate.as_analysis()
+        assert analysis['document_count'] == 2
+        assert analysis['income_items'] == [SALARY, INTEREST]
+        assert analysis['income_totals'] == {'Employment Income': 100000, 'Investment Income': 5000}
+        assert analysis['total_assessable_income'] == 97000
+
+    def test_repeated_entries_within_a_document_are_kept(self):
+        self.aggregate.add_document('a', {'income_items': [SALARY] * 12}, source='digest-1')
+        assert len(self.aggregate.as_analysis()['income_items']) == 12
+        assert self.aggregate.category_totals('income') == {'Employment Income': 1200000}
+
+    def test_identical_entries_of_different_documents_all_count(self):
+        self.aggregate.add_document('a', {'income_items': [SALARY] * 12}, source='digest-1')
+        self.aggregate.add_document('b', {'income_items': [SALARY] * 12}, source='digest-2')
+        assert len(self.aggregate.as_analysis()['income_items']) == 24
+        assert self.aggregate.category_totals('income') == {'Employment Income': 2400000}
+
+    def test_removal_keeps_entries_shared_with_other_documents(self):
+        self.aggregate.add_document('a', {'income_items': [SALARY, INTEREST]}, source='digest-1')
+        self.aggregate.add_document('b', {'income_items': [SALARY]}, source='digest-1')
+
+        assert self.aggregate.remove_document('a')
+        analysis = self.aggregate.as_analysis()
+        assert analysis['income_items'] == [SALARY]
+        assert analysis['income_totals'] == {'Employment Income': 100000}
+
+        assert self.aggregate.remove_document('b')
+        assert self.aggregate.entries == {} and self.aggregate.totals == {'income': {}}
+        assert not self.aggregate.remove_document('b')
+
+    def test_reanalysis_replaces_the_documents_entries(self):
+        self.aggregate.add_document('a', {'income_items': [SALARY]})
+        self.aggregate.add_document('a', {'income_items': [INTEREST]})
+        analysis = self.aggregate.as_analysis()
+        assert analysis['document_count'] == 1
+        assert analysis['income_items'] == [INTEREST]
+
+    def test_round_trips_through_its_stored_state(self):
+        self.aggregate.add_document('a', {'income_items': [SALARY], 'deductions': [APIT]})
+        restored = SessionAggregate(self.aggregate.entries, self.aggregate.documents,
+                                    self.aggregate.totals, self.aggregate.next_sequence)
+        restored.add_document('b', {'income_items': [INTEREST]})
+        assert restored.as_analysis()['income_items'] == [SALARY, INTEREST]
+
+
+@pytest.mark.django_db
+class TestSessionAggregateService:
+    SESSION = 'session-1'
+
+    def document(self, content, analysis, session=SESSION):
+        name = upload_storage.save(f'tax_documents/{session}/payslip.pdf', ContentFile(content))
+        return TaxFormDocument.objects.create(
+            session_id=session, file=name, original_filename='payslip.pdf', extracted_data=analysis,
+            is_processed=True, analyzed_at=timezone.now()
+        )
+
+    def test_two_payslips_with_the_same_amount_both_count(self):
+        for month in ('January', 'February'):
+            session_aggregates.add_document(self.document(f'payslip {month}'.encode(), {'income_items': [SALARY]}))
+
+        analysis = session_aggregates.analysis(self.SESSION)
+        assert analysis['document_count'] == 2
+        assert analysis['income_items'] == [SALARY, SALARY]
+        assert analysis['income_totals'] == {'Employment Income': 200000}
+
+    def test_reupload_of_the_same_file_counts_once(self):
+        first = self.document(b'payslip January', {'income_items': [SALARY]})
+        again = self.document(b'payslip January', {'income_items': [SALARY]})
+        session_aggregates.add_document(first)
+        assert session_aggregates.add_document(again) == {'added': 0, 'duplicates': 1}
+        assert session_aggregates.analysis(self.SESSION)['income_totals'] == {'Employment Income': 100000}
+
+        # The entry stays until its last copy is removed
+        session_aggregates.remove_document(first)
+        assert session_aggregates.analysis(self.SESSION)['income_items'] == [SALARY]
+        session_aggregates.remove_document(again)
+        assert session_aggregates.analysis(self.SESSION) == {}
+
+    def test_missing_aggregate_is_rebuilt_from_the_documents(self):
+        self.document(b'payslip January', {'income_items': [SALARY], 'deductions': [APIT]})
+        self.document(b'payslip February', {'income_items': [SALARY]})
+        self.document(b'payslip January', {'income_items': [SALARY], 'deductions': [APIT]})
+        self.document(b'other session', {'income_items': [INTEREST]}, session='session-2')
+
+        analysis = session_aggregates.analysis(self.SESSION)
+        assert analysis['income_totals'] == {'Employment Income': 200000}
+        assert analysis['deduction_totals'] == {'Employment Income': 8000}
+        assert SessionAnalysisAggregate.objects.filter(session_id=self.SESSION).exists()
+
+        session_aggregates.clear(self.SESSION)
+        assert not SessionAnalysisAggregate.objects.filter(session_id=self.SESSION).exists()
@@ -0,0 +1,69 @@
+import json
+import os
+from multiprocessing import Process
+
+from tax_report.services import session_index
+from tax_report.services.session_index import SessionDocumentIndex, INDEX_FILENAME
+
+
+def _append_documents(directory, worker, count):
+    index = SessionDocumentIndex(directory)
+    for i in range(count):
+        index.add({'doc_id': f'{worker}-{i}', 'worker': worker})
+
+
+class TestSessionDocumentIndex:
+    def test_add_get_and_remove(self, tmp_path):
+        index = SessionDocumentIndex(str(tmp_path))
+        index.add({'doc_id': 'a', 'name': 'first'})
+        index.add({'doc_id': 'b', 'name': 'second'})
+        index.remove('a')
+
+        assert index.get('a') is None
+        assert index.get('b') == {'doc_id': 'b', 'name': 'second'}
+        assert [doc['doc_id'] for doc in index.all()] == ['b']
+
+    def test_replace_false_keeps_existing_record(self, tmp_path):
+        index = SessionDocumentIndex(str(tmp_path))
+        index.add({'doc_id': 'a', 'name': 'first'})
+        index.add({'doc_id': 'a', 'name': 'changed'}, replace=False)
+        assert index.get('a')['name'] == 'first'
+
+    def test_readers_see_appends_from_other_instances(self, tmp_path):
+        reader = SessionDocumentIndex(str(tmp_path))
+        writer = SessionDocumentIndex(str(tmp_path))
+        assert reader.all() == []
+        writer.add({'doc_id': 'a'})
+        assert reader.get('a') == {'doc_id': 'a'}
+
+    def test_compaction_drops_stale_records(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(session_index, 'COMPACT_MIN_RECORDS', 10)
+        index = SessionDocumentIndex(str(tmp_path))
+        reader = SessionDocumentIndex(str(tmp_path))
+        for i in range(20):
+            index.add({'doc_id': 'a', 'version': i})
+        index.add({'doc_id': 'b'})
+
+        with open(tmp_path / INDEX_FILENAME) as f:
+            assert len(f.readlines()) < 10
+        assert reader.get('a') == {'doc_id': 'a', 'version': 19}
+        assert [doc['doc_id'] for doc in reader.all()] == ['a', 'b']
+
+    def test_legacy_metadata_is_imported(self, tmp_path):
+        legacy = tmp_path / 'metadata.json'
+        legacy.write_text(json.dumps([{'doc_id': 'old'}]))
+        index = SessionDocumentIndex(str(tmp_path), legacy_files=[str(legacy)])
+        index.add({'doc_id': 'new'})
+
+        assert [doc['doc_id'] for doc in index.all()] == ['old', 'new']
+        assert not os.path.exists(legacy)
+
+    def test_concurrent_processes_do_not_lose_appends(self, tmp_path):
+        workers = [Process(target=_append_documents, args=(str(tmp_path), w, 50)) for w in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        documents = SessionDocumentIndex(str(tmp_path)).all()
+        assert len(documents) == 200
@@ -0,0 +1,120 @@
+import os
+import time
+import pytest
+from django.core.files.base import ContentFile # type: ignore
+from tax_report.models import StoredBlob, StoredFile
+from tax_report.storage import ZSTD_INSTALLED, ContentAddressableStorage
+
+PAYSLIP = b'Gross pay 4,200.00 PAYE 610.00\n' * 64
+
+
+@pytest.fixture
+def storage(tmp_path):
+    return ContentAddressableStorage(location=str(tmp_path), options={'compress': False})
+
+
+def blob_files(storage):
+    root = os.path.join(storage.location, 'blobs')
+    files = (os.path.relpath(os.path.join(path, name), root) for path, dirs, names in os.walk(root) for name in names)
+    return sorted(path for path in files if not path.startswith('tmp' + os.sep))
+
+
+@pytest.mark.django_db
+class TestContentAddressableStorage:
+    def test_identical_uploads_share_one_blob(self, storage):
+        first = storage.save('tax_documents/s1/payslip.pdf', ContentFile(PAYSLIP))
+        second = storage.save('tax_documents/s2/payslip.pdf', ContentFile(PAYSLIP))
+        storage.save('tax_documents/s2/other.pdf', ContentFile(b'something else'))
+
+        assert storage.digest(first) == storage.digest(second)
+        assert StoredBlob.objects.get(digest=storage.digest(first)).ref_count == 2
+        assert len(blob_files(storage)) == 2
+        with storage.open(second) as f:
+            assert f.read() == PAYSLIP
+        assert storage.usage()['deduplication_saved_bytes'] == len(PAYSLIP)
+
+    def test_files_go_with_the_last_name(self, storage, django_capture_on_commit_callbacks):
+        first = storage.save('tax_documents/s1/payslip.pdf', ContentFile(PAYSLIP))
+        second = storage.save('tax_documents/s2/payslip.pdf', ContentFile(PAYSLIP))
+        path = storage.path(first)
+
+        with django_capture_on_commit_callbacks(execute=True):
+            storage.delete(first)
+        assert StoredBlob.objects.get().ref_count == 1
+        assert os.path.exists(path)
+
+        with django_capture_on_commit_callbacks(execute=True):
+            storage.delete(second)
+        assert not StoredBlob.objects.exists()
+        assert not os.path.exists(path)
+
+    def test_upload_between_release_and_purge_keeps_the_files(self, storage, django_capture_on_commit_callbacks):
+        name = storage.save('tax_documents/s1/payslip.pdf', ContentFile(PAYSLIP))
+        with django_capture_on_commit_callbacks() as callbacks:
+            storage.delete(name)
+        # The row stays behind as a tombstone until the purge runs
+        assert StoredBlob.objects.get().ref_count == 0
+        assert storage.usage()['blobs'] == 0
+
+        again = storage.save('tax_documents/s2/payslip.pdf', ContentFile(PAYSLIP))
+        for callback in callbacks:
+            callback()
+
+        assert StoredBlob.objects.get().ref_count == 1
+        with storage.open(again) as f:
+            assert f.read() == PAYSLIP
+
+    def test_delete_prefix_releases_in_batches(self, storage, monkeypatch, django_capture_on_commit_callbacks):
+        monkeypatch.setattr('tax_report.storage.RELEASE_BATCH_SIZE', 2)
+        for index in range(5):
+            storage.save(f'tax_documents/s1/{index}.pdf', ContentFile(b'page %d' % index))
+        kept = storage.save('tax_documents/s2/0.pdf', ContentFile(b'page 0'))
+        released = []
+        release = storage._release
+        monkeypatch.setattr(storage, '_release', lambda names: released.append(len(names)) or release(names))
+
+        with django_capture_on_commit_callbacks(execute=True):
+            assert storage.delete_prefix('tax_documents/s1/') == 5
+
+        assert released == [2, 2, 1]
+        assert list(StoredFile.objects.values_list('name', flat=True)) == [kept]
+        assert len(blob_files(storage)) == 1
+
+    @pytest.mark.skipif(not ZSTD_INSTALLED, reason='zstandard not installed')
+    def test_compressed_blobs_round_trip(self, tmp_path):
+        storage = ContentAddressableStorage(location=str(tmp_path), options={'compress': True})
+        name = storage.save('tax_documents/s1/statement.txt', ContentFile(PAYSLIP))
+
+        blob = StoredBlob.objects.get()
+        assert blob.compressed and blob.path.endswith('.zst')
+        assert blob.stored_size < blob.size == len(PAYSLIP)
+        with storage.open(name) as f:
+            assert f.read() == PAYSLIP
+        assert storage.stat(name)['compressed'] is True
+
+    @pytest.mark.skipif(not ZSTD_INSTALLED, reason='zstandard not installed')
+    def test_incompressible_content_is_stored_as_is(self, tmp_path):
+        storage = ContentAddressableStorage(location=str(tmp_path), options={'compress': True})
+        name = storage.save('tax_documents/s1/scan.bin', ContentFile(os.urandom(4096)))
+
+        assert not StoredBlob.objects.get().compressed
+        assert storage.stat(name)['size'] == 4096
+
+
+@pytest.mark.django_db
+def test_sweeper_purges_tombstones_left_behind(storage, django_capture_on_commit_callbacks):
+    from tax_report.services.upload_sweeper import Reclaimer, UploadSweeper
+    name = storage.save('tax_documents/s1/payslip.pdf', ContentFile(PAYSLIP))
+    path = storage.path(name)
+    with django_capture_on_commit_callbacks():
+        storage.delete(name)  # the purge callback never runs
+    sweeper = UploadSweeper(storage=storage)
+
+    dry_run = Reclaimer(batch_size=100, batch_pause=0, dry_run=True)
+    sweeper.sweep_blobs(dry_run, time.time())
+    assert dry_run.report['orphan_blobs'] == {'files': 1, 'bytes': len(PAYSLIP)}
+    assert os.path.exists(path)
+
+    sweeper.sweep_blobs(Reclaimer(batch_size=100, batch_pause=0), time.time())
+    assert not StoredBlob.objects.exists()
+    assert not os.path.exists(path)
@@ -0,0 +1,145 @@
+import re
+import datetime
+import zipfile
+import pytest
+from tax_report.services.streaming_extractors import CELL_DELIMITER, iter_docx_lines, iter_excel_lines, join_lines
+
+docx = pytest.importorskip('docx')
+openpyxl = pytest.importorskip('openpyxl')
+
+
+@pytest.fixture
+def word_file(tmp_path):
+    document = docx.Document()
+    document.add_heading('APIT Statement 2024/2025', level=1)
+    document.add_paragraph('Employee: Jane Perera')
+    run = document.add_paragraph().add_run('Period')
+    run.add_tab()
+    run.add_text('April to March')
+    run.add_break()
+    run.add_text('Employer: Acme   Holdings')
+    table = document.add_table(rows=3, cols=3)
+    for row, values in zip(table.rows, [('Primary Salary', '', '1,800,000.00'),
+                                        ('APIT', 'Monthly', '120,000.00'),
+                                        ('', '', '')]):
+        for cell, value in zip(row.cells, values):
+            cell.text = value
+    document.add_paragraph('Net pay 1,680,000.00')
+    path = tmp_path / 'statement.docx'
+    document.save(str(path))
+    return str(path)
+
+
+@pytest.fixture
+def excel_file(tmp_path):
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.title = 'Salary'
+    sheet.append(['Description', None, 'Amount'])
+    sheet.append(['Primary Salary', None, 1800000.0])
+    sheet.append([None, None, None])
+    sheet.append(['Bonus', 'December', 250000.5])
+    sheet.append(['Primary Salary', 'Paid on', datetime.date(2025, 3, 31)])
+    interest = workbook.create_sheet('Interest')
+    interest.append(['Interest Income', 42000])
+    interest['D5'] = 'WHT   on interest'
+    path = tmp_path / 'ledger.xlsx'
+    workbook.save(str(path))
+    share_strings(str(path))
+    return str(path)
+
+
+def share_strings(path):
+    """
+    Move the inline strings openpyxl writes into a shared string table, the
+    way Excel saves workbooks (repeated labels stored once)
+    """
+    inline = re.compile(r'<c r="([A-Z]+[0-9]+)"((?: s="[0-9]+")?) t="inlineStr"><is><t[^>]*>(.*?)</t></is></c>')
+    strings = []
+
+    def shared(match):
+        if match.group(3) not in strings:
+            strings.append(match.group(3))
+        return f'<c r="{match.group(1)}"{match.group(2)} t="s"><v>{strings.index(match.group(3))}</v></c>'
+
+    with zipfile.ZipFile(path) as archive:
+        parts = {name: archive.read(name).decode('utf-8') for name in archive.namelist()}
+    for name in parts:
+        if name.startswith('xl/worksheets/'):
+            parts[name] = inline.sub(shared, parts[name])
+    parts['xl/sharedStrings.xml'] = (
+        '<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        f'uniqueCount="{len(strings)}">' + ''.join(f'<si><t>{text}</t></si>' for text in strings) + '</sst>'
+    )
+    parts['[Content_Types].xml'] = parts['[Content_Types].xml'].replace('</Types>', (
+        '<Override PartName="/xl/sharedStrings.xml" ContentType="application/'
+        'vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/></Types>'))
+    parts['xl/_rels/workbook.xml.rels'] = parts['xl/_rels/workbook.xml.rels'].replace('</Relationships>', (
+        '<Relationship Id="rIdShared" Target="sharedStrings.xml" Type="http://schemas.openxmlformats.org/'
+        'officeDocument/2006/relationships/sharedStrings"/></Relationships>'))
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, content in parts.items():
+            archive.writestr(name, content)
+
+
+class TestIterDocxLines:
+    def test_matches_python_docx_in_document_order(self, word_file):
+        document = docx.Document(word_file)
+        paragraphs = [paragraph.text for paragraph in document.paragraphs]
+        rows = [CELL_DELIMITER.join(cell.text for cell in row.cells if cell.text) for row in document.tables[0].rows]
+
+        # python-docx renders tabs and breaks as characters; the stream as a space and a new line
+        expected = paragraphs[:2] + paragraphs[2].replace('\t', ' ').split('\n')
+        expected += [row for row in rows if row] + paragraphs[3:]
+
+        assert list(iter_docx_lines(word_file)) == expected
+        assert expected[4:6] == ['Primary Salary\t1,800,000.00', 'APIT\tMonthly\t120,000.00']
+
+    def test_joined_text_keeps_amounts_last(self, word_file):
+        text = join_lines(iter_docx_lines(word_file))
+        assert text.endswith('Net pay 1,680,000.00\n')
+        assert '\n\n' not in text
+
+
+class TestIterExcelLines:
+    def test_matches_openpyxl_with_shared_strings_and_empty_cells(self, excel_file):
+        with zipfile.ZipFile(excel_file) as archive:
+            assert 'inlineStr' not in archive.read('xl/worksheets/sheet1.xml').decode('utf-8')
+
+        def cell(value):
+            if isinstance(value, float) and value.is_integer():
+                return str(int(value))
+            return value.isoformat() if isinstance(value, datetime.date) else ' '.join(str(value).split())
+
+        expected = []
+        workbook = openpyxl.load_workbook(excel_file)
+        for sheet in workbook.worksheets:
+            for row in sheet.iter_rows(values_only=True):
+                cells = [cell(value) for value in row if value is not None]
+                if cells:
+                    expected.append(CELL_DELIMITER.join(cells))
+
+        lines = list(iter_excel_lines(excel_file))
+        assert lines == expected
+        assert lines == [
+            'Description\tAmount',
+            'Primary Salary\t1800000',
+            'Bonus\tDecember\t250000.5',
+            'Primary Salary\tPaid on\t2025-03-31T00:00:00',
+            'Interest Income\t42000',
+            'WHT on interest',
+        ]
+
+    def test_sheet_titles_never_become_amounts(self, tmp_path):
+        from tax_report.services.keyword_classifier import KeywordClassifier
+        workbook = openpyxl.Workbook()
+        workbook.active.title = 'Interest 2024'
+        workbook.active.append(['Statement of interest earned'])
+        path = str(tmp_path / 'interest.xlsx')
+        workbook.save(path)
+
+        lines = list(iter_excel_lines(path))
+        assert lines == ['Statement of interest earned']
+        analysis = KeywordClassifier().build_analysis(KeywordClassifier().classify_lines(lines))
+        assert analysis['income_items'] == []
+        assert analysis['total_assessable_income'] == 0
@@ -0,0 +1,159 @@
+import pytest
+from tax_report.services.tax_engine import TaxEngine, RateSchedule, RateScheduleCache, DEFAULT_RATE_SCHEDULES
+
+
+@pytest.fixture(autouse=True)
+def built_in_schedules(monkeypatch):
+    # Keep the tests off the database: always use the built-in schedules
+    monkeypatch.setattr(RateScheduleCache, '_load',
+                        lambda self, kind, year: RateSchedule(*DEFAULT_RATE_SCHEDULES[(kind, year)]))
+
+
+def entries(*amounts, name='Item'):
+    return [{'name': f'{name} {index}', 'amount': amount} for index, amount in enumerate(amounts)]
+
+
+MAPPINGS = {
+    'EmploymentIncome': {
+        'primaryEntries': entries('3,000,000.00'),
+        'secondaryEntries': [],
+        'apitEntries': [{'name': 'APIT', 'source': 'Employer', 'amount': '100000'}],
+    },
+    'BusinessIncome': {'businessEntries': entries('1000000'), 'deductions': entries('200000')},
+    'InvestmentIncome': {'investmentEntries': [], 'deductions': []},
+    'OtherIncome': {'otherEntries': [], 'whtEntries': [{'source': 'Bank', 'amount': ''}]},
+    'QualifyingPayments': {'donationEntries': entries('300000')},
+}
+
+
+class TestTaxEngine:
+    def test_computes_return_in_one_pass(self):
+        result = TaxEngine({}).compute(MAPPINGS, '2024/2025')
+
+        assert result['assessable_income'] == 3800000.0
+        assert result['personal_relief'] == 1200000.0
+        assert result['qualifying_relief'] == 300000.0
+        assert result['taxable_income'] == 2300000.0
+        # 500k each at 6, 12, 18 and 24%, then 300k at 30%
+        assert result['income_tax'] == 390000.0
+        assert [bracket['rate'] for bracket in result['brackets']] == [6.0, 12.0, 18.0, 24.0, 30.0]
+        assert result['tax_credits'] == {'APIT': 100000.0, 'WHT': 0.0}
+        assert result['balance_tax_payable'] == 290000.0
+        assert result['refund_due'] == 0.0
+
+    def test_tax_is_shared_out_by_assessable_income(self):
+        categories = {category['category']: category
+                      for category in TaxEngine({}).compute(MAPPINGS, '2024/2025')['categories']}
+
+        assert categories['EmploymentIncome']['tax'] == 307894.74
+        assert categories['BusinessIncome']['assessable'] == 800000.0
+        assert categories['BusinessIncome']['tax'] == 82105.26
+        assert categories['InvestmentIncome']['tax'] == 0.0
+        assert sum(category['tax'] for category in categories.values()) == 390000.0
+
+    def test_reliefs_never_exceed_assessable_income(self):
+        mappings = {'EmploymentIncome': {'primaryEntries': entries('1000000'),
+                                         'apitEntries': [{'source': 'Employer', 'amount': '5000'}]},
+                    'QualifyingPayments': {'donationEntries': entries('500000')}}
+        result = TaxEngine({}).compute(mappings, '2025/2026')
+
+        assert result['personal_relief'] == 1000000.0
+        assert result['qualifying_relief'] == 0.0
+        assert result['taxable_income'] == 0.0
+        assert result['refund_due'] == 5000.0
+
+    def test_terminal_benefits_use_their_own_schedule(self):
+        mappings = {'EmploymentIncome': {'primaryEntries': entries('1000000')},
+                    'TerminalBenefits': {'gratuityEntries': entries('15000000')}}
+        result = TaxEngine({}).compute(mappings, '2025/2026')
+
+        # 10M at 0%, then 5M at 6%
+        assert result['terminal_benefits']['tax'] == 300000.0
+        assert result['income_tax'] == 0.0
+        assert result['total_tax_payable'] == 300000.0
+
+    def test_unknown_tax_year_is_rejected(self):
+        with pytest.raises(ValueError):
+            TaxEngine({}).compute(MAPPINGS, '1999/2000')
+
+    @pytest.mark.parametrize('mappings', [[], {'EmploymentIncome': []}, {'QualifyingPayments': 'donations'}])
+    def test_malformed_mappings_are_rejected(self, mappings):
+        with pytest.raises(ValueError):
+            TaxEngine({}).compute(mappings, '2024/2025')
+
+    @pytest.mark.django_db
+    def test_save_writes_the_whole_return(self, django_assert_num_queries):
+        from django.contrib.auth.models import User # type: ignore
+        from tax_report.models import TaxReport
+        user = User.objects.create_user('jane', 'jane@example.com', 'password')
+        mappings = dict(MAPPINGS, TerminalBenefits={'gratuityEntries': entries('15000000', name='Gratuity')})
+        result = TaxEngine({}).compute(mappings, '2024/2025')
+
+        # Savepoint, report and one insert each for categories, entries and deductions
+        with django_assert_num_queries(6):
+            report = TaxEngine({}).save(result, user)
+
+        report = TaxReport.objects.get(pk=report.pk)
+        assert (report.user, report.tax_year) == (user, '2024/2025')
+        assert float(report.total_tax_payable) == result['total_tax_payable']
+        categories = {category.category_type: category for category in report.categories.all()}
+        assert sorted(categories) == ['BusinessIncome', 'EmploymentIncome', 'TerminalBenefits']
+        assert float(categories['BusinessIncome'].total_amount) == 800000.0
+        assert [(entry.name, float(entry.amount)) for entry in categories['TerminalBenefits'].entries.all()] == [
+            ('Gratuity 0', 15000000.0)]
+        deductions = {deduction.deduction_type: float(deduction.amount) for deduction in report.deductions.all()}
+        assert deductions == {'PERSONAL_RELIEF': 1200000.0, 'QUALIFYING_PAYMENT': 300000.0, 'APIT': 100000.0}
+
+
+@pytest.mark.django_db
+class TestComputeTaxReturnView:
+    @pytest.fixture
+    def client(self):
+        from rest_framework.test import APIClient # type: ignore
+        return APIClient()
+
+    @pytest.fixture
+    def user(self):
+        from django.contrib.auth.models import User # type: ignore
+        return User.objects.create_user('jane', 'jane@example.com', 'password')
+
+    def post(self, client, **data):
+        return client.post('/compute-tax-return/', dict({'tax_year': '2024/2025'}, **data), format='json')
+
+    def test_returns_are_only_saved_on_request(self, client, user):
+        from tax_report.models import TaxReport
+        client.force_authenticate(user)
+
+        response = self.post(client, mappings=MAPPINGS)
+        assert response.status_code == 200
+        assert response.data['report_id'] is None
+        assert response.data['result']['balance_tax_payable'] == 290000.0
+        assert not TaxReport.objects.exists()
+
+        response = self.post(client, mappings=MAPPINGS, save=True)
+        assert TaxReport.objects.get().id == response.data['report_id']
+
+    def test_saving_needs_a_signed_in_user(self, client):
+        from tax_report.models import TaxReport
+        assert self.post(client, mappings=MAPPINGS, save=True).status_code == 401
+        assert not TaxReport.objects.exists()
+
+    @pytest.mark.parametrize('mappings', [['EmploymentIncome'], {'EmploymentIncome': [1, 2]}])
+    def test_malformed_mappings_are_a_bad_request(self, client, mappings):
+        response = self.post(client, mappings=mappings)
+        assert response.status_code == 400
+        assert response.data['success'] is False
+
+
+class TestRateScheduleCache:
+    def test_schedules_are_reloaded_after_ttl(self, monkeypatch):
+        loads = []
+        monkeypatch.setattr(RateScheduleCache, '_load', lambda self, kind, year: loads.append(kind) or kind)
+        now = [0.0]
+        cache = RateScheduleCache(ttl=60, clock=lambda: now[0])
+
+        cache.get('income', '2024/2025')
+        cache.get('income', '2024/2025')
+        now[0] = 61.0
+        cache.get('income', '2024/2025')
+        assert loads == ['income', 'income']
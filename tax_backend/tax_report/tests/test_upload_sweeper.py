@@ -0,0 +1,75 @@
+import os
+import time
+from tax_report.services.upload_sweeper import Reclaimer, UploadSweeper, sweep_blob_tree, start_sweeper
+
+NOW = time.time()
+OLD = NOW - 7200
+
+
+def write(path, size, mtime=OLD):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(b'x' * size)
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+class TestReclaimer:
+    def test_pauses_after_every_batch(self, tmp_path):
+        pauses = []
+        reclaimer = Reclaimer(batch_size=2, batch_pause=0.5, sleep=pauses.append)
+        for index in range(5):
+            reclaimer.remove(write(str(tmp_path / f'{index}.tmp'), 10), 'temp_files')
+
+        assert pauses == [0.5, 0.5]
+        assert os.listdir(tmp_path) == []
+        assert reclaimer.summary() == {'dry_run': False, 'categories': {'temp_files': {'files': 5, 'bytes': 50}},
+                                       'files': 5, 'bytes': 50}
+
+    def test_dry_run_counts_directories_without_deleting(self, tmp_path):
+        write(str(tmp_path / 'session' / 'a.pdf'), 100)
+        write(str(tmp_path / 'session' / 'nested' / 'b.pdf'), 20)
+        reclaimer = Reclaimer(batch_size=1, batch_pause=1.0, dry_run=True, sleep=lambda _: None)
+        reclaimer.remove(str(tmp_path / 'session'), 'session_files')
+
+        assert reclaimer.summary()['bytes'] == 120
+        assert os.path.exists(tmp_path / 'session' / 'nested' / 'b.pdf')
+
+
+class TestSweepBlobTree:
+    def test_only_unaccounted_files_are_removed(self, tmp_path):
+        root = str(tmp_path)
+        write(f'{root}/ab/cd/abcd.pdf', 10)  # live blob
+        write(f'{root}/ab/cd/abcd.previews/p1-small.jpg', 5)  # previews of a live blob
+        write(f'{root}/ab/cd/abce.txt.zst', 10)  # live compressed blob
+        write(f'{root}/ab/cd/abce.txt', 30)  # its unused decompressed copy
+        write(f'{root}/ab/cd/dead.pdf', 40)  # blob without a row
+        write(f'{root}/ab/cd/dead.previews/p1-small.jpg', 5)
+        os.utime(f'{root}/ab/cd/dead.previews', (OLD, OLD))
+        write(f'{root}/ab/cd/fresh.pdf', 50, mtime=NOW)  # row may not be committed yet
+        write(f'{root}/tmp/upload.part', 60)  # scratch files are swept separately
+
+        reclaimer = Reclaimer(batch_size=100, batch_pause=0)
+        sweep_blob_tree(root, {'ab/cd/abcd.pdf', 'ab/cd/abce.txt.zst'}, reclaimer, NOW,
+                        orphan_grace=3600, expanded_max_age=3600)
+
+        assert sorted(os.listdir(f'{root}/ab/cd')) == ['abcd.pdf', 'abcd.previews', 'abce.txt.zst', 'fresh.pdf']
+        assert os.path.exists(f'{root}/tmp/upload.part')
+        assert reclaimer.report == {
+            'expanded_copies': {'files': 1, 'bytes': 30},
+            'orphan_blobs': {'files': 1, 'bytes': 40},
+            'orphan_previews': {'files': 1, 'bytes': 5},
+        }
+
+    def test_recently_used_expanded_copy_is_kept(self, tmp_path):
+        root = str(tmp_path)
+        write(f'{root}/ab/cd/abce.txt.zst', 10)
+        write(f'{root}/ab/cd/abce.txt', 30, mtime=NOW - 60)
+        reclaimer = Reclaimer(batch_size=100, batch_pause=0)
+        sweep_blob_tree(root, {'ab/cd/abce.txt.zst'}, reclaimer, NOW, orphan_grace=3600, expanded_max_age=3600)
+        assert os.path.exists(f'{root}/ab/cd/abce.txt')
+
+
+class TestScheduler:
+    def test_disabled_without_interval(self):
+        assert start_sweeper(UploadSweeper({'interval': 0})) is None
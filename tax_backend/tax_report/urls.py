@@ -6,18 +6,28 @@ urlpatterns = [
     path('documents/', views.get_documents, name='get_documents'),
     path('documents/<str:doc_id>/', views.get_document, name='get_document'),
     path('documents/<str:doc_id>/delete/', views.delete_document, name='delete_document'),
+    path('documents/<str:doc_id>/preview/', views.document_preview, name='document_preview'),
     path('analyze-document/<str:doc_id>/', views.analyze_document, name='analyze_document'),
+    path('analyze-document/<str:doc_id>/stream/', views.analyze_document_stream, name='analyze_document_stream'),
     path('documents/<str:doc_id>/extract-context/', views.extract_and_map_context, name='extract_and_map_context'),
     path('documents/<str:doc_id>/form-mappings/', views.get_form_field_mappings, name='get_form_field_mappings'),
     path('upload-document/', views.upload_tax_form_document, name='upload_tax_form_document'),
     path('session-documents/', views.get_session_documents, name='get_session_documents'),
+    path('uploads/init/', views.init_chunked_upload, name='init_chunked_upload'),
+    path('uploads/<str:upload_id>/', views.chunked_upload_status, name='chunked_upload_status'),
+    path('uploads/<str:upload_id>/chunks/<int:index>/', views.upload_chunk, name='upload_chunk'),
+    path('uploads/<str:upload_id>/complete/', views.complete_chunked_upload, name='complete_chunked_upload'),
     path('remove-document/<str:doc_id>/', views.remove_session_document, name='remove_session_document'),
     path('view-document/<str:doc_id>/', views.view_document, name='view_document'),
     path('analyze-uploaded-document/', views.analyze_uploaded_document, name='analyze-uploaded-document'),
     path('cleanup-session/', views.cleanup_tax_session, name='cleanup-session'),
     path('auto-fill/', views.auto_fill_forms, name='auto_fill_forms'),
+    path('compute-tax-return/', views.compute_tax_return, name='compute_tax_return'),
     path('api/download/', views.record_download, name='record_download'),
     path('save-document/', views.save_document, name='save_document'),
     path('user-details/<int:user_id>/', views.get_user_details, name='get_user_details'),
+    path('tax-reports/<int:report_id>/render/', views.render_tax_report, name='render_tax_report'),
+    path('downloaded-reports/<int:report_id>/download/', views.download_report, name='download_report'),
     path('test-gemini-analysis/', views.test_gemini_analysis, name='test_gemini_analysis'),
+    path('llm-status/', views.llm_status, name='llm_status'),
 ]
\ No newline at end of file
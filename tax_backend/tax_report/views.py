@@ -6,35 +6,133 @@ from rest_framework.decorators import api_view, parser_classes
 from rest_framework.parsers import MultiPartParser, FormParser, FileUploadParser
 from django.core.files.storage import default_storage
 from django.conf import settings
-from django.http import FileResponse, Http404, JsonResponse
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from asgiref.sync import sync_to_async
 from django.utils import timezone
 import os
 import mimetypes
 import json
+from datetime import datetime, timezone as dt_timezone
 import uuid
+from django.urls import reverse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
-from .models import TaxFormDocument
-from .services.document_processor import TaxFormDocumentProcessor, DocumentProcessor
+from .models import TaxFormDocument, ChunkedUpload
+from .storage import upload_storage, report_storage
+from .services.chunked_upload import chunked_upload_manager, ChunkedUploadError
+from .services.document_processor import TaxFormDocumentProcessor, get_document_processor, notify
+from .services.analysis_stream import stream_events
+from .services.file_serving import serve_stored_file, serve_file
+from .services.previews import preview_service
+from .services.llm_client import llm_metrics
+from .services.autofill_mapping import autofill_mapper
+from .services.session_aggregate import session_aggregates
+from .services.tax_engine import tax_engine
+from .services.report_renderer import report_context, report_renderer
 from django.conf import settings
 from django.utils import timezone
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
-from .models import DownloadedReports
+from .models import DownloadedReports, TaxReport
 from django.core.files import File
+from django.core.files.base import ContentFile
 import os
 
 # Initialize logger
 logger = logging.getLogger(__name__)
 
+def _force_refresh_requested(request):
+    """Whether the client asked to bypass the Gemini response cache"""
+    value = request.data.get('force_refresh', request.query_params.get('force_refresh', False))
+    return str(value).lower() in ('1', 'true', 'yes')
+
+def _session_key(request):
+    """Return the session key, creating the session if needed"""
+    if not request.session.session_key:
+        request.session.create()
+    return request.session.session_key
+
+def _get_session_document(request, doc_id):
+    """Indexed lookup of a document owned by the current session"""
+    try:
+        uuid.UUID(str(doc_id))
+    except ValueError:
+        return None
+    return TaxFormDocument.objects.filter(session_id=_session_key(request), id=doc_id).first()
+
+def _session_analysis(request):
+    """Merged analysis of every document analyzed in this session"""
+    return session_aggregates.analysis(_session_key(request))
+
+def _analyze_stored_document(document, force_refresh=False, progress=None):
+    """
+    Return the stored analysis for a document, processing it only once.
+    force_refresh re-runs the analysis on the stored text without OCR.
+    progress receives the processing stages (see analyze_document_stream).
+    """
+    if document.is_processed and document.extracted_data is not None and not force_refresh:
+        return document.extracted_data
+
+    processor = get_document_processor()
+    rows = None
+    if document.content_text and force_refresh:
+        extracted_text = document.content_text
+    else:
+        # Extract text from document, skipping pages already OCRed in this session
+        notify(progress, 'extraction_started', file_type=document.file_type)
+        rows = []
+        extracted_text, document.extraction_stats = processor.extract_text_with_stats(
+            document.file.path, session_id=document.session_id, progress=progress,
+            on_page=preview_service.page_writer(document.file), rows=rows
+        )
+        notify(progress, 'text_extracted', **document.extraction_stats)
+        logger.info(f"Extracted text: {extracted_text[:200]}...")  # Log first 200 chars
+
+    # Analyze the document using Gemini-enhanced analysis
+    analysis_result = processor.analyze_document_with_gemini(
+        extracted_text, force_refresh=force_refresh, progress=progress, rows=rows
+    )
+    analysis_data = json.loads(analysis_result)
+
+    # Log the analysis results
+    logger.info(f"Gemini-enhanced analysis results: {analysis_data}")
+
+    document.content_text = extracted_text
+    document.extracted_data = analysis_data
+    document.is_processed = True
+    document.analyzed_at = timezone.now()
+    document.form_progress = 'analyzed'
+    document.save(update_fields=['content_text', 'extracted_data', 'extraction_stats', 'is_processed',
+                                 'analyzed_at', 'form_progress'])
+    session_aggregates.add_document(document)
+    return analysis_data
+
+def _render_upload_preview(document):
+    """Render the first page's preview at upload time when PREVIEWS['render_on_upload'] is set"""
+    if not preview_service.options['render_on_upload']:
+        return
+    try:
+        preview_service.get(document.file, 1)
+    except Exception as e:
+        logger.error(f"Error rendering preview: {str(e)}")
+
+def _delete_stored_document(document):
+    """Remove a document's file from storage and delete its row"""
+    try:
+        if document.file.name:
+            document.file.storage.delete(document.file.name)
+    except Exception as e:
+        logger.error(f"Error deleting file: {str(e)}")
+    session_aggregates.remove_document(document)
+    document.delete()
+
 @api_view(['POST'])
 @parser_classes([MultiPartParser, FormParser, FileUploadParser])
 def upload_tax_form_document(request):
     try:
-        if not request.session.session_key:
-            request.session.create()
+        session_key = _session_key(request)
         
         if 'file' not in request.FILES:
             return Response({
@@ -43,32 +141,24 @@ def upload_tax_form_document(request):
             }, status=status.HTTP_400_BAD_REQUEST)
 
         uploaded_file = request.FILES['file']
+        document = TaxFormDocument(
+            session_id=session_key,
+            original_filename=uploaded_file.name,
+            file_type=uploaded_file.content_type or ''
+        )
         
         # Generate unique filename
-        unique_filename = f"{uuid.uuid4()}_{uploaded_file.name}"
-        file_path = os.path.join('tax_documents', request.session.session_key, unique_filename)
+        unique_filename = f"{document.id}_{uploaded_file.name}"
+        file_path = os.path.join('tax_documents', session_key, unique_filename)
         
-        # Save file
-        full_path = default_storage.save(file_path, uploaded_file)
-
-        # Create document data
-        document_data = {
-            'doc_id': str(uuid.uuid4()),
-            'filename': uploaded_file.name,
-            'stored_filename': full_path,  # Save the stored path
-            'file_type': uploaded_file.content_type,
-            'upload_date': timezone.now().isoformat()
-        }
-
-        # Store in session
-        documents = request.session.get('tax_documents', [])
-        documents.append(document_data)
-        request.session['tax_documents'] = documents
-        request.session.modified = True
+        # Save file (deduplicated by content) and register the document
+        document.file.name = upload_storage.save(file_path, uploaded_file)
+        document.save()
+        _render_upload_preview(document)
 
         return Response({
             'success': True,
-            'document': document_data
+            'document': document.as_document_data()
         })
 
     except Exception as e:
@@ -78,23 +168,155 @@ def upload_tax_form_document(request):
             'error': str(e)
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+def _get_session_upload(request, upload_id):
+    """Lookup of a chunked upload owned by the current session"""
+    try:
+        uuid.UUID(str(upload_id))
+    except ValueError:
+        return None
+    return ChunkedUpload.objects.filter(session_id=_session_key(request), id=upload_id).first()
+
+def _chunked_upload_error(e):
+    return Response({
+        'success': False,
+        'error': str(e)
+    }, status=e.status_code)
+
+@api_view(['POST'])
+def init_chunked_upload(request):
+    """Start a resumable upload: declare filename and size, get the chunk layout back"""
+    try:
+        chunk_size = request.data.get('chunk_size')
+        upload = chunked_upload_manager.start(
+            _session_key(request),
+            request.data.get('filename', ''),
+            int(request.data.get('size', 0)),
+            file_type=request.data.get('file_type', ''),
+            chunk_size=int(chunk_size) if chunk_size else None
+        )
+        return Response({
+            'success': True,
+            'upload': upload.as_status()
+        }, status=status.HTTP_201_CREATED)
+
+    except (TypeError, ValueError):
+        return Response({
+            'success': False,
+            'error': 'Invalid size or chunk_size'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    except ChunkedUploadError as e:
+        return _chunked_upload_error(e)
+    except Exception as e:
+        logger.error(f"Error starting chunked upload: {str(e)}")
+        return Response({
+            'success': False,
+            'error': str(e)
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+@api_view(['GET', 'DELETE'])
+def chunked_upload_status(request, upload_id):
+    """Report received/missing chunks so a client can resume, or abort the upload"""
+    try:
+        upload = _get_session_upload(request, upload_id)
+        if not upload:
+            return Response({
+                'success': False,
+                'error': 'Upload not found'
+            }, status=status.HTTP_404_NOT_FOUND)
+
+        if request.method == 'DELETE' and upload.status == 'uploading':
+            chunked_upload_manager.abort(upload)
+
+        return Response({
+            'success': True,
+            'upload': upload.as_status()
+        })
+
+    except Exception as e:
+        logger.error(f"Error reading chunked upload: {str(e)}")
+        return Response({
+            'success': False,
+            'error': str(e)
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+@api_view(['PUT', 'POST'])
+def upload_chunk(request, upload_id, index):
+    """
+    Receive chunk ``index``. The raw request body is streamed straight to the
+    chunk's offset; a multipart "chunk" field is accepted as well.
+    """
+    try:
+        upload = _get_session_upload(request, upload_id)
+        if not upload:
+            return Response({
+                'success': False,
+                'error': 'Upload not found'
+            }, status=status.HTTP_404_NOT_FOUND)
+
+        if request.content_type.startswith('multipart/'):
+            stream = request.FILES.get('chunk')
+        else:
+            stream = request.stream
+        if stream is None:
+            return Response({
+                'success': False,
+                'error': 'No chunk data provided'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        upload = chunked_upload_manager.write_chunk(upload, index, stream)
+        return Response({
+            'success': True,
+            'upload': upload.as_status()
+        })
+
+    except ChunkedUploadError as e:
+        return _chunked_upload_error(e)
+    except Exception as e:
+        logger.error(f"Error writing chunk {index} of upload {upload_id}: {str(e)}")
+        return Response({
+            'success': False,
+            'error': str(e)
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+@api_view(['POST'])
+def complete_chunked_upload(request, upload_id):
+    """Assemble the upload into a session document; optional sha256 is verified"""
+    try:
+        upload = _get_session_upload(request, upload_id)
+        if not upload:
+            return Response({
+                'success': False,
+                'error': 'Upload not found'
+            }, status=status.HTTP_404_NOT_FOUND)
+
+        document = chunked_upload_manager.complete(upload, expected_sha256=request.data.get('sha256'))
+        _render_upload_preview(document)
+        return Response({
+            'success': True,
+            'document': document.as_document_data()
+        })
+
+    except ChunkedUploadError as e:
+        return _chunked_upload_error(e)
+    except Exception as e:
+        logger.error(f"Error completing chunked upload: {str(e)}")
+        return Response({
+            'success': False,
+            'error': str(e)
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
 @api_view(['GET'])
 def get_session_documents(request):
     try:
-        # Ensure session exists
-        if not request.session.session_key:
-            request.session.create()
-            
-        # Get documents from session
-        documents = request.session.get('tax_documents', [])
-        
-        # Ensure we're returning a list
-        if not isinstance(documents, list):
-            documents = []
+        # Get documents registered for this session, in upload order
+        documents = (TaxFormDocument.objects
+                     .filter(session_id=_session_key(request))
+                     .defer('content_text')
+                     .order_by('uploaded_at'))
             
         return Response({
             'success': True,
-            'documents': documents
+            'documents': [document.as_document_data() for document in documents]
         }, status=status.HTTP_200_OK)
         
     except Exception as e:
@@ -108,11 +330,8 @@ def get_session_documents(request):
 @api_view(['DELETE'])
 def remove_session_document(request, doc_id):
     try:
-        # Get documents from session
-        documents = request.session.get('tax_documents', [])
-        
         # Find the document to remove
-        document = next((doc for doc in documents if doc['doc_id'] == doc_id), None)
+        document = _get_session_document(request, doc_id)
         
         if not document:
             return Response({
@@ -120,19 +339,8 @@ def remove_session_document(request, doc_id):
                 'error': 'Document not found'
             }, status=status.HTTP_404_NOT_FOUND)
 
-        # Remove file from storage if it exists
-        if 'stored_filename' in document:
-            try:
-                file_path = document['stored_filename']
-                if default_storage.exists(file_path):
-                    default_storage.delete(file_path)
-            except Exception as e:
-                logger.error(f"Error deleting file: {str(e)}")
-
-        # Remove document from session
-        updated_documents = [doc for doc in documents if doc['doc_id'] != doc_id]
-        request.session['tax_documents'] = updated_documents
-        request.session.modified = True
+        # Remove file from storage and the document row
+        _delete_stored_document(document)
 
         return Response({
             'success': True,
@@ -149,33 +357,31 @@ def remove_session_document(request, doc_id):
 @api_view(['GET'])
 def view_document(request, doc_id):
     try:
-        # Get document from session
-        documents = request.session.get('tax_documents', [])
-        document = next((doc for doc in documents if doc['doc_id'] == doc_id), None)
+        document = _get_session_document(request, doc_id)
         
-        if not document or 'stored_filename' not in document:
+        if not document or not document.file.name:
             logger.error(f"Document not found or invalid: {doc_id}")
             return Response({
                 'success': False,
                 'error': 'Document not found'
             }, status=status.HTTP_404_NOT_FOUND)
 
-        file_path = document['stored_filename']
+        file_path = document.file.name
         
-        if not default_storage.exists(file_path):
+        if not document.file.storage.exists(file_path):
             logger.error(f"File not found at path: {file_path}")
             return Response({
                 'success': False,
                 'error': 'File not found'
             }, status=status.HTTP_404_NOT_FOUND)
 
-        # Open and serve file
-        file = default_storage.open(file_path)
-        response = FileResponse(file)
-        response['Content-Type'] = document.get('file_type', 'application/octet-stream')
-        response['Content-Disposition'] = f'inline; filename="{document["filename"]}"'
-        
-        return response
+        # Conditional and Range requests are answered without re-sending the whole file
+        return serve_stored_file(
+            request,
+            document.file,
+            document.file_type or 'application/octet-stream',
+            document.original_filename
+        )
 
     except Exception as e:
         logger.error(f"Error viewing document: {str(e)}")
@@ -184,53 +390,80 @@ def view_document(request, doc_id):
             'error': 'Error viewing document'
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+@api_view(['GET'])
+def document_preview(request, doc_id):
+    """
+    JPEG thumbnail of a document page (?page=1&size=small|medium|large).
+    A document's content never changes, so previews are cached for a year.
+    """
+    try:
+        document = _get_session_document(request, doc_id)
+        if not document or not document.file.name:
+            return Response({
+                'success': False,
+                'error': 'Document not found'
+            }, status=status.HTTP_404_NOT_FOUND)
+
+        size = request.query_params.get('size', preview_service.options['default_size'])
+        try:
+            page = int(request.query_params.get('page', 1))
+        except ValueError:
+            page = 0
+        if size not in preview_service.sizes or page < 1:
+            return Response({
+                'success': False,
+                'error': f"page must be a positive number and size one of {', '.join(preview_service.sizes)}"
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        path = preview_service.get(document.file, page, size)
+        if not path:
+            return Response({
+                'success': False,
+                'error': 'No preview available'
+            }, status=status.HTTP_404_NOT_FOUND)
+
+        stat = os.stat(path)
+        digest = document.file.storage.digest(document.file.name) or document.id.hex
+        return serve_file(
+            request, lambda: path, 'image/jpeg', f"{os.path.splitext(document.original_filename)[0]}-p{page}.jpg",
+            etag=f'"{digest}-p{page}-{size}"',
+            size=stat.st_size,
+            modified=datetime.fromtimestamp(stat.st_mtime, tz=dt_timezone.utc),
+            root=document.file.storage.location,
+            cache_control=f"private, max-age={preview_service.options['max_age']}, immutable"
+        )
+
+    except Exception as e:
+        logger.error(f"Error rendering preview: {str(e)}")
+        return Response({
+            'success': False,
+            'error': 'Error rendering preview'
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
 @api_view(['POST'])
 def analyze_document(request, doc_id):
     try:
-        # Get document from session
-        documents = request.session.get('tax_documents', [])
-        document = next((doc for doc in documents if doc['doc_id'] == doc_id), None)
+        document = _get_session_document(request, doc_id)
         
-        if not document or 'stored_filename' not in document:
+        if not document or not document.file.name:
             return Response({
                 'success': False,
                 'error': 'Document not found'
             }, status=status.HTTP_404_NOT_FOUND)
 
-        file_path = os.path.join(settings.MEDIA_ROOT, document['stored_filename'])
-        
-        if not os.path.exists(file_path):
+        if not document.is_processed and not document.file.storage.exists(document.file.name):
             return Response({
                 'success': False,
                 'error': 'File not found'
             }, status=status.HTTP_404_NOT_FOUND)
 
-        # Initialize processor and process document
-        processor = DocumentProcessor()
-        
-        # Extract text from document
-        extracted_text = processor.extract_text_from_document(file_path)
-        logger.info(f"Extracted text: {extracted_text[:200]}...")  # Log first 200 chars
-        
-        # Analyze the document using Gemini-enhanced analysis
-        analysis_result = processor.analyze_document_with_gemini(extracted_text)
-        analysis_data = json.loads(analysis_result)
-        
-        # Log the analysis results
-        logger.info(f"Gemini-enhanced analysis results: {analysis_data}")
-        
-        # Update document with analysis results
-        document['analyzed'] = True
-        document['analysis'] = analysis_data
-        request.session.modified = True
-
-        # Store the analysis results in a separate session key for easy access
-        request.session['last_analysis'] = analysis_data
-        request.session.modified = True
+        # Stored results are returned as-is; only new documents are processed
+        analysis_data = _analyze_stored_document(document, _force_refresh_requested(request))
 
         return Response({
             'success': True,
-            'analysis': analysis_data
+            'analysis': analysis_data,
+            'duplicate_pages_skipped': (document.extraction_stats or {}).get('duplicate_pages_skipped', 0)
         })
 
     except Exception as e:
@@ -240,6 +473,45 @@ def analyze_document(request, doc_id):
             'error': str(e)
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+async def analyze_document_stream(request, doc_id):
+    """
+    Server-Sent Events version of analyze_document for EventSource clients.
+
+    Emits verified, extraction_started, page (one per OCRed page),
+    text_extracted, rules (rule-based analysis), llm_partial (per Gemini
+    part), result, mapping and finally done or error. Already analyzed
+    documents go straight to result. Events are only delivered as they
+    happen when the app is served through ASGI.
+    """
+    if request.method != 'GET':
+        return JsonResponse({'success': False, 'error': 'Method not allowed'}, status=405)
+
+    document = await sync_to_async(_get_session_document)(request, doc_id)
+    if not document or not document.file.name:
+        return JsonResponse({'success': False, 'error': 'Document not found'}, status=404)
+
+    force_refresh = str(request.GET.get('force_refresh', '')).lower() in ('1', 'true', 'yes')
+
+    def run(emit):
+        if not document.is_processed and not document.file.storage.exists(document.file.name):
+            raise FileNotFoundError('File not found')
+        emit('verified', {'doc_id': str(document.id), 'filename': document.original_filename,
+                          'file_type': document.file_type, 'analyzed': document.is_processed})
+
+        stored = document.is_processed and document.extracted_data is not None and not force_refresh
+        analysis_data = _analyze_stored_document(document, force_refresh, progress=emit)
+        emit('result', {
+            'analysis': analysis_data,
+            'stored': stored,
+            'duplicate_pages_skipped': (document.extraction_stats or {}).get('duplicate_pages_skipped', 0)
+        })
+        emit('mapping', {'mappings': get_document_processor().map_context_to_form_fields(analysis_data)})
+
+    response = StreamingHttpResponse(stream_events(run), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # stop nginx from buffering the stream
+    return response
+
 @api_view(['POST'])
 @parser_classes([MultiPartParser, FormParser])
 def analyze_uploaded_document(request):
@@ -275,16 +547,22 @@ def analyze_uploaded_document(request):
         full_path = default_storage.path(file_path)
         
         # Process the document using Gemini-enhanced analysis
-        processor = DocumentProcessor()
-        extracted_text = processor.extract_text_from_document(full_path)
-        analysis_result = processor.analyze_document_with_gemini(extracted_text)
+        processor = get_document_processor()
+        rows = []
+        extracted_text, extraction_stats = processor.extract_text_with_stats(
+            full_path, session_id=_session_key(request), rows=rows
+        )
+        analysis_result = processor.analyze_document_with_gemini(
+            extracted_text, force_refresh=_force_refresh_requested(request), rows=rows
+        )
         
         # Clean up
         default_storage.delete(file_path)
         
         return Response({
             'success': True,
-            'analysis': analysis_result
+            'analysis': analysis_result,
+            'duplicate_pages_skipped': extraction_stats['duplicate_pages_skipped']
         })
         
     except Exception as e:
@@ -299,10 +577,12 @@ def cleanup_tax_session(request):
     """Clean up session documents when returning to home"""
     try:
         if request.session.session_key:
-            processor = DocumentProcessor()
+            processor = get_document_processor()
             processor.cleanup_session_documents(request.session.session_key)
-            request.session['tax_documents'] = []
-            request.session.modified = True
+            # Blobs still referenced by other sessions are kept
+            upload_storage.delete_prefix(f"tax_documents/{request.session.session_key}/")
+            TaxFormDocument.objects.filter(session_id=request.session.session_key).delete()
+            session_aggregates.clear(request.session.session_key)
         return Response({'success': True})
     except Exception as e:
         return Response({'error': str(e)}, status=500)
@@ -348,8 +628,8 @@ def upload_document(request):
 def process_auto_fill(request):
     """Process auto-fill request"""
     try:
-        # Get the last analysis results from session
-        analysis_results = request.session.get('last_analysis', {})
+        # Get the last analysis results for this session
+        analysis_results = _session_analysis(request)
         
         if not analysis_results:
             logger.error("No analysis results found in session")
@@ -361,7 +641,7 @@ def process_auto_fill(request):
         logger.info(f"Processing auto-fill with analysis results: {analysis_results}")
 
         # Process the analysis results
-        processor = DocumentProcessor()
+        processor = get_document_processor()
         mapped_data = processor.map_context_to_form_fields(analysis_results)
 
         # Format the response
@@ -420,20 +700,15 @@ def determine_form_type(item_type):
 def get_documents(request):
     """Get all documents for the current session"""
     try:
-        # Ensure session exists
-        if not request.session.session_key:
-            request.session.create()
-            
-        # Get documents from session
-        documents = request.session.get('tax_documents', [])
-        
-        # Ensure we're returning a list
-        if not isinstance(documents, list):
-            documents = []
+        # Get documents registered for this session, in upload order
+        documents = (TaxFormDocument.objects
+                     .filter(session_id=_session_key(request))
+                     .defer('content_text')
+                     .order_by('uploaded_at'))
             
         return Response({
             'success': True,
-            'documents': documents
+            'documents': [document.as_document_data() for document in documents]
         }, status=status.HTTP_200_OK)
         
     except Exception as e:
@@ -445,14 +720,11 @@ def get_documents(request):
         }, status=status.HTTP_200_OK)
 
 @api_view(['GET'])
-def get_document(request, document_id):
+def get_document(request, doc_id):
     """Get a specific document by ID"""
     try:
-        # Get documents from session
-        documents = request.session.get('tax_documents', [])
-        
         # Find the requested document
-        document = next((doc for doc in documents if doc['doc_id'] == document_id), None)
+        document = _get_session_document(request, doc_id)
         
         if not document:
             return Response({
@@ -462,7 +734,7 @@ def get_document(request, document_id):
             
         return Response({
             'success': True,
-            'document': document
+            'document': document.as_document_data()
         })
         
     except Exception as e:
@@ -473,14 +745,11 @@ def get_document(request, document_id):
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 @api_view(['DELETE'])
-def delete_document(request, document_id):
+def delete_document(request, doc_id):
     """Delete a specific document"""
     try:
-        # Get documents from session
-        documents = request.session.get('tax_documents', [])
-        
         # Find the document to delete
-        document = next((doc for doc in documents if doc['doc_id'] == document_id), None)
+        document = _get_session_document(request, doc_id)
         
         if not document:
             return Response({
@@ -488,19 +757,8 @@ def delete_document(request, document_id):
                 'error': 'Document not found'
             }, status=status.HTTP_404_NOT_FOUND)
 
-        # Remove file from storage if it exists
-        if 'stored_filename' in document:
-            try:
-                file_path = document['stored_filename']
-                if default_storage.exists(file_path):
-                    default_storage.delete(file_path)
-            except Exception as e:
-                logger.error(f"Error deleting file: {str(e)}")
-
-        # Remove document from session
-        updated_documents = [doc for doc in documents if doc['doc_id'] != document_id]
-        request.session['tax_documents'] = updated_documents
-        request.session.modified = True
+        # Remove file from storage and the document row
+        _delete_stored_document(document)
 
         return Response({
             'success': True,
@@ -515,39 +773,29 @@ def delete_document(request, document_id):
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 @api_view(['POST'])
-def extract_and_map_context(request, document_id):
+def extract_and_map_context(request, doc_id):
     """Extract and map context from a document"""
     try:
-        # Get document from session
-        documents = request.session.get('tax_documents', [])
-        document = next((doc for doc in documents if doc['doc_id'] == document_id), None)
+        document = _get_session_document(request, doc_id)
         
-        if not document or 'stored_filename' not in document:
+        if not document or not document.file.name:
             return Response({
                 'success': False,
                 'error': 'Document not found'
             }, status=status.HTTP_404_NOT_FOUND)
 
-        file_path = os.path.join(settings.MEDIA_ROOT, document['stored_filename'])
-        
-        if not os.path.exists(file_path):
+        if not document.is_processed and not document.file.storage.exists(document.file.name):
             return Response({
                 'success': False,
                 'error': 'File not found'
             }, status=status.HTTP_404_NOT_FOUND)
 
-        # Initialize processor
-        processor = DocumentProcessor()
-        
-        # Extract text from document
-        extracted_text = processor.extract_text_from_document(file_path)
-        
-        # Analyze the document using Gemini-enhanced analysis
-        analysis_result = processor.analyze_document_with_gemini(extracted_text)
-        analysis_data = json.loads(analysis_result)
+        # Reuse the stored analysis when the document was already processed
+        analysis_data = _analyze_stored_document(document, _force_refresh_requested(request))
         
         # Process and store context
-        success = processor.process_and_store_context(document_id, analysis_data)
+        processor = get_document_processor()
+        success = processor.process_and_store_context(document.id, analysis_data)
         
         if not success:
             return Response({
@@ -555,11 +803,6 @@ def extract_and_map_context(request, document_id):
                 'error': 'Failed to process and store context'
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-        # Update document with analysis results
-        document['analyzed'] = True
-        document['analysis'] = analysis_data
-        request.session.modified = True
-
         return Response({
             'success': True,
             'analysis': analysis_data
@@ -573,12 +816,10 @@ def extract_and_map_context(request, document_id):
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 @api_view(['GET'])
-def get_form_field_mappings(request, document_id):
+def get_form_field_mappings(request, doc_id):
     """Get form field mappings for a document"""
     try:
-        # Get document from session
-        documents = request.session.get('tax_documents', [])
-        document = next((doc for doc in documents if doc['doc_id'] == document_id), None)
+        document = _get_session_document(request, doc_id)
         
         if not document:
             return Response({
@@ -587,7 +828,7 @@ def get_form_field_mappings(request, document_id):
             }, status=status.HTTP_404_NOT_FOUND)
 
         # Get mappings from document analysis
-        mappings = document.get('analysis', {}).get('mappings', [])
+        mappings = (document.extracted_data or {}).get('mappings', [])
         
         return Response({
             'success': True,
@@ -608,8 +849,8 @@ def auto_fill_forms(request):
     try:
         logger.info("Received auto-fill request")
         
-        # Get the last analysis results from session
-        analysis_data = request.session.get('last_analysis', {})
+        # Get the last analysis results for this session
+        analysis_data = _session_analysis(request)
         
         if not analysis_data:
             logger.error("No analysis data found in session")
@@ -619,263 +860,7 @@ def auto_fill_forms(request):
             }, status=status.HTTP_400_BAD_REQUEST)
 
         logger.info(f"Processing analysis data: {analysis_data}")
-        processor = DocumentProcessor()
-        
-        # Map the analysis data to form fields
-        mappings = processor.map_context_to_form_fields(analysis_data)
-        logger.info(f"Generated mappings: {mappings}")
-        
-        # Format the response
-        formatted_mappings = {
-            'EmploymentIncome': {
-                'primaryEntries': [],
-                'secondaryEntries': [],
-                'apitEntries': []
-            },
-            'BusinessIncome': {
-                'businessEntries': [],
-                'deductions': []
-            },
-            'InvestmentIncome': {
-                'investmentEntries': [],
-                'deductions': []
-            },
-            'OtherIncome': {
-                'otherEntries': [],
-                'whtEntries': []
-            },
-            'TerminalBenefits': {
-                'commutedEntries': [],
-                'gratuityEntries': [],
-                'compensationEntries': [],
-                'etfEntries': [],
-                'otherEntries': []
-            },
-            'QualifyingPayments': {
-                'paymentEntries': [],
-                'samurdhiEntries': [],
-                'donationEntries': [],
-                'solarEntries': [],
-                'housingEntries': [],
-                'otherEntries': []
-            }
-        }
-
-        # Process income items with enhanced categorization
-        for item in analysis_data.get('income_items', []):
-            category = item.get('category', '')
-            item_type = item.get('type', '')
-            description = item.get('description', '').lower()
-            
-            if category == 'Employment Income':
-                if item_type == 'Primary Employment' or 'primary' in description or 'salary' in description:
-                    formatted_mappings['EmploymentIncome']['primaryEntries'].append({
-                        'name': 'Primary Salary',
-                        'amount': str(item.get('amount', 0))
-                    })
-                elif item_type == 'Secondary Employment' or 'secondary' in description or 'part-time' in description:
-                    formatted_mappings['EmploymentIncome']['secondaryEntries'].append({
-                        'name': 'Secondary Salary',
-                        'amount': str(item.get('amount', 0))
-                    })
-                else:
-                    # Default to primary employment
-                    formatted_mappings['EmploymentIncome']['primaryEntries'].append({
-                        'name': 'Primary Salary',
-                        'amount': str(item.get('amount', 0))
-                    })
-                    
-            elif category == 'Business Income':
-                # Enhanced business income categorization
-                if item_type == 'Sole Proprietorship' or 'sole proprietor' in description or 'self-employed' in description:
-                    formatted_mappings['BusinessIncome']['businessEntries'].append({
-                        'name': 'Sole Proprietorship',
-                        'amount': str(item.get('amount', 0))
-                    })
-                elif item_type == 'Partnership' or 'partnership' in description:
-                    formatted_mappings['BusinessIncome']['businessEntries'].append({
-                        'name': 'Partnership',
-                        'amount': str(item.get('amount', 0))
-                    })
-                elif item_type == 'Trust Beneficiary' or 'trust' in description:
-                    formatted_mappings['BusinessIncome']['businessEntries'].append({
-                        'name': 'Trust Beneficiary',
-                        'amount': str(item.get('amount', 0))
-                    })
-                elif item_type == 'Betting, Gaming, Liquor & Tobacco' or any(keyword in description for keyword in ['betting', 'gaming', 'casino', 'lottery']):
-                    formatted_mappings['BusinessIncome']['businessEntries'].append({
-                        'name': 'Betting, Gaming, Liquor & Tobacco',
-                        'amount': str(item.get('amount', 0))
-                    })
-                else:
-                    # Default business income
-                    formatted_mappings['BusinessIncome']['businessEntries'].append({
-                        'name': item.get('description', 'Business Income'),
-                        'amount': str(item.get('amount', 0))
-                    })
-                    
-            elif category == 'Investment Income':
-                # Enhanced investment income categorization
-                if item_type == 'Interest Income' or 'interest' in description:
-                    formatted_mappings['InvestmentIncome']['investmentEntries'].append({
-                        'name': 'Interest Income',
-                        'amount': str(item.get('amount', 0))
-                    })
-                elif item_type == 'Dividend Income' or 'dividend' in description:
-                    formatted_mappings['InvestmentIncome']['investmentEntries'].append({
-                        'name': 'Dividend Income',
-                        'amount': str(item.get('amount', 0))
-                    })
-                elif item_type == 'Rental Income' or 'rent' in description or 'rental' in description:
-                    formatted_mappings['InvestmentIncome']['investmentEntries'].append({
-                        'name': 'Rental Income',
-                        'amount': str(item.get('amount', 0))
-                    })
-                elif item_type == 'Capital Gains' or 'capital' in description or 'gain' in description:
-                    formatted_mappings['InvestmentIncome']['investmentEntries'].append({
-                        'name': 'Capital Gains',
-                        'amount': str(item.get('amount', 0))
-                    })
-                else:
-                    # Default investment income
-                    formatted_mappings['InvestmentIncome']['investmentEntries'].append({
-                        'name': item.get('description', 'Investment Income'),
-                        'amount': str(item.get('amount', 0))
-                    })
-                    
-            elif category == 'Other Income':
-                # Enhanced other income categorization
-                if item_type == 'Service Income (WHT)' or 'service' in description:
-                    formatted_mappings['OtherIncome']['otherEntries'].append({
-                        'name': 'Service Income',
-                        'amount': str(item.get('amount', 0))
-                    })
-                elif item_type == 'Royalty (WHT)' or 'royalty' in description:
-                    formatted_mappings['OtherIncome']['otherEntries'].append({
-                        'name': 'Royalty',
-                        'amount': str(item.get('amount', 0))
-                    })
-                elif item_type == 'Natural Resource Payment (WHT)' or 'natural resource' in description:
-                    formatted_mappings['OtherIncome']['otherEntries'].append({
-                        'name': 'Natural Resource Payment',
-                        'amount': str(item.get('amount', 0))
-                    })
-                elif item_type == 'Auctioned Gem Sale (WHT)' or 'gem' in description or 'auction' in description:
-                    formatted_mappings['OtherIncome']['otherEntries'].append({
-                        'name': 'Auctioned Gem Sale',
-                        'amount': str(item.get('amount', 0))
-                    })
-                else:
-                    # Default other income
-                    formatted_mappings['OtherIncome']['otherEntries'].append({
-                        'name': item.get('description', 'Other Income'),
-                        'amount': str(item.get('amount', 0))
-                    })
-                    
-            elif category == 'Terminal Benefits':
-                # Enhanced terminal benefits categorization
-                if item_type == 'Commuted Pension' or 'commuted' in description or 'lump sum pension' in description:
-                    formatted_mappings['TerminalBenefits']['commutedEntries'].append({
-                        'name': 'Commuted Pension',
-                        'amount': str(item.get('amount', 0))
-                    })
-                elif item_type == 'Retiring Gratuity' or 'gratuity' in description:
-                    formatted_mappings['TerminalBenefits']['gratuityEntries'].append({
-                        'name': 'Retiring Gratuity',
-                        'amount': str(item.get('amount', 0))
-                    })
-                elif item_type == 'Compensation for Job Loss' or 'compensation' in description or 'job loss' in description:
-                    formatted_mappings['TerminalBenefits']['compensationEntries'].append({
-                        'name': 'Compensation for Job Loss',
-                        'amount': str(item.get('amount', 0))
-                    })
-                elif item_type == 'ETF Payment' or 'etf' in description or 'trust fund' in description:
-                    formatted_mappings['TerminalBenefits']['etfEntries'].append({
-                        'name': 'ETF Payment',
-                        'amount': str(item.get('amount', 0))
-                    })
-                else:
-                    # Default to other terminal benefits
-                    formatted_mappings['TerminalBenefits']['otherEntries'].append({
-                        'name': item.get('description', 'Other Terminal Benefit'),
-                        'amount': str(item.get('amount', 0))
-                    })
-                    
-            elif category == 'Qualifying Payments':
-                # Enhanced qualifying payments categorization
-                if item_type == 'Donations' or 'donation' in description or 'charity' in description:
-                    formatted_mappings['QualifyingPayments']['donationEntries'].append({
-                        'name': 'Donations',
-                        'amount': str(item.get('amount', 0))
-                    })
-                elif item_type == 'Shop Setup for Samurdhi Beneficiary' or 'samurdhi' in description or 'samurthy' in description:
-                    formatted_mappings['QualifyingPayments']['samurdhiEntries'].append({
-                        'name': 'Shop Setup for Samurdhi Beneficiary',
-                        'amount': str(item.get('amount', 0))
-                    })
-                elif item_type == 'Solar Panel Installation' or 'solar' in description:
-                    formatted_mappings['QualifyingPayments']['solarEntries'].append({
-                        'name': 'Solar Panel Installation',
-                        'amount': str(item.get('amount', 0))
-                    })
-                elif item_type == 'Low-Income Housing Construction' or 'housing' in description:
-                    formatted_mappings['QualifyingPayments']['housingEntries'].append({
-                        'name': 'Low-Income Housing Construction',
-                        'amount': str(item.get('amount', 0))
-                    })
-                elif item_type == 'Film & Cinema Industry Expenditure' or 'cinema' in description or 'film' in description:
-                    formatted_mappings['QualifyingPayments']['otherEntries'].append({
-                        'name': 'Film & Cinema Industry Expenditure',
-                        'amount': str(item.get('amount', 0))
-                    })
-                else:
-                    # Default to other qualifying payments
-                    formatted_mappings['QualifyingPayments']['otherEntries'].append({
-                        'name': item.get('description', 'Other Qualifying Payment'),
-                        'amount': str(item.get('amount', 0))
-                    })
-
-        # Process deductions with enhanced categorization
-        for deduction in analysis_data.get('deductions', []):
-            deduction_type = deduction.get('type', '')
-            description = deduction.get('description', '').lower()
-            
-            if deduction_type == 'APIT Deduction' or 'apit' in description:
-                formatted_mappings['EmploymentIncome']['apitEntries'].append({
-                    'source': deduction.get('source', 'Primary Employment'),
-                    'name': 'APIT Deduction',
-                    'amount': str(deduction.get('amount', 0))
-                })
-            elif deduction_type == 'WHT Deduction' or 'wht' in description or 'withholding' in description:
-                # Enhanced WHT source determination
-                source = 'WHT Deduction'
-                if 'service' in description:
-                    source = 'Service Income WHT'
-                elif 'royalty' in description:
-                    source = 'Royalty WHT'
-                elif 'resource' in description or 'natural' in description:
-                    source = 'Natural Resource WHT'
-                elif 'gem' in description or 'auction' in description:
-                    source = 'Gem Sale WHT'
-                elif 'dividend' in description:
-                    source = 'Dividend WHT'
-                elif 'interest' in description:
-                    source = 'Interest WHT'
-
-                formatted_mappings['OtherIncome']['whtEntries'].append({
-                    'source': source,
-                    'amount': str(deduction.get('amount', 0))
-                })
-            elif deduction_type == 'BUSINESS_DEDUCTION' or 'business' in description:
-                formatted_mappings['BusinessIncome']['deductions'].append({
-                    'name': deduction.get('description', 'Business Deduction'),
-                    'amount': str(deduction.get('amount', 0))
-                })
-            elif deduction_type == 'INVESTMENT_DEDUCTION' or 'investment' in description:
-                formatted_mappings['InvestmentIncome']['deductions'].append({
-                    'name': deduction.get('description', 'Investment Deduction'),
-                    'amount': str(deduction.get('amount', 0))
-                })
+        formatted_mappings = autofill_mapper.map_analysis(analysis_data)
 
         logger.info(f"Returning formatted mappings: {formatted_mappings}")
         return Response({
@@ -890,6 +875,58 @@ def auto_fill_forms(request):
             'error': str(e)
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+@api_view(['POST'])
+@csrf_exempt
+def compute_tax_return(request):
+    """
+    Compute the tax return for the auto-filled forms in one call. Takes the
+    (possibly edited) form mappings, or maps this session's analysis when
+    none are posted. With ``save: true`` a signed-in user gets the return
+    saved as a TaxReport.
+    """
+    try:
+        save = request.data.get('save') is True
+        if save and not request.user.is_authenticated:
+            return Response({
+                'success': False,
+                'error': 'Sign in to save the tax return'
+            }, status=status.HTTP_401_UNAUTHORIZED)
+
+        mappings = request.data.get('mappings')
+        if mappings is None:
+            analysis_data = _session_analysis(request)
+            if not analysis_data:
+                return Response({
+                    'success': False,
+                    'error': 'No form data or analysis data available'
+                }, status=status.HTTP_400_BAD_REQUEST)
+            mappings = autofill_mapper.map_analysis(analysis_data)
+
+        try:
+            result = tax_engine.compute(mappings, request.data.get('tax_year'))
+        except ValueError as e:
+            return Response({
+                'success': False,
+                'error': str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        report_id = None
+        if save:
+            report_id = tax_engine.save(result, request.user).id
+
+        return Response({
+            'success': True,
+            'report_id': report_id,
+            'result': result
+        })
+
+    except Exception as e:
+        logger.error(f"Error computing tax return: {str(e)}")
+        return Response({
+            'success': False,
+            'error': str(e)
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def record_download(request):
@@ -899,23 +936,100 @@ def record_download(request):
     if not document_name:
         return Response({"error": "Missing document_name"}, status=status.HTTP_400_BAD_REQUEST)
 
-    # Construct full path of the file on the server
-    file_path = os.path.join(settings.MEDIA_ROOT, 'downloaded_docs', document_name)
+    # Name of the file in the report storage
+    name = 'downloaded_docs/' + os.path.basename(document_name)
 
-    if not os.path.exists(file_path):
+    if not report_storage.exists(name):
         return Response({"error": "Document not found on server"}, status=status.HTTP_404_NOT_FOUND)
 
-    # Open the existing file and create DownloadedReports entry
-    with open(file_path, 'rb') as f:
-        django_file = File(f)
-        # Create a record of the download
-        DownloadedReports.objects.create(
-            user=user,
-            document=django_file,
+    record = DownloadedReports(user_id=user.id, username=user.username, email=user.email,
+                               downloaded_at=timezone.now())
+    if report_storage.digest(name):
+        # Reference the stored content instead of copying it
+        record.document = report_storage.link(name, name)
+        record.save()
+    else:
+        # A file saved before reports were stored as blobs
+        with report_storage.open(name) as f:
+            record.document = File(f, name=os.path.basename(name))
+            record.save()
+
+    return Response({"message": "Download recorded successfully"}, status=status.HTTP_201_CREATED)
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def render_tax_report(request, report_id):
+    """
+    Render a saved tax return as a PDF on the server and record it as a
+    downloaded report, instead of the browser generating and uploading it
+    """
+    try:
+        report = TaxReport.objects.select_related('user').prefetch_related(
+            'categories__entries', 'deductions'
+        ).filter(id=report_id, user=request.user).first()
+        if not report:
+            return Response({
+                'success': False,
+                'error': 'Tax report not found'
+            }, status=status.HTTP_404_NOT_FOUND)
+
+        context = report_context(report)
+        pdf = report_renderer.render(context)
+        downloaded_report = DownloadedReports.objects.create(
+            user_id=request.user.id,
+            username=request.user.username,
+            email=request.user.email,
+            document=ContentFile(pdf, name=report_renderer.filename(context)),
             downloaded_at=timezone.now()
         )
-    
-    return Response({"message": "Download recorded successfully"}, status=status.HTTP_201_CREATED)
+
+        return Response({
+            'success': True,
+            'document_id': downloaded_report.id,
+            'document_name': downloaded_report.document.name,
+            'document_size': len(pdf),
+            'download_url': reverse('download_report', args=[downloaded_report.id])
+        }, status=status.HTTP_201_CREATED)
+
+    except Exception as e:
+        logger.error(f"Error rendering tax report: {str(e)}")
+        return Response({
+            'success': False,
+            'error': str(e)
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def download_report(request, report_id):
+    """Stream a saved report to its owner, decompressing it on the fly"""
+    try:
+        reports = DownloadedReports.objects.all()
+        if not request.user.is_staff:
+            reports = reports.filter(user_id=request.user.id)
+        report = reports.filter(id=report_id).first()
+
+        if not report or not report.document or not report.document.storage.exists(report.document.name):
+            return Response({
+                'success': False,
+                'error': 'Report not found'
+            }, status=status.HTTP_404_NOT_FOUND)
+
+        filename = os.path.basename(report.document.name)
+        return serve_stored_file(
+            request,
+            report.document,
+            mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+            filename,
+            attachment=True,
+            decompress=True
+        )
+
+    except Exception as e:
+        logger.error(f"Error downloading report: {str(e)}")
+        return Response({
+            'success': False,
+            'error': 'Error downloading report'
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
@@ -1006,7 +1120,7 @@ def save_document(request):
         logger.info(f"  - Email: {downloaded_report.email}")
         logger.info(f"  - Document: {downloaded_report.document.name}")
         logger.info(f"  - Document size: {downloaded_report.document.size} bytes")
-        logger.info(f"  - Document path: {downloaded_report.document.path if downloaded_report.document else 'No path'}")
+        logger.info(f"  - Document digest: {report_storage.digest(downloaded_report.document.name)}")
         logger.info(f"  - Downloaded at: {downloaded_report.downloaded_at}")
         
         return Response({
@@ -1068,7 +1182,7 @@ def get_user_details(request, user_id):
                 'document_name': report.document.name if report.document else None,
                 'document_size': report.document.size if report.document else None,
                 'downloaded_at': report.downloaded_at.isoformat(),
-                'document_url': report.document.url if report.document else None
+                'document_url': reverse('download_report', args=[report.id]) if report.document else None
             })
         
         return Response({
@@ -1148,11 +1262,13 @@ def test_gemini_analysis(request):
             }, status=status.HTTP_400_BAD_REQUEST)
 
         # Initialize processor
-        processor = DocumentProcessor()
+        processor = get_document_processor()
         
         # Test both basic and Gemini analysis
         basic_result = processor.analyze_document(test_text)
-        gemini_result = processor.analyze_document_with_gemini(test_text)
+        gemini_result = processor.analyze_document_with_gemini(
+            test_text, force_refresh=_force_refresh_requested(request)
+        )
         
         basic_data = json.loads(basic_result)
         gemini_data = json.loads(gemini_result)
@@ -1169,7 +1285,9 @@ def test_gemini_analysis(request):
                 'gemini_deductions': len(gemini_data.get('deductions', [])),
                 'improvement': len(gemini_data.get('income_items', [])) > len(basic_data.get('income_items', [])) or 
                               len(gemini_data.get('deductions', [])) > len(basic_data.get('deductions', []))
-            }
+            },
+            'cache': processor.response_cache.stats(),
+            'llm': llm_metrics()
         })
 
     except Exception as e:
@@ -1178,3 +1296,11 @@ def test_gemini_analysis(request):
             'success': False,
             'error': str(e)
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+@api_view(['GET'])
+def llm_status(request):
+    """Latency, error and circuit breaker metrics for LLM calls made by this worker process"""
+    return Response({
+        'success': True,
+        'services': llm_metrics()
+    })